@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""
+Локальная генерация вспомогательных файлов набора Windows-скриптов.
+
+Start-Optimizer.bat всегда одинаков (проверка прав, запуск PowerShell с
+нужными параметрами), а README.md в основном состоит из типового текста.
+Вместо того чтобы просить модель написать их, оба файла строятся по
+основному скрипту WindowsOptimizer.ps1: из него извлекаются функции с
+описаниями, затрагиваемые службы, параметры реестра, путь к журналу и
+папке резервных копий.
+
+Пример использования:
+```python
+metadata = extract_script_metadata(files["WindowsOptimizer.ps1"])
+files.update(generate_artifacts(files["WindowsOptimizer.ps1"]))
+```
+"""
+
+import re
+import logging
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+SCRIPT_NAME = "WindowsOptimizer.ps1"
+LAUNCHER_NAME = "Start-Optimizer.bat"
+README_NAME = "README.md"
+# Файлы, которые строятся локально
+ARTIFACT_FILES = (LAUNCHER_NAME, README_NAME)
+
+# Служебные функции: не описывают оптимизации и не попадают в README
+HELPER_FUNCTIONS = {
+    "write-log", "show-progress", "test-administrator", "test-admin", "show-menu",
+    "write-status", "write-header", "pause-script", "backup-settings",
+    # Вспомогательные функции скриптов, собранных из модулей (script_assembler)
+    "set-servicestartup", "set-registryvalue",
+}
+
+_FUNCTION = re.compile(r"^[ \t]*function\s+([\w-]+)", re.IGNORECASE | re.MULTILINE)
+_SYNOPSIS = re.compile(r"\.SYNOPSIS\s*\n\s*(.+)", re.IGNORECASE)
+_SERVICE = re.compile(
+    r"\b(?:Set|Stop|Start|Restart)-Service(?:Startup)?\s+(?:-Name\s+)?[\"']?([A-Za-z][\w.]*)", re.IGNORECASE
+)
+_REGISTRY_WRITE = re.compile(
+    r"\b(?:Set-ItemProperty|New-ItemProperty|Set-RegistryValue)\b[^\n]*\b(?:HKLM|HKCU|HKCR|Registry)", re.IGNORECASE
+)
+_LOG_PATH = re.compile(r"\$LogPath\s*=\s*[\"']([^\"']+)[\"']", re.IGNORECASE)
+_BACKUP_DIR = re.compile(r"\$Backup\w*\s*=\s*[\"']([^\"']+)[\"']", re.IGNORECASE)
+
+LAUNCHER_TEMPLATE = """@echo off
+chcp 65001 >nul
+title Windows Optimization
+
+:: Check administrator rights
+net session >nul 2>&1
+if %errorlevel% neq 0 (
+    echo Administrator rights required.
+    echo Please run this file as administrator.
+    pause
+    exit /b 1
+)
+
+:: Script file check
+if not exist "%~dp0{script}" (
+    echo File {script} not found.
+    echo Please make sure it is in the same folder.
+    pause
+    exit /b 1
+)
+
+:: Run PowerShell script with needed parameters
+echo Starting Windows optimization script...
+echo ==========================================
+
+powershell -ExecutionPolicy Bypass -NoProfile -File "%~dp0{script}"
+
+echo ==========================================
+echo Optimization script completed.
+pause
+"""
+
+
+class ScriptMetadata:
+    """Сведения об основном скрипте для вспомогательных файлов"""
+
+    def __init__(self, functions, services, registry_changes, log_path, backup_dir, restore_point):
+        self.functions = functions  # [(имя, описание)]
+        self.services = services
+        self.registry_changes = registry_changes
+        self.log_path = log_path
+        self.backup_dir = backup_dir
+        self.restore_point = restore_point
+
+    def __repr__(self):
+        return (f"ScriptMetadata(functions={len(self.functions)}, services={self.services}, "
+                f"registry_changes={self.registry_changes})")
+
+
+def _describe_function(content, match):
+    """Описание функции: .SYNOPSIS или комментарий над объявлением"""
+    body = content[match.end():match.end() + 600]
+    synopsis = _SYNOPSIS.search(body)
+    if synopsis and "function" not in body[:synopsis.start()].lower():
+        return synopsis.group(1).strip()
+
+    comments = []
+    for line in reversed(content[:match.start()].rstrip("\n").split("\n")):
+        stripped = line.strip()
+        if not stripped.startswith("#") or stripped.startswith("#>"):
+            break
+        comments.append(stripped.lstrip("#").strip())
+    comments = [comment for comment in reversed(comments) if comment and not set(comment) <= set("=-#")]
+    return comments[-1] if comments else ""
+
+
+def extract_script_metadata(content):
+    """
+    Разбирает основной PowerShell-скрипт
+
+    Args:
+        content (str): Содержимое WindowsOptimizer.ps1
+
+    Returns:
+        ScriptMetadata: Функции, службы, изменения реестра, журнал и резервные копии
+    """
+    functions = []
+    seen = set()
+    for match in _FUNCTION.finditer(content):
+        name = match.group(1)
+        if name.lower() in HELPER_FUNCTIONS or name.lower() in seen:
+            continue
+        seen.add(name.lower())
+        functions.append((name, _describe_function(content, match)))
+
+    services = list(dict.fromkeys(match.group(1) for match in _SERVICE.finditer(content)))
+    log_path = _LOG_PATH.search(content)
+    backup_dir = _BACKUP_DIR.search(content)
+    return ScriptMetadata(
+        functions=functions,
+        services=services,
+        registry_changes=len(_REGISTRY_WRITE.findall(content)),
+        log_path=log_path.group(1) if log_path else None,
+        backup_dir=backup_dir.group(1) if backup_dir else None,
+        restore_point=bool(re.search(r"Checkpoint-Computer", content, re.IGNORECASE)),
+    )
+
+
+def build_launcher(script_name=SCRIPT_NAME):
+    """
+    Запускающий bat-файл (только английский текст)
+
+    Returns:
+        str: Содержимое Start-Optimizer.bat
+    """
+    return LAUNCHER_TEMPLATE.replace("{script}", script_name)
+
+
+def build_readme(metadata, script_name=SCRIPT_NAME):
+    """
+    Инструкция по использованию
+
+    Args:
+        metadata (ScriptMetadata): Сведения о скрипте
+
+    Returns:
+        str: Содержимое README.md
+    """
+    lines = [
+        "# Оптимизация Windows",
+        "",
+        "Набор скриптов для оптимизации Windows, подготовленный по данным вашей системы.",
+        "",
+        "## Состав архива",
+        "",
+        f"- `{script_name}` - основной скрипт оптимизации PowerShell",
+        f"- `{LAUNCHER_NAME}` - запуск основного скрипта с правами администратора",
+        f"- `{README_NAME}` - эта инструкция",
+        "",
+        "## Использование",
+        "",
+        "1. Распакуйте все файлы из архива в одну папку",
+        f"2. Щелкните правой кнопкой мыши по `{LAUNCHER_NAME}` и выберите \"Запуск от имени администратора\"",
+        "3. Следуйте сообщениям в окне скрипта и дождитесь его завершения",
+        "4. Перезагрузите компьютер, чтобы изменения вступили в силу",
+        "",
+    ]
+
+    if metadata.functions:
+        lines += ["## Что делает скрипт", ""]
+        for name, description in metadata.functions:
+            lines.append(f"- **{name}**" + (f" - {description}" if description else ""))
+        lines.append("")
+
+    details = []
+    if metadata.services:
+        details.append("Изменяет параметры служб: " + ", ".join(f"`{name}`" for name in metadata.services))
+    if metadata.registry_changes:
+        details.append(f"Изменяет параметры реестра (команд записи: {metadata.registry_changes})")
+    if metadata.restore_point:
+        details.append("Создает точку восстановления системы перед изменениями")
+    if metadata.backup_dir:
+        details.append(f"Сохраняет резервные копии настроек в `{metadata.backup_dir}`")
+    if metadata.log_path:
+        details.append(f"Записывает журнал действий в `{metadata.log_path}`")
+    if details:
+        lines += ["## Изменения в системе", ""] + [f"- {detail}" for detail in details] + [""]
+
+    lines += [
+        "## Требования",
+        "",
+        "- Windows 10 или Windows 11",
+        "- PowerShell 5.1 или новее",
+        "- Права администратора",
+        "",
+        "## Предупреждения",
+        "",
+        "- Перед запуском создайте точку восстановления системы и сохраните важные данные",
+        "- Не закрывайте окно скрипта до завершения работы",
+        "- Некоторые изменения требуют перезагрузки компьютера",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def generate_artifacts(script_content, script_name=SCRIPT_NAME):
+    """
+    Строит запускающий файл и инструкцию по основному скрипту
+
+    Returns:
+        dict: Start-Optimizer.bat и README.md
+    """
+    metadata = extract_script_metadata(script_content)
+    logger.info(f"Вспомогательные файлы построены локально: {metadata}")
+    return {
+        LAUNCHER_NAME: build_launcher(script_name),
+        README_NAME: build_readme(metadata, script_name),
+    }
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Бенчмарк предобработки скриншотов: размер и стоимость в токенах до и после.
+
+Запуск:
+    python bench_image_preprocessing.py                  # синтетические скриншоты
+    python bench_image_preprocessing.py shot1.jpg shot2.png
+"""
+
+import sys
+import random
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from image_preprocessor import preprocess_screenshot
+
+
+def make_synthetic_screenshot(width, height, image_format="PNG", seed=0):
+    """Рисует скриншот, похожий на окно «Сведения о системе»"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), (32, 32, 40))
+    draw = ImageDraw.Draw(image)
+    margin = width // 12
+    draw.rectangle([margin, margin, width - margin, height - margin], fill=(245, 245, 245))
+    draw.rectangle([margin, margin, width - margin, margin + 28], fill=(0, 95, 184))
+    y = margin + 40
+    while y < height - margin - 20:
+        x = margin + 12
+        label = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789 ")
+                        for _ in range(rng.randint(20, 70)))
+        draw.text((x, y), label, fill=(20, 20, 20))
+        y += 18
+    buffer = BytesIO()
+    if image_format == "JPEG":
+        image.save(buffer, format="JPEG", quality=92)
+    else:
+        image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def run(samples):
+    """Печатает таблицу результатов"""
+    total_before = total_after = tokens_before = tokens_after = 0
+    print(f"{'образец':<28}{'до, Б':>10}{'после, Б':>10}{'ток. до':>9}{'ток. после':>11}{'мс':>7}  формат")
+    for name, data in samples:
+        result = preprocess_screenshot(data)
+        total_before += result.original_size
+        total_after += result.size
+        tokens_before += result.original_tokens
+        tokens_after += result.estimated_tokens
+        print(f"{name:<28}{result.original_size:>10}{result.size:>10}{result.original_tokens:>9}"
+              f"{result.estimated_tokens:>11}{result.elapsed_ms:>7.0f}  {result.media_type}")
+    print(f"{'итого':<28}{total_before:>10}{total_after:>10}{tokens_before:>9}{tokens_after:>11}")
+    if total_before:
+        print(f"размер: -{100 - total_after * 100 / total_before:.0f}%, "
+              f"токены: -{100 - tokens_after * 100 / max(tokens_before, 1):.0f}%")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        samples = []
+        for path in sys.argv[1:]:
+            with open(path, "rb") as f:
+                samples.append((path, f.read()))
+    else:
+        samples = [
+            ("1280x720 jpeg (Telegram)", make_synthetic_screenshot(1280, 720, "JPEG", 1)),
+            ("1920x1080 png", make_synthetic_screenshot(1920, 1080, "PNG", 2)),
+            ("2560x1440 png", make_synthetic_screenshot(2560, 1440, "PNG", 3)),
+            ("3840x2160 jpeg", make_synthetic_screenshot(3840, 2160, "JPEG", 4)),
+        ]
+    run(samples)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+Простой потокобезопасный Circuit Breaker для внешних сервисов.
+
+После серии неудачных вызовов цепь "размыкается" и последующие запросы
+сразу отклоняются, не дожидаясь таймаутов. По истечении recovery_timeout
+пропускается один пробный запрос: при успехе цепь замыкается снова.
+
+Кроме подряд идущих ошибок цепь может размыкаться по доле ошибок и доле
+медленных вызовов среди последних window_size вызовов.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Исключение, выбрасываемое при вызове через разомкнутую цепь"""
+
+    def __init__(self, name, retry_in=0.0):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(f"Цепь '{name}' разомкнута, повтор через {retry_in:.1f} с")
+
+
+class CircuitBreaker:
+    """Circuit Breaker с состояниями closed / open / half_open"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30.0, on_state_change=None,
+                 failure_rate_threshold=None, slow_call_threshold=None, slow_call_rate_threshold=None,
+                 window_size=20, min_calls=10, is_failure=None, is_ignored=None):
+        """
+        Инициализация Circuit Breaker
+
+        Args:
+            name (str): Имя цепи (для логов и метрик)
+            failure_threshold (int): Количество подряд идущих ошибок до размыкания
+            recovery_timeout (float): Время в секундах до пробного запроса
+            on_state_change (callable, optional): Колбэк (name, old_state, new_state)
+            failure_rate_threshold (float, optional): Доля ошибок в окне для размыкания
+            slow_call_threshold (float, optional): Длительность в секундах, после которой вызов считается медленным
+            slow_call_rate_threshold (float, optional): Доля медленных вызовов в окне для размыкания
+            window_size (int): Количество последних вызовов для оценки долей
+            min_calls (int): Минимум вызовов в окне для оценки долей
+            is_failure (callable, optional): Признак ошибки сервиса по исключению (по умолчанию любое)
+            is_ignored (callable, optional): Признак исключения, при котором запрос не дошел
+                до сервиса (например, отказ локальной очереди); такой вызов не учитывается
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.on_state_change = on_state_change
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.min_calls = min_calls
+        self.is_failure = is_failure
+        self.is_ignored = is_ignored
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._window = deque(maxlen=window_size)  # (ошибка, медленный вызов)
+
+        # Счетчики для метрик
+        self.total_calls = 0
+        self.total_failures = 0
+        self.total_slow = 0
+        self.total_rejected = 0
+
+    @property
+    def state(self):
+        """Текущее состояние цепи с учетом истекшего recovery_timeout"""
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _set_state(self, new_state):
+        """Смена состояния (вызывается под блокировкой)"""
+        old_state = self._state
+        if old_state == new_state:
+            return
+        self._state = new_state
+        if new_state == self.OPEN:
+            self._opened_at = time.monotonic()
+        if new_state != self.HALF_OPEN:
+            # Доли считаются заново после каждого размыкания и замыкания
+            self._window.clear()
+        logger.warning(f"Circuit breaker '{self.name}': {old_state} -> {new_state}")
+        if self.on_state_change:
+            try:
+                self.on_state_change(self.name, old_state, new_state)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике смены состояния цепи '{self.name}': {e}")
+
+    def _maybe_half_open(self):
+        """Переводит цепь в half_open, если истек recovery_timeout"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._set_state(self.HALF_OPEN)
+            self._probe_in_flight = False
+
+    def allow_request(self):
+        """
+        Проверяет, можно ли выполнить запрос
+
+        Returns:
+            bool: True, если запрос разрешен
+        """
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                # Пропускаем ровно один пробный запрос
+                self._probe_in_flight = True
+                return True
+            self.total_rejected += 1
+            return False
+
+    def retry_in(self):
+        """Количество секунд до следующего пробного запроса"""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+    def _is_slow(self, duration):
+        return (self.slow_call_threshold is not None and duration is not None
+                and duration >= self.slow_call_threshold)
+
+    def _rates(self):
+        """Доли ошибок и медленных вызовов в окне (вызывается под блокировкой)"""
+        if not self._window:
+            return 0.0, 0.0
+        failures = sum(1 for failed, _ in self._window if failed)
+        slow = sum(1 for _, is_slow in self._window if is_slow)
+        return failures / len(self._window), slow / len(self._window)
+
+    def _window_exceeded(self):
+        """Превышены ли пороги долей в окне (вызывается под блокировкой)"""
+        if len(self._window) < self.min_calls:
+            return False
+        failure_rate, slow_rate = self._rates()
+        if self.failure_rate_threshold is not None and failure_rate >= self.failure_rate_threshold:
+            logger.warning(f"Circuit breaker '{self.name}': доля ошибок {failure_rate:.0%}")
+            return True
+        if self.slow_call_rate_threshold is not None and slow_rate >= self.slow_call_rate_threshold:
+            logger.warning(f"Circuit breaker '{self.name}': доля медленных вызовов {slow_rate:.0%}")
+            return True
+        return False
+
+    def record_success(self, duration=None):
+        """Регистрирует успешный вызов
+
+        Args:
+            duration (float, optional): Длительность вызова в секундах
+        """
+        with self._lock:
+            slow = self._is_slow(duration)
+            self.total_calls += 1
+            self.total_slow += int(slow)
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN:
+                # Медленный пробный вызов не восстанавливает цепь
+                self._set_state(self.OPEN if slow else self.CLOSED)
+                return
+            self._window.append((False, slow))
+            if self._state == self.CLOSED and self._window_exceeded():
+                self._set_state(self.OPEN)
+
+    def record_failure(self, duration=None):
+        """Регистрирует неудачный вызов
+
+        Args:
+            duration (float, optional): Длительность вызова в секундах
+        """
+        with self._lock:
+            slow = self._is_slow(duration)
+            self.total_calls += 1
+            self.total_failures += 1
+            self.total_slow += int(slow)
+            self._consecutive_failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN:
+                self._set_state(self.OPEN)
+                return
+            self._window.append((True, slow))
+            if self._state == self.CLOSED and (
+                    self._consecutive_failures >= self.failure_threshold or self._window_exceeded()):
+                self._set_state(self.OPEN)
+
+    def record_ignored(self):
+        """Регистрирует вызов, не дошедший до сервиса: состояние и доли не меняются"""
+        with self._lock:
+            # Пробный запрос не выполнен, следующий вызов может стать пробным
+            self._probe_in_flight = False
+
+    def call(self, func, *args, **kwargs):
+        """
+        Выполняет функцию через Circuit Breaker
+
+        Исключение из func считается ошибкой (если is_failure не говорит
+        обратного) и пробрасывается дальше; исключения, отмеченные is_ignored,
+        не учитываются.
+
+        Raises:
+            CircuitOpenError: если цепь разомкнута
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(self.name, self.retry_in())
+        started = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            duration = time.monotonic() - started
+            if self.is_ignored is not None and self.is_ignored(e):
+                self.record_ignored()
+            elif self.is_failure is None or self.is_failure(e):
+                self.record_failure(duration)
+            else:
+                # Сервис ответил, ошибка относится к самому запросу
+                self.record_success(duration)
+            raise
+        self.record_success(time.monotonic() - started)
+        return result
+
+    def get_status(self):
+        """
+        Возвращает состояние цепи для метрик и healthcheck
+
+        Returns:
+            dict: Состояние и счетчики
+        """
+        with self._lock:
+            self._maybe_half_open()
+            failure_rate, slow_call_rate = self._rates()
+            return {
+                "name": self.name,
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "failure_rate": round(failure_rate, 3),
+                "slow_call_rate": round(slow_call_rate, 3),
+                "total_calls": self.total_calls,
+                "total_failures": self.total_failures,
+                "total_slow": self.total_slow,
+                "total_rejected": self.total_rejected,
+            }
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+Инкрементальное извлечение блоков кода из ответа модели.
+
+Парсер получает текст фрагментами по мере потоковой генерации и
+возвращает каждый блок ```язык ... ``` сразу после закрывающей ограды,
+не дожидаясь окончания ответа. Текст просматривается один раз: каждая
+строка разбирается ровно однажды, для блоков запоминаются позиции в ответе.
+
+Тип блока (PowerShell, Batch, Markdown, shell) определяет classify_block:
+тег языка и признаки содержимого складываются в баллы, побеждает тип с
+наибольшей суммой. Так распознаются и блоки без тега или с тегом-синонимом
+(```ps1, ```cmd, ```md).
+
+Пример использования:
+```python
+parser = IncrementalFenceParser()
+for chunk in stream.text_stream:
+    for block in parser.feed(chunk):
+        print(block.language, len(block.content), block.span)
+for block in parser.close():
+    ...
+
+for block in iter_fenced_blocks(response_text):
+    kind, score = classify_block(block, WINDOWS_KINDS)
+```
+"""
+
+import re
+
+FENCE = "```"
+
+# Синонимы тегов языка -> тип блока
+LANGUAGE_ALIASES = {
+    "powershell": "powershell", "ps1": "powershell", "ps": "powershell", "pwsh": "powershell",
+    "batch": "batch", "bat": "batch", "cmd": "batch", "batchfile": "batch",
+    "markdown": "markdown", "md": "markdown",
+    "bash": "shell", "sh": "shell", "zsh": "shell", "shell": "shell",
+}
+
+WINDOWS_KINDS = ("powershell", "batch", "markdown")
+MACOS_KINDS = ("shell", "markdown")
+
+# Баллы за совпадение тега языка: тег почти всегда решает, но блок без тега
+# или с чужим тегом классифицируется по содержимому
+TAG_WEIGHT = 10
+# Минимальная сумма баллов, при которой блок относится к типу
+MIN_SCORE = 3
+
+# Признаки содержимого: (регулярное выражение, баллы); учитывается наличие признака
+BLOCK_FEATURES = {
+    "powershell": (
+        (re.compile(r"\b(?:Get|Set|New|Remove|Write|Test|Stop|Start|Invoke|Out)-[A-Z]\w+"), 3),
+        (re.compile(r"^\s*function\s+[\w-]+", re.MULTILINE | re.IGNORECASE), 2),
+        (re.compile(r"\[[\w.]+\]::"), 2),
+        (re.compile(r"\$\w+"), 1),
+        (re.compile(r"-ErrorAction\b|\btry\s*\{", re.IGNORECASE), 1),
+        (re.compile(r"^@echo off", re.MULTILINE | re.IGNORECASE), -4),
+    ),
+    "batch": (
+        (re.compile(r"^@echo off", re.MULTILINE | re.IGNORECASE), 4),
+        (re.compile(r"^\s*chcp\s+\d+", re.MULTILINE | re.IGNORECASE), 2),
+        (re.compile(r"%~?\w+%?|%errorlevel%", re.IGNORECASE), 1),
+        (re.compile(r"^\s*(?:rem\s|::|goto\s|pause\b|exit\s+/b)", re.MULTILINE | re.IGNORECASE), 1),
+        (re.compile(r"powershell(?:\.exe)?\s+.*-(?:File|ExecutionPolicy)\b", re.IGNORECASE), 2),
+        (re.compile(r"^\s*function\s+[\w-]+", re.MULTILINE | re.IGNORECASE), -3),
+    ),
+    "markdown": (
+        (re.compile(r"^#{1,6}\s+\S", re.MULTILINE), 3),
+        (re.compile(r"^\s*(?:[-*]|\d+\.)\s+\S", re.MULTILINE), 1),
+        (re.compile(r"\*\*[^*\n]+\*\*|\[[^\]\n]+\]\([^)\n]+\)"), 1),
+        (re.compile(r"^\s*\$\w+\s*=|^@echo off|^#!/", re.MULTILINE | re.IGNORECASE), -4),
+    ),
+    "shell": (
+        (re.compile(r"^#!/bin/(?:ba|z)?sh"), 4),
+        (re.compile(r"\b(?:sudo|defaults write|launchctl|brew|osascript|diskutil)\b"), 2),
+        (re.compile(r"^\s*(?:if \[|fi\b|echo\s)", re.MULTILINE), 1),
+    ),
+}
+
+
+def canonical_language(language):
+    """Тип блока по тегу языка (None для неизвестного или пустого тега)"""
+    return LANGUAGE_ALIASES.get((language or "").strip().lower())
+
+
+def score_block(block, kinds=WINDOWS_KINDS):
+    """
+    Баллы блока по каждому типу
+
+    Args:
+        block (FencedBlock): Блок кода
+        kinds (tuple): Допустимые типы
+
+    Returns:
+        dict: Тип -> сумма баллов
+    """
+    tagged = canonical_language(block.language)
+    scores = {}
+    for kind in kinds:
+        score = TAG_WEIGHT if tagged == kind else 0
+        for pattern, weight in BLOCK_FEATURES.get(kind, ()):
+            if pattern.search(block.content):
+                score += weight
+        scores[kind] = score
+    return scores
+
+
+def classify_block(block, kinds=WINDOWS_KINDS):
+    """
+    Определяет тип блока
+
+    Returns:
+        tuple: (тип или None, баллы)
+    """
+    scores = score_block(block, kinds)
+    if not scores:
+        return None, 0
+    kind = max(kinds, key=lambda name: scores[name])
+    if scores[kind] < MIN_SCORE:
+        return None, scores[kind]
+    return kind, scores[kind]
+
+
+class FencedBlock:
+    """Завершенный блок кода"""
+
+    def __init__(self, language, content, index, start=None, end=None):
+        self.language = language
+        self.content = content
+        self.index = index
+        self.start = start
+        self.end = end
+
+    @property
+    def span(self):
+        """Позиции блока в ответе: от открывающей ограды до конца закрывающей"""
+        return self.start, self.end
+
+    def __repr__(self):
+        return (f"FencedBlock(language={self.language!r}, index={self.index}, "
+                f"length={len(self.content)}, span={self.span})")
+
+
+class IncrementalFenceParser:
+    """Разбор блоков кода из текста, поступающего фрагментами"""
+
+    def __init__(self):
+        self._buffer = ""
+        self._line_start = 0
+        self._language = None
+        self._lines = []
+        self._block_start = None
+        self._in_block = False
+        self.blocks = []
+        self.received_chars = 0
+
+    @property
+    def in_block(self):
+        """Открыт ли сейчас блок кода"""
+        return self._in_block
+
+    @property
+    def current_language(self):
+        """Язык открытого блока"""
+        return self._language if self._in_block else None
+
+    def feed(self, text):
+        """
+        Добавляет фрагмент текста
+
+        Args:
+            text (str): Очередной фрагмент ответа
+
+        Returns:
+            list: Блоки (FencedBlock), закрытые в этом фрагменте
+        """
+        self.received_chars += len(text)
+        completed = []
+        position = 0
+        newline = text.find("\n")
+        while newline != -1:
+            line = text[position:newline]
+            if self._buffer:
+                line, self._buffer = self._buffer + line, ""
+            block = self._process_line(line, len(line) + 1)
+            if block is not None:
+                completed.append(block)
+            position = newline + 1
+            newline = text.find("\n", position)
+        # Незавершенная строка ждет следующего фрагмента
+        self._buffer += text[position:]
+        return completed
+
+    def close(self):
+        """
+        Завершает разбор (конец ответа)
+
+        Returns:
+            list: Блок, закрытый последней строкой без перевода строки
+        """
+        completed = []
+        if self._buffer:
+            line, self._buffer = self._buffer, ""
+            block = self._process_line(line, len(line))
+            if block is not None:
+                completed.append(block)
+        return completed
+
+    def _process_line(self, line, consumed):
+        line_start = self._line_start
+        self._line_start += consumed
+        stripped = line.strip()
+        if not self._in_block:
+            if stripped.startswith(FENCE):
+                self._in_block = True
+                self._language = stripped[len(FENCE):].strip().lower()
+                self._lines = []
+                self._block_start = line_start
+            return None
+
+        if stripped.startswith(FENCE) and not stripped[len(FENCE):].strip():
+            block = FencedBlock(self._language, "\n".join(self._lines) + "\n", len(self.blocks),
+                                self._block_start, line_start + len(line))
+            self.blocks.append(block)
+            self._in_block = False
+            self._language = None
+            self._lines = []
+            return block
+
+        self._lines.append(line)
+        return None
+
+
+def iter_fenced_blocks(text):
+    """
+    Блоки кода полного ответа за один проход
+
+    Yields:
+        FencedBlock: Блоки в порядке следования
+    """
+    parser = IncrementalFenceParser()
+    yield from parser.feed(text)
+    yield from parser.close()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+Адаптивное ограничение числа одновременных запросов (AIMD).
+
+Лимит растет на 1 за каждое "окно" успешных запросов (аддитивно) и
+уменьшается в decrease_factor раз при перегрузке (мультипликативно):
+ответ 429/529 или рост задержки больше чем в latency_tolerance раз
+относительно базовой. Запросы сверх лимита ждут в очереди по порядку,
+но не дольше заданного срока.
+
+Пример использования:
+```python
+permit = limiter.acquire(timeout=60)
+try:
+    response = client.messages.create(...)
+    permit.success(latency=response.timing.ttfb_ms / 1000)
+except RateLimitError:
+    permit.overload()
+    raise
+finally:
+    permit.release()
+```
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyLimitExceeded(Exception):
+    """Запрос не дождался свободного места (истек срок или переполнена очередь)"""
+
+    def __init__(self, name, reason, waited=0.0):
+        self.name = name
+        self.reason = reason
+        self.waited = waited
+        super().__init__(f"Лимит одновременных запросов '{name}': {reason} (ожидание {waited:.1f} с)")
+
+
+class Permit:
+    """Разрешение на выполнение одного запроса"""
+
+    def __init__(self, limiter, acquired_at):
+        self._limiter = limiter
+        self.acquired_at = acquired_at
+        self._outcome = None
+        self._latency = None
+        self._released = False
+
+    def success(self, latency=None):
+        """Запрос выполнен; latency (секунды) используется для обнаружения перегрузки"""
+        self._outcome, self._latency = "success", latency
+
+    def overload(self):
+        """Провайдер сообщил о перегрузке (429, 529)"""
+        self._outcome = "overload"
+
+    def release(self):
+        """Освобождает место; без success/overload лимит не меняется"""
+        if not self._released:
+            self._released = True
+            self._limiter._release(self, self._outcome, self._latency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD-ограничитель одновременных запросов с очередью ожидания"""
+
+    def __init__(self, name, initial_limit=4, min_limit=1, max_limit=32, decrease_factor=0.5,
+                 latency_tolerance=2.0, max_queue=100, latency_window=100, min_latency_samples=10):
+        """
+        Инициализация ограничителя
+
+        Args:
+            name (str): Имя (для логов и метрик)
+            initial_limit (int): Начальный лимит
+            min_limit (int): Минимальный лимит
+            max_limit (int): Максимальный лимит
+            decrease_factor (float): Множитель лимита при перегрузке
+            latency_tolerance (float): Во сколько раз задержка может превышать базовую
+            max_queue (int): Максимальная длина очереди ожидания
+            latency_window (int): Сколько последних задержек хранить для базовой оценки
+            min_latency_samples (int): Минимум задержек до проверки их роста
+        """
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.max_queue = max_queue
+        self.min_latency_samples = min_latency_samples
+
+        self._cond = threading.Condition()
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._in_flight = 0
+        self._waiters = deque()
+        self._latencies = deque(maxlen=latency_window)
+        self._last_decrease = 0.0
+
+        # Счетчики для метрик
+        self.acquired = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.overloads = 0
+        self.decreases = 0
+        self.total_wait = 0.0
+
+    @property
+    def limit(self):
+        """Текущий лимит одновременных запросов"""
+        with self._cond:
+            return int(self._limit)
+
+    def acquire(self, timeout=None):
+        """
+        Ожидает свободное место в порядке очереди
+
+        Args:
+            timeout (float, optional): Максимальное ожидание в секундах (0 - без ожидания)
+
+        Returns:
+            Permit: Разрешение, которое нужно освободить через release()
+
+        Raises:
+            ConcurrencyLimitExceeded: истек срок ожидания или очередь переполнена
+        """
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        with self._cond:
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise ConcurrencyLimitExceeded(self.name, "очередь переполнена")
+            waiter = object()
+            self._waiters.append(waiter)
+            try:
+                while not (self._waiters[0] is waiter and self._in_flight < int(self._limit)):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.timeouts += 1
+                        raise ConcurrencyLimitExceeded(self.name, "истек срок ожидания", time.monotonic() - started)
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters.remove(waiter)
+                # Следующий в очереди проверяет, не освободилось ли место
+                self._cond.notify_all()
+            self._in_flight += 1
+            self.acquired += 1
+            self.total_wait += time.monotonic() - started
+            return Permit(self, time.monotonic())
+
+    def _baseline_latency(self):
+        """Базовая задержка - 10-й перцентиль последних значений (под блокировкой)"""
+        if len(self._latencies) < self.min_latency_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[len(ordered) // 10]
+
+    def _release(self, permit, outcome, latency):
+        with self._cond:
+            self._in_flight -= 1
+            overloaded = outcome == "overload"
+            if outcome == "success" and latency is not None:
+                baseline = self._baseline_latency()
+                if baseline is not None and latency > baseline * self.latency_tolerance:
+                    logger.info(f"Лимит '{self.name}': задержка {latency:.1f} с при базовой {baseline:.1f} с")
+                    overloaded = True
+                self._latencies.append(latency)
+
+            if overloaded:
+                self.overloads += 1
+                # Запросы, начатые до последнего снижения, лимит повторно не снижают
+                if permit.acquired_at > self._last_decrease:
+                    self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+                    self._last_decrease = time.monotonic()
+                    self.decreases += 1
+                    logger.warning(f"Лимит '{self.name}' снижен до {int(self._limit)}")
+            elif outcome == "success" and self._in_flight + 1 >= int(self._limit):
+                # Лимит растет, только если он действительно был исчерпан
+                self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+            self._cond.notify_all()
+
+    def get_stats(self):
+        """
+        Состояние ограничителя для метрик
+
+        Returns:
+            dict: Лимит, загрузка, очередь и счетчики
+        """
+        with self._cond:
+            baseline = self._baseline_latency()
+            return {
+                "name": self.name,
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "queued": len(self._waiters),
+                "acquired": self.acquired,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "overloads": self.overloads,
+                "decreases": self.decreases,
+                "avg_wait_ms": round(self.total_wait / self.acquired * 1000) if self.acquired else 0,
+                "baseline_latency_ms": round(baseline * 1000) if baseline is not None else None,
+            }
@@ -0,0 +1,676 @@
+#!/usr/bin/env python
+"""
+Локальная имитация Anthropic Messages API для нагрузочного тестирования.
+
+Сервер принимает POST /v1/messages (в том числе stream=true с SSE-событиями
+как у настоящего API), отвечает текстами из корпуса ответов с блоками
+```powershell, ```batch и ```markdown, имитирует задержку по заданному
+распределению и с заданной вероятностью возвращает ошибки 429/529/500,
+обрыв потока или "зависание" дольше таймаута клиента.
+
+Пример использования:
+```python
+from fake_anthropic_server import FakeAnthropicServer, LatencyDistribution
+import fallback_anthropic
+
+server = FakeAnthropicServer(
+    ttfb=LatencyDistribution.parse("lognormal:1.5:0.5"),
+    error_rates={"429": 0.05, "529": 0.02, "timeout": 0.01},
+    seed=42,
+).start()
+client = fallback_anthropic.Anthropic(api_key="test", base_url=server.base_url)
+# или ANTHROPIC_BASE_URL=http://127.0.0.1:8082 для всего бота
+...
+server.stop()
+```
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import logging
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Виды внедряемых ошибок: HTTP код, тип ошибки API, текст
+ERROR_KINDS = {
+    "429": (429, "rate_limit_error", "Number of request tokens has exceeded your per-minute rate limit"),
+    "529": (529, "overloaded_error", "Overloaded"),
+    "500": (500, "api_error", "Internal server error"),
+}
+# "timeout" - ответ не отправляется дольше таймаута клиента,
+# "stream_error" - поток обрывается событием error после части текста
+FAULT_KINDS = tuple(ERROR_KINDS) + ("timeout", "stream_error")
+
+CHARS_PER_TOKEN = 4
+
+DEFAULT_CORPUS = [
+    """Вот оптимизированные скрипты для вашей системы.
+
+```powershell
+# Win11Optimizer.ps1
+# Скрипт оптимизации Windows 11
+[Console]::OutputEncoding = [System.Text.Encoding]::UTF8
+
+if (-NOT ([Security.Principal.WindowsPrincipal][Security.Principal.WindowsIdentity]::GetCurrent()).IsInRole([Security.Principal.WindowsBuiltInRole]::Administrator)) {
+    Write-Warning "Запустите скрипт от имени администратора"
+    exit 1
+}
+
+function Backup-Settings {
+    param([string]$BackupPath = "$env:USERPROFILE\\OptimizerBackup")
+    try {
+        if (-not (Test-Path -Path $BackupPath)) {
+            New-Item -Path $BackupPath -ItemType Directory -Force | Out-Null
+        }
+        reg export "HKCU\\Software\\Microsoft\\Windows\\CurrentVersion" "$BackupPath\\user_settings.reg" /y | Out-Null
+        Write-Host "Резервная копия создана: $BackupPath" -ForegroundColor Green
+    } catch {
+        Write-Host "Ошибка резервного копирования: $_" -ForegroundColor Red
+    }
+}
+
+function Show-Menu {
+    Write-Host "1. Оптимизация служб"
+    Write-Host "2. Очистка временных файлов"
+    Write-Host "0. Выход"
+}
+
+function Optimize-Services {
+    $services = @("DiagTrack", "SysMain", "WSearch")
+    foreach ($service in $services) {
+        try {
+            $svc = Get-Service -Name $service -ErrorAction SilentlyContinue
+            if ($svc) {
+                Stop-Service -Name $service -Force -ErrorAction SilentlyContinue
+                Set-Service -Name $service -StartupType Disabled -ErrorAction SilentlyContinue
+                Write-Host "Служба $service отключена" -ForegroundColor Green
+            }
+        } catch {
+            Write-Host "Не удалось изменить службу $service" -ForegroundColor Yellow
+        }
+    }
+}
+
+function Clear-TempFiles {
+    $paths = @("$env:TEMP", "$env:SystemRoot\\Temp")
+    foreach ($path in $paths) {
+        if (Test-Path -Path $path) {
+            Get-ChildItem -Path $path -Recurse -Force -ErrorAction SilentlyContinue |
+                Remove-Item -Recurse -Force -ErrorAction SilentlyContinue
+        }
+    }
+    Write-Host "Временные файлы удалены" -ForegroundColor Green
+}
+
+Backup-Settings
+do {
+    Show-Menu
+    $choice = Read-Host "Выберите действие"
+    switch ($choice) {
+        "1" { Optimize-Services }
+        "2" { Clear-TempFiles }
+    }
+} while ($choice -ne "0")
+```
+
+```batch
+@echo off
+chcp 65001 >nul
+net session >nul 2>&1
+if %errorlevel% neq 0 (
+    echo Требуются права администратора
+    pause
+    exit /b 1
+)
+if not exist "%~dp0Win11Optimizer.ps1" (
+    echo Файл Win11Optimizer.ps1 не найден
+    pause
+    exit /b 1
+)
+powershell -NoProfile -ExecutionPolicy Bypass -File "%~dp0Win11Optimizer.ps1"
+pause
+```
+
+```markdown
+# Оптимизатор Windows 11
+
+## Запуск
+1. Распакуйте архив в любую папку.
+2. Запустите Start-Optimizer.bat от имени администратора.
+
+## Что делает скрипт
+- Создает резервную копию настроек.
+- Отключает телеметрию и неиспользуемые службы.
+- Очищает временные файлы.
+```
+""",
+    """Анализ скриншота показывает высокую загрузку диска. Подготовил скрипты.
+
+```powershell
+# Win11Optimizer.ps1
+[Console]::OutputEncoding = [System.Text.Encoding]::UTF8
+
+function Backup-Settings {
+    $backupFile = "$env:USERPROFILE\\Desktop\\power_backup.txt"
+    try {
+        powercfg /list | Out-File -FilePath $backupFile -Encoding UTF8
+        Write-Host "Текущие схемы питания сохранены в $backupFile"
+    } catch {
+        Write-Host "Не удалось сохранить схемы питания: $_" -ForegroundColor Red
+    }
+}
+
+function Show-Menu {
+    Write-Host "=== Оптимизация диска ==="
+    Write-Host "1. Отключить индексацию"
+    Write-Host "2. Включить схему высокой производительности"
+    Write-Host "0. Выход"
+}
+
+function Disable-Indexing {
+    try {
+        $svc = Get-Service -Name "WSearch" -ErrorAction SilentlyContinue
+        if ($svc -and $svc.Status -eq "Running") {
+            Stop-Service -Name "WSearch" -Force -ErrorAction SilentlyContinue
+            Set-Service -Name "WSearch" -StartupType Disabled -ErrorAction SilentlyContinue
+        }
+        Write-Host "Индексация отключена" -ForegroundColor Green
+    } catch {
+        Write-Host "Ошибка: $_" -ForegroundColor Red
+    }
+}
+
+function Set-HighPerformance {
+    $logPath = "$env:TEMP\\optimizer.log"
+    if (Test-Path -Path $logPath) {
+        Add-Content -Path $logPath -Value "Включение схемы высокой производительности"
+    }
+    powercfg /setactive SCHEME_MIN
+    Write-Host "Схема высокой производительности включена" -ForegroundColor Green
+}
+
+Backup-Settings
+do {
+    Show-Menu
+    $choice = Read-Host "Выбор"
+    switch ($choice) {
+        "1" { Disable-Indexing }
+        "2" { Set-HighPerformance }
+    }
+} while ($choice -ne "0")
+```
+
+```batch
+@echo off
+chcp 65001 >nul
+net session >nul 2>&1 || (echo Запустите от имени администратора & pause & exit /b 1)
+if not exist "%~dp0Win11Optimizer.ps1" (echo Скрипт не найден & pause & exit /b 1)
+powershell -NoProfile -ExecutionPolicy Bypass -File "%~dp0Win11Optimizer.ps1"
+```
+
+```markdown
+# Оптимизация диска
+
+Скрипт отключает службу индексации Windows Search и включает схему
+питания "Высокая производительность". Текущие схемы питания сохраняются
+на рабочий стол перед изменениями.
+```
+""",
+    """```powershell
+# Win11Optimizer.ps1
+function Backup-Settings {
+    try {
+        Checkpoint-Computer -Description "Перед оптимизацией" -RestorePointType MODIFY_SETTINGS -ErrorAction Stop
+    } catch {
+        Write-Host "Точка восстановления не создана: $_" -ForegroundColor Yellow
+    }
+}
+
+function Show-Menu {
+    Write-Host "1. Отключить автозапуск OneDrive"
+    Write-Host "0. Выход"
+}
+
+Backup-Settings
+$runKey = "HKCU:\\Software\\Microsoft\\Windows\\CurrentVersion\\Run"
+if (Test-Path -Path $runKey) {
+    $svc = Get-Service -Name "OneSyncSvc*" -ErrorAction SilentlyContinue | Select-Object -First 1
+    Remove-ItemProperty -Path $runKey -Name "OneDrive" -ErrorAction SilentlyContinue
+}
+Show-Menu
+```
+
+```batch
+@echo off
+chcp 65001 >nul
+net session >nul 2>&1
+if %errorlevel% neq 0 (echo Нужны права администратора & exit /b 1)
+if exist "%~dp0Win11Optimizer.ps1" powershell -NoProfile -ExecutionPolicy Bypass -File "%~dp0Win11Optimizer.ps1"
+```
+
+```markdown
+# Автозапуск
+
+Скрипт создает точку восстановления и убирает OneDrive из автозапуска.
+```
+""",
+]
+
+
+def load_corpus(path):
+    """
+    Загружает корпус ответов
+
+    Args:
+        path (str): Каталог (каждый файл - отдельный ответ) или JSONL-файл
+            со строками {"text": "..."}
+
+    Returns:
+        list: Тексты ответов
+    """
+    if os.path.isdir(path):
+        corpus = []
+        for name in sorted(os.listdir(path)):
+            full_path = os.path.join(path, name)
+            if os.path.isfile(full_path):
+                with open(full_path, "r", encoding="utf-8") as f:
+                    corpus.append(f.read())
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            corpus = [json.loads(line)["text"] for line in f if line.strip()]
+    if not corpus:
+        raise ValueError(f"Корпус ответов {path} пуст")
+    return corpus
+
+
+class LatencyDistribution:
+    """Распределение задержки в секундах: fixed, uniform или lognormal"""
+
+    KINDS = ("fixed", "uniform", "lognormal")
+
+    def __init__(self, kind="fixed", a=0.0, b=None):
+        """
+        Args:
+            kind (str): Вид распределения
+            a (float): fixed - значение, uniform - минимум, lognormal - медиана
+            b (float, optional): uniform - максимум, lognormal - sigma
+        """
+        if kind not in self.KINDS:
+            raise ValueError(f"Неизвестное распределение задержки: {kind}")
+        self.kind = kind
+        self.a = float(a)
+        self.b = float(b) if b is not None else (self.a if kind == "uniform" else 0.5)
+
+    @classmethod
+    def parse(cls, spec):
+        """Создает распределение из строки "fixed:0.5", "uniform:0.2:1.5" или "lognormal:1.0:0.6" """
+        parts = spec.split(":")
+        return cls(parts[0], *[float(value) for value in parts[1:3]])
+
+    def sample(self, rng):
+        if self.kind == "fixed":
+            return self.a
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        return rng.lognormvariate(math.log(self.a), self.b) if self.a > 0 else 0.0
+
+    def __repr__(self):
+        return f"LatencyDistribution({self.kind}:{self.a}:{self.b})"
+
+
+def _estimate_tokens(value):
+    """Грубая оценка числа токенов текста или структуры content/system"""
+    if isinstance(value, str):
+        return max(1, len(value) // CHARS_PER_TOKEN)
+    if isinstance(value, list):
+        return sum(_estimate_tokens(item) for item in value)
+    if isinstance(value, dict):
+        if value.get("type") == "image":
+            return 1500
+        return _estimate_tokens(value.get("text") or value.get("content") or "")
+    return 0
+
+
+class _AnthropicRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик HTTP-запросов к имитации Messages API"""
+
+    def _send_json(self, status_code, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_event(self, event_type, data):
+        payload = f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        self.wfile.write(payload.encode("utf-8"))
+        self.wfile.flush()
+
+    def do_POST(self):
+        fake = self.server.fake
+        if self.path.split("?")[0].rstrip("/") != "/v1/messages":
+            self._send_json(404, fake.error_body("not_found_error", f"Unknown path {self.path}"))
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError:
+            self._send_json(400, fake.error_body("invalid_request_error", "Body is not valid JSON"))
+            return
+
+        plan = fake.plan_response(body, dict(self.headers))
+        try:
+            if plan["status"] != 200:
+                self._send_json(plan["status"], plan["body"], plan["headers"])
+            elif plan["fault"] == "timeout":
+                fake.hang()
+                self.close_connection = True
+            elif body.get("stream"):
+                self._stream(fake, plan)
+            else:
+                fake.sleep(plan["ttfb"] + plan["generation"])
+                self._send_json(200, plan["message"])
+        except (BrokenPipeError, ConnectionResetError):
+            fake.record_outcome(plan, "cancelled")
+            return
+        fake.record_outcome(plan, plan["outcome"])
+
+    def _stream(self, fake, plan):
+        message = plan["message"]
+        fake.sleep(plan["ttfb"])
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.close_connection = True
+
+        start = dict(message, content=[], stop_reason=None,
+                     usage=dict(message["usage"], output_tokens=1))
+        self._send_event("message_start", {"type": "message_start", "message": start})
+        self._send_event("content_block_start", {"type": "content_block_start", "index": 0,
+                                                 "content_block": {"type": "text", "text": ""}})
+        self._send_event("ping", {"type": "ping"})
+
+        chunks = plan["chunks"]
+        if plan["fault"] == "stream_error":
+            chunks = chunks[:max(1, len(chunks) // 2)]
+        chunk_delay = plan["generation"] / max(1, len(plan["chunks"]))
+        for chunk in chunks:
+            fake.sleep(chunk_delay)
+            self._send_event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                     "delta": {"type": "text_delta", "text": chunk}})
+        if plan["fault"] == "stream_error":
+            self._send_event("error", fake.error_body("overloaded_error", "Overloaded"))
+            return
+
+        self._send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self._send_event("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+            "usage": {"output_tokens": message["usage"]["output_tokens"]},
+        })
+        self._send_event("message_stop", {"type": "message_stop"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeAnthropicServer:
+    """Имитация Anthropic Messages API с задержками, ошибками и записью запросов"""
+
+    def __init__(self, host="127.0.0.1", port=0, ttfb=None, tokens_per_second=200.0,
+                 error_rates=None, corpus=None, retry_after=1.0, hang_seconds=300.0,
+                 chunk_chars=40, seed=None):
+        """
+        Инициализация сервера
+
+        Args:
+            host (str): Адрес для прослушивания
+            port (int): Порт (0 - выбрать свободный)
+            ttfb (LatencyDistribution, optional): Задержка до первого байта ответа
+            tokens_per_second (float): Скорость генерации выходных токенов (0 - мгновенно)
+            error_rates (dict, optional): Вероятности ошибок по видам из FAULT_KINDS
+            corpus (list, optional): Тексты ответов (по умолчанию DEFAULT_CORPUS)
+            retry_after (float): Значение заголовка retry-after для 429, секунды
+            hang_seconds (float): Сколько "зависает" запрос при ошибке timeout
+            chunk_chars (int): Размер фрагмента текста в потоке
+            seed (int, optional): Зерно генератора для воспроизводимых прогонов
+        """
+        unknown = set(error_rates or {}) - set(FAULT_KINDS)
+        if unknown:
+            raise ValueError(f"Неизвестные виды ошибок: {', '.join(sorted(unknown))}")
+        self.host = host
+        self.port = port
+        self.ttfb = ttfb or LatencyDistribution("fixed", 0.0)
+        self.tokens_per_second = tokens_per_second
+        self.error_rates = dict(error_rates or {})
+        self.corpus = list(corpus or DEFAULT_CORPUS)
+        self.retry_after = retry_after
+        self.hang_seconds = hang_seconds
+        self.chunk_chars = chunk_chars
+
+        self.requests = []  # Список словарей с параметрами и результатом запросов
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._scripted_faults = []
+        self._cached_prompts = set()
+        self._stopping = threading.Event()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """Базовый URL сервера (для base_url клиента или ANTHROPIC_BASE_URL)"""
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        """Запускает сервер в фоновом потоке"""
+        self._stopping.clear()
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _AnthropicRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Имитация Anthropic API запущена на {self.base_url}")
+        return self
+
+    def stop(self):
+        """Останавливает сервер и прерывает "зависшие" запросы"""
+        self._stopping.set()
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def fail_next(self, kind, count=1):
+        """Следующие count запросов завершатся ошибкой kind (независимо от вероятностей)"""
+        if kind not in FAULT_KINDS:
+            raise ValueError(f"Неизвестный вид ошибки: {kind}")
+        with self._lock:
+            self._scripted_faults.extend([kind] * count)
+
+    def sleep(self, seconds):
+        """Пауза, прерываемая остановкой сервера"""
+        if seconds > 0:
+            self._stopping.wait(seconds)
+
+    def hang(self):
+        """Имитация запроса, ответ на который не приходит"""
+        self.sleep(self.hang_seconds)
+
+    @staticmethod
+    def error_body(error_type, message):
+        return {"type": "error", "error": {"type": error_type, "message": message}}
+
+    def _pick_fault(self):
+        """Выбирает ошибку для запроса (под блокировкой)"""
+        if self._scripted_faults:
+            return self._scripted_faults.pop(0)
+        roll = self._rng.random()
+        for kind in FAULT_KINDS:
+            rate = self.error_rates.get(kind, 0.0)
+            if roll < rate:
+                return kind
+            roll -= rate
+        return None
+
+    def _usage(self, body, output_tokens):
+        """Расход токенов с учетом кеша системного промпта (под блокировкой)"""
+        usage = {"input_tokens": _estimate_tokens(body.get("messages") or []),
+                 "output_tokens": output_tokens,
+                 "cache_creation_input_tokens": 0,
+                 "cache_read_input_tokens": 0}
+        system = body.get("system")
+        if not system:
+            return usage
+        system_tokens = _estimate_tokens(system)
+        cacheable = isinstance(system, list) and any(block.get("cache_control") for block in system)
+        if not cacheable:
+            usage["input_tokens"] += system_tokens
+            return usage
+        key = hashlib.sha256(json.dumps([body.get("model"), system], sort_keys=True).encode("utf-8")).hexdigest()
+        if key in self._cached_prompts:
+            usage["cache_read_input_tokens"] = system_tokens
+        else:
+            self._cached_prompts.add(key)
+            usage["cache_creation_input_tokens"] = system_tokens
+        return usage
+
+    def plan_response(self, body, headers):
+        """
+        Определяет ответ на запрос: ошибку, задержки и текст
+
+        Returns:
+            dict: План ответа (status, headers, body, fault, message, chunks, ttfb, generation)
+        """
+        record = {
+            "model": body.get("model"),
+            "stream": bool(body.get("stream")),
+            "max_tokens": body.get("max_tokens"),
+            "cached_system": isinstance(body.get("system"), list),
+            "received_at": time.monotonic(),
+            "outcome": None,
+        }
+        plan = {"status": 200, "headers": {}, "body": None, "fault": None, "record": record,
+                "message": None, "chunks": [], "ttfb": 0.0, "generation": 0.0, "outcome": "ok"}
+        lowered = {name.lower(): value for name, value in headers.items()}
+
+        with self._lock:
+            self.requests.append(record)
+            if not lowered.get("x-api-key"):
+                plan.update(status=401, outcome="401",
+                            body=self.error_body("authentication_error", "x-api-key header is required"))
+                return plan
+            if not body.get("model") or not body.get("messages") or not body.get("max_tokens"):
+                plan.update(status=400, outcome="400",
+                            body=self.error_body("invalid_request_error", "model, messages and max_tokens are required"))
+                return plan
+
+            fault = self._pick_fault()
+            if fault in ERROR_KINDS:
+                status, error_type, message = ERROR_KINDS[fault]
+                if status == 429:
+                    plan["headers"]["retry-after"] = str(int(math.ceil(self.retry_after)))
+                plan.update(status=status, outcome=fault, fault=fault, body=self.error_body(error_type, message))
+                return plan
+
+            text = self._rng.choice(self.corpus)
+            max_chars = int(body["max_tokens"]) * CHARS_PER_TOKEN
+            stop_reason = "end_turn"
+            if len(text) > max_chars:
+                text, stop_reason = text[:max_chars], "max_tokens"
+            output_tokens = _estimate_tokens(text)
+            usage = self._usage(body, output_tokens)
+            ttfb = self.ttfb.sample(self._rng)
+
+        plan.update(
+            fault=fault,
+            outcome=fault or "ok",
+            ttfb=ttfb,
+            generation=output_tokens / self.tokens_per_second if self.tokens_per_second else 0.0,
+            chunks=[text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)],
+            message={
+                "id": f"msg_fake_{uuid.uuid4().hex[:24]}",
+                "type": "message",
+                "role": "assistant",
+                "model": body["model"],
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": stop_reason,
+                "stop_sequence": None,
+                "usage": usage,
+            },
+        )
+        return plan
+
+    def record_outcome(self, plan, outcome):
+        with self._lock:
+            plan["record"]["outcome"] = outcome
+            plan["record"]["duration"] = time.monotonic() - plan["record"]["received_at"]
+
+    def get_stats(self):
+        """
+        Сводка по обработанным запросам
+
+        Returns:
+            dict: Число запросов и распределение результатов
+        """
+        with self._lock:
+            outcomes = Counter(record["outcome"] or "in_progress" for record in self.requests)
+            return {"requests": len(self.requests), "outcomes": dict(outcomes)}
+
+
+def _parse_error_rates(spec):
+    """Разбирает строку вида "429=0.05,529=0.02,timeout=0.01" """
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, rate = item.partition("=")
+        rates[kind.strip()] = float(rate)
+    return rates
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Имитация Anthropic Messages API")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--ttfb", default="lognormal:1.5:0.5",
+                        help="Задержка до первого байта: fixed:S, uniform:MIN:MAX или lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--error-rates", default="",
+                        help=f"Вероятности ошибок, например 429=0.05,529=0.02 (виды: {', '.join(FAULT_KINDS)})")
+    parser.add_argument("--corpus", help="Каталог или JSONL-файл с текстами ответов")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    server = FakeAnthropicServer(
+        port=args.port,
+        ttfb=LatencyDistribution.parse(args.ttfb),
+        tokens_per_second=args.tokens_per_second,
+        error_rates=_parse_error_rates(args.error_rates),
+        corpus=load_corpus(args.corpus) if args.corpus else None,
+        seed=args.seed,
+    ).start()
+    print(f"ANTHROPIC_BASE_URL={server.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+        print(json.dumps(server.get_stats(), ensure_ascii=False, indent=2))
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+"""
+Локальная имитация Telegram Bot API для интеграционных тестов.
+
+Сервер принимает запросы telebot по адресам /bot<token>/<method>,
+записывает все исходящие вызовы бота и умеет доставлять обновления
+на зарегистрированный через setWebhook адрес или через очередь getUpdates
+(long polling). Файлы, добавленные через add_file, отдаются методом getFile
+и по адресу /file/bot<token>/<path>.
+
+Пример использования:
+```python
+from fake_telegram_server import FakeTelegramServer
+import telebot
+
+server = FakeTelegramServer().start()
+telebot.apihelper.API_URL = server.api_url
+...
+server.deliver_update(server.make_text_update(chat_id=1, text="/start"))
+server.stop()
+```
+"""
+
+import json
+import time
+import logging
+import threading
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def _parse_multipart(content_type, body):
+    """Разбирает multipart/form-data тело запроса в (поля, файлы)"""
+    fields, files = {}, {}
+    message = BytesParser(policy=default_policy).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+    )
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        filename = part.get_filename()
+        payload = part.get_payload(decode=True) or b""
+        if filename is not None:
+            files[name] = {"file_name": filename, "content": payload}
+        else:
+            fields[name] = payload.decode("utf-8")
+    return fields, files
+
+
+class _TelegramRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик HTTP-запросов к имитации Bot API"""
+
+    def _read_params(self):
+        parsed = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        files = {}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        content_type = self.headers.get("Content-Type", "")
+        if body and content_type.startswith("multipart/form-data"):
+            fields, files = _parse_multipart(content_type, body)
+            params.update(fields)
+        elif body and content_type.startswith("application/json"):
+            params.update(json.loads(body.decode("utf-8")))
+        elif body and content_type.startswith("application/x-www-form-urlencoded"):
+            params.update({key: values[-1] for key, values in parse_qs(body.decode("utf-8")).items()})
+        return parsed.path, params, files
+
+    def _send_file(self, path):
+        content = self.server.fake.get_file_content(path)
+        if content is None:
+            self._send_json(404, {"ok": False, "error_code": 404, "description": "Not Found: file not found"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_json(self, status_code, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        path, params, files = self._read_params()
+        parts = path.strip("/").split("/")
+        if len(parts) >= 3 and parts[0] == "file" and parts[1].startswith("bot"):
+            self._send_file("/".join(parts[2:]))
+            return
+        if len(parts) < 2 or not parts[0].startswith("bot"):
+            self._send_json(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+        method = parts[1]
+        status_code, payload = self.server.fake.handle_method(method, params, files)
+        self._send_json(status_code, payload)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTelegramServer:
+    """Имитация Telegram Bot API с записью всех вызовов"""
+
+    def __init__(self, host="127.0.0.1", port=0, bot_username="fake_optimizer_bot"):
+        """
+        Инициализация сервера
+
+        Args:
+            host (str): Адрес для прослушивания
+            port (int): Порт (0 - выбрать свободный)
+            bot_username (str): Имя бота, возвращаемое getMe
+        """
+        self.host = host
+        self.port = port
+        self.bot_username = bot_username
+
+        self.calls = []  # Список (метод, параметры, файлы, время)
+        self.webhook = {"url": "", "secret_token": None}
+        self.files = {}  # file_id -> (file_path, содержимое)
+        self.document_names = {}  # file_id загруженного документа -> имя файла
+        self._updates = []  # Очередь обновлений для getUpdates
+        self._lock = threading.Lock()
+        self._calls_changed = threading.Condition(self._lock)
+        self._updates_changed = threading.Condition(self._lock)
+        self._stopping = False
+        self._next_message_id = 1000
+        self._next_update_id = 1
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """Базовый URL сервера"""
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def api_url(self):
+        """Шаблон URL для telebot.apihelper.API_URL"""
+        return self.base_url + "/bot{0}/{1}"
+
+    @property
+    def file_url(self):
+        """Шаблон URL для telebot.apihelper.FILE_URL"""
+        return self.base_url + "/file/bot{0}/{1}"
+
+    def start(self):
+        """Запускает сервер в фоновом потоке"""
+        self._stopping = False
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _TelegramRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Имитация Telegram Bot API запущена на {self.base_url}")
+        return self
+
+    def stop(self):
+        """Останавливает сервер и завершает ожидающие getUpdates"""
+        with self._updates_changed:
+            self._stopping = True
+            self._updates_changed.notify_all()
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def _new_message(self, chat_id, **fields):
+        """Формирует объект Message для ответа"""
+        with self._lock:
+            self._next_message_id += 1
+            message_id = self._next_message_id
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "Fake", "username": self.bot_username},
+        }
+        message.update(fields)
+        return message
+
+    def handle_method(self, method, params, files):
+        """
+        Обрабатывает вызов метода Bot API
+
+        Returns:
+            tuple: (HTTP код, JSON-ответ)
+        """
+        with self._calls_changed:
+            self.calls.append((method, dict(params), dict(files), time.monotonic()))
+            self._calls_changed.notify_all()
+
+        handler = getattr(self, f"_method_{method}", None)
+        if handler is None:
+            return 200, {"ok": True, "result": True}
+        return handler(params, files)
+
+    def _method_getMe(self, params, files):
+        return 200, {"ok": True, "result": {
+            "id": 1, "is_bot": True, "first_name": "Fake", "username": self.bot_username,
+        }}
+
+    def _method_setWebhook(self, params, files):
+        self.webhook = {"url": params.get("url", ""), "secret_token": params.get("secret_token")}
+        return 200, {"ok": True, "result": True, "description": "Webhook was set"}
+
+    def _method_deleteWebhook(self, params, files):
+        self.webhook = {"url": "", "secret_token": None}
+        return 200, {"ok": True, "result": True, "description": "Webhook was deleted"}
+
+    def _method_getWebhookInfo(self, params, files):
+        return 200, {"ok": True, "result": {"url": self.webhook["url"], "pending_update_count": 0}}
+
+    def _method_sendMessage(self, params, files):
+        return 200, {"ok": True, "result": self._new_message(params["chat_id"], text=params.get("text", ""))}
+
+    def _method_editMessageText(self, params, files):
+        return 200, {"ok": True, "result": self._new_message(
+            params["chat_id"], text=params.get("text", ""), message_id=int(params["message_id"]))}
+
+    def _method_sendDocument(self, params, files):
+        upload = files.get("document")
+        if upload:
+            # Загруженный документ доступен для повторной отправки по file_id
+            file_id = self.add_file(upload["content"], upload["file_name"].rsplit(".", 1)[-1], "documents")
+            file_name = upload["file_name"]
+            self.document_names[file_id] = file_name
+        else:
+            file_id = params.get("document")
+            if file_id not in self.files:
+                return 400, {"ok": False, "error_code": 400,
+                             "description": "Bad Request: wrong file identifier/HTTP URL specified"}
+            file_name = self.document_names.get(file_id, "document")
+        document = {"file_id": file_id, "file_unique_id": file_id, "file_name": file_name,
+                    "file_size": len(self.files[file_id][1])}
+        return 200, {"ok": True, "result": self._new_message(
+            params["chat_id"], document=document, caption=params.get("caption", ""))}
+
+    def _method_getUpdates(self, params, files):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self._updates_changed:
+            # Обновления с update_id меньше offset подтверждены ботом
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            while not self._updates and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_changed.wait(remaining)
+            return 200, {"ok": True, "result": self._updates[:limit]}
+
+    def _method_getFile(self, params, files):
+        file_id = params.get("file_id")
+        if file_id not in self.files:
+            return 400, {"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}
+        file_path, content = self.files[file_id]
+        return 200, {"ok": True, "result": {
+            "file_id": file_id, "file_unique_id": file_id, "file_size": len(content), "file_path": file_path,
+        }}
+
+    def add_file(self, content, extension="jpg", folder="photos"):
+        """
+        Добавляет файл, доступный через getFile и скачивание
+
+        Returns:
+            str: file_id
+        """
+        with self._lock:
+            file_id = f"file_{len(self.files) + 1}_{int(time.time() * 1000)}"
+            self.files[file_id] = (f"{folder}/{file_id}.{extension}", content)
+        return file_id
+
+    def get_file_content(self, file_path):
+        """Содержимое файла по file_path (None, если файла нет)"""
+        with self._lock:
+            for path, content in self.files.values():
+                if path == file_path:
+                    return content
+        return None
+
+    def enqueue_update(self, update):
+        """
+        Ставит обновление в очередь getUpdates
+
+        update_id назначается заново при постановке в очередь: обновления,
+        созданные раньше, но поставленные позже уже подтвержденных, иначе
+        были бы отброшены по offset.
+        """
+        with self._updates_changed:
+            update["update_id"] = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append(update)
+            self._updates_changed.notify_all()
+
+    def _make_update(self, chat_id, first_name, **fields):
+        """Создает обновление с входящим сообщением"""
+        with self._lock:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": first_name},
+            "from": {"id": chat_id, "is_bot": False, "first_name": first_name},
+        }
+        message.update(fields)
+        return {"update_id": update_id, "message": message}
+
+    def make_text_update(self, chat_id, text, first_name="Tester"):
+        """Создает обновление с текстовым сообщением"""
+        fields = {"text": text}
+        if text.startswith("/"):
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._make_update(chat_id, first_name, **fields)
+
+    def make_photo_update(self, chat_id, file_id, width=1280, height=720, first_name="Tester"):
+        """Создает обновление с фотографией (файл добавляется через add_file)"""
+        file_size = len(self.files[file_id][1]) if file_id in self.files else 0
+        photo = [
+            {"file_id": file_id, "file_unique_id": file_id, "width": width, "height": height, "file_size": file_size},
+        ]
+        return self._make_update(chat_id, first_name, photo=photo)
+
+    def deliver_update(self, update, timeout=5):
+        """
+        Доставляет обновление на зарегистрированный webhook
+
+        Returns:
+            int: HTTP код ответа webhook
+        """
+        if not self.webhook["url"]:
+            raise RuntimeError("Webhook не установлен")
+        headers = {}
+        if self.webhook["secret_token"]:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self.webhook["secret_token"]
+        response = requests.post(self.webhook["url"], json=update, headers=headers, timeout=timeout)
+        return response.status_code
+
+    def _matching_calls(self, method, chat_id, predicate):
+        """Вызовы метода для чата, удовлетворяющие predicate(параметры) (под блокировкой)"""
+        return [
+            call for call in self.calls
+            if call[0] == method
+            and (chat_id is None or str(call[1].get("chat_id")) == str(chat_id))
+            and (predicate is None or predicate(call[1]))
+        ]
+
+    def calls_for(self, method, chat_id=None, predicate=None):
+        """Возвращает записанные вызовы метода (опционально для одного чата)"""
+        with self._lock:
+            return self._matching_calls(method, chat_id, predicate)
+
+    def wait_for_call(self, method, chat_id=None, count=1, timeout=5.0, predicate=None):
+        """
+        Ожидает, пока бот выполнит заданное количество вызовов метода
+
+        Args:
+            predicate (callable, optional): Учитывать только вызовы, для параметров
+                которых predicate(params) истинно
+
+        Returns:
+            list: Записанные вызовы
+
+        Raises:
+            TimeoutError: если вызовы не поступили за отведенное время
+        """
+        deadline = time.monotonic() + timeout
+        with self._calls_changed:
+            while True:
+                matched = self._matching_calls(method, chat_id, predicate)
+                if len(matched) >= count:
+                    return matched
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Не дождались {count} вызовов {method} (получено {len(matched)})")
+                self._calls_changed.wait(remaining)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Имитация Telegram Bot API")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(port=args.port).start()
+    print(f"API_URL для telebot: {server.api_url}")
+    print(f"FILE_URL для telebot: {server.file_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -19,9 +19,11 @@ print(response.content[0].text)
 
 import os
 import json
+import time
+import random
 import logging
 import requests
-import traceback
+from email.utils import parsedate_to_datetime
 from typing import List, Dict, Any, Optional
 
 # Настройка логирования
@@ -32,11 +34,50 @@ logger = logging.getLogger("fallback_anthropic")
 API_URL = "https://api.anthropic.com"
 API_VERSION = "2023-06-01"  # Последняя стабильная версия
 DEFAULT_MODELS = ["claude-3-opus-20240229", "claude-3-haiku-20240307", "claude-3-sonnet-20240229"]
+DEFAULT_TIMEOUT = 180  # Общий срок одного вызова с учетом повторов, секунды
+DEFAULT_MAX_RETRIES = 3
+CONNECT_TIMEOUT = 10
+
+class Usage(dict):
+    """Расход токенов запроса (поле usage ответа)
+    
+    Словарь с доступом к счетчикам как к атрибутам; отсутствующие счетчики равны 0.
+    """
+    FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+    
+    def __getattr__(self, name):
+        if name in self.FIELDS:
+            return self.get(name) or 0
+        raise AttributeError(name)
+    
+    @property
+    def total_input_tokens(self):
+        """Входные токены с учетом записи и чтения кеша промпта"""
+        return self.input_tokens + self.cache_creation_input_tokens + self.cache_read_input_tokens
+
+class Timing:
+    """Время выполнения запроса с учетом повторов
+    
+    ttfb_ms - до первого фрагмента текста (в потоковом режиме) или до
+    заголовков ответа, total_ms - до получения ответа целиком.
+    """
+    def __init__(self, ttfb_ms=None, total_ms=None, attempts=1):
+        self.ttfb_ms = ttfb_ms
+        self.total_ms = total_ms
+        self.attempts = attempts
+    
+    def to_dict(self):
+        return {"ttfb_ms": self.ttfb_ms, "total_ms": self.total_ms, "attempts": self.attempts}
+    
+    def __repr__(self):
+        return f"Timing(ttfb_ms={self.ttfb_ms}, total_ms={self.total_ms}, attempts={self.attempts})"
 
 class Response:
     """Простой класс для представления ответа от API"""
-    def __init__(self, content, **kwargs):
+    def __init__(self, content, usage=None, timing=None, **kwargs):
         self.content = content
+        self.usage = Usage(usage or {})
+        self.timing = timing or Timing()
         for key, value in kwargs.items():
             setattr(self, key, value)
     
@@ -55,103 +96,382 @@ class MessageContent:
         preview = self.text[:50] + "..." if len(self.text) > 50 else self.text
         return f"MessageContent(text='{preview}')"
 
+class APIError(Exception):
+    """Базовая ошибка обращения к API"""
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+class APIConnectionError(APIError):
+    """Не удалось связаться с API"""
+
+class APITimeoutError(APIConnectionError):
+    """Истек таймаут запроса"""
+
+class DeadlineExceededError(APITimeoutError):
+    """Истек общий срок выполнения вызова с учетом повторов"""
+
+class APIStatusError(APIError):
+    """API вернул код ошибки"""
+    def __init__(self, message, status_code, error_type=None, retry_after=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_type = error_type
+        self.retry_after = retry_after
+        self.body = body
+
+class BadRequestError(APIStatusError):
+    """400: некорректный запрос (в том числе недостаточный баланс)"""
+
+class AuthenticationError(APIStatusError):
+    """401: неверный API ключ"""
+
+class PermissionDeniedError(APIStatusError):
+    """403: нет доступа"""
+
+class NotFoundError(APIStatusError):
+    """404: модель или ресурс не найдены"""
+
+class RateLimitError(APIStatusError):
+    """429: превышен лимит запросов"""
+
+class InternalServerError(APIStatusError):
+    """5xx: временная ошибка на стороне API"""
+
+class OverloadedError(InternalServerError):
+    """529: API перегружен"""
+
+_STATUS_ERRORS = {
+    400: BadRequestError,
+    401: AuthenticationError,
+    403: PermissionDeniedError,
+    404: NotFoundError,
+    429: RateLimitError,
+    529: OverloadedError,
+}
+
+# Ошибки, после которых запрос имеет смысл повторить
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+def parse_retry_after(headers):
+    """Извлекает задержку из заголовков retry-after-ms / retry-after (секунды или HTTP-дата)
+    
+    Returns:
+        float: Задержка в секундах или None
+    """
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def make_status_error(response):
+    """Создает типизированное исключение по ответу с кодом ошибки"""
+    error_type, message, body = None, response.reason or "", None
+    try:
+        body = response.json()
+        error = body.get("error", {}) if isinstance(body, dict) else {}
+        error_type = error.get("type")
+        message = error.get("message", message)
+    except ValueError:
+        message = (response.text or message)[:500]
+    status_code = response.status_code
+    error_class = _STATUS_ERRORS.get(status_code)
+    if error_class is None:
+        error_class = InternalServerError if status_code >= 500 else APIStatusError
+    return error_class(
+        f"Ошибка API {status_code} ({error_type or 'unknown'}): {message}",
+        status_code, error_type=error_type, retry_after=parse_retry_after(response.headers), body=body
+    )
+
+def is_retryable(error):
+    """Можно ли повторить запрос после этой ошибки"""
+    if isinstance(error, DeadlineExceededError):
+        return False
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+class RetryPolicy:
+    """Экспоненциальная задержка с полным джиттером и учетом retry-after"""
+    def __init__(self, max_retries=2, base_delay=0.5, max_delay=20.0, max_retry_after=60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+    
+    def compute_delay(self, attempt, retry_after=None):
+        """Задержка перед повтором номер attempt (с нуля)"""
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+def iter_sse_events(lines):
+    """
+    Разбирает поток Server-Sent Events
+    
+    Args:
+        lines: Итератор строк ответа (str или bytes)
+        
+    Yields:
+        tuple: (тип события, данные события в виде dict)
+    """
+    event_type, data_lines = None, []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.rstrip("\r")
+        if not line:
+            if data_lines:
+                data = json.loads("\n".join(data_lines))
+                yield event_type or data.get("type"), data
+            event_type, data_lines = None, []
+        elif line.startswith(":"):
+            continue
+        elif line.startswith("event:"):
+            event_type = line[6:].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[5:].lstrip())
+    if data_lines:
+        data = json.loads("\n".join(data_lines))
+        yield event_type or data.get("type"), data
+
+class MessageStream:
+    """Потоковый ответ API (stream=True)
+    
+    Итерация по объекту возвращает события (тип, данные), text_stream - только
+    фрагменты текста. После чтения потока get_final_message() возвращает
+    собранный Response, как при обычном запросе.
+    """
+    def __init__(self, http_response, started=None, attempts=1):
+        self.http_response = http_response
+        self.text = ""
+        self.message = {}
+        self.usage = Usage()
+        self.stop_reason = None
+        self._consumed = False
+        self._started = started if started is not None else time.monotonic()
+        self.timing = Timing(attempts=attempts)
+    
+    def __iter__(self):
+        if self._consumed:
+            return
+        self._consumed = True
+        try:
+            for event_type, data in iter_sse_events(self.http_response.iter_lines(decode_unicode=False)):
+                if event_type == "message_start":
+                    self.message = data.get("message", {})
+                    self.usage.update(self.message.get("usage") or {})
+                elif event_type == "content_block_delta":
+                    delta = data.get("delta", {})
+                    if delta.get("type") == "text_delta":
+                        if self.timing.ttfb_ms is None:
+                            self.timing.ttfb_ms = self._elapsed_ms()
+                        self.text += delta.get("text", "")
+                elif event_type == "message_delta":
+                    self.stop_reason = data.get("delta", {}).get("stop_reason", self.stop_reason)
+                    self.usage.update(data.get("usage") or {})
+                elif event_type == "error":
+                    error = data.get("error", {})
+                    error_class = OverloadedError if error.get("type") == "overloaded_error" else InternalServerError
+                    raise error_class(
+                        f"Ошибка потока API ({error.get('type')}): {error.get('message')}",
+                        529 if error_class is OverloadedError else 500, error_type=error.get("type"), body=data
+                    )
+                yield event_type, data
+        except requests.exceptions.Timeout as e:
+            raise APITimeoutError(f"Таймаут при чтении потока: {e}") from e
+        except requests.exceptions.RequestException as e:
+            raise APIConnectionError(f"Обрыв потока: {e}") from e
+        finally:
+            self.timing.total_ms = self._elapsed_ms()
+            self.close()
+    
+    def _elapsed_ms(self):
+        return round((time.monotonic() - self._started) * 1000)
+    
+    @property
+    def text_stream(self):
+        """Генератор фрагментов текста ответа"""
+        for event_type, data in self:
+            if event_type == "content_block_delta" and data.get("delta", {}).get("type") == "text_delta":
+                yield data["delta"].get("text", "")
+    
+    def get_final_message(self):
+        """Дочитывает поток и возвращает итоговый Response"""
+        for _ in self:
+            pass
+        fields = {k: v for k, v in self.message.items() if k not in ("content", "usage", "stop_reason")}
+        return Response([MessageContent(self.text)], usage=self.usage, timing=self.timing,
+                        stop_reason=self.stop_reason, **fields)
+    
+    def close(self):
+        """Закрывает HTTP-соединение"""
+        if self.http_response is not None:
+            self.http_response.close()
+
+def cached_system_prompt(text):
+    """
+    Системный промпт с точкой кеширования (prompt caching)
+    
+    Args:
+        text (str): Статичные инструкции
+        
+    Returns:
+        list: Блоки для параметра system
+    """
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
 class Messages:
     """Класс для работы с сообщениями"""
     def __init__(self, client):
         self.client = client
     
-    def create(self, model: str, messages: List[Dict[str, Any]], max_tokens: int = 1000, **kwargs):
-        """Создает новый запрос к модели Claude"""
-        try:
-            logger.info(f"Создаем сообщение с моделью {model}, max_tokens={max_tokens}")
-            
-            # Проверка модели
-            if not model or not isinstance(model, str):
-                logger.warning(f"Некорректная модель: {model}, используем claude-3-haiku-20240307")
-                model = "claude-3-haiku-20240307"
-            
-            # Подготовка запроса
-            headers = {
-                "Content-Type": "application/json",
-                "x-api-key": self.client.api_key,
-                "anthropic-version": API_VERSION
-            }
-            
-            # Формирование данных запроса
-            data = {
-                "model": model,
-                "max_tokens": max_tokens,
-                "messages": messages
-            }
-            
-            # Добавляем дополнительные параметры
-            for key, value in kwargs.items():
-                if key != 'proxies':  # Игнорируем proxies
-                    data[key] = value
-            
-            # Логируем параметры запроса (без API ключа)
-            safe_headers = {k: v for k, v in headers.items() if k != 'x-api-key'}
-            logger.info(f"Заголовки запроса: {safe_headers}")
-            logger.info(f"Параметры запроса: model={model}, max_tokens={max_tokens}, messages_count={len(messages)}")
-            
-            # Очищаем переменные окружения прокси перед запросом
-            saved_proxies = {}
-            for env_var in ['HTTP_PROXY', 'HTTPS_PROXY', 'http_proxy', 'https_proxy']:
-                if env_var in os.environ:
-                    saved_proxies[env_var] = os.environ[env_var]
-                    del os.environ[env_var]
+    def create(self, model: str, messages: List[Dict[str, Any]], max_tokens: int = 1000, stream: bool = False,
+               timeout: Optional[float] = None, system=None, **kwargs):
+        """Создает новый запрос к модели Claude
+        
+        system - строка или список текстовых блоков; блоки с cache_control
+        (см. cached_system_prompt) кешируются на стороне API, а в usage ответа
+        приходят cache_creation_input_tokens и cache_read_input_tokens.
+        
+        Временные ошибки (сеть, 429, 5xx, 529) повторяются с экспоненциальной
+        задержкой и полным джиттером, а при наличии заголовка retry-after - через
+        указанное время. Все попытки укладываются в общий срок timeout.
+        При stream=True возвращает MessageStream, который читает ответ по мере генерации.
+        
+        Raises:
+            APIStatusError: API вернул неповторяемую ошибку или повторы исчерпаны
+            APIConnectionError: не удалось связаться с API
+            DeadlineExceededError: истек общий срок выполнения вызова
+        """
+        logger.info(f"Создаем сообщение с моделью {model}, max_tokens={max_tokens}")
+        
+        # Проверка модели
+        if not model or not isinstance(model, str):
+            logger.warning(f"Некорректная модель: {model}, используем claude-3-haiku-20240307")
+            model = "claude-3-haiku-20240307"
+        
+        # Подготовка запроса
+        headers = {
+            "Content-Type": "application/json",
+            "x-api-key": self.client.api_key,
+            "anthropic-version": API_VERSION
+        }
+        
+        # Формирование данных запроса
+        data = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "messages": messages
+        }
+        
+        if system:
+            data["system"] = system
+        
+        if stream:
+            data["stream"] = True
+        
+        # Добавляем дополнительные параметры
+        for key, value in kwargs.items():
+            if key != 'proxies':  # Игнорируем proxies
+                data[key] = value
+        
+        # Логируем параметры запроса (без API ключа)
+        safe_headers = {k: v for k, v in headers.items() if k != 'x-api-key'}
+        logger.info(f"Заголовки запроса: {safe_headers}")
+        logger.info(f"Параметры запроса: model={model}, max_tokens={max_tokens}, messages_count={len(messages)}")
+        
+        url = f"{self.client.base_url or API_URL}/v1/messages"
+        policy = self.client.retry_policy
+        started = time.monotonic()
+        deadline = started + (timeout if timeout is not None else self.client.timeout)
+        attempt = 0
+        
+        while True:
+            attempt_started = time.monotonic()
+            remaining = deadline - attempt_started
+            if remaining <= 0:
+                raise DeadlineExceededError(f"Истек срок выполнения запроса к модели {model}")
             
+            self.client.stats["requests"] += 1
             try:
-                # Выполнение запроса без использования прокси
-                logger.info("Отправляем запрос напрямую в Anthropic API...")
-                response = requests.post(
-                    f"{API_URL}/v1/messages",
+                error = None
+                # Сессия игнорирует переменные окружения прокси (trust_env=False)
+                response = self.client.session.post(
+                    url,
                     headers=headers,
                     json=data,
-                    timeout=120  # Увеличиваем таймаут до 2 минут
+                    timeout=(min(CONNECT_TIMEOUT, remaining), remaining),
+                    stream=stream
                 )
-                
-                # Проверка ответа
-                response.raise_for_status()
-                result = response.json()
-                
-                # Преобразование результата в объект
-                content = [MessageContent(c["text"]) for c in result.get("content", [])]
-                resp_obj = Response(content, **{k: v for k, v in result.items() if k != "content"})
-                
-                # Логируем успешный результат
-                logger.info(f"Успешно получен ответ от API: {str(resp_obj)}")
-                return resp_obj
+                if response.status_code >= 400:
+                    error = make_status_error(response)
+                    response.close()
+                elif stream:
+                    logger.info("Получаем ответ API в потоковом режиме")
+                    return MessageStream(response, started=started, attempts=attempt + 1)
+                else:
+                    result = response.json()
+                    timing = Timing(
+                        ttfb_ms=round((attempt_started - started + response.elapsed.total_seconds()) * 1000),
+                        total_ms=round((time.monotonic() - started) * 1000),
+                        attempts=attempt + 1
+                    )
+                    
+                    # Преобразование результата в объект
+                    content = [MessageContent(c["text"]) for c in result.get("content", []) if "text" in c]
+                    resp_obj = Response(content, timing=timing, **{k: v for k, v in result.items() if k != "content"})
+                    
+                    # Логируем успешный результат
+                    logger.info(f"Успешно получен ответ от API: {str(resp_obj)}")
+                    return resp_obj
+            except requests.exceptions.Timeout as e:
+                error = APITimeoutError(f"Таймаут запроса к API: {e}")
+            except requests.exceptions.RequestException as e:
+                error = APIConnectionError(f"Ошибка сетевого запроса: {e}")
             
-            finally:
-                # Восстанавливаем переменные окружения
-                for env_var, value in saved_proxies.items():
-                    os.environ[env_var] = value
-        
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка сетевого запроса: {e}")
-            if hasattr(e, 'response') and e.response:
-                try:
-                    error_details = e.response.json()
-                    logger.error(f"Детали ошибки API: {error_details}")
-                except:
-                    logger.error(f"Текст ответа API: {e.response.text}")
+            # Число выполненных попыток: вызывающий код не повторяет запрос, который уже повторяла политика
+            error.attempts = attempt + 1
+            if not is_retryable(error) or attempt >= policy.max_retries:
+                self.client.stats["failures"] += 1
+                logger.error(f"Запрос к API не выполнен: {error.message}")
+                raise error
             
-            # Возвращаем объект Response с сообщением об ошибке
-            error_content = MessageContent(f"Ошибка API: {str(e)}")
-            return Response([error_content], error=str(e), status_code=getattr(e.response, 'status_code', 500) if hasattr(e, 'response') else 500)
+            delay = policy.compute_delay(attempt, getattr(error, "retry_after", None))
+            if time.monotonic() + delay >= deadline:
+                self.client.stats["failures"] += 1
+                logger.error(f"Нет времени на повтор запроса ({error.message})")
+                raise error
             
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка в messages.create: {e}")
-            logger.error(traceback.format_exc())
-            
-            # Возвращаем объект Response с сообщением об ошибке
-            error_content = MessageContent(f"Внутренняя ошибка: {str(e)}")
-            return Response([error_content], error=str(e), status_code=500)
+            attempt += 1
+            self.client.stats["retries"] += 1
+            logger.warning(f"{error.message}. Повтор {attempt}/{policy.max_retries} через {delay:.2f} с")
+            time.sleep(delay)
 
 class Anthropic:
     """Минимальная реализация клиента Anthropic для Railway"""
-    def __init__(self, api_key=None, **kwargs):
+    def __init__(self, api_key=None, base_url=None, max_retries=None, timeout=None, **kwargs):
+        """
+        Args:
+            api_key (str): API ключ (по умолчанию ANTHROPIC_API_KEY)
+            base_url (str): Адрес API (по умолчанию ANTHROPIC_BASE_URL или API_URL)
+            max_retries (int): Количество повторов временных ошибок
+            timeout (float): Общий срок одного вызова с учетом повторов, секунды
+        """
         logger.info(f"Инициализация Fallback Anthropic клиента с {len(kwargs)} kwargs")
         
         # Игнорируем параметр proxies и все остальные
@@ -169,6 +489,17 @@ class Anthropic:
         masked_key = self.api_key[:4] + "*" * (len(self.api_key) - 8) + self.api_key[-4:] if len(self.api_key) > 8 else "****"
         logger.info(f"API ключ получен (маскирован): {masked_key}")
         
+        # Параметры подключения и повторов
+        base_url = base_url or os.environ.get("ANTHROPIC_BASE_URL")
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.timeout = float(timeout if timeout is not None else os.environ.get("ANTHROPIC_TIMEOUT", DEFAULT_TIMEOUT))
+        self.retry_policy = RetryPolicy(
+            max_retries=int(max_retries if max_retries is not None else os.environ.get("ANTHROPIC_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+        )
+        self.session = requests.Session()
+        self.session.trust_env = False  # Прокси из окружения не используются
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+        
         # Инициализируем компоненты
         self.messages = Messages(self)
         logger.info("Fallback Anthropic клиент успешно инициализирован")
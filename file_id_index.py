@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Индекс ранее загруженных в Telegram документов.
+
+Telegram позволяет отправить уже загруженный документ повторно по file_id,
+не передавая содержимое. Индекс связывает хеш содержимого архива (вместе с
+именем файла) с file_id, полученным при первой загрузке, и сохраняется на
+диск, поэтому одинаковые архивы (шаблоны, результаты из кеша, повторные
+отправки) загружаются один раз и после перезапуска бота.
+
+file_id действителен только для бота, который его получил, поэтому индекс
+хранит идентификатор бота и сбрасывается при его смене.
+
+Изменения записываются на диск пакетно (не чаще save_interval) атомарной
+заменой файла; перед завершением процесса нужно вызвать flush().
+
+Пример использования:
+```python
+index = FileIdIndex("/tmp/optimizer_file_ids.json", bot_id="123456")
+key = document_key(archive_bytes, "WindowsOptimizer.zip")
+file_id = index.get(key)
+if file_id is None:
+    message = bot.send_document(chat_id, BytesIO(archive_bytes), visible_file_name="WindowsOptimizer.zip")
+    index.put(key, message.document.file_id, len(archive_bytes))
+index.flush()
+```
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def document_key(content, file_name):
+    """
+    Ключ документа: хеш имени файла и содержимого
+
+    Args:
+        content (bytes): Содержимое документа
+        file_name (str): Имя файла, видимое пользователю
+
+    Returns:
+        str: Шестнадцатеричный SHA-256
+    """
+    digest = hashlib.sha256(file_name.encode("utf-8") + b"\0")
+    digest.update(content)
+    return digest.hexdigest()
+
+
+class FileIdIndex:
+    """Хеш содержимого документа -> file_id Telegram, с сохранением на диск"""
+
+    def __init__(self, path, bot_id=None, max_entries=10000, save_interval=30.0):
+        """
+        Инициализация индекса
+
+        Args:
+            path (str): Путь к JSON-файлу индекса (None - только в памяти)
+            bot_id (str, optional): Идентификатор бота, для которого действительны file_id
+            max_entries (int): Максимальное количество записей
+            save_interval (float): Минимальный интервал между записями файла в секундах
+        """
+        self.path = path
+        self.bot_id = str(bot_id) if bot_id is not None else None
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # Порядок записей файла
+        self._entries = {}
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+        # Счетчики для метрик
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+        self.saved_bytes = 0
+
+        self._load()
+
+    def _load(self):
+        """Загружает индекс с диска"""
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if self.bot_id is not None and data.get("bot_id") != self.bot_id:
+                logger.info("Индекс file_id создан для другого бота, начинаю заново")
+                return
+            self._entries = data.get("entries", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить индекс file_id: {e}")
+
+    def _changed(self):
+        """Отмечает изменения (вызывается под блокировкой)
+
+        Returns:
+            bool: Пора ли записать индекс на диск
+        """
+        self._dirty = True
+        return bool(self.path) and time.monotonic() - self._last_save >= self.save_interval
+
+    def flush(self):
+        """Атомарно сохраняет накопленные изменения
+
+        Снимок записей делается под блокировкой, сериализация и запись
+        файла - вне ее, чтобы не задерживать get и put.
+        """
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = {key: dict(entry) for key, entry in self._entries.items()}
+                self._dirty = False
+                self._last_save = time.monotonic()
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"bot_id": self.bot_id, "entries": snapshot}, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить индекс file_id: {e}")
+                with self._lock:
+                    self._dirty = True
+
+    def get(self, key):
+        """
+        file_id ранее загруженного документа
+
+        Returns:
+            str или None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_bytes += entry.get("size", 0)
+            entry["last_used"] = time.time()
+            return entry["file_id"]
+
+    def put(self, key, file_id, size=0):
+        """Запоминает file_id загруженного документа"""
+        if not file_id:
+            return
+        with self._lock:
+            now = time.time()
+            self._entries[key] = {"file_id": file_id, "size": size, "created": now, "last_used": now}
+            self.stores += 1
+            if len(self._entries) > self.max_entries:
+                # Вытесняем давно не использованные записи
+                by_age = sorted(self._entries, key=lambda item: self._entries[item]["last_used"])
+                for old_key in by_age[:len(self._entries) - self.max_entries]:
+                    del self._entries[old_key]
+            save = self._changed()
+        if save:
+            self.flush()
+
+    def invalidate(self, key):
+        """Удаляет запись, file_id которой Telegram больше не принимает"""
+        save = False
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+                save = self._changed()
+        if save:
+            self.flush()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self):
+        """Статистика для метрик"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "invalidations": self.invalidations,
+                "saved_bytes": self.saved_bytes,
+            }
@@ -4,6 +4,7 @@
 """
 
 import os
+import hmac
 import logging
 import threading
 import time
@@ -50,9 +51,12 @@ def home():
 def health():
     """Полная информация о состоянии бота"""
     is_healthy = bot_status["status"] == "running" and not bot_status["errors"]
+    # Разомкнутая цепь Claude API: бот работает, но отдает шаблонные скрипты
+    llm_circuit = bot_status.get("llm_circuit") or {}
+    is_degraded = llm_circuit.get("state", "closed") != "closed"
     
     return jsonify({
-        "status": "healthy" if is_healthy else "unhealthy",
+        "status": "unhealthy" if not is_healthy else ("degraded" if is_degraded else "healthy"),
         "details": bot_status,
         "environment": {
             "railway": bool(os.getenv("RAILWAY_ENVIRONMENT")),
@@ -62,6 +66,39 @@ def health():
         }
     }), 200 if is_healthy else 503
 
+# Источники статистики для /stats: имя -> функция(include_private) -> dict
+stats_providers = {}
+
+def register_stats_provider(name, provider):
+    """Регистрирует источник статистики для /stats
+    
+    Args:
+        name (str): Раздел ответа
+        provider (callable): Функция (include_private) -> dict; include_private
+            разрешает данные по отдельным пользователям
+    """
+    stats_providers[name] = provider
+
+@app.route('/stats')
+def stats():
+    """Статистика бота: расход токенов, задержки, кеши
+    
+    Данные по пользователям отдаются только при заданной переменной STATS_TOKEN
+    и переданном токене (заголовок X-Stats-Token или параметр token).
+    """
+    expected_token = os.getenv("STATS_TOKEN", "")
+    supplied_token = request.headers.get("X-Stats-Token") or request.args.get("token", "")
+    include_private = bool(expected_token) and hmac.compare_digest(supplied_token, expected_token)
+    
+    result = {}
+    for name, provider in stats_providers.items():
+        try:
+            result[name] = provider(include_private)
+        except Exception as e:
+            logger.error(f"Ошибка при получении статистики {name}: {e}")
+            result[name] = {"error": str(e)}
+    return jsonify(result)
+
 @app.route('/add_subscription', methods=['POST'])
 def add_subscription():
     """API-эндпоинт для активации подписки после оплаты"""
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+Хеджирование запросов к модели для сокращения "хвоста" задержек.
+
+Если основной запрос выполняется дольше наблюдаемого перцентиля задержки
+(по умолчанию p90), отправляется второй такой же запрос (при необходимости
+к более быстрой модели). Используется ответ, полученный первым, второй
+запрос отменяется. Доля хеджированных запросов ограничена max_fraction.
+
+Пример использования:
+```python
+hedger = RequestHedger(percentile=0.9, max_fraction=0.1)
+text = hedger.run("claude-3-opus-20240229", attempt, hedge_model="claude-3-haiku-20240307")
+# attempt(model, cancel_token, is_hedge) выполняет запрос и вызывает
+# cancel_token.on_cancel(stream.close), чтобы проигравший запрос можно было прервать
+```
+"""
+
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, q):
+    """Перцентиль q (0..1) по списку значений методом ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+    return ordered[index]
+
+
+class CancelToken:
+    """Признак отмены запроса с обработчиками (например, закрытие соединения)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def on_cancel(self, callback):
+        """Регистрирует обработчик; если запрос уже отменен, вызывает его сразу"""
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        self._run(callback)
+
+    def cancel(self):
+        """Отменяет запрос"""
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run(callback)
+
+    @staticmethod
+    def _run(callback):
+        try:
+            callback()
+        except Exception as e:
+            logger.debug(f"Ошибка в обработчике отмены запроса: {e}")
+
+
+class RequestHedger:
+    """Хеджирование запросов по наблюдаемому перцентилю задержки"""
+
+    def __init__(self, percentile=0.9, max_fraction=0.1, min_samples=20, min_delay=5.0,
+                 window=200, enabled=True):
+        """
+        Инициализация
+
+        Args:
+            percentile (float): Перцентиль задержки основного запроса, после которого отправляется второй
+            max_fraction (float): Максимальная доля хеджированных запросов
+            min_samples (int): Минимум наблюдений задержки модели до включения хеджирования
+            min_delay (float): Минимальная задержка перед вторым запросом, секунды
+            window (int): Сколько последних задержек хранить
+            enabled (bool): Включено ли хеджирование
+        """
+        self.percentile = percentile
+        self.max_fraction = max_fraction
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        # Задержки основных запросов по моделям: (секунды, завершен ли запрос).
+        # Для отмененных запросов известно только время до отмены (нижняя оценка)
+        self._primary_latencies = defaultdict(lambda: deque(maxlen=window))
+        # Задержки, которые увидел пользователь
+        self._observed_latencies = deque(maxlen=window)
+
+        # Счетчики для метрик
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.cancelled = 0
+        self.estimated_saved = 0.0
+
+    def hedge_delay(self, model):
+        """
+        Время ожидания основного запроса перед отправкой второго
+
+        Returns:
+            float: Задержка в секундах или None, если данных пока недостаточно
+        """
+        with self._lock:
+            latencies = [latency for latency, _ in self._primary_latencies[model]]
+        if len(latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, percentile(latencies, self.percentile))
+
+    def _budget_allows(self):
+        """Не превышена ли доля хеджированных запросов (вызывается под блокировкой)"""
+        return self.hedged + 1 <= self.max_fraction * self.requests
+
+    def run(self, model, attempt, hedge_model=None, metrics=None):
+        """
+        Выполняет запрос с хеджированием
+
+        Args:
+            model (str): Модель основного запроса
+            attempt (callable): attempt(model, cancel_token, is_hedge) -> результат
+            hedge_model (str, optional): Модель второго запроса (по умолчанию та же)
+            metrics (ScriptMetrics, optional): Метрики для записи результата
+
+        Returns:
+            Результат запроса, завершившегося первым
+
+        Raises:
+            Exception: ошибка основного запроса, если оба запроса завершились ошибкой
+        """
+        hedge_model = hedge_model or model
+        started = time.monotonic()
+        with self._lock:
+            self.requests += 1
+        delay = self.hedge_delay(model) if self.enabled else None
+
+        primary_token = CancelToken()
+        primary = self._start(attempt, model, primary_token, False)
+        attempts = {primary: ("primary", model, primary_token)}
+
+        if delay is not None:
+            done, _ = wait([primary], timeout=delay)
+            if not done:
+                with self._lock:
+                    start_hedge = self._budget_allows()
+                    if start_hedge:
+                        self.hedged += 1
+                if start_hedge:
+                    logger.info(f"Запрос к {model} дольше {delay:.1f} с, отправляем второй запрос к {hedge_model}")
+                    hedge_token = CancelToken()
+                    attempts[self._start(attempt, hedge_model, hedge_token, True)] = ("hedge", hedge_model, hedge_token)
+
+        winner, first_error = None, None
+        pending = set(attempts)
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    winner = winner or future
+                elif attempts[future][0] == "primary" or first_error is None:
+                    first_error = future.exception()
+
+        elapsed = time.monotonic() - started
+        # Отменяются только незавершенные запросы; завершившиеся ошибкой уже учтены
+        losers = [future for future in attempts if future is not winner and not future.done()]
+        for future in losers:
+            attempts[future][2].cancel()
+        with self._lock:
+            self.cancelled += len(losers)
+
+        hedged = len(attempts) > 1
+        hedge_won = winner is not None and attempts[winner][0] == "hedge"
+        if winner is not None:
+            saved = self._record(model, elapsed, hedge_won)
+            if hedge_won:
+                logger.info(f"Второй запрос к {attempts[winner][1]} завершился первым за {elapsed:.1f} с "
+                            f"(ожидаемый выигрыш {saved:.1f} с)")
+            if metrics is not None:
+                try:
+                    metrics.record_hedged_request(model, hedged, hedge_won, elapsed * 1000, saved * 1000,
+                                                  cancelled=len(losers))
+                except Exception as e:
+                    logger.warning(f"Не удалось записать метрики хеджирования: {e}")
+            return winner.result()
+        raise first_error
+
+    def _start(self, attempt, model, token, is_hedge):
+        future = Future()
+
+        def target():
+            try:
+                future.set_result(attempt(model, token, is_hedge))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=target, daemon=True).start()
+        return future
+
+    def _record(self, model, elapsed, hedge_won):
+        """
+        Записывает задержку запроса
+
+        Returns:
+            float: Оценка выигрыша в секундах - медиана завершенных основных
+                запросов, которые шли дольше elapsed, минус elapsed
+        """
+        with self._lock:
+            window = self._primary_latencies[model]
+            saved = 0.0
+            if hedge_won:
+                self.hedge_wins += 1
+                slower = [latency for latency, finished in window if finished and latency > elapsed]
+                if slower:
+                    saved = percentile(slower, 0.5) - elapsed
+                self.estimated_saved += saved
+            # Для отмененного основного запроса elapsed - нижняя оценка его задержки
+            window.append((elapsed, not hedge_won))
+            self._observed_latencies.append(elapsed)
+            return saved
+
+    def get_stats(self):
+        """
+        Статистика хеджирования
+
+        Выигрыш оценивается по завершенным основным запросам, которые шли
+        дольше победившего второго запроса.
+
+        Returns:
+            dict: Счетчики и перцентили задержек в миллисекундах
+        """
+        with self._lock:
+            observed = list(self._observed_latencies)
+            stats = {
+                "enabled": self.enabled,
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "cancelled": self.cancelled,
+                "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+                "estimated_saved_ms": round(self.estimated_saved * 1000),
+            }
+        for q in (0.5, 0.9, 0.99):
+            value = percentile(observed, q)
+            stats[f"p{int(q * 100)}_ms"] = round(value * 1000) if value is not None else None
+        return stats
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+Предобработка скриншотов перед отправкой в Claude Vision.
+
+Скриншот системной информации или ошибки не нуждается в полном разрешении
+и цвете: текст хорошо читается в оттенках серого при длинной стороне
+1280 пикселей, а все, что больше 1568 пикселей или ~1.15 Мп, Claude
+все равно уменьшит сам, оплачивая при этом загрузку. Конвейер:
+1. переводит в оттенки серого;
+2. обрезает однотонные поля по краям;
+3. уменьшает изображение до заданной длинной стороны и предела пикселей API;
+4. кодирует в PNG-8 и JPEG с подобранным качеством и выбирает меньший вариант.
+
+Пример использования:
+```python
+from image_preprocessor import preprocess_screenshot, to_content_block
+image = preprocess_screenshot(raw_bytes)
+content = [to_content_block(image), {"type": "text", "text": prompt}]
+```
+"""
+
+import os
+import time
+import base64
+import logging
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageOps
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Длинная сторона, до которой Claude сам уменьшает изображения
+API_MAX_LONG_EDGE = 1568
+# Предел пикселей, после которого Claude уменьшает изображение
+API_MAX_PIXELS = 1_150_000
+# Целевая длинная сторона скриншота
+MAX_LONG_EDGE = int(os.getenv("SCREENSHOT_MAX_EDGE", "1280"))
+# Переводить ли скриншоты в оттенки серого
+GRAYSCALE = os.getenv("SCREENSHOT_GRAYSCALE", "true").lower() == "true"
+# Качество JPEG-варианта
+JPEG_QUALITY = int(os.getenv("SCREENSHOT_JPEG_QUALITY", "80"))
+# Допуск при определении однотонных полей (0-255)
+BORDER_TOLERANCE = 12
+
+
+class PreprocessedImage:
+    """Результат предобработки скриншота"""
+
+    def __init__(self, data, media_type, width, height, original_size, original_width, original_height,
+                 elapsed_ms=0.0):
+        self.data = data
+        self.media_type = media_type
+        self.width = width
+        self.height = height
+        self.original_size = original_size
+        self.original_width = original_width
+        self.original_height = original_height
+        self.elapsed_ms = elapsed_ms
+
+    @property
+    def size(self):
+        """Размер закодированного изображения в байтах"""
+        return len(self.data)
+
+    @property
+    def estimated_tokens(self):
+        """Оценка стоимости изображения в токенах"""
+        return estimate_image_tokens(self.width, self.height)
+
+    @property
+    def original_tokens(self):
+        """Оценка стоимости исходного изображения в токенах"""
+        return estimate_image_tokens(self.original_width, self.original_height)
+
+    def to_base64(self):
+        """Изображение в base64 для API"""
+        return base64.b64encode(self.data).decode("utf-8")
+
+    def summary(self):
+        """Краткое описание для логов"""
+        return (f"{self.original_width}x{self.original_height} {self.original_size} Б "
+                f"(~{self.original_tokens} ток.) -> {self.width}x{self.height} {self.media_type} "
+                f"{self.size} Б (~{self.estimated_tokens} ток.) за {self.elapsed_ms:.0f} мс")
+
+
+def estimate_image_tokens(width, height):
+    """
+    Оценивает стоимость изображения в токенах (width * height / 750)
+    с учетом автоматического уменьшения на стороне API
+
+    Returns:
+        int: Примерное количество токенов
+    """
+    scale = min(1.0, API_MAX_LONG_EDGE / max(width, height, 1), (API_MAX_PIXELS / max(width * height, 1)) ** 0.5)
+    return int(round(width * scale) * round(height * scale) / 750)
+
+
+def _sniff_media_type(data):
+    """Определяет MIME-тип по сигнатуре файла"""
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"GIF8"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def crop_borders(image, tolerance=BORDER_TOLERANCE):
+    """
+    Обрезает однотонные поля по краям изображения
+
+    Цвет фона берется из левого верхнего пикселя.
+    """
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    diff = ImageChops.difference(image, background)
+    if diff.mode != "L":
+        diff = diff.convert("L")
+    bbox = diff.point(lambda value: 255 if value > tolerance else 0).getbbox()
+    if not bbox:
+        return image
+    return image.crop(bbox)
+
+
+def _encode_png8(image):
+    """PNG с палитрой (8 бит на пиксель)"""
+    if image.mode not in ("L", "P"):
+        image = image.quantize(colors=256)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def _encode_jpeg(image, quality):
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def preprocess_screenshot(data, max_long_edge=MAX_LONG_EDGE, grayscale=GRAYSCALE, jpeg_quality=JPEG_QUALITY,
+                          crop=True):
+    """
+    Уменьшает и перекодирует скриншот для отправки в API
+
+    Args:
+        data (bytes): Исходное изображение
+        max_long_edge (int): Максимальная длинная сторона
+        grayscale (bool): Переводить в оттенки серого
+        jpeg_quality (int): Качество JPEG-варианта
+        crop (bool): Обрезать однотонные поля
+
+    Returns:
+        PreprocessedImage: Результат; при ошибке декодирования - исходные данные
+    """
+    started = time.perf_counter()
+    try:
+        image = Image.open(BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+        original_width, original_height = image.size
+
+        image = image.convert("L" if grayscale else "RGB")
+        if crop:
+            image = crop_borders(image)
+
+        scale = min(max_long_edge / max(image.size), (API_MAX_PIXELS / (image.width * image.height)) ** 0.5)
+        if scale < 1:
+            image = image.resize(
+                (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                Image.LANCZOS
+            )
+
+        candidates = [
+            (_encode_png8(image), "image/png"),
+            (_encode_jpeg(image, jpeg_quality), "image/jpeg"),
+        ]
+        encoded, media_type = min(candidates, key=lambda candidate: len(candidate[0]))
+
+        if len(encoded) >= len(data) and (original_width, original_height) == image.size:
+            # Перекодирование ничего не дало - отправляем оригинал
+            encoded, media_type = data, _sniff_media_type(data)
+
+        return PreprocessedImage(
+            encoded, media_type, image.width, image.height, len(data), original_width, original_height,
+            elapsed_ms=(time.perf_counter() - started) * 1000
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось обработать скриншот, отправляем оригинал: {e}")
+        try:
+            with Image.open(BytesIO(data)) as original:
+                width, height = original.size
+        except Exception:
+            width, height = 0, 0
+        return PreprocessedImage(
+            data, _sniff_media_type(data), width, height, len(data), width, height,
+            elapsed_ms=(time.perf_counter() - started) * 1000
+        )
+
+
+def to_content_block(image):
+    """
+    Формирует блок изображения для Messages API
+
+    Args:
+        image (PreprocessedImage): Обработанный скриншот
+
+    Returns:
+        dict: Блок {"type": "image", "source": {...}}
+    """
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": image.media_type,
+            "data": image.to_base64(),
+        },
+    }
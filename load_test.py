@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+"""
+Нагрузочный тест бота с виртуальными пользователями.
+
+N виртуальных пользователей проходят сценарий /start → "🔧 Создать скрипт
+оптимизации" → скриншот против локальных имитаций Telegram Bot API
+(fake_telegram_server) и Claude API (fake_anthropic_server). Бот работает
+так же, как в бою: long polling через getUpdates (или webhook), загрузка
+скриншота через getFile, отправка через sendMessage/editMessageText/sendDocument.
+
+Для каждого этапа считаются перцентили задержки от отправки сообщения
+пользователем до ответа бота, для всего сценария - пропускная способность.
+Отчет сохраняется в JSON (с хешем коммита) для сравнения между коммитами.
+
+Запуск:
+    python load_test.py --users 20
+    python load_test.py --users 50 --ramp-up 10 --llm-ttfb lognormal:3:0.5 --llm-errors 529=0.05
+    python load_test.py --users 20 --mode webhook --compare load_reports/baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import tempfile
+import argparse
+import threading
+import subprocess
+from io import BytesIO
+from datetime import datetime
+from collections import Counter, defaultdict
+
+import telebot
+from PIL import Image, ImageDraw
+
+from fake_telegram_server import FakeTelegramServer
+from fake_anthropic_server import FakeAnthropicServer, LatencyDistribution, _parse_error_rates
+from hedging import percentile
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+TOKEN = "123456:LOAD_TEST_TOKEN"
+CREATE_BUTTON = "🔧 Создать скрипт оптимизации"
+
+# Этапы сценария: (имя, метод Bot API, условие на параметры вызова)
+STAGES = (
+    ("start", "sendMessage", lambda params: "Привет" in params.get("text", "")),
+    ("menu", "sendMessage", lambda params: "Отправьте скриншот" in params.get("text", "")),
+    ("photo_ack", "sendMessage", lambda params: "Анализирую" in params.get("text", "")),
+    ("scripts", "sendDocument", None),
+    ("done", "sendMessage", lambda params: "Скрипты готовы" in params.get("text", "")
+                                         or params.get("text", "").startswith("❌")),
+)
+
+
+def make_user_screenshot(index, width=1280, height=720):
+    """
+    Рисует скриншот, уникальный для пользователя
+
+    Крупные блоки случайной яркости дают разные перцептивные хеши, поэтому
+    кеш результатов не объединяет скриншоты разных пользователей.
+    """
+    rng = random.Random(index)
+    image = Image.new("RGB", (width, height))
+    draw = ImageDraw.Draw(image)
+    columns, rows = 12, 8
+    for row in range(rows):
+        for col in range(columns):
+            shade = rng.randint(0, 255)
+            draw.rectangle([col * width // columns, row * height // rows,
+                            (col + 1) * width // columns, (row + 1) * height // rows], fill=(shade, shade, shade))
+    draw.text((20, 20), f"Virtual user {index}: Windows 11 Pro, 8 GB RAM", fill=(255, 0, 0))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def summarize(latencies, errors=0):
+    """
+    Сводка задержек этапа
+
+    Args:
+        latencies (list): Задержки в секундах
+        errors (int): Количество неудачных прохождений этапа
+
+    Returns:
+        dict: Количество, ошибки и перцентили в миллисекундах
+    """
+    summary = {"count": len(latencies), "errors": errors}
+    for name, q in (("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99)):
+        value = percentile(latencies, q)
+        summary[f"{name}_ms"] = round(value * 1000) if value is not None else None
+    summary["mean_ms"] = round(sum(latencies) / len(latencies) * 1000) if latencies else None
+    summary["max_ms"] = round(max(latencies) * 1000) if latencies else None
+    return summary
+
+
+def compare_reports(report, baseline):
+    """
+    Сравнение p95 этапов с предыдущим отчетом
+
+    Returns:
+        list: Строки для вывода
+    """
+    lines = [f"Сравнение с {baseline.get('commit') or 'baseline'} ({baseline.get('created_at')}):"]
+    for stage, current in report["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous or previous.get("p95_ms") is None or current.get("p95_ms") is None:
+            continue
+        old, new = previous["p95_ms"], current["p95_ms"]
+        change = f"{(new - old) * 100 / old:+.0f}%" if old else "n/a"
+        lines.append(f"  {stage:<10} p95 {old:>7} мс -> {new:>7} мс ({change})")
+    old_rate = baseline.get("throughput_per_min")
+    if old_rate:
+        lines.append(f"  пропускная способность {old_rate} -> {report['throughput_per_min']} сценариев/мин")
+    return lines
+
+
+def _git_revision():
+    """Короткий хеш коммита и наличие незакоммиченных изменений"""
+    try:
+        root = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except Exception:
+        return None, None
+
+
+class LoadTest:
+    """Прогон сценария виртуальными пользователями против бота из optimization_bot"""
+
+    def __init__(self, args):
+        self.args = args
+        self.telegram = None
+        self.llm = None
+        self.bot_module = None
+        self.workdir = None
+        self.samples = defaultdict(list)  # этап -> задержки в секундах
+        self.errors = Counter()  # этап -> количество неудач
+        self.flows = Counter()
+        self._lock = threading.Lock()
+        self._saved_cwd = os.getcwd()
+        self._stop_bot = None
+
+    def setup(self):
+        """Запускает имитации API и бота"""
+        args = self.args
+        self.telegram = FakeTelegramServer().start()
+        self.llm = FakeAnthropicServer(
+            ttfb=LatencyDistribution.parse(args.llm_ttfb),
+            tokens_per_second=args.llm_tokens_per_second,
+            error_rates=_parse_error_rates(args.llm_errors),
+            seed=args.seed,
+        ).start()
+
+        # Метрики, сессии и кеш бота пишутся во временный каталог, а не в репозиторий
+        self.workdir = tempfile.mkdtemp(prefix="optimizer_load_")
+        os.environ.update({
+            "TELEGRAM_TOKEN": TOKEN,
+            "ANTHROPIC_API_KEY": "load-test-key",
+            "ANTHROPIC_BASE_URL": self.llm.base_url,
+            "RESULT_CACHE_DIR": os.path.join(self.workdir, "result_cache"),
+            "SESSION_SPILL_DIR": os.path.join(self.workdir, "sessions"),
+            "TELEGRAM_FILE_ID_INDEX": os.path.join(self.workdir, "file_ids.json"),
+            "BOT_MODE": args.mode,
+        })
+        telebot.apihelper.API_URL = self.telegram.api_url
+        telebot.apihelper.FILE_URL = self.telegram.file_url
+        os.chdir(self.workdir)
+
+        import subscription_check
+        import optimization_bot
+        self.bot_module = optimization_bot
+
+        # У каждого виртуального пользователя есть подписка с запасом генераций
+        subscription_check.SUBSCRIPTIONS_FILE = subscription_check.Path(self.workdir) / "subscriptions.json"
+        subscription_check.subscription_manager.subscriptions = {"users": {}}
+        for index in range(args.users):
+            subscription_check.add_user_subscription(
+                str(self._chat_id(index)), "Нагрузочный тест", 1, generations_limit=args.iterations + 1)
+
+        if args.mode == "webhook":
+            self._start_webhook()
+        else:
+            thread = threading.Thread(target=optimization_bot.bot.polling, kwargs={
+                "non_stop": True, "interval": args.poll_interval, "timeout": 60,
+                "long_polling_timeout": args.long_polling_timeout,
+            }, daemon=True)
+            thread.start()
+            self._stop_bot = optimization_bot.bot.stop_polling
+
+    def _start_webhook(self):
+        from werkzeug.serving import make_server
+
+        bot_module = self.bot_module
+        dispatcher = bot_module.setup_webhook_mode()
+        http_server = make_server("127.0.0.1", 0, bot_module.app, threaded=True)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        bot_module.bot.set_webhook(url=f"http://127.0.0.1:{http_server.server_port}{bot_module.WEBHOOK_PATH}",
+                                   secret_token=bot_module.WEBHOOK_SECRET_TOKEN or None)
+
+        def stop():
+            http_server.shutdown()
+            dispatcher.shutdown()
+        self._stop_bot = stop
+
+    def teardown(self):
+        """Останавливает бота и имитации, удаляет временный каталог"""
+        if self._stop_bot:
+            self._stop_bot()
+        if self.telegram:
+            self.telegram.stop()
+        if self.llm:
+            self.llm.stop()
+        os.chdir(self._saved_cwd)
+        if self.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    @staticmethod
+    def _chat_id(index):
+        return 700000 + index
+
+    def _send(self, update):
+        if self.args.mode == "webhook":
+            self.telegram.deliver_update(update)
+        else:
+            self.telegram.enqueue_update(update)
+
+    def _await(self, stage, chat_id, sent_at, count):
+        """Ждет ответа бота на этапе и записывает задержку; False - ответа нет"""
+        _, method, predicate = next(item for item in STAGES if item[0] == stage)
+        try:
+            calls = self.telegram.wait_for_call(method, chat_id=chat_id, count=count,
+                                                timeout=self.args.stage_timeout, predicate=predicate)
+        except TimeoutError:
+            with self._lock:
+                self.errors[stage] += 1
+            return None
+        latency = calls[count - 1][3] - sent_at
+        with self._lock:
+            self.samples[stage].append(latency)
+        return calls[count - 1]
+
+    def run_user(self, index):
+        """Сценарий одного виртуального пользователя (args.iterations повторов)"""
+        chat_id = self._chat_id(index)
+        file_id = self.telegram.add_file(make_user_screenshot(index + self.args.seed * 100000))
+        for iteration in range(self.args.iterations):
+            count = iteration + 1
+            flow_started = time.monotonic()
+            with self._lock:
+                self.flows["started"] += 1
+
+            steps = (
+                (self.telegram.make_text_update(chat_id, "/start"), ("start",)),
+                (self.telegram.make_text_update(chat_id, CREATE_BUTTON), ("menu",)),
+                (self.telegram.make_photo_update(chat_id, file_id), ("photo_ack", "scripts", "done")),
+            )
+            completed = True
+            final_call = None
+            for update, stages in steps:
+                sent_at = time.monotonic()
+                self._send(update)
+                for stage in stages:
+                    final_call = self._await(stage, chat_id, sent_at, count)
+                    if final_call is None:
+                        completed = False
+                        break
+                if not completed:
+                    break
+
+            with self._lock:
+                if completed and "Скрипты готовы" in final_call[1].get("text", ""):
+                    self.flows["completed"] += 1
+                    self.samples["flow"].append(time.monotonic() - flow_started)
+                else:
+                    self.flows["failed"] += 1
+                    self.errors["flow"] += 1
+            time.sleep(self.args.think_time)
+
+    def run(self):
+        """
+        Запускает пользователей с равномерным разгоном и собирает отчет
+
+        Returns:
+            dict: Отчет
+        """
+        args = self.args
+        started = time.monotonic()
+        threads = []
+        for index in range(args.users):
+            thread = threading.Thread(target=self.run_user, args=(index,), daemon=True)
+            thread.start()
+            threads.append(thread)
+            if args.ramp_up and args.users > 1:
+                time.sleep(args.ramp_up / (args.users - 1) if index < args.users - 1 else 0)
+        for thread in threads:
+            thread.join()
+        duration = time.monotonic() - started
+        return self.build_report(duration)
+
+    def build_report(self, duration):
+        args = self.args
+        commit, dirty = _git_revision()
+        stages = {name: summarize(self.samples[name], self.errors[name]) for name, _, _ in STAGES}
+        stages["flow"] = summarize(self.samples["flow"], self.errors["flow"])
+
+        fallbacks = len(self.telegram.calls_for(
+            "editMessageText", predicate=lambda params: params.get("text", "").startswith("⚠️")))
+        telegram_calls = Counter(call[0] for call in self.telegram.calls)
+
+        bot_stats = {}
+        healthcheck = getattr(self.bot_module, "healthcheck", None)
+        for name, provider in getattr(healthcheck, "stats_providers", {}).items():
+            try:
+                bot_stats[name] = provider(False)
+            except Exception as e:
+                bot_stats[name] = {"error": str(e)}
+        bot_stats["telegram_sender"] = self.bot_module.tg_sender.get_stats()
+
+        return {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "commit": commit,
+            "dirty": dirty,
+            "config": {
+                "users": args.users,
+                "iterations": args.iterations,
+                "ramp_up": args.ramp_up,
+                "think_time": args.think_time,
+                "mode": args.mode,
+                "poll_interval": args.poll_interval if args.mode == "polling" else None,
+                "llm_ttfb": args.llm_ttfb,
+                "llm_tokens_per_second": args.llm_tokens_per_second,
+                "llm_errors": _parse_error_rates(args.llm_errors),
+                "seed": args.seed,
+            },
+            "duration_s": round(duration, 2),
+            "flows": {"started": self.flows["started"], "completed": self.flows["completed"],
+                      "failed": self.flows["failed"], "template_fallbacks": fallbacks},
+            "throughput_per_min": round(self.flows["completed"] * 60 / duration, 2) if duration else 0.0,
+            "stages": stages,
+            "telegram_calls": dict(telegram_calls),
+            "llm_server": self.llm.get_stats(),
+            "bot": bot_stats,
+        }
+
+
+def print_report(report):
+    """Выводит сводку отчета"""
+    flows = report["flows"]
+    print(f"\nКоммит {report['commit']}{' (с изменениями)' if report['dirty'] else ''}, "
+          f"пользователей: {report['config']['users']}, режим: {report['config']['mode']}")
+    print(f"Сценариев: {flows['completed']}/{flows['started']} за {report['duration_s']} с, "
+          f"{report['throughput_per_min']} в минуту, шаблонных ответов: {flows['template_fallbacks']}")
+    print(f"{'этап':<11}{'кол-во':>7}{'ошибки':>8}{'p50':>8}{'p90':>8}{'p95':>8}{'p99':>8}{'max':>8}  (мс)")
+    for stage, summary in report["stages"].items():
+        values = [summary[key] if summary[key] is not None else "-"
+                  for key in ("p50_ms", "p90_ms", "p95_ms", "p99_ms", "max_ms")]
+        print(f"{stage:<11}{summary['count']:>7}{summary['errors']:>8}" + "".join(f"{value:>8}" for value in values))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с имитациями Telegram и Claude API")
+    parser.add_argument("--users", type=int, default=10, help="Количество виртуальных пользователей")
+    parser.add_argument("--iterations", type=int, default=1, help="Сколько раз каждый пользователь проходит сценарий")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Время запуска всех пользователей, секунды")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Пауза между сценариями пользователя, секунды")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--poll-interval", type=float, default=5.0,
+                        help="Пауза между запросами getUpdates (как в main(): 5 с)")
+    parser.add_argument("--long-polling-timeout", type=int, default=20)
+    parser.add_argument("--llm-ttfb", default="lognormal:2.0:0.4",
+                        help="Задержка Claude API до первого байта: fixed:S, uniform:MIN:MAX, lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--llm-errors", default="", help="Вероятности ошибок API, например 429=0.05,529=0.02")
+    parser.add_argument("--stage-timeout", type=float, default=300.0, help="Максимальное ожидание ответа бота")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Файл отчета (по умолчанию load_reports/load_<время>_<коммит>.json)")
+    parser.add_argument("--compare", help="Отчет предыдущего прогона для сравнения p95")
+    args = parser.parse_args(argv)
+
+    test = LoadTest(args)
+    try:
+        test.setup()
+        report = test.run()
+    finally:
+        test.teardown()
+
+    output = args.output
+    if not output:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join("load_reports", f"load_{stamp}_{report['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print_report(report)
+    print(f"Отчет сохранен: {output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print("\n".join(compare_reports(report, json.load(f))))
+    return report
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit(0)
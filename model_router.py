@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Маршрутизация запросов генерации между быстрой и качественной моделями.
+
+Запрос сначала отправляется быстрой модели (OptimizationBot.models["default"]).
+К качественной модели (models["high_quality"]) запрос повторяется, только если
+ScriptValidator.should_regenerate_script считает результат непригодным; если
+непригодны не все файлы набора, качественная модель генерирует заново только
+их (ScriptValidator.failing_files).
+Быстрая модель пропускается, если по данным ScriptMetrics.model_performance
+она часто завершается ошибкой или перестала быть быстрее качественной.
+Маршрутизаторы всех запросов работают с общим экземпляром ScriptMetrics:
+окна задержек и результатов обновляются в памяти, а в файл метрики
+записываются пакетно (ScriptMetrics.flush).
+"""
+
+import os
+import logging
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Доля ошибок среди последних запросов, после которой модель считается нездоровой
+MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+# Минимальное количество запросов для выводов о модели
+MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "5"))
+
+
+class ModelRouter:
+    """Выбор модели по уровню и наблюдаемым задержкам и ошибкам"""
+
+    def __init__(self, models, metrics, max_error_rate=MAX_ERROR_RATE, min_samples=MIN_SAMPLES):
+        """
+        Инициализация маршрутизатора
+
+        Args:
+            models (dict): {"default": быстрая модель, "high_quality": качественная модель}
+            metrics (ScriptMetrics): Общие метрики с model_performance
+            max_error_rate (float): Предельная доля ошибок
+            min_samples (int): Минимум наблюдений для учета статистики
+        """
+        self.fast_model = models["default"]
+        self.quality_model = models.get("high_quality", self.fast_model)
+        self.metrics = metrics
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+
+    def _health(self, model):
+        try:
+            return self.metrics.get_model_health(model)
+        except Exception as e:
+            logger.warning(f"Не удалось получить статистику модели {model}: {e}")
+            return {"samples": 0, "error_rate": 0.0, "median_latency_ms": None}
+
+    def is_healthy(self, model):
+        """Модель не превышает допустимую долю ошибок"""
+        health = self._health(model)
+        return health["samples"] < self.min_samples or health["error_rate"] <= self.max_error_rate
+
+    def route(self):
+        """
+        Порядок моделей для запроса
+
+        Returns:
+            list: Модели в порядке попыток (первая - основная, вторая - для эскалации)
+        """
+        if self.fast_model == self.quality_model:
+            return [self.fast_model]
+
+        fast, quality = self._health(self.fast_model), self._health(self.quality_model)
+        if not self.is_healthy(self.fast_model):
+            logger.warning(f"Модель {self.fast_model} часто завершается ошибкой "
+                           f"({fast['error_rate']:.0%}), используем {self.quality_model}")
+            return [self.quality_model]
+
+        if (fast["samples"] >= self.min_samples and quality["samples"] >= self.min_samples
+                and fast["median_latency_ms"] is not None and quality["median_latency_ms"] is not None
+                and fast["median_latency_ms"] >= quality["median_latency_ms"]):
+            logger.info(f"Модель {self.fast_model} не быстрее {self.quality_model} "
+                        f"({fast['median_latency_ms']} мс против {quality['median_latency_ms']} мс)")
+            return [self.quality_model]
+
+        if not self.is_healthy(self.quality_model):
+            # Эскалация к модели, которая сейчас отвечает ошибками, бесполезна
+            return [self.fast_model]
+        return [self.fast_model, self.quality_model]
+
+    def escalation_model(self, model, route, validation_results, validator):
+        """
+        Модель для повторного запроса, если результат непригоден
+
+        Args:
+            model (str): Модель, давшая результат
+            route (list): Порядок моделей из route()
+            validation_results (dict): Результаты проверки скриптов
+            validator (ScriptValidator): Валидатор
+
+        Returns:
+            str: Следующая модель или None
+        """
+        if model not in route or route.index(model) + 1 >= len(route):
+            return None
+        if not validator.should_regenerate_script(validation_results):
+            return None
+        self.metrics.record_escalation(model)
+        next_model = route[route.index(model) + 1]
+        logger.info(f"Результат {model} непригоден, повторяем запрос к {next_model}")
+        return next_model
+
+    def record(self, model, latency_ms, success):
+        """Записывает результат обращения к модели"""
+        self.metrics.record_model_call(model, latency_ms, success)
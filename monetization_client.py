@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Общий HTTP-клиент для сервера монетизации.
+
+Использует пул соединений (requests.Session), строгие таймауты на
+подключение и чтение, Circuit Breaker и короткий TTL-кеш конечных
+статусов платежей (succeeded / canceled), чтобы повторные активации
+не обращались к сети.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Конечные статусы платежа - после них статус больше не меняется
+TERMINAL_PAYMENT_STATUSES = ("succeeded", "canceled")
+
+# Таймауты по умолчанию (подключение, чтение) в секундах
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("MONETIZATION_CONNECT_TIMEOUT", "3"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("MONETIZATION_READ_TIMEOUT", "10"))
+
+# Время жизни записи кеша конечных статусов в секундах
+DEFAULT_STATUS_CACHE_TTL = float(os.getenv("MONETIZATION_STATUS_CACHE_TTL", "300"))
+
+
+class MonetizationUnavailable(Exception):
+    """Сервер монетизации недоступен (сетевая ошибка, таймаут или разомкнутая цепь)"""
+
+
+class MonetizationClient:
+    """Клиент сервера монетизации с пулом соединений, таймаутами и кешем"""
+
+    def __init__(self, base_url, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, cache_ttl=DEFAULT_STATUS_CACHE_TTL,
+                 cache_size=1024, pool_maxsize=10, breaker=None):
+        """
+        Инициализация клиента
+
+        Args:
+            base_url (str): Базовый URL сервера монетизации
+            connect_timeout (float): Таймаут подключения в секундах
+            read_timeout (float): Таймаут чтения ответа в секундах
+            cache_ttl (float): Время жизни закешированного конечного статуса
+            cache_size (int): Максимальное количество записей в кеше
+            pool_maxsize (int): Размер пула соединений
+            breaker (CircuitBreaker, optional): Собственный Circuit Breaker
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.breaker = breaker or CircuitBreaker("monetization", failure_threshold=3, recovery_timeout=30.0)
+
+        # Пул соединений переиспользуется всеми потоками
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._cache = OrderedDict()  # payment_id -> (expires_at, status_code, payload)
+        self._cache_lock = threading.Lock()
+
+        # Счетчики для метрик
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _cache_get(self, payment_id):
+        """Возвращает закешированный статус или None"""
+        with self._cache_lock:
+            entry = self._cache.get(payment_id)
+            if entry is None:
+                return None
+            expires_at, status_code, payload = entry
+            if expires_at < time.monotonic():
+                del self._cache[payment_id]
+                return None
+            self._cache.move_to_end(payment_id)
+            return status_code, dict(payload)
+
+    def _cache_put(self, payment_id, status_code, payload):
+        """Сохраняет конечный статус платежа в кеш"""
+        with self._cache_lock:
+            self._cache[payment_id] = (time.monotonic() + self.cache_ttl, status_code, dict(payload))
+            self._cache.move_to_end(payment_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def fetch_payment_status(self, payment_id):
+        """
+        Запрашивает статус платежа на сервере монетизации
+
+        Args:
+            payment_id (str): ID платежа
+
+        Returns:
+            tuple: (HTTP код ответа, данные ответа в виде dict)
+
+        Raises:
+            MonetizationUnavailable: если сервер недоступен или цепь разомкнута
+        """
+        cached = self._cache_get(payment_id)
+        if cached is not None:
+            self.cache_hits += 1
+            logger.info(f"Статус платежа {payment_id} получен из кеша: {cached[1].get('status')}")
+            return cached
+        self.cache_misses += 1
+
+        if not self.breaker.allow_request():
+            raise MonetizationUnavailable(str(CircuitOpenError(self.breaker.name, self.breaker.retry_in())))
+
+        url = f"{self.base_url}/api/payment-status/{payment_id}"
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            self.breaker.record_failure()
+            raise MonetizationUnavailable(f"Ошибка запроса статуса платежа {payment_id}: {e}") from e
+
+        # Ошибки сервера считаем сбоем, ответы 2xx/4xx - нормальной работой
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        try:
+            payload = response.json()
+            if not isinstance(payload, dict):
+                payload = {}
+        except ValueError:
+            payload = {}
+
+        if response.status_code == 200 and payload.get("status") in TERMINAL_PAYMENT_STATUSES:
+            self._cache_put(payment_id, response.status_code, payload)
+
+        return response.status_code, payload
+
+    def get_stats(self):
+        """
+        Возвращает статистику клиента
+
+        Returns:
+            dict: Попадания в кеш, промахи и состояние Circuit Breaker
+        """
+        with self._cache_lock:
+            cache_entries = len(self._cache)
+        return {
+            "cache_entries": cache_entries,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "circuit": self.breaker.get_status(),
+        }
@@ -11,6 +11,9 @@ from datetime import datetime
 import zipfile
 import asyncio
 import threading
+import tempfile
+import shutil
+import hashlib
 # Используем прямой импорт нашей собственной реализации
 import fallback_anthropic as anthropic
 # Обертки для обратной совместимости
@@ -178,6 +181,23 @@ single_instance_socket = None
 from script_validator import ScriptValidator
 from script_metrics import ScriptMetrics
 from prompt_optimizer import PromptOptimizer
+from telegram_sender import TelegramSender
+from file_id_index import FileIdIndex
+from session_store import SessionStore
+from image_preprocessor import preprocess_screenshot, to_content_block
+from result_cache import ResultCache, perceptual_hash, prompt_version
+from single_flight import SingleFlight, CoalescedCallError
+from code_blocks import (IncrementalFenceParser, iter_fenced_blocks, classify_block, canonical_language,
+                         WINDOWS_KINDS, MACOS_KINDS)
+from model_router import ModelRouter
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from hedging import RequestHedger
+from concurrency_limiter import AdaptiveConcurrencyLimiter, ConcurrencyLimitExceeded
+from template_bundle import TemplateBundle, TemplateBundleCache
+from script_patcher import ScriptPatcher, PatchError, render_scripts_for_prompt
+from zip_packager import ZipPackager, DEFAULT_LEVEL_POLICY, parse_level_policy
+from artifact_generator import ARTIFACT_FILES, generate_artifacts
+from script_assembler import ScriptAssembler, ProfileError, parse_profile
 
 # Импортируем модуль для валидации скриптов
 from validate_and_fix_scripts import validate_and_fix_scripts
@@ -199,13 +219,290 @@ ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
 # Создаем экземпляр бота
 bot = telebot.TeleBot(TELEGRAM_TOKEN)
 
+# Индекс file_id загруженных архивов: одинаковые архивы повторно
+# отправляются по file_id без загрузки содержимого
+document_file_ids = FileIdIndex(
+    os.getenv('TELEGRAM_FILE_ID_INDEX', os.path.join(tempfile.gettempdir(), 'optimizer_file_ids.json')),
+    bot_id=(TELEGRAM_TOKEN or '').split(':')[0] or None,
+    save_interval=float(os.getenv('TELEGRAM_FILE_ID_SAVE_INTERVAL', '30'))
+)
+atexit.register(document_file_ids.flush)
+
+# Все исходящие сообщения идут через общий слой с ограничением скорости
+# (глобальный и поканальный token bucket) и повторами при ответе 429
+tg_sender = TelegramSender(bot, file_ids=document_file_ids)
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+# Публичный URL веб-сервера бота (например, https://bot.up.railway.app)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+
+# Диспетчер обновлений для режима webhook
+webhook_dispatcher = None
+# Признак того, что веб-сервер уже запущен в отдельном потоке
+web_server_started = False
+
 # НЕ инициализируем отдельный API сервер, используем интегрированный Flask
 logger.info("Используется интегрированный Flask сервер вместо отдельного API сервера")
 
-# Словари для хранения состояний пользователей
-user_states = {}  # Хранение состояний пользователей
-user_files = {}   # Хранение файлов пользователей
-user_messages = {}  # Хранение текста сообщений
+# Хранилище сессий пользователей с TTL, LRU и лимитом памяти
+session_store = SessionStore(
+    max_sessions=int(os.getenv('SESSION_MAX_COUNT', '10000')),
+    ttl=float(os.getenv('SESSION_TTL', str(24 * 3600))),
+    max_bytes=int(os.getenv('SESSION_MAX_MB', '64')) * 1024 * 1024,
+    # Без SESSION_SPILL_DIR - закрытый каталог процесса, удаляемый при завершении
+    spill_dir=os.getenv('SESSION_SPILL_DIR') or tempfile.mkdtemp(prefix='optimizer_sessions_')
+)
+if not os.getenv('SESSION_SPILL_DIR'):
+    atexit.register(shutil.rmtree, session_store.spill_dir, True)
+user_states = session_store.field("state")  # Хранение состояний пользователей
+user_files = session_store.field("files")   # Хранение файлов пользователей (сжатые)
+user_messages = session_store.field("message")  # Хранение текста сообщений
+
+# Кеш результатов генерации по перцептивному хешу скриншота
+result_cache = ResultCache(
+    os.getenv('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'optimizer_result_cache')),
+    ttl=float(os.getenv('RESULT_CACHE_TTL', str(7 * 24 * 3600))),
+    max_bytes=int(os.getenv('RESULT_CACHE_MAX_MB', '100')) * 1024 * 1024,
+    max_distance=int(os.getenv('RESULT_CACHE_MAX_DISTANCE', '8'))
+)
+
+# Объединение одновременных генераций по одному и тому же скриншоту
+generation_flights = SingleFlight()
+
+# Метрики генерации и обращений к моделям: один экземпляр на процесс,
+# файл записывается пакетно и при завершении
+script_metrics = ScriptMetrics()
+atexit.register(script_metrics.flush)
+
+def _publish_llm_circuit_state(name, old_state, new_state):
+    """Передает состояние цепи Claude API в healthcheck"""
+    if has_healthcheck:
+        healthcheck.update_bot_status({"llm_circuit": {"state": new_state, "changed_at": time.time()}})
+
+def _is_llm_backend_failure(error):
+    """Ошибки запроса (400, 401, 403, 404) не говорят о деградации API"""
+    return not isinstance(error, anthropic.APIStatusError) or anthropic.is_retryable(error)
+
+def _is_llm_local_rejection(error):
+    """Запрос не дождался места в llm_limiter и не был отправлен в API"""
+    return isinstance(error, ConcurrencyLimitExceeded)
+
+# Circuit breaker вокруг Claude API: при сбоях и деградации запросы не ждут
+# таймаутов, а сразу получают шаблонные скрипты
+llm_breaker = CircuitBreaker(
+    "anthropic",
+    failure_threshold=int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', '3')),
+    recovery_timeout=float(os.getenv('LLM_CIRCUIT_RECOVERY_TIMEOUT', '60')),
+    failure_rate_threshold=float(os.getenv('LLM_CIRCUIT_FAILURE_RATE', '0.5')),
+    slow_call_threshold=float(os.getenv('LLM_CIRCUIT_SLOW_CALL_SECONDS', '90')),
+    slow_call_rate_threshold=float(os.getenv('LLM_CIRCUIT_SLOW_CALL_RATE', '0.8')),
+    window_size=int(os.getenv('LLM_CIRCUIT_WINDOW', '20')),
+    min_calls=int(os.getenv('LLM_CIRCUIT_MIN_CALLS', '5')),
+    is_failure=_is_llm_backend_failure,
+    # Отказ локальной очереди (llm_limiter) не означает сбой API
+    is_ignored=_is_llm_local_rejection,
+    on_state_change=_publish_llm_circuit_state
+)
+_publish_llm_circuit_state(llm_breaker.name, None, llm_breaker.state)
+
+# Хеджирование: если запрос идет дольше p90 наблюдаемых задержек, отправляется
+# второй запрос к быстрой модели, используется ответ, полученный первым
+request_hedger = RequestHedger(
+    percentile=float(os.getenv('LLM_HEDGE_PERCENTILE', '0.9')),
+    max_fraction=float(os.getenv('LLM_HEDGE_MAX_FRACTION', '0.1')),
+    min_samples=int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20')),
+    min_delay=float(os.getenv('LLM_HEDGE_MIN_DELAY', '5')),
+    enabled=os.getenv('LLM_HEDGE_ENABLED', 'false').lower() == 'true'
+)
+
+# Ограничение одновременных запросов к Claude API (AIMD): лимит растет при
+# успешных ответах и снижается при 429/529 и росте задержки
+llm_limiter = AdaptiveConcurrencyLimiter(
+    "anthropic",
+    initial_limit=int(os.getenv('LLM_CONCURRENCY_INITIAL', '4')),
+    min_limit=int(os.getenv('LLM_CONCURRENCY_MIN', '1')),
+    max_limit=int(os.getenv('LLM_CONCURRENCY_MAX', '16')),
+    latency_tolerance=float(os.getenv('LLM_LATENCY_TOLERANCE', '2.0')),
+    max_queue=int(os.getenv('LLM_QUEUE_MAX', '100'))
+)
+# Максимальное ожидание места в очереди, секунды
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '60'))
+# Общий срок запроса к модели: потоковый запрос и резервный прямой запрос вместе
+LLM_CALL_DEADLINE = float(os.getenv('ANTHROPIC_TIMEOUT', '180'))
+
+def _direct_fallback_allowed(error, started):
+    """Нужен ли резервный непотоковый запрос после ошибки потокового
+    
+    Ошибки, которые клиент уже повторял по своей политике (есть attempts),
+    и истекший общий срок не повторяются: при перегрузке API резервный
+    запрос только добавил бы нагрузку. Повторяется обрыв уже начатого потока.
+    """
+    if getattr(error, "attempts", None) is not None or isinstance(error, anthropic.DeadlineExceededError):
+        return False
+    return time.monotonic() < started + LLM_CALL_DEADLINE
+
+def _report_llm_outcome(permit, response=None, error=None):
+    """Передает ограничителю результат запроса: перегрузка или задержка до первого байта"""
+    if isinstance(error, (anthropic.RateLimitError, anthropic.OverloadedError)):
+        permit.overload()
+    elif response is not None:
+        timing = getattr(response, "timing", None)
+        if timing is not None and timing.attempts > 1:
+            # Клиент повторял запрос после временных ошибок
+            permit.overload()
+        else:
+            permit.success(timing.ttfb_ms / 1000 if timing is not None and timing.ttfb_ms is not None else None)
+
+# Упаковка архивов со скриптами: уровень сжатия по размеру файла,
+# статические файлы сжимаются один раз
+script_packager = ZipPackager(
+    parse_level_policy(os.getenv('ZIP_LEVEL_POLICY')) if os.getenv('ZIP_LEVEL_POLICY') else DEFAULT_LEVEL_POLICY
+)
+
+# Точечное исправление ранее отправленных скриптов (diff и замена функций)
+script_patcher = ScriptPatcher()
+# Лимит ответа в режиме исправлений: изменения намного короче полного набора
+PATCH_MAX_TOKENS = int(os.getenv('PATCH_MAX_TOKENS', '1500'))
+# Режим исправлений можно отключить (PATCH_MODE=0), тогда скрипты генерируются заново
+PATCH_MODE = os.getenv('PATCH_MODE', '1') != '0'
+
+# Шаблонные скрипты, проверенные и упакованные в архив один раз на ОС
+template_bundles = TemplateBundleCache(lambda os_type: build_template_bundle(os_type))
+
+# Двухэтапная генерация: быстрая модель возвращает профиль системы (JSON),
+# скрипт собирается локально из модулей, проверенных при запуске.
+# ASSEMBLY_MODE=0 - скрипты всегда генерирует модель
+ASSEMBLY_MODE = os.getenv('ASSEMBLY_MODE', '1') != '0'
+# Лимит ответа с профилем системы
+PROFILE_MAX_TOKENS = int(os.getenv('PROFILE_MAX_TOKENS', '400'))
+script_assembler = ScriptAssembler()
+# Запросы без пожеланий пользователя: для них достаточно сборки из модулей
+STANDARD_REQUEST_MESSAGES = (
+    "Создай скрипт оптимизации Windows",
+    "Создай скрипт оптимизации Windows на основе этого скриншота",
+)
+
+# Статистика для /stats healthcheck-сервера
+if has_healthcheck:
+    healthcheck.register_stats_provider(
+        "llm_usage", lambda include_private: script_metrics.get_llm_usage(include_users=include_private)
+    )
+    healthcheck.register_stats_provider("llm_circuit", lambda include_private: llm_breaker.get_status())
+    healthcheck.register_stats_provider("hedging", lambda include_private: request_hedger.get_stats())
+    healthcheck.register_stats_provider("llm_limiter", lambda include_private: llm_limiter.get_stats())
+    healthcheck.register_stats_provider("result_cache", lambda include_private: result_cache.get_stats())
+    healthcheck.register_stats_provider("sessions", lambda include_private: session_store.get_stats())
+    healthcheck.register_stats_provider("templates", lambda include_private: template_bundles.get_stats())
+    healthcheck.register_stats_provider("zip_packager", lambda include_private: script_packager.get_stats())
+    healthcheck.register_stats_provider("patching", lambda include_private: script_patcher.get_stats())
+    healthcheck.register_stats_provider("file_ids", lambda include_private: document_file_ids.get_stats())
+    healthcheck.register_stats_provider("assembler", lambda include_private: script_assembler.get_stats())
+
+LLM_UNAVAILABLE_NOTICE = (
+    "⚠️ Сервис генерации сейчас недоступен или перегружен.\n\n"
+    "Пока что вы получите проверенные шаблонные скрипты. "
+    "Для персональной оптимизации отправьте скриншот позже."
+)
+
+def download_photo(message):
+    """
+    Загружает самое крупное фото из сообщения
+    
+    Returns:
+        bytes: Содержимое файла
+    """
+    file_info = bot.get_file(message.photo[-1].file_id)
+    # Адрес файлового API берется из telebot.apihelper.FILE_URL (по умолчанию api.telegram.org)
+    return bot.download_file(file_info.file_path)
+
+# Файлы, соответствующие типам блоков кода в ответе модели (см. code_blocks.classify_block)
+STREAM_BLOCK_FILES = {
+    "powershell": "WindowsOptimizer.ps1",
+    "batch": "Start-Optimizer.bat",
+    "markdown": "README.md",
+}
+# Файлы для macOS: два shell-скрипта (основной и запускающий) и документация
+MACOS_BLOCK_FILES = ("MacOptimizer.sh", "StartOptimizer.command", "README.md")
+
+# Лимит ответа при повторной генерации одного файла
+FILE_REGENERATION_MAX_TOKENS = {
+    "WindowsOptimizer.ps1": int(os.getenv('REGENERATE_PS1_MAX_TOKENS', '3000')),
+    "Start-Optimizer.bat": int(os.getenv('REGENERATE_BAT_MAX_TOKENS', '600')),
+    "README.md": int(os.getenv('REGENERATE_README_MAX_TOKENS', '1000')),
+}
+
+# Start-Optimizer.bat и README.md строятся локально по WindowsOptimizer.ps1
+# (artifact_generator), модель пишет только основной скрипт.
+# LOCAL_ARTIFACTS=0 - все три файла генерирует модель
+LOCAL_ARTIFACTS = os.getenv('LOCAL_ARTIFACTS', '1') != '0'
+
+def normalize_script_block(kind, content):
+    """
+    Добавляет обязательные строки в начало блока Windows-скрипта
+    
+    Args:
+        kind (str): Тип блока (powershell, batch, markdown)
+        content (str): Содержимое блока
+    
+    Returns:
+        str: Содержимое файла
+    """
+    if kind == "powershell":
+        # Проверяем на наличие кодировки UTF-8
+        if "$OutputEncoding = [System.Text.Encoding]::UTF8" not in content:
+            content = "# Encoding: UTF-8\n$OutputEncoding = [System.Text.Encoding]::UTF8\n\n" + content
+    elif kind == "batch":
+        # Проверяем на наличие обязательных команд
+        if "@echo off" not in content:
+            content = "@echo off\n" + content
+        if "chcp 65001" not in content:
+            content = content.replace("@echo off", "@echo off\nchcp 65001 >nul")
+    return content
+
+def make_progress_callback(chat_id, message_id, header, min_interval=2.0):
+    """
+    Создает функцию обновления сообщения о ходе генерации
+    
+    Сообщение редактируется в фоне и не чаще min_interval, кроме
+    принудительных обновлений (получен очередной файл).
+    
+    Args:
+        chat_id: ID чата
+        message_id: ID сообщения о ходе обработки
+        header (str): Первая строка сообщения
+        min_interval (float): Минимальный интервал между обновлениями
+        
+    Returns:
+        callable: Функция (text, force=False)
+    """
+    state = {"last": 0.0, "text": None, "busy": False}
+    lock = threading.Lock()
+    
+    def edit(text):
+        try:
+            tg_sender.edit_message_text(text, chat_id, message_id)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сообщение о ходе генерации: {e}")
+        finally:
+            with lock:
+                state["busy"] = False
+    
+    def report(text, force=False):
+        full_text = f"{header}\n\n{text}" if text else header
+        now = time.monotonic()
+        with lock:
+            if full_text == state["text"] or state["busy"]:
+                return
+            if not force and now - state["last"] < min_interval:
+                return
+            state.update(last=now, text=full_text, busy=True)
+        threading.Thread(target=edit, args=(full_text,), daemon=True).start()
+    
+    return report
 
 # Функция проверки подписки перед действиями
 def check_subscription_before_action(message, check_generations=False):
@@ -253,7 +550,7 @@ def check_subscription_before_action(message, check_generations=False):
             markup.add(payment_button)
             
             # Отправляем сообщение с кнопкой оплаты
-            bot.send_message(
+            tg_sender.send_message(
                 chat_id=message.chat.id, 
                 text="⚠️ *У вас нет доступных скриптов*\n\n"
                      "Для создания скриптов оптимизации необходимо купить пакет скриптов.\n\n"
@@ -303,7 +600,7 @@ def check_subscription_before_action(message, check_generations=False):
                                    f"Использовано: {used}/{limit} скриптов\n\n"
                                    f"💡 Купите дополнительные скрипты для продолжения работы:")
                 
-                bot.send_message(
+                tg_sender.send_message(
                     chat_id=message.chat.id,
                     text=message_text,
                     parse_mode="Markdown",
@@ -399,6 +696,49 @@ pause
 ```
 """
 
+# Шаблон промпта для генерации только PowerShell скрипта:
+# Start-Optimizer.bat и README.md строятся по нему локально (artifact_generator)
+OPTIMIZATION_PS1_PROMPT_TEMPLATE = """Ты эксперт по оптимизации Windows. Тебе предоставлен скриншот системной информации. Твоя задача - создать PowerShell скрипт для оптимизации этой системы.
+
+Требования к скрипту WindowsOptimizer.ps1:
+- Всегда начинай с установки кодировки UTF-8: `$OutputEncoding = [System.Text.Encoding]::UTF8`
+- Проверяй права администратора в самом начале скрипта
+- Все блоки try ДОЛЖНЫ иметь соответствующие блоки catch
+- НИКОГДА не используй формат ${1}:TEMP в путях - это приводит к ошибкам!
+- ВСЕГДА используй ТОЛЬКО формат $env:VARIABLENAME для переменных окружения (например: $env:TEMP, $env:APPDATA, $env:USERPROFILE)
+- Внутри строк с двоеточием используй `${variable}` вместо `$variable`
+- Проверяй существование файлов с помощью Test-Path перед их использованием
+- Добавляй ключ -Force для команд Remove-Item
+- Обеспечь балансировку всех фигурных скобок
+- Для вывода сообщений об ошибках используй формат: `"Сообщение: ${variable}"`
+
+Оформление (по нему автоматически составляется инструкция для пользователя):
+- Каждую оптимизацию оформляй отдельной функцией
+- Над каждой функцией пиши однострочный комментарий на русском языке с описанием того, что она делает
+- Путь к журналу задавай переменной $LogPath, к папке резервных копий - переменной $BackupDir
+
+Предоставь только один файл - WindowsOptimizer.ps1 - в одном блоке ```powershell. Bat-файл для запуска и README.md писать не нужно: они создаются автоматически.
+"""
+
+# Шаблон промпта для определения профиля системы (первый этап двухэтапной генерации)
+PROFILE_PROMPT_TEMPLATE = """Тебе предоставлен скриншот системной информации Windows. Определи по нему профиль системы.
+
+Верни только JSON-объект в блоке ```json без пояснений:
+```json
+{
+  "windows_version": "10 или 11",
+  "windows_edition": "Home, Pro, Enterprise или Education",
+  "cpu": "модель процессора",
+  "cpu_cores": 4,
+  "ram_gb": 8,
+  "disk_type": "ssd или hdd",
+  "laptop": true
+}
+```
+
+Если значение нельзя определить по скриншоту, укажи null. Не придумывай значения.
+"""
+
 # Шаблон промпта для исправления ошибок в скрипте
 ERROR_FIX_PROMPT_TEMPLATE = """Ты эксперт по PowerShell и Batch скриптам. Перед тобой скриншот с ошибками выполнения скрипта оптимизации Windows. Твоя задача - проанализировать ошибки и исправить код скрипта.
 
@@ -442,6 +782,99 @@ ERROR_FIX_PROMPT_TEMPLATE = """Ты эксперт по PowerShell и Batch ск
 - Правильный формат переменных в строках с двоеточием (${variable})
 """
 
+# Шаблон промпта для исправления ошибок только в PowerShell скрипте:
+# Start-Optimizer.bat и README.md строятся по нему локально (artifact_generator)
+ERROR_FIX_PS1_PROMPT_TEMPLATE = """Ты эксперт по PowerShell. Перед тобой скриншот с ошибками выполнения скрипта оптимизации Windows WindowsOptimizer.ps1. Твоя задача - проанализировать ошибки и исправить код скрипта.
+
+Вот основные типы ошибок, которые могут встречаться:
+
+1. Синтаксические ошибки:
+   - Несбалансированные скобки
+   - Неверное использование переменных
+   - Ошибки в конструкциях try-catch
+   - Неэкранированные специальные символы
+
+2. Проблемы с доступом:
+   - Отсутствие проверки прав администратора
+   - Попытка доступа к несуществующим файлам или службам
+   - Отсутствие параметра -Force для Remove-Item
+
+3. Проблемы кодировки:
+   - Отсутствие установки правильной кодировки
+   - Неверное отображение кириллических символов
+
+Важные правила при исправлении:
+- Всегда добавляй в начало скрипта: `$OutputEncoding = [System.Text.Encoding]::UTF8`
+- Все блоки try ДОЛЖНЫ иметь соответствующие блоки catch
+- Переменные в строках с двоеточием используй в формате `${variable}` вместо `$variable`
+- Используй проверки Test-Path перед операциями с файлами
+- Балансируй все фигурные скобки
+- Каждую оптимизацию оформляй отдельной функцией с однострочным комментарием на русском языке над ней
+- Путь к журналу задавай переменной $LogPath, к папке резервных копий - переменной $BackupDir
+
+Предоставь только исправленный WindowsOptimizer.ps1 в одном блоке ```powershell. Bat-файл для запуска и README.md писать не нужно: они создаются автоматически.
+"""
+
+# Шаблон промпта для точечного исправления уже отправленных скриптов
+ERROR_PATCH_PROMPT_TEMPLATE = """Ты эксперт по PowerShell и Batch скриптам. Пользователь запустил скрипты оптимизации Windows, которые ты видишь в сообщении, и прислал скриншот с ошибками. Исправь только то, что вызывает ошибки, не переписывая скрипты целиком.
+
+Верни изменения в одном из форматов (можно сочетать):
+
+1. Unified diff в блоке ```diff с заголовками файлов:
+```diff
+--- a/WindowsOptimizer.ps1
++++ b/WindowsOptimizer.ps1
+@@ -12,3 +12,4 @@
+ неизмененная строка
+-строка с ошибкой
++исправленная строка
+```
+
+2. Новая версия функции PowerShell целиком:
+```powershell file=WindowsOptimizer.ps1 function=Clear-TempFiles
+function Clear-TempFiles {
+    ...
+}
+```
+
+3. Небольшой файл целиком:
+```batch file=Start-Optimizer.bat
+@echo off
+...
+```
+
+Правила:
+- Строки контекста в diff копируй из присланных скриптов без изменений
+- Не добавляй блоки кода, кроме изменений
+- Сохраняй кодировку UTF-8, проверку прав администратора и обработку ошибок
+- Все блоки try должны иметь catch, фигурные скобки должны быть сбалансированы
+- Переменные в строках с двоеточием используй в формате ${variable}
+- После изменений кратко перечисли, что исправлено
+"""
+
+# Шаблон промпта для повторной генерации одного файла, не прошедшего проверку
+FILE_REGENERATION_PROMPT_TEMPLATE = """Ты эксперт по PowerShell и Batch скриптам. Один файл из набора скриптов оптимизации Windows не прошел автоматическую проверку. Остальные файлы набора в порядке и не меняются.
+
+Набор состоит из файлов:
+- WindowsOptimizer.ps1 - основной PowerShell скрипт оптимизации
+- Start-Optimizer.bat - запуск WindowsOptimizer.ps1 от имени администратора
+- README.md - инструкция для пользователя на русском языке
+
+Верни исправленную версию только указанного файла целиком, в одном блоке кода (```powershell, ```batch или ```markdown), без пояснений.
+
+Требования к PowerShell:
+- В начале скрипта: `$OutputEncoding = [System.Text.Encoding]::UTF8`
+- Проверка прав администратора, все блоки try имеют catch
+- Сбалансированные фигурные и круглые скобки
+- Переменные в строках с двоеточием в формате ${variable}
+- Test-Path перед операциями с файлами, -ErrorAction SilentlyContinue при работе со службами
+
+Требования к Batch:
+- Начало: `@echo off` и `chcp 65001 >nul`
+- Проверка прав администратора через `net session`
+- Запуск PowerShell с параметрами `-ExecutionPolicy Bypass -NoProfile -File`
+"""
+
 def validate_and_fix_scripts(files):
     """
     Валидирует и исправляет скрипты
@@ -478,6 +911,93 @@ def validate_and_fix_scripts(files):
     
     return enhanced_files, fixed_validation_results, errors_corrected
 
+# Инструкции, добавляемые в архив со скриптами
+MACOS_USAGE_INSTRUCTIONS = """# Инструкция по использованию скриптов оптимизации macOS
+
+1. Распакуйте все файлы из архива в отдельную папку на вашем Mac.
+
+ЗАПУСК СКРИПТА:
+
+1. Откройте терминал.
+2. Перейдите в папку со скриптами командой: cd путь/к/папке/со/скриптами
+3. Сделайте скрипты исполняемыми с помощью команды:
+   chmod +x MacOptimizer.sh StartOptimizer.command
+4. Запустите скрипт одним из способов:
+   a) Через Finder: дважды щелкните на StartOptimizer.command
+   b) Через Терминал: sudo ./MacOptimizer.sh
+
+ВАЖНЫЕ ПРИМЕЧАНИЯ:
+- Перед запуском создайте резервную копию важных данных.
+- Вас попросят ввести пароль администратора.
+- Скрипты создают резервные копии измененных параметров в папке ~/MacOptimizer_Backups.
+- Все действия скриптов записываются в лог-файл ~/Library/Logs/MacOptimizer.log.
+
+Если у вас возникнут проблемы, используйте команду /help для получения справки."""
+
+WINDOWS_USAGE_INSTRUCTIONS = """# Инструкция по использованию скриптов оптимизации Windows
+
+1. Распакуйте все файлы из архива в отдельную папку на вашем компьютере.
+
+СПОСОБ 1 (РЕКОМЕНДУЕТСЯ): Запуск через PowerShell
+- Щелкните правой кнопкой мыши на файле Run-Optimizer.ps1
+- Выберите "Запустить с помощью PowerShell" или "Запустить от имени администратора"
+- Следуйте инструкциям на экране
+
+СПОСОБ 2: Запуск через командную строку
+- Запустите командную строку от имени администратора
+- Перейдите в папку со скриптами командой: cd путь\\к\\папке\\со\\скриптами
+- Выполните команду: Start-Optimizer.bat
+
+ЕСЛИ ВОЗНИКАЮТ ОШИБКИ КОДИРОВКИ:
+Если при запуске Start-Optimizer.bat видны ошибки с символами "", используйте 
+метод запуска через PowerShell скрипт Run-Optimizer.ps1 (Способ 1).
+
+## Важно:
+- Перед запуском создайте точку восстановления системы.
+- Скрипты создают резервные копии измененных параметров в папке WindowsOptimizer_Backups.
+- Все действия скриптов записываются в лог-файл в папке Temp.
+
+Если у вас возникнут проблемы, используйте команду /help для получения справки."""
+
+# Инструкции сжимаются один раз и вставляются в каждый архив без повторного сжатия
+MACOS_USAGE_MEMBER = script_packager.precompress("КАК_ИСПОЛЬЗОВАТЬ.txt", MACOS_USAGE_INSTRUCTIONS)
+WINDOWS_USAGE_MEMBER = script_packager.precompress("КАК_ИСПОЛЬЗОВАТЬ.txt", WINDOWS_USAGE_INSTRUCTIONS)
+
+def build_script_archive(files, stream=None):
+    """
+    Упаковывает скрипты и инструкцию в ZIP-архив
+    
+    Общая точка упаковки для всех отправок архивов (новые скрипты,
+    исправления, повторная отправка).
+    
+    Args:
+        files: словарь с файлами (имя файла -> содержимое)
+        stream: поток для записи архива (None - вернуть байты)
+    
+    Returns:
+        bytes: Содержимое архива (одинаковые файлы дают одинаковые байты)
+            или количество записанных байт, если передан stream
+    """
+    usage = MACOS_USAGE_MEMBER if "MacOptimizer.sh" in files else WINDOWS_USAGE_MEMBER
+    if stream is not None:
+        return script_packager.write_to(stream, files, members=[usage])
+    return script_packager.package(files, members=[usage])
+
+def build_template_bundle(os_type):
+    """
+    Собирает набор шаблонных скриптов: проверка, исправление, улучшение и архив
+    
+    Args:
+        os_type: тип операционной системы ('windows' или 'macos')
+    
+    Returns:
+        TemplateBundle: Готовый набор
+    """
+    raw_files = OptimizationBot._build_template_scripts(os_type)
+    files, validation_results, errors_corrected = validate_and_fix_scripts(raw_files)
+    return TemplateBundle(os_type, raw_files, files, validation_results, errors_corrected,
+                          build_script_archive(files))
+
 class OptimizationBot:
     """Класс для оптимизации Windows с помощью AI"""
     
@@ -509,11 +1029,19 @@ class OptimizationBot:
             # Инициализация промптов
             self.prompts = {
                 "OPTIMIZATION_PROMPT_TEMPLATE": OPTIMIZATION_PROMPT_TEMPLATE,
-                "ERROR_FIX_PROMPT_TEMPLATE": ERROR_FIX_PROMPT_TEMPLATE
+                "OPTIMIZATION_PS1_PROMPT_TEMPLATE": OPTIMIZATION_PS1_PROMPT_TEMPLATE,
+                "PROFILE_PROMPT_TEMPLATE": PROFILE_PROMPT_TEMPLATE,
+                "ERROR_FIX_PROMPT_TEMPLATE": ERROR_FIX_PROMPT_TEMPLATE,
+                "ERROR_FIX_PS1_PROMPT_TEMPLATE": ERROR_FIX_PS1_PROMPT_TEMPLATE,
+                "ERROR_PATCH_PROMPT_TEMPLATE": ERROR_PATCH_PROMPT_TEMPLATE,
+                "FILE_REGENERATION_PROMPT_TEMPLATE": FILE_REGENERATION_PROMPT_TEMPLATE
             }
             
-            # Инициализация метрик
-            self.metrics = ScriptMetrics()
+            # Метрики общие для всех запросов
+            self.metrics = script_metrics
+            
+            # Выбор модели по наблюдаемым задержкам и ошибкам
+            self.router = ModelRouter(self.models, self.metrics)
             
             # Тип клиента и метод вызова API
             self.client_method = "messages"
@@ -525,8 +1053,402 @@ class OptimizationBot:
             logger.error(f"Ошибка при инициализации бота оптимизации: {e}")
             self.is_initialized = False
     
-    async def generate_new_script(self, message):
-        """Генерация нового скрипта оптимизации на основе скриншота системы"""
+    def _validate_block(self, filename, content):
+        """Проверка одного файла сразу после его получения из потока
+        
+        Returns:
+            list: Найденные проблемы или None для файлов, которые не проверяются
+        """
+        try:
+            if filename.endswith(".ps1"):
+                return self.validator.validate_powershell_script(content)
+            if filename.endswith(".bat"):
+                return self.validator.validate_batch_script(content)
+        except Exception as e:
+            logger.warning(f"Ошибка предварительной проверки {filename}: {e}")
+        return None
+    
+    def _stream_completion(self, model, messages, max_tokens=4000, on_progress=None, system=None, accounting=None):
+        """Запрос к API в потоковом режиме
+        
+        Блоки кода извлекаются и проверяются по мере получения, о ходе
+        генерации сообщается через on_progress(text, force). Долгий запрос
+        хеджируется вторым запросом к быстрой модели (request_hedger).
+        
+        Args:
+            model (str): Модель
+            messages (list): Сообщения запроса
+            max_tokens (int): Максимальная длина ответа
+            on_progress (callable, optional): Функция обновления статуса
+            system (list, optional): Системный промпт (кешируемые блоки)
+            accounting (dict, optional): user_id и prompt_version для учета расхода
+            
+        Returns:
+            str: Полный текст ответа
+            
+        Raises:
+            CircuitOpenError: цепь Claude API разомкнута
+            ConcurrencyLimitExceeded: запрос не дождался места в llm_limiter
+        """
+        def attempt(attempt_model, cancel_token, is_hedge):
+            # О ходе генерации сообщает только основной запрос; второй запрос
+            # отправляется, только если в ограничителе есть свободное место
+            return self._run_stream(attempt_model, messages, max_tokens,
+                                    None if is_hedge else on_progress, cancel_token, system, accounting,
+                                    queue_timeout=0 if is_hedge else LLM_QUEUE_TIMEOUT)
+        
+        return llm_breaker.call(
+            request_hedger.run, model, attempt,
+            hedge_model=self.models["default"], metrics=self.metrics
+        )
+    
+    def _record_llm_call(self, model, response, outcome, accounting, started):
+        """Записывает токены, задержку и результат обращения к модели"""
+        timing = getattr(response, "timing", None)
+        total_ms = timing.total_ms if timing is not None and timing.total_ms is not None else None
+        self.metrics.record_llm_call(
+            model,
+            usage=getattr(response, "usage", None),
+            ttfb_ms=timing.ttfb_ms if timing is not None else None,
+            total_ms=total_ms if total_ms is not None else (time.monotonic() - started) * 1000,
+            outcome=outcome,
+            **(accounting or {})
+        )
+    
+    def _run_stream(self, model, messages, max_tokens, on_progress, cancel_token=None, system=None, accounting=None,
+                    queue_timeout=LLM_QUEUE_TIMEOUT):
+        """Выполняет потоковый запрос через llm_limiter и записывает расход токенов и задержку"""
+        permit = llm_limiter.acquire(timeout=queue_timeout)
+        started = time.monotonic()
+        try:
+            final_message = self._read_stream(model, messages, max_tokens, on_progress, cancel_token, system)
+        except Exception as e:
+            _report_llm_outcome(permit, error=e)
+            cancelled = cancel_token is not None and cancel_token.cancelled
+            self._record_llm_call(model, None, "cancelled" if cancelled else f"error:{type(e).__name__}",
+                                  accounting, started)
+            raise
+        else:
+            _report_llm_outcome(permit, response=final_message)
+            # Закрытый при отмене поток может завершиться без исключения
+            cancelled = cancel_token is not None and cancel_token.cancelled
+            self._record_llm_call(model, final_message, "cancelled" if cancelled else "success",
+                                  accounting, started)
+            return final_message.content[0].text
+        finally:
+            permit.release()
+    
+    def _limited_create(self, deadline=None, **kwargs):
+        """Обычный (не потоковый) запрос через llm_limiter
+        
+        Args:
+            deadline (float, optional): Момент (time.monotonic), к которому запрос
+                вместе с ожиданием в очереди должен завершиться
+        """
+        queue_timeout = LLM_QUEUE_TIMEOUT
+        if deadline is not None:
+            queue_timeout = min(queue_timeout, max(0.0, deadline - time.monotonic()))
+        permit = llm_limiter.acquire(timeout=queue_timeout)
+        try:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise anthropic.DeadlineExceededError("Истек общий срок запроса к модели")
+                kwargs["timeout"] = remaining
+            response = self.client.messages.create(**kwargs)
+        except Exception as e:
+            _report_llm_outcome(permit, error=e)
+            raise
+        else:
+            _report_llm_outcome(permit, response=response)
+            return response
+        finally:
+            permit.release()
+    
+    def _read_stream(self, model, messages, max_tokens, on_progress, cancel_token, system):
+        """Читает поток, извлекая блоки кода по мере получения (см. _stream_completion)
+        
+        Returns:
+            Response: Итоговое сообщение
+        """
+        stream = self.client.messages.create(
+            model=model, max_tokens=max_tokens, messages=messages, system=system, stream=True
+        )
+        if cancel_token is not None:
+            # Проигравший при хеджировании запрос прерывается закрытием соединения
+            cancel_token.on_cancel(stream.close)
+        parser = IncrementalFenceParser()
+        ready = []
+        
+        def report(force=False):
+            if on_progress is None or (cancel_token is not None and cancel_token.cancelled):
+                return
+            lines = [f"✅ {name}: {details}" for name, details in ready]
+            if parser.in_block:
+                lines.append(f"⏳ {STREAM_BLOCK_FILES.get(canonical_language(parser.current_language), 'файл')}...")
+            on_progress("\n".join(lines), force)
+        
+        def handle(block):
+            kind, _ = classify_block(block, WINDOWS_KINDS)
+            filename = STREAM_BLOCK_FILES.get(kind)
+            if filename is None or any(name == filename for name, _ in ready):
+                return
+            details = f"{block.content.count(chr(10))} строк"
+            issues = self._validate_block(filename, block.content)
+            if issues is not None:
+                details += f", замечаний: {len(issues)}"
+            ready.append((filename, details))
+            logger.info(f"Из потока получен {filename} ({details})")
+        
+        for chunk in stream.text_stream:
+            completed = parser.feed(chunk)
+            for block in completed:
+                handle(block)
+            report(force=bool(completed))
+        for block in parser.close():
+            handle(block)
+        report(force=True)
+        
+        return stream.get_final_message()
+    
+    async def _request_escalation(self, model, messages, on_progress=None, system=None, accounting=None):
+        """Повторный запрос к более качественной модели
+        
+        Returns:
+            tuple: Результат validate_and_fix_scripts или None, если запрос не удался
+        """
+        started = time.monotonic()
+        try:
+            response_text = await asyncio.to_thread(
+                self._stream_completion, model, messages, max_tokens=4000, on_progress=on_progress,
+                system=system, accounting=accounting
+            )
+        except Exception as e:
+            self.router.record(model, (time.monotonic() - started) * 1000, False)
+            logger.error(f"Ошибка при повторном запросе к модели {model}: {e}")
+            return None
+        self.router.record(model, (time.monotonic() - started) * 1000, True)
+        
+        files = self.extract_files(response_text)
+        if not files:
+            logger.warning(f"Не удалось извлечь файлы из ответа модели {model}")
+            return None
+        return validate_and_fix_scripts(files)
+    
+    async def _regenerate_failing_files(self, model, files, validation_results, on_progress=None, accounting=None):
+        """Повторная генерация только файлов, не прошедших проверку
+        
+        Каждый файл с критическими ошибками запрашивается отдельно, коротким
+        промптом для этого файла; остальные файлы набора сохраняются.
+        
+        Returns:
+            tuple: Результат в формате validate_and_fix_scripts или None, если нужна
+                полная повторная генерация (непригодны все файлы или запрос не удался)
+        """
+        # Локально построенные файлы модель не генерирует; если модель пишет только
+        # основной скрипт, он запрашивается заново тем же коротким промптом
+        generated = [name for name in files if name in FILE_REGENERATION_MAX_TOKENS
+                     and not (LOCAL_ARTIFACTS and name in ARTIFACT_FILES)]
+        failing = [name for name in self.validator.failing_files(validation_results) if name in generated]
+        if not failing or (len(generated) > 1 and len(failing) >= len(generated)):
+            return None
+        
+        prompt = self.prompts.get("FILE_REGENERATION_PROMPT_TEMPLATE", FILE_REGENERATION_PROMPT_TEMPLATE)
+        system = anthropic.cached_system_prompt(prompt)
+        if accounting is not None:
+            accounting = dict(accounting, prompt_version=prompt_version(prompt))
+        kinds = {filename: kind for kind, filename in STREAM_BLOCK_FILES.items()}
+        
+        regenerated = {}
+        for filename in failing:
+            issues = "\n".join(f"- {issue}" for issue in validation_results[filename])
+            messages = [
+                {
+                    "role": "user",
+                    "content": f"Файл: {filename}\n\nЗамечания проверки:\n{issues}\n\n"
+                               f"Текущая версия:\n```\n{files[filename].rstrip()}\n```"
+                }
+            ]
+            started = time.monotonic()
+            try:
+                response_text = await asyncio.to_thread(
+                    self._stream_completion, model, messages, max_tokens=FILE_REGENERATION_MAX_TOKENS[filename],
+                    on_progress=on_progress, system=system, accounting=accounting
+                )
+            except Exception as e:
+                self.router.record(model, (time.monotonic() - started) * 1000, False)
+                logger.error(f"Ошибка при повторной генерации {filename} моделью {model}: {e}")
+                return None
+            self.router.record(model, (time.monotonic() - started) * 1000, True)
+            
+            kind = kinds[filename]
+            block = next((block for block in iter_fenced_blocks(response_text)
+                          if classify_block(block, WINDOWS_KINDS)[0] == kind), None)
+            if block is None:
+                logger.warning(f"В ответе модели {model} нет новой версии {filename}")
+                return None
+            regenerated[filename] = normalize_script_block(kind, block.content)
+            logger.info(f"Файл {filename} сгенерирован заново ({len(regenerated[filename])} символов)")
+        
+        # Проверяются только новые версии файлов
+        fixed_regenerated, regenerated_results, errors_corrected = validate_and_fix_scripts(regenerated)
+        merged_files = dict(files)
+        merged_files.update({name: fixed_regenerated[name] for name in regenerated})
+        merged_results = dict(validation_results)
+        merged_results.update({name: regenerated_results.get(name, []) for name in regenerated})
+        if LOCAL_ARTIFACTS and "WindowsOptimizer.ps1" in regenerated:
+            artifacts = generate_artifacts(merged_files["WindowsOptimizer.ps1"])
+            merged_files.update(artifacts)
+            merged_results.update({name: [] for name in artifacts if name in merged_results})
+        return merged_files, merged_results, errors_corrected
+    
+    async def _assemble_from_profile(self, chat_id, image_block, model):
+        """Двухэтапная генерация: профиль системы от модели, сборка скрипта из модулей
+
+        Модель возвращает только короткий JSON-профиль; WindowsOptimizer.ps1
+        собирается из проверенных модулей (script_assembler), bat-файл и
+        README строятся по нему локально.
+
+        Returns:
+            tuple: (файлы, результаты проверки, исправлено ошибок) или None, если нужна полная генерация
+        """
+        prompt = self.prompts.get("PROFILE_PROMPT_TEMPLATE", PROFILE_PROMPT_TEMPLATE)
+        system = anthropic.cached_system_prompt(prompt)
+        accounting = {"user_id": chat_id, "prompt_version": prompt_version(prompt)}
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    image_block,
+                    {"type": "text", "text": "Определи профиль системы по скриншоту."}
+                ]
+            }
+        ]
+
+        started = time.monotonic()
+        try:
+            response_text = await asyncio.to_thread(
+                self._stream_completion, model, messages, max_tokens=PROFILE_MAX_TOKENS,
+                system=system, accounting=accounting
+            )
+        except (CircuitOpenError, ConcurrencyLimitExceeded):
+            raise
+        except Exception as e:
+            self.router.record(model, (time.monotonic() - started) * 1000, False)
+            logger.error(f"Ошибка при определении профиля системы моделью {model}: {e}")
+            return None
+        self.router.record(model, (time.monotonic() - started) * 1000, True)
+
+        try:
+            profile = parse_profile(response_text)
+        except ProfileError as e:
+            logger.warning(f"Профиль системы для пользователя {chat_id} не определен: {e}")
+            return None
+
+        # Модули проверены при запуске: повторная проверка и исправление не нужны
+        files = script_assembler.assemble(profile)
+        return files, {filename: [] for filename in files}, 0
+
+    async def _fix_with_patch(self, chat_id, previous_files, image_block, user_message, model, on_progress=None):
+        """Точечное исправление ранее отправленных скриптов
+        
+        Модель получает текущие скрипты и скриншот ошибки и возвращает только
+        изменения (diff или новые версии функций), которые применяются локально.
+        
+        Returns:
+            tuple: Результат validate_and_fix_scripts или None, если нужна полная генерация
+        """
+        prompt = self.prompts.get("ERROR_PATCH_PROMPT_TEMPLATE", ERROR_PATCH_PROMPT_TEMPLATE)
+        system = anthropic.cached_system_prompt(prompt)
+        accounting = {"user_id": chat_id, "prompt_version": prompt_version(prompt)}
+        # Локально построенные файлы модели не отправляются: они строятся заново по скрипту
+        patchable = {name: content for name, content in previous_files.items()
+                     if not (LOCAL_ARTIFACTS and name in ARTIFACT_FILES)}
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    image_block,
+                    {
+                        "type": "text",
+                        "text": f"{user_message}\n\nТекущие скрипты:\n\n{render_scripts_for_prompt(patchable)}"
+                    }
+                ]
+            }
+        ]
+        
+        started = time.monotonic()
+        try:
+            response_text = await asyncio.to_thread(
+                self._stream_completion, model, messages, max_tokens=PATCH_MAX_TOKENS, on_progress=on_progress,
+                system=system, accounting=accounting
+            )
+        except (CircuitOpenError, ConcurrencyLimitExceeded):
+            raise
+        except Exception as e:
+            self.router.record(model, (time.monotonic() - started) * 1000, False)
+            logger.warning(f"Запрос изменений к модели {model} не удался, генерирую скрипты заново: {e}")
+            return None
+        self.router.record(model, (time.monotonic() - started) * 1000, True)
+        
+        try:
+            result = script_patcher.apply(patchable, response_text)
+        except PatchError as e:
+            logger.info(f"Изменения не применились ({e}), генерирую скрипты заново")
+            return None
+        
+        # Проверяются только измененные файлы: остальные проверены при первой отправке
+        changed = {name: result.files[name] for name in result.changed}
+        fixed_changed, validation_results, errors_corrected = validate_and_fix_scripts(changed)
+        if self.validator.should_regenerate_script(validation_results):
+            logger.info("После изменений скрипты непригодны, генерирую скрипты заново")
+            return None
+        
+        files = dict(previous_files)
+        files.update({name: fixed_changed[name] for name in result.changed})
+        if LOCAL_ARTIFACTS and "WindowsOptimizer.ps1" in result.changed:
+            files.update(generate_artifacts(files["WindowsOptimizer.ps1"]))
+        return files, validation_results, errors_corrected
+    
+    def _template_fallback(self, chat_id, notice=None):
+        """Шаблонные скрипты вместо ответа API
+        
+        Args:
+            chat_id: ID чата
+            notice (str, optional): Сообщение пользователю о причине
+            
+        Returns:
+            dict: Проверенные шаблонные файлы
+        """
+        if notice:
+            tg_sender.send_message(chat_id, notice)
+        
+        # Набор шаблонов уже проверен и улучшен при сборке
+        bundle = template_bundles.get('windows')
+        fixed_files = bundle.copy_files()
+        
+        # Обновляем статистику
+        self.metrics.record_script_generation({
+            "timestamp": datetime.now().isoformat(),
+            "errors": bundle.validation_results,
+            "error_count": bundle.error_count,
+            "fixed_count": bundle.errors_corrected,
+            "model": "template_fallback",
+            "api_error": True
+        })
+        
+        # Сохраняем файлы для последующей отправки
+        user_files[chat_id] = fixed_files
+        return fixed_files
+    
+    async def generate_new_script(self, message, img_data=None, on_progress=None):
+        """Генерация нового скрипта оптимизации на основе скриншота системы
+        
+        Args:
+            message: Сообщение Telegram со скриншотом
+            img_data (bytes, optional): Уже загруженный скриншот
+            on_progress (callable, optional): Функция обновления статуса генерации
+        """
         
         try:
             logger.info(f"Начинаю генерацию скрипта для пользователя {message.chat.id}")
@@ -535,32 +1457,95 @@ class OptimizationBot:
             if not message.photo:
                 return "Не найдено изображение. Пожалуйста, отправьте скриншот системной информации."
             
-            # Получаем файл фото
-            file_id = message.photo[-1].file_id
-            file_info = bot.get_file(file_id)
-            file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file_info.file_path}"
-            
-            # Загружаем изображение
-            img_data = requests.get(file_url).content
-            
-            # Кодируем изображение в base64
-            img_base64 = base64.b64encode(img_data).decode('utf-8')
+            # Загружаем скриншот и уменьшаем его перед отправкой в API
+            if img_data is None:
+                img_data = download_photo(message)
+            screenshot = preprocess_screenshot(img_data)
+            logger.info(f"Скриншот подготовлен: {screenshot.summary()}")
+            image_block = to_content_block(screenshot)
             
             # Формируем сообщение для API
             user_message = user_messages.get(message.chat.id, "Создай скрипт оптимизации Windows")
             
-            # Используем оптимизированный промпт, если он доступен
-            prompt = self.prompts.get("OPTIMIZATION_PROMPT_TEMPLATE", OPTIMIZATION_PROMPT_TEMPLATE)
+            # Используем оптимизированный промпт, если он доступен;
+            # при локальной сборке bat-файла и README модель пишет только PowerShell скрипт
+            if LOCAL_ARTIFACTS:
+                prompt = self.prompts.get("OPTIMIZATION_PS1_PROMPT_TEMPLATE", OPTIMIZATION_PS1_PROMPT_TEMPLATE)
+            else:
+                prompt = self.prompts.get("OPTIMIZATION_PROMPT_TEMPLATE", OPTIMIZATION_PROMPT_TEMPLATE)
+            
+            # Сначала быстрая модель, качественная - только если результат непригоден
+            route = self.router.route()
+            model = route[0]
+            
+            # Запрос без пожеланий пользователя: профиль системы и сборка скрипта из модулей
+            assemble = (ASSEMBLY_MODE and user_message in STANDARD_REQUEST_MESSAGES
+                        and self.client is not None and self.client_method != "completion")
+            if assemble:
+                cache_prompt = self.prompts.get("PROFILE_PROMPT_TEMPLATE", PROFILE_PROMPT_TEMPLATE)
+            else:
+                cache_prompt = prompt
+            
+            # Повторный или почти такой же скриншот того же пользователя отдаем из кеша без запроса к API
+            cache_key = None
+            try:
+                cache_key = (message.chat.id, perceptual_hash(img_data), user_message,
+                             prompt_version(cache_prompt), model)
+                cached_files = result_cache.lookup(*cache_key)
+            except Exception as e:
+                logger.warning(f"Не удалось проверить кеш результатов: {e}")
+                cached_files = None
+            if cached_files:
+                logger.info(f"Скрипты для пользователя {message.chat.id} взяты из кеша")
+                user_files[message.chat.id] = cached_files
+                return cached_files
             
             # Подготовка текста промпта
-            enhanced_prompt = f"{prompt}\n\n{user_message}\n\nЯ отправил скриншот со сведениями о системе. Создай скрипты оптимизации для Windows."
+            request_text = f"{user_message}\n\nЯ отправил скриншот со сведениями о системе. Создай скрипты оптимизации для Windows."
+            enhanced_prompt = f"{prompt}\n\n{request_text}"
             
+            # Статичные инструкции идут кешируемым системным промптом, в сообщении - только запрос
+            system = anthropic.cached_system_prompt(prompt)
+            accounting = {"user_id": message.chat.id, "prompt_version": prompt_version(prompt)}
+            
+            # Пока цепь разомкнута, не ждем таймаутов API и сразу отдаем шаблоны
+            if llm_breaker.state == CircuitBreaker.OPEN:
+                logger.warning(f"Claude API недоступен (цепь разомкнута), шаблонные скрипты для {message.chat.id}")
+                return self._template_fallback(message.chat.id, LLM_UNAVAILABLE_NOTICE)
+            
+            assembled = None
+            if assemble:
+                try:
+                    assembled = await self._assemble_from_profile(message.chat.id, image_block, model)
+                except (CircuitOpenError, ConcurrencyLimitExceeded) as circuit_error:
+                    # При перегрузке не отправляем следующий, более тяжелый запрос
+                    logger.warning(f"Claude API недоступен: {circuit_error}")
+                    return self._template_fallback(message.chat.id, LLM_UNAVAILABLE_NOTICE)
+            if assembled:
+                fixed_files, validation_results, errors_corrected = assembled
+                self.metrics.record_script_generation({
+                    "timestamp": datetime.now().isoformat(),
+                    "errors": validation_results,
+                    "error_count": sum(len(issues) for issues in validation_results.values()),
+                    "fixed_count": errors_corrected,
+                    "model": model,
+                    "assembled": True
+                })
+                user_files[message.chat.id] = fixed_files
+                if cache_key:
+                    result_cache.store(*cache_key, fixed_files)
+                return fixed_files
+            if assemble and cache_key:
+                # Результат полной генерации хранится под версией ее промпта
+                cache_key = cache_key[:3] + (prompt_version(prompt),) + cache_key[4:]
+            
+            started = time.monotonic()
             try:
                 # Проверяем, инициализирован ли клиент API
                 if self.client is None:
                     raise Exception("API клиент не инициализирован. Используем шаблонные скрипты.")
                 
-                logger.info("Отправляю запрос к Claude API...")
+                logger.info(f"Отправляю запрос к Claude API (модель {model})...")
                 
                 # Отправляем запрос в зависимости от версии клиента
                 if self.client_method == "completion":
@@ -592,101 +1577,90 @@ class OptimizationBot:
                             {
                                 "role": "user", 
                                 "content": [
+                                    image_block,
                                     {
                                         "type": "text",
-                                        "text": enhanced_prompt
+                                        "text": request_text
                                     }
                                 ]
                             }
                         ]
-                        response = await asyncio.to_thread(
-                            self.client.messages.create,
-                            model="claude-3-opus-20240229",
+                        response_text = await asyncio.to_thread(
+                            self._stream_completion,
+                            model,
+                            messages,
                             max_tokens=4000,
-                            messages=messages
+                            on_progress=on_progress,
+                            system=system,
+                            accounting=accounting
                         )
-                        response_text = response.content[0].text
                     except Exception as new_api_error:
                         # Резервный вызов без asyncio
                         error_str = str(new_api_error)
                         logger.error(f"Ошибка при использовании нового API асинхронно: {new_api_error}")
                         
+                        if isinstance(new_api_error, (CircuitOpenError, ConcurrencyLimitExceeded)):
+                            raise
+                        
                         if "invalid x-api-key" in error_str or "authentication_error" in error_str:
-                            # Отправляем сообщение об ошибке аутентификации
-                            bot.send_message(message.chat.id, 
-                                             "⚠️ Обнаружена проблема с API ключом.\n\n"
-                                             "Пожалуйста, получите новый ключ API на сайте Anthropic и настройте его в файле .env.\n"
-                                             "Пока что будут использоваться шаблонные скрипты.")
-                            
-                            # Переходим к использованию шаблонных скриптов
-                            files = self._get_template_scripts()
-                            # Проверяем и улучшаем шаблонные скрипты
-                            fixed_files, validation_results, errors_corrected = validate_and_fix_scripts(files)
-                            # Обновляем статистику
-                            self.metrics.record_script_generation({
-                                "timestamp": datetime.now().isoformat(),
-                                "errors": validation_results,
-                                "error_count": sum(len(issues) for issues in validation_results.values()),
-                                "fixed_count": errors_corrected,
-                                "model": "template_fallback",
-                                "api_error": True
-                            })
-                            # Сохраняем файлы для последующей отправки
-                            user_files[message.chat.id] = fixed_files
-                            return fixed_files
+                            # Отправляем сообщение об ошибке аутентификации и переходим к шаблонным скриптам
+                            return self._template_fallback(
+                                message.chat.id,
+                                "⚠️ Обнаружена проблема с API ключом.\n\n"
+                                "Пожалуйста, получите новый ключ API на сайте Anthropic и настройте его в файле .env.\n"
+                                "Пока что будут использоваться шаблонные скрипты."
+                            )
                             
+                        # Повторенные клиентом ошибки не отправляются второй раз, срок общий
+                        if not _direct_fallback_allowed(new_api_error, started):
+                            raise
+                        
+                        direct_started = time.monotonic()
                         try:
                             messages = [
                                 {
                                     "role": "user", 
                                     "content": [
+                                        image_block,
                                         {
                                             "type": "text",
-                                            "text": enhanced_prompt
+                                            "text": request_text
                                         }
                                     ]
                                 }
                             ]
-                            response = self.client.messages.create(
-                                model="claude-3-opus-20240229",
+                            response = llm_breaker.call(
+                                self._limited_create,
+                                deadline=started + LLM_CALL_DEADLINE,
+                                model=model,
                                 max_tokens=4000,
-                                messages=messages
+                                messages=messages,
+                                system=system
                             )
+                            self._record_llm_call(model, response, "success", accounting, direct_started)
                             response_text = response.content[0].text
                         except Exception as e:
+                            if not isinstance(e, (CircuitOpenError, ConcurrencyLimitExceeded)):
+                                self._record_llm_call(model, None, f"error:{type(e).__name__}", accounting, direct_started)
                             logger.error(f"Ошибка при использовании нового API напрямую: {e}")
                             raise
                 
                 logger.info(f"Получен ответ от Claude API, длина: {len(response_text)} символов")
+                self.router.record(model, (time.monotonic() - started) * 1000, True)
+            except (CircuitOpenError, ConcurrencyLimitExceeded) as circuit_error:
+                logger.warning(f"Claude API недоступен: {circuit_error}")
+                return self._template_fallback(message.chat.id, LLM_UNAVAILABLE_NOTICE)
             except Exception as api_error:
+                self.router.record(model, (time.monotonic() - started) * 1000, False)
                 # Проверяем ошибку баланса API
                 error_str = str(api_error)
                 if "credit balance is too low" in error_str or "Your credit balance is too low" in error_str:
                     logger.error(f"Ошибка недостаточного баланса API: {api_error}")
                     error_message = "К сожалению, баланс API-кредитов исчерпан. Пожалуйста, обратитесь к администратору для пополнения баланса."
                     error_message += "\n\nПока что будет использован резервный подход с шаблонными скриптами."
-                    bot.send_message(message.chat.id, error_message)
                     
                     # Используем альтернативный подход с шаблонами
-                    files = self._get_template_scripts()
-                    
-                    # Проверяем и улучшаем шаблонные скрипты
-                    fixed_files, validation_results, errors_corrected = validate_and_fix_scripts(files)
-                    
-                    # Обновляем статистику
-                    self.metrics.record_script_generation({
-                        "timestamp": datetime.now().isoformat(),
-                        "errors": validation_results,
-                        "error_count": sum(len(issues) for issues in validation_results.values()),
-                        "fixed_count": errors_corrected,
-                        "model": "template_fallback",
-                        "api_error": True
-                    })
-                    
-                    # Сохраняем файлы для последующей отправки
-                    user_files[message.chat.id] = fixed_files
-                    
-                    return fixed_files
+                    return self._template_fallback(message.chat.id, error_message)
                 else:
                     # Другая ошибка API - просто пробрасываем исключение
                     logger.error(f"Ошибка API: {api_error}")
@@ -702,17 +1676,33 @@ class OptimizationBot:
             # Дополнительная проверка и исправление скриптов
             fixed_files, validation_results, errors_corrected = validate_and_fix_scripts(files)
             
+            # Непригодный результат быстрой модели повторяем на качественной
+            escalation_model = self.router.escalation_model(model, route, validation_results, self.validator)
+            if escalation_model and self.client_method != "completion":
+                # Сначала заново только непригодные файлы, весь набор - если непригодны все
+                escalated = (
+                    await self._regenerate_failing_files(
+                        escalation_model, fixed_files, validation_results, on_progress, accounting
+                    )
+                    or await self._request_escalation(escalation_model, messages, on_progress, system, accounting)
+                )
+                if escalated:
+                    model = escalation_model
+                    fixed_files, validation_results, errors_corrected = escalated
+            
             # Обновляем статистику
             self.metrics.record_script_generation({
                 "timestamp": datetime.now().isoformat(),
                 "errors": validation_results,
                 "error_count": sum(len(issues) for issues in validation_results.values()),
                 "fixed_count": errors_corrected,
-                "model": "claude-3-opus-20240229"
+                "model": model
             })
             
             # Сохраняем файлы для последующей отправки
             user_files[message.chat.id] = fixed_files
+            if cache_key:
+                result_cache.store(*cache_key, fixed_files)
             
             return fixed_files
         
@@ -723,13 +1713,28 @@ class OptimizationBot:
     def _get_template_scripts(self, os_type='windows'):
         """Получение шаблонных скриптов в случае ошибки API
         
+        Файлы берутся из готового набора (template_bundles): проверка и
+        улучшение выполнены один раз при его сборке.
+        
         Args:
             os_type: тип операционной системы ('windows' или 'macos')
             
         Returns:
-            dict: Словарь с файлами (имя файла -> содержимое)
+            dict: Словарь с проверенными файлами (имя файла -> содержимое)
         """
         logger.info(f"Использую шаблонные скрипты из-за ошибки API для {os_type}")
+        return template_bundles.get(os_type).copy_files()
+    
+    @staticmethod
+    def _build_template_scripts(os_type='windows'):
+        """Исходные шаблонные скрипты (до проверки и улучшения)
+        
+        Args:
+            os_type: тип операционной системы ('windows' или 'macos')
+            
+        Returns:
+            dict: Словарь с файлами (имя файла -> содержимое)
+        """
         
         # Получаем шаблонные скрипты
         template_files = {}
@@ -1316,13 +2321,15 @@ Write-Host "Optimization script completed." -ForegroundColor Green
 pause
 """
         
-        # Подсчет и возврат найденных файлов
-        logger.info(f"Всего извлечено {len(template_files)} файлов из ответа API")
         return template_files
     
     def extract_files(self, response_text, os_type='windows'):
         """Извлечение файлов из ответа API
         
+        Ответ разбирается за один проход (iter_fenced_blocks), тип каждого блока
+        определяется по тегу языка и содержимому (classify_block). Для каждого
+        файла берется первый подходящий блок, недостающие файлы заменяются шаблонами.
+        
         Args:
             response_text (str): Текст ответа от API
             os_type (str): Тип операционной системы ('windows' или 'macos')
@@ -1333,144 +2340,46 @@ pause
         files = {}
         
         if os_type == 'macos':
-            # Шаблоны для извлечения блоков кода для macOS
-            shell_pattern = r"```bash\n(.*?)```"
-            command_pattern = r"```bash\n(.*?)```"
-            markdown_pattern = r"```markdown\n(.*?)```"
-            
-            # Извлечение Shell скрипта
-            shell_matches = re.findall(shell_pattern, response_text, re.DOTALL)
-            if shell_matches and len(shell_matches) >= 1:
-                shell_content = shell_matches[0]
-                # Проверяем на наличие шебанга
-                if "#!/bin/bash" not in shell_content:
-                    shell_content = "#!/bin/bash\n\n" + shell_content
-                files["MacOptimizer.sh"] = shell_content
-                logger.info(f"Извлечен Shell скрипт длиной {len(shell_content)} символов")
-            
-            # Извлечение Command скрипта (launcher)
-            if len(shell_matches) >= 2:
-                command_content = shell_matches[1]
-                # Проверяем на наличие шебанга
-                if "#!/bin/bash" not in command_content:
-                    command_content = "#!/bin/bash\n\n" + command_content
-                files["StartOptimizer.command"] = command_content
-                logger.info(f"Извлечен Command скрипт длиной {len(command_content)} символов")
-            
-            # Извлечение Markdown документации
-            md_matches = re.findall(markdown_pattern, response_text, re.DOTALL)
-            if md_matches:
-                md_content = md_matches[0]
-                files["README.md"] = md_content
-                logger.info(f"Извлечена документация длиной {len(md_content)} символов")
-            
-            # Проверка на пустые совпадения (ошибки в формате блоков кода)
-            if "MacOptimizer.sh" not in files or "StartOptimizer.command" not in files:
-                # Пробуем альтернативное извлечение без указания языка
-                alt_pattern = r"```\n(.*?)```"
-                alt_matches = re.findall(alt_pattern, response_text, re.DOTALL)
-                
-                if alt_matches:
-                    for i, content in enumerate(alt_matches):
-                        # Пытаемся определить тип файла по содержимому
-                        if i == 0 or ("optimize_mac" in content or "cleanup_system" in content):
-                            if "#!/bin/bash" not in content:
-                                content = "#!/bin/bash\n\n" + content
-                            files["MacOptimizer.sh"] = content
-                            logger.info(f"Извлечен Shell скрипт (альт.) длиной {len(content)} символов")
-                        elif i == 1 or "sudo" in content:
-                            if "#!/bin/bash" not in content:
-                                content = "#!/bin/bash\n\n" + content
-                            files["StartOptimizer.command"] = content
-                            logger.info(f"Извлечен Command скрипт (альт.) длиной {len(content)} символов")
-                        elif "#" in content and "macOS" in content:
-                            files["README.md"] = content
-                            logger.info(f"Извлечена документация (альт.) длиной {len(content)} символов")
-            
-            # Дополнительная проверка: добавляем файлы, которых не хватает
-            if "MacOptimizer.sh" not in files:
-                files["MacOptimizer.sh"] = self._get_template_scripts('macos')["MacOptimizer.sh"]
-                logger.info("Добавлен шаблонный Shell скрипт")
-            
-            if "StartOptimizer.command" not in files:
-                files["StartOptimizer.command"] = self._get_template_scripts('macos')["StartOptimizer.command"]
-                logger.info("Добавлен шаблонный Command скрипт")
-            
-            if "README.md" not in files:
-                files["README.md"] = self._get_template_scripts('macos')["README.md"]
-                logger.info("Добавлена шаблонная документация")
+            shell_files = ["MacOptimizer.sh", "StartOptimizer.command"]
+            for block in iter_fenced_blocks(response_text):
+                kind, score = classify_block(block, MACOS_KINDS)
+                if kind == "shell" and shell_files:
+                    # Первый скрипт - основной, второй - запускающий (launcher)
+                    filename = shell_files.pop(0)
+                    content = block.content
+                    # Проверяем на наличие шебанга
+                    if "#!/bin/bash" not in content:
+                        content = "#!/bin/bash\n\n" + content
+                    files[filename] = content
+                elif kind == "markdown" and "README.md" not in files:
+                    filename = "README.md"
+                    files[filename] = block.content
+                else:
+                    continue
+                logger.info(f"Извлечен {filename} (блок {block.index}, тег '{block.language}', "
+                            f"баллы {score}) длиной {len(files[filename])} символов")
         else:
-            # Шаблоны для извлечения блоков кода для Windows
-            powershell_pattern = r"```powershell\n(.*?)```"
-            batch_pattern = r"```batch\n(.*?)```"
-            markdown_pattern = r"```markdown\n(.*?)```"
-            
-            # Извлечение PowerShell скрипта
-            ps_matches = re.findall(powershell_pattern, response_text, re.DOTALL)
-            if ps_matches:
-                ps_content = ps_matches[0]
-                # Проверяем на наличие кодировки UTF-8
-                if "$OutputEncoding = [System.Text.Encoding]::UTF8" not in ps_content:
-                    ps_content = "# Encoding: UTF-8\n$OutputEncoding = [System.Text.Encoding]::UTF8\n\n" + ps_content
-                files["WindowsOptimizer.ps1"] = ps_content
-                logger.info(f"Извлечен PowerShell скрипт длиной {len(ps_content)} символов")
-            
-            # Извлечение Batch скрипта
-            bat_matches = re.findall(batch_pattern, response_text, re.DOTALL)
-            if bat_matches:
-                bat_content = bat_matches[0]
-                # Проверяем на наличие обязательных команд
-                if "@echo off" not in bat_content:
-                    bat_content = "@echo off\n" + bat_content
-                if "chcp 65001" not in bat_content:
-                    bat_content = bat_content.replace("@echo off", "@echo off\nchcp 65001 >nul")
-                files["Start-Optimizer.bat"] = bat_content
-                logger.info(f"Извлечен Batch скрипт длиной {len(bat_content)} символов")
-            
-            # Извлечение Markdown документации
-            md_matches = re.findall(markdown_pattern, response_text, re.DOTALL)
-            if md_matches:
-                md_content = md_matches[0]
-                files["README.md"] = md_content
-                logger.info(f"Извлечена документация длиной {len(md_content)} символов")
-            
-            # Проверка на пустые совпадения (ошибки в формате блоков кода)
-            if not ps_matches and not bat_matches and not md_matches:
-                # Пробуем альтернативное извлечение без указания языка
-                alt_pattern = r"```\n(.*?)```"
-                alt_matches = re.findall(alt_pattern, response_text, re.DOTALL)
-                
-                if alt_matches:
-                    for i, content in enumerate(alt_matches):
-                        # Пытаемся определить тип файла по содержимому
-                        if "function" in content and "$" in content:
-                            if "$OutputEncoding = [System.Text.Encoding]::UTF8" not in content:
-                                content = "# Encoding: UTF-8\n$OutputEncoding = [System.Text.Encoding]::UTF8\n\n" + content
-                            files["WindowsOptimizer.ps1"] = content
-                            logger.info(f"Извлечен PowerShell скрипт (альт.) длиной {len(content)} символов")
-                        elif "@echo off" in content or "powershell" in content.lower():
-                            if "@echo off" not in content:
-                                content = "@echo off\n" + content
-                            if "chcp 65001" not in content:
-                                content = content.replace("@echo off", "@echo off\nchcp 65001 >nul")
-                            files["Start-Optimizer.bat"] = content
-                            logger.info(f"Извлечен Batch скрипт (альт.) длиной {len(content)} символов")
-                        elif "#" in content and "Windows" in content:
-                            files["README.md"] = content
-                            logger.info(f"Извлечена документация (альт.) длиной {len(content)} символов")
-            
-            # Дополнительная проверка: добавляем файлы, которых не хватает
-            if "WindowsOptimizer.ps1" not in files:
-                files["WindowsOptimizer.ps1"] = self._get_template_scripts('windows')["WindowsOptimizer.ps1"]
-                logger.info("Добавлен шаблонный PowerShell скрипт")
-            
-            if "Start-Optimizer.bat" not in files:
-                files["Start-Optimizer.bat"] = self._get_template_scripts('windows')["Start-Optimizer.bat"]
-                logger.info("Добавлен шаблонный Batch скрипт")
-            
-            if "README.md" not in files:
-                files["README.md"] = self._get_template_scripts('windows')["README.md"]
-                logger.info("Добавлена шаблонная документация")
+            for block in iter_fenced_blocks(response_text):
+                kind, score = classify_block(block, WINDOWS_KINDS)
+                filename = STREAM_BLOCK_FILES.get(kind)
+                if filename is None or filename in files:
+                    continue
+                content = normalize_script_block(kind, block.content)
+                files[filename] = content
+                logger.info(f"Извлечен {filename} (блок {block.index}, тег '{block.language}', "
+                            f"баллы {score}) длиной {len(content)} символов")
+            if LOCAL_ARTIFACTS and "WindowsOptimizer.ps1" in files:
+                # Запускающий файл и инструкция строятся по основному скрипту
+                files.update(generate_artifacts(files["WindowsOptimizer.ps1"]))
+        
+        # Дополнительная проверка: добавляем файлы, которых не хватает
+        templates = None
+        for filename in MACOS_BLOCK_FILES if os_type == 'macos' else STREAM_BLOCK_FILES.values():
+            if filename not in files:
+                # Исходный шаблон: файлы ответа целиком проверяются и улучшаются позже
+                templates = templates or template_bundles.get(os_type).raw_files
+                files[filename] = templates[filename]
+                logger.info(f"Добавлен шаблонный файл {filename}")
         
         # Подсчет и возврат найденных файлов
         logger.info(f"Всего извлечено {len(files)} файлов из ответа API")
@@ -1480,72 +2389,15 @@ pause
         """Отправляет сгенерированные файлы пользователю в виде архива"""
         try:
             if not files:
-                bot.send_message(chat_id, "Не удалось создать файлы скриптов.")
+                tg_sender.send_message(chat_id, "Не удалось создать файлы скриптов.")
                 return False
             
             # Определяем тип ОС по именам файлов
             is_macos = "MacOptimizer.sh" in files
             
-            # Создаем ZIP-архив в памяти
-            zip_buffer = BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-                for filename, content in files.items():
-                    # Записываем файлы в архив (с правильной кодировкой)
-                    zip_file.writestr(filename, content)
-                
-                # Добавляем инструкции в архив
-                if is_macos:
-                    instructions = """# Инструкция по использованию скриптов оптимизации macOS
-
-1. Распакуйте все файлы из архива в отдельную папку на вашем Mac.
-
-ЗАПУСК СКРИПТА:
-
-1. Откройте терминал.
-2. Перейдите в папку со скриптами командой: cd путь/к/папке/со/скриптами
-3. Сделайте скрипты исполняемыми с помощью команды:
-   chmod +x MacOptimizer.sh StartOptimizer.command
-4. Запустите скрипт одним из способов:
-   a) Через Finder: дважды щелкните на StartOptimizer.command
-   b) Через Терминал: sudo ./MacOptimizer.sh
-
-ВАЖНЫЕ ПРИМЕЧАНИЯ:
-- Перед запуском создайте резервную копию важных данных.
-- Вас попросят ввести пароль администратора.
-- Скрипты создают резервные копии измененных параметров в папке ~/MacOptimizer_Backups.
-- Все действия скриптов записываются в лог-файл ~/Library/Logs/MacOptimizer.log.
-
-Если у вас возникнут проблемы, используйте команду /help для получения справки."""
-                else:
-                    instructions = """# Инструкция по использованию скриптов оптимизации Windows
-
-1. Распакуйте все файлы из архива в отдельную папку на вашем компьютере.
-
-СПОСОБ 1 (РЕКОМЕНДУЕТСЯ): Запуск через PowerShell
-- Щелкните правой кнопкой мыши на файле Run-Optimizer.ps1
-- Выберите "Запустить с помощью PowerShell" или "Запустить от имени администратора"
-- Следуйте инструкциям на экране
-
-СПОСОБ 2: Запуск через командную строку
-- Запустите командную строку от имени администратора
-- Перейдите в папку со скриптами командой: cd путь\\к\\папке\\со\\скриптами
-- Выполните команду: Start-Optimizer.bat
-
-ЕСЛИ ВОЗНИКАЮТ ОШИБКИ КОДИРОВКИ:
-Если при запуске Start-Optimizer.bat видны ошибки с символами "", используйте 
-метод запуска через PowerShell скрипт Run-Optimizer.ps1 (Способ 1).
-
-## Важно:
-- Перед запуском создайте точку восстановления системы.
-- Скрипты создают резервные копии измененных параметров в папке WindowsOptimizer_Backups.
-- Все действия скриптов записываются в лог-файл в папке Temp.
-
-Если у вас возникнут проблемы, используйте команду /help для получения справки."""
-                
-                zip_file.writestr("КАК_ИСПОЛЬЗОВАТЬ.txt", instructions)
-            
-            # Сбрасываем указатель буфера на начало
-            zip_buffer.seek(0)
+            # Шаблонные файлы уже упакованы в архив при сборке набора
+            bundle = template_bundles.find(files)
+            archive = bundle.archive if bundle is not None else build_script_archive(files)
             
             # Определяем имя архива и текст сообщения в зависимости от ОС
             if is_macos:
@@ -1567,16 +2419,11 @@ pause
                                 "3. Дождитесь завершения работы скрипта\n\n"\
                                 "ℹ️ Если возникнут ошибки при запуске скрипта, отправьте мне скриншот с ошибкой."
             
-            # Отправляем архив пользователю
-            bot.send_document(
-                chat_id=chat_id,
-                document=zip_buffer,
-                caption=caption,
-                visible_file_name=archive_name
-            )
+            # Отправляем архив пользователю (ранее загруженный архив - по file_id)
+            tg_sender.send_document_bytes(chat_id, archive, archive_name, caption=caption)
             
             # Отправляем дополнительное сообщение с инструкциями
-            bot.send_message(
+            tg_sender.send_message(
                 chat_id=chat_id,
                 text=additional_msg,
                 parse_mode="Markdown"
@@ -1589,14 +2436,19 @@ pause
         
         except Exception as e:
             logger.error(f"Ошибка при отправке файлов пользователю: {e}", exc_info=True)
-            bot.send_message(
+            tg_sender.send_message(
                 chat_id=chat_id, 
                 text=f"❌ Произошла ошибка при отправке файлов: {str(e)}"
             )
             return False
 
-    async def fix_script_errors(self, message):
-        """Генерация скриптов с улучшенным промптом после обнаружения ошибок"""
+    async def fix_script_errors(self, message, on_progress=None):
+        """Генерация скриптов с улучшенным промптом после обнаружения ошибок
+        
+        Args:
+            message: Сообщение Telegram со скриншотом ошибки
+            on_progress (callable, optional): Функция обновления статуса генерации
+        """
         try:
             logger.info(f"Начинаю исправление ошибок в скрипте для пользователя {message.chat.id}")
             
@@ -1604,27 +2456,34 @@ pause
             if not message.photo:
                 return "Не найдено изображение с ошибкой. Пожалуйста, отправьте скриншот ошибки."
             
-            # Получаем файл фото
-            file_id = message.photo[-1].file_id
-            file_info = bot.get_file(file_id)
-            file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file_info.file_path}"
-            
-            # Загружаем изображение
-            img_data = requests.get(file_url).content
-            
-            # Кодируем изображение в base64
-            img_base64 = base64.b64encode(img_data).decode('utf-8')
+            # Загружаем скриншот и уменьшаем его перед отправкой в API
+            screenshot = preprocess_screenshot(download_photo(message))
+            logger.info(f"Скриншот подготовлен: {screenshot.summary()}")
+            image_block = to_content_block(screenshot)
             
             # Формируем сообщение для API
             user_message = user_messages.get(message.chat.id, "Исправь ошибки в скрипте, показанные на скриншоте")
             
-            # Используем оптимизированный промпт исправления ошибок
-            prompt = self.prompts.get("ERROR_FIX_PROMPT_TEMPLATE", ERROR_FIX_PROMPT_TEMPLATE)
+            # Используем оптимизированный промпт исправления ошибок;
+            # при локальной сборке bat-файла и README модель исправляет только PowerShell скрипт
+            if LOCAL_ARTIFACTS:
+                prompt = self.prompts.get("ERROR_FIX_PS1_PROMPT_TEMPLATE", ERROR_FIX_PS1_PROMPT_TEMPLATE)
+            else:
+                prompt = self.prompts.get("ERROR_FIX_PROMPT_TEMPLATE", ERROR_FIX_PROMPT_TEMPLATE)
             
             # Подготовка текста промпта
-            enhanced_prompt = f"{prompt}\n\n{user_message}\n\nЯ отправил скриншот с ошибками в скрипте. Исправь основные проблемы, которые обычно возникают в PowerShell скриптах."
+            request_text = f"{user_message}\n\nЯ отправил скриншот с ошибками в скрипте. Исправь основные проблемы, которые обычно возникают в PowerShell скриптах."
+            enhanced_prompt = f"{prompt}\n\n{request_text}"
+            
+            # Статичные инструкции идут кешируемым системным промптом, в сообщении - только запрос
+            system = anthropic.cached_system_prompt(prompt)
+            accounting = {"user_id": message.chat.id, "prompt_version": prompt_version(prompt)}
+            
+            # Сначала быстрая модель, качественная - только если результат непригоден
+            route = self.router.route()
+            model = route[0]
             
-            logger.info("Отправляю запрос к Claude API для исправления ошибок...")
+            logger.info(f"Отправляю запрос к Claude API для исправления ошибок (модель {model})...")
             
             # Проверяем, инициализирован ли клиент API
             if self.client is None:
@@ -1632,6 +2491,39 @@ pause
                 files = self._get_template_scripts()
                 return files
             
+            # Пока цепь разомкнута, не ждем таймаутов API
+            if llm_breaker.state == CircuitBreaker.OPEN:
+                logger.warning("Claude API недоступен (цепь разомкнута). Используем шаблонные скрипты.")
+                tg_sender.send_message(message.chat.id, LLM_UNAVAILABLE_NOTICE)
+                return self._get_template_scripts()
+            
+            # Если у пользователя есть отправленный набор, сначала просим только изменения;
+            # полная генерация - если изменения не применились
+            previous_files = user_files.get(message.chat.id)
+            if (PATCH_MODE and previous_files and "WindowsOptimizer.ps1" in previous_files
+                    and self.client_method != "completion"):
+                try:
+                    patched = await self._fix_with_patch(
+                        message.chat.id, previous_files, image_block, user_message, model, on_progress
+                    )
+                except (CircuitOpenError, ConcurrencyLimitExceeded) as circuit_error:
+                    logger.warning(f"Claude API недоступен при исправлении скрипта: {circuit_error}")
+                    return self._get_template_scripts()
+                if patched is not None:
+                    fixed_files, validation_results, errors_corrected = patched
+                    self.metrics.record_script_generation({
+                        "timestamp": datetime.now().isoformat(),
+                        "errors": validation_results,
+                        "error_count": sum(len(issues) for issues in validation_results.values()),
+                        "fixed_count": errors_corrected,
+                        "model": model,
+                        "is_error_fix": True,
+                        "is_patch": True
+                    })
+                    user_files[message.chat.id] = fixed_files
+                    return fixed_files
+            
+            started = time.monotonic()
             try:
                 # Отправляем запрос в зависимости от версии клиента
                 if self.client_method == "completion":
@@ -1663,64 +2555,87 @@ pause
                             {
                                 "role": "user", 
                                 "content": [
+                                    image_block,
                                     {
                                         "type": "text",
-                                        "text": enhanced_prompt
+                                        "text": request_text
                                     }
                                 ]
                             }
                         ]
-                        response = await asyncio.to_thread(
-                            self.client.messages.create,
-                            model="claude-3-opus-20240229",
+                        response_text = await asyncio.to_thread(
+                            self._stream_completion,
+                            model,
+                            messages,
                             max_tokens=4000,
-                            messages=messages
+                            on_progress=on_progress,
+                            system=system,
+                            accounting=accounting
                         )
-                        response_text = response.content[0].text
                     except Exception as new_api_error:
                         # Резервный вызов без asyncio
                         error_str = str(new_api_error)
                         logger.error(f"Ошибка при использовании нового API асинхронно для исправления: {new_api_error}")
                         
+                        if isinstance(new_api_error, (CircuitOpenError, ConcurrencyLimitExceeded)):
+                            raise
+                        
                         if "invalid x-api-key" in error_str or "authentication_error" in error_str:
                             # Отправляем сообщение об ошибке аутентификации
-                            bot.send_message(message.chat.id, 
+                            tg_sender.send_message(message.chat.id, 
                                             "⚠️ Обнаружена проблема с API ключом.\n\n"
                                             "Пожалуйста, получите новый ключ API на сайте Anthropic и настройте его в файле .env.")
                             # Используем альтернативный подход с шаблонами
                             files = self._get_template_scripts()
                             return files
                         
+                        # Повторенные клиентом ошибки не отправляются второй раз, срок общий
+                        if not _direct_fallback_allowed(new_api_error, started):
+                            raise
+                        
+                        direct_started = time.monotonic()
                         try:
                             messages = [
                                 {
                                     "role": "user", 
                                     "content": [
+                                        image_block,
                                         {
                                             "type": "text",
-                                            "text": enhanced_prompt
+                                            "text": request_text
                                         }
                                     ]
                                 }
                             ]
-                            response = self.client.messages.create(
-                                model="claude-3-opus-20240229",
+                            response = llm_breaker.call(
+                                self._limited_create,
+                                deadline=started + LLM_CALL_DEADLINE,
+                                model=model,
                                 max_tokens=4000,
-                                messages=messages
+                                messages=messages,
+                                system=system
                             )
+                            self._record_llm_call(model, response, "success", accounting, direct_started)
                             response_text = response.content[0].text
                         except Exception as e:
+                            if not isinstance(e, (CircuitOpenError, ConcurrencyLimitExceeded)):
+                                self._record_llm_call(model, None, f"error:{type(e).__name__}", accounting, direct_started)
                             logger.error(f"Ошибка при использовании нового API напрямую для исправления: {e}")
                             raise
                 
                 logger.info(f"Получен ответ от Claude API, длина: {len(response_text)} символов")
+                self.router.record(model, (time.monotonic() - started) * 1000, True)
+            except (CircuitOpenError, ConcurrencyLimitExceeded) as circuit_error:
+                logger.warning(f"Claude API недоступен при исправлении скрипта: {circuit_error}")
+                return self._get_template_scripts()
             except Exception as api_error:
+                self.router.record(model, (time.monotonic() - started) * 1000, False)
                 # Проверяем ошибку баланса API
                 error_str = str(api_error)
                 if "credit balance is too low" in error_str or "Your credit balance is too low" in error_str:
                     logger.error(f"Ошибка недостаточного баланса API: {api_error}")
                     error_message = "К сожалению, баланс API-кредитов исчерпан. Пожалуйста, обратитесь к администратору для пополнения баланса."
-                    bot.send_message(message.chat.id, error_message)
+                    tg_sender.send_message(message.chat.id, error_message)
                     
                     # Используем альтернативный подход с шаблонами
                     files = self._get_template_scripts()
@@ -1742,13 +2657,27 @@ pause
             # Дополнительная проверка и исправление скриптов
             fixed_files, validation_results, errors_corrected = validate_and_fix_scripts(files)
             
+            # Непригодный результат быстрой модели повторяем на качественной
+            escalation_model = self.router.escalation_model(model, route, validation_results, self.validator)
+            if escalation_model and self.client_method != "completion":
+                # Сначала заново только непригодные файлы, весь набор - если непригодны все
+                escalated = (
+                    await self._regenerate_failing_files(
+                        escalation_model, fixed_files, validation_results, on_progress, accounting
+                    )
+                    or await self._request_escalation(escalation_model, messages, on_progress, system, accounting)
+                )
+                if escalated:
+                    model = escalation_model
+                    fixed_files, validation_results, errors_corrected = escalated
+            
             # Обновляем статистику
             self.metrics.record_script_generation({
                 "timestamp": datetime.now().isoformat(),
                 "errors": validation_results,
                 "error_count": sum(len(issues) for issues in validation_results.values()),
                 "fixed_count": errors_corrected,
-                "model": "claude-3-opus-20240229",
+                "model": model,
                 "is_error_fix": True
             })
             
@@ -1794,7 +2723,7 @@ def cmd_start(message):
         markup.add(btn1, btn2)
         
         # Приветственное сообщение
-        bot.send_message(
+        tg_sender.send_message(
             message.chat.id,
             f"👋 Привет, {message.from_user.first_name}!\n\n"
             "Я бот для создания скриптов оптимизации Windows.\n\n"
@@ -1810,56 +2739,7 @@ def cmd_start(message):
         logger.info(f"Пользователь {message.chat.id} запустил бота")
     except Exception as e:
         logger.error(f"Ошибка в обработчике команды /start: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка при запуске бота. Пожалуйста, попробуйте снова.")
-
-# Обработчик для проверки подписки
-def check_subscription_before_action(message):
-    """
-    Проверяет наличие активной подписки у пользователя перед выполнением действия
-    
-    Args:
-        message: Объект сообщения от Telegram
-        
-    Returns:
-        bool: True, если есть активная подписка или проверка отключена
-    """
-    if not has_subscription_check:
-        return True  # Если модуль проверки подписок не загружен, пропускаем проверку
-    
-    # Получаем информацию о боте для формирования ссылки на оплату
-    try:
-        bot_info = bot.get_me()
-        bot_username = bot_info.username
-    except Exception as e:
-        logger.error(f"Ошибка при получении информации о боте: {e}")
-        bot_username = "your_bot"  # Запасной вариант
-    
-    user_id = message.from_user.id
-    if check_user_subscription(str(user_id)):
-        return True
-    else:
-        # Создаем кнопку для оплаты через мини-приложение
-        markup = types.InlineKeyboardMarkup()
-        # Создаем URL для мини-приложения оплаты
-        # Для WebApp в Telegram необходимо использовать только публичные URL (localhost не подходит)
-        # Используем реальный URL платежной системы на Railway
-        payment_url = f"{PAYMENT_SYSTEM_URL}/?user_id={user_id}&bot_username={bot_username}"
-        
-        # Добавляем кнопку оплаты
-        payment_button = types.InlineKeyboardButton(
-            text="💳 Оплатить подписку", 
-            web_app=types.WebAppInfo(url=payment_url)
-        )
-        markup.add(payment_button)
-        
-        # Отправляем сообщение с кнопкой оплаты
-        bot.send_message(
-            chat_id=message.chat.id, 
-            text="⚠️ *Ваша подписка не активна*\n\nДля использования всех функций бота необходимо приобрести подписку.", 
-            parse_mode="Markdown",
-            reply_markup=markup
-        )
-        return False
+        tg_sender.send_message(message.chat.id, "Произошла ошибка при запуске бота. Пожалуйста, попробуйте снова.")
 
 # Обработчик для выбора пользователя - модифицируем для проверки подписки
 @bot.message_handler(func=lambda message: user_states.get(message.chat.id) == "main_menu")
@@ -1877,7 +2757,7 @@ def handle_user_choice(message):
             user_messages[message.chat.id] = "Создай скрипт оптимизации Windows на основе этого скриншота"
             
             # Запрашиваем скриншот
-            bot.send_message(
+            tg_sender.send_message(
                 message.chat.id,
                 "📸 Отправьте скриншот с информацией о вашей системе (например, из приложения 'Сведения о системе' или 'Диспетчер задач').",
                 reply_markup=types.ReplyKeyboardRemove()
@@ -1897,7 +2777,7 @@ def handle_user_choice(message):
             user_messages[message.chat.id] = "Исправь ошибки в скрипте, показанные на этом скриншоте"
             
             # Запрашиваем скриншот с ошибкой
-            bot.send_message(
+            tg_sender.send_message(
                 message.chat.id,
                 "📸 Отправьте скриншот с ошибкой, которую нужно исправить.",
                 reply_markup=types.ReplyKeyboardRemove()
@@ -1906,13 +2786,13 @@ def handle_user_choice(message):
             logger.info(f"Пользователь {message.chat.id} выбрал исправление ошибок в скрипте")
             
         else:
-            bot.send_message(
+            tg_sender.send_message(
                 message.chat.id,
                 "Пожалуйста, выберите один из вариантов на клавиатуре.",
             )
     except Exception as e:
         logger.error(f"Ошибка в обработчике выбора пользователя: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте снова.")
+        tg_sender.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте снова.")
 
 # Обработчик команды /help - дополняем информацией о подписке
 @bot.message_handler(commands=['help'])
@@ -1945,7 +2825,7 @@ def cmd_help(message):
 
 *Важно:* Перед запуском скриптов оптимизации рекомендуется создать точку восстановления системы.
 """
-        bot.send_message(message.chat.id, help_text, parse_mode="Markdown")
+        tg_sender.send_message(message.chat.id, help_text, parse_mode="Markdown")
         
         # Добавляем информацию о подписке, если доступно
         if has_subscription_check:
@@ -1962,9 +2842,9 @@ def cmd_help(message):
 
 Для более подробной информации используйте команду /subscription
 """
-                bot.send_message(message.chat.id, sub_text, parse_mode="Markdown")
+                tg_sender.send_message(message.chat.id, sub_text, parse_mode="Markdown")
             else:
-                bot.send_message(
+                tg_sender.send_message(
                     message.chat.id,
                     "⚠️ У вас нет активной подписки. Используйте команду /subscription для получения информации о подписке.",
                     parse_mode="Markdown"
@@ -1973,7 +2853,7 @@ def cmd_help(message):
         logger.info(f"Пользователь {message.chat.id} запросил справку")
     except Exception as e:
         logger.error(f"Ошибка в обработчике команды /help: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка при отправке справки. Пожалуйста, попробуйте снова.")
+        tg_sender.send_message(message.chat.id, "Произошла ошибка при отправке справки. Пожалуйста, попробуйте снова.")
 
 # Обработчик команды /cancel
 @bot.message_handler(commands=['cancel'])
@@ -1989,7 +2869,7 @@ def cmd_cancel(message):
         btn2 = types.KeyboardButton("🔨 Исправить ошибки в скрипте")
         markup.add(btn1, btn2)
         
-        bot.send_message(
+        tg_sender.send_message(
             message.chat.id, 
             "❌ Текущая операция отменена. Выберите, что вы хотите сделать:",
             reply_markup=markup
@@ -1998,7 +2878,7 @@ def cmd_cancel(message):
         logger.info(f"Пользователь {message.chat.id} отменил текущую операцию")
     except Exception as e:
         logger.error(f"Ошибка в обработчике команды /cancel: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка при отмене операции. Пожалуйста, попробуйте снова.")
+        tg_sender.send_message(message.chat.id, "Произошла ошибка при отмене операции. Пожалуйста, попробуйте снова.")
 
 # Обработчик для скриншотов с ошибками
 @bot.message_handler(content_types=['photo'], func=lambda message: user_states.get(message.chat.id) == "waiting_for_error_screenshot")
@@ -2014,12 +2894,12 @@ def process_error_photo(message):
             btn1 = types.KeyboardButton("🔧 Создать скрипт оптимизации")
             btn2 = types.KeyboardButton("🔨 Исправить ошибки в скрипте")
             markup.add(btn1, btn2)
-            bot.send_message(message.chat.id, "Выберите действие:", reply_markup=markup)
+            tg_sender.send_message(message.chat.id, "Выберите действие:", reply_markup=markup)
             return
         
         # Продолжаем обработку фото
         # Сообщаем пользователю, что начали обработку
-        processing_msg = bot.send_message(
+        processing_msg = tg_sender.send_message(
             message.chat.id,
             "🔍 Анализирую ошибку на скриншоте...",
             reply_markup=types.ReplyKeyboardRemove()
@@ -2033,7 +2913,12 @@ def process_error_photo(message):
         
         try:
             # Вызываем асинхронную функцию через asyncio.run
-            result = asyncio.run(optimization_bot.fix_script_errors(message))
+            result = asyncio.run(optimization_bot.fix_script_errors(
+                message,
+                on_progress=make_progress_callback(
+                    message.chat.id, processing_msg.message_id, "🔍 Анализирую ошибку на скриншоте..."
+                )
+            ))
         except Exception as api_error:
             logger.error(f"Ошибка при исправлении скрипта: {api_error}")
             
@@ -2042,20 +2927,20 @@ def process_error_photo(message):
                 result = optimization_bot._get_template_scripts()
                 
                 try:
-                    bot.edit_message_text(
+                    tg_sender.edit_message_text(
                         "⚠️ Возникла проблема при анализе ошибки. Будут предоставлены стандартные скрипты оптимизации.",
                         message.chat.id,
                         processing_msg.message_id
                     )
                 except Exception as edit_error:
                     logger.warning(f"Не удалось отредактировать сообщение: {edit_error}")
-                    bot.send_message(
+                    tg_sender.send_message(
                         message.chat.id,
                         "⚠️ Возникла проблема при анализе ошибки. Будут предоставлены стандартные скрипты оптимизации."
                     )
             except Exception as fallback_error:
                 logger.error(f"Ошибка при создании шаблонных скриптов: {fallback_error}")
-                bot.send_message(
+                tg_sender.send_message(
                     message.chat.id,
                     "❌ Возникла критическая ошибка. Пожалуйста, попробуйте позже."
                 )
@@ -2066,13 +2951,13 @@ def process_error_photo(message):
             # Сообщаем об успешном исправлении
             try:
                 if "MacOptimizer.sh" in result or "WindowsOptimizer.ps1" in result:
-                    bot.edit_message_text(
+                    tg_sender.edit_message_text(
                         "✅ Создаю ZIP-архив со скриптами оптимизации...",
                         message.chat.id,
                         processing_msg.message_id
                     )
                 else:
-                    bot.edit_message_text(
+                    tg_sender.edit_message_text(
                         "✅ Ошибки успешно исправлены! Создаю ZIP-архив с исправленными скриптами...",
                         message.chat.id,
                         processing_msg.message_id
@@ -2081,7 +2966,7 @@ def process_error_photo(message):
                 if "message can't be edited" in str(api_error):
                     logger.warning(f"Не удалось отредактировать сообщение - сообщение не может быть отредактировано")
                     # Отправляем новое сообщение вместо редактирования
-                    bot.send_message(
+                    tg_sender.send_message(
                         message.chat.id,
                         "✅ Ошибки успешно исправлены! Создаю ZIP-архив с исправленными скриптами..."
                     )
@@ -2090,7 +2975,7 @@ def process_error_photo(message):
             except Exception as edit_error:
                 logger.warning(f"Не удалось отредактировать сообщение: {edit_error}")
                 # Отправляем новое сообщение вместо редактирования
-                bot.send_message(
+                tg_sender.send_message(
                     message.chat.id,
                     "✅ Ошибки успешно исправлены! Создаю ZIP-архив с исправленными скриптами..."
                 )
@@ -2100,7 +2985,7 @@ def process_error_photo(message):
                 asyncio.run(optimization_bot.send_script_files_to_user(message.chat.id, result))
             except Exception as send_error:
                 logger.error(f"Ошибка при отправке файлов: {send_error}")
-                bot.send_message(
+                tg_sender.send_message(
                     message.chat.id, 
                     "❌ Произошла ошибка при отправке файлов. Пожалуйста, попробуйте еще раз."
                 )
@@ -2111,7 +2996,7 @@ def process_error_photo(message):
             btn2 = types.KeyboardButton("🔨 Исправить ошибки в скрипте")
             markup.add(btn1, btn2)
             
-            bot.send_message(
+            tg_sender.send_message(
                 message.chat.id,
                 "Что еще вы хотите сделать?",
                 reply_markup=markup
@@ -2123,7 +3008,7 @@ def process_error_photo(message):
         else:
             # В случае ошибки
             try:
-                bot.edit_message_text(
+                tg_sender.edit_message_text(
                     f"❌ {result}",
                     message.chat.id,
                     processing_msg.message_id
@@ -2132,7 +3017,7 @@ def process_error_photo(message):
                 if "message can't be edited" in str(api_error):
                     logger.warning(f"Не удалось отредактировать сообщение - сообщение не может быть отредактировано")
                     # Отправляем новое сообщение вместо редактирования
-                    bot.send_message(
+                    tg_sender.send_message(
                         message.chat.id,
                         f"❌ {result}"
                     )
@@ -2141,20 +3026,20 @@ def process_error_photo(message):
             except Exception as edit_error:
                 logger.warning(f"Не удалось отредактировать сообщение: {edit_error}")
                 # Отправляем новое сообщение вместо редактирования
-                bot.send_message(
+                tg_sender.send_message(
                     message.chat.id,
                     f"❌ {result}"
                 )
             
             # Предлагаем попробовать снова
-            bot.send_message(
+            tg_sender.send_message(
                 message.chat.id,
                 "Пожалуйста, отправьте более четкий скриншот с ошибкой или вернитесь в главное меню с помощью команды /cancel."
             )
         
     except Exception as e:
         logger.error(f"Ошибка в обработчике фото с ошибкой: {e}", exc_info=True)
-        bot.send_message(
+        tg_sender.send_message(
             message.chat.id,
             f"❌ Произошла ошибка при обработке фото: {str(e)}\n\nПопробуйте отправить другой скриншот или вернитесь в главное меню с помощью команды /cancel."
         )
@@ -2165,7 +3050,7 @@ def process_error_photo(message):
         btn1 = types.KeyboardButton("🔧 Создать скрипт оптимизации")
         btn2 = types.KeyboardButton("🔨 Исправить ошибки в скрипте")
         markup.add(btn1, btn2)
-        bot.send_message(message.chat.id, "Выберите действие:", reply_markup=markup)
+        tg_sender.send_message(message.chat.id, "Выберите действие:", reply_markup=markup)
 
 # Обработчик для скриншотов с системной информацией
 @bot.message_handler(content_types=['photo'], func=lambda message: user_states.get(message.chat.id) == "waiting_for_screenshot")
@@ -2181,12 +3066,12 @@ def process_photo(message):
             btn1 = types.KeyboardButton("🔧 Создать скрипт оптимизации")
             btn2 = types.KeyboardButton("🔨 Исправить ошибки в скрипте")
             markup.add(btn1, btn2)
-            bot.send_message(message.chat.id, "Выберите действие:", reply_markup=markup)
+            tg_sender.send_message(message.chat.id, "Выберите действие:", reply_markup=markup)
             return
             
         # Продолжаем обработку фото как обычно
         # Сообщаем пользователю, что начали обработку
-        processing_msg = bot.send_message(
+        processing_msg = tg_sender.send_message(
             message.chat.id,
             "🔍 Анализирую систему на скриншоте и создаю скрипт оптимизации...",
             reply_markup=types.ReplyKeyboardRemove()
@@ -2199,8 +3084,35 @@ def process_photo(message):
         result = None
         
         try:
-            # Вызываем асинхронную функцию через asyncio.run
-            result = asyncio.run(optimization_bot.generate_new_script(message))
+            # Повторная отправка того же скриншота, пока идет генерация, присоединяется
+            # к уже выполняющемуся запросу: API вызывается и генерация списывается один раз
+            img_data = download_photo(message)
+            flight_key = f"{message.chat.id}:{hashlib.sha256(img_data).hexdigest()}"
+            result, is_leader = generation_flights.do(
+                flight_key,
+                lambda: asyncio.run(optimization_bot.generate_new_script(
+                    message, img_data=img_data,
+                    on_progress=make_progress_callback(
+                        message.chat.id, processing_msg.message_id,
+                        "🔍 Анализирую систему на скриншоте и создаю скрипт оптимизации..."
+                    )
+                ))
+            )
+            if not is_leader:
+                logger.info(f"Повторный скриншот пользователя {message.chat.id} объединен с выполняющимся запросом")
+                try:
+                    tg_sender.edit_message_text(
+                        "ℹ️ Этот скриншот уже обрабатывается - скрипты придут в ответ на первое сообщение.",
+                        message.chat.id,
+                        processing_msg.message_id
+                    )
+                except Exception as edit_error:
+                    logger.warning(f"Не удалось отредактировать сообщение: {edit_error}")
+                return
+        except CoalescedCallError:
+            # Первый запрос сам отправит пользователю шаблонные скрипты
+            logger.info(f"Объединенный запрос пользователя {message.chat.id} завершился ошибкой")
+            return
         except Exception as api_error:
             logger.error(f"Ошибка при генерации скрипта: {api_error}")
             
@@ -2209,20 +3121,20 @@ def process_photo(message):
                 result = optimization_bot._get_template_scripts()
                 
                 try:
-                    bot.edit_message_text(
+                    tg_sender.edit_message_text(
                         "⚠️ Возникла проблема при анализе скриншота. Будут предоставлены стандартные скрипты оптимизации.",
                         message.chat.id,
                         processing_msg.message_id
                     )
                 except Exception as edit_error:
                     logger.warning(f"Не удалось отредактировать сообщение: {edit_error}")
-                    bot.send_message(
+                    tg_sender.send_message(
                         message.chat.id,
                         "⚠️ Возникла проблема при анализе скриншота. Будут предоставлены стандартные скрипты оптимизации."
                     )
             except Exception as fallback_error:
                 logger.error(f"Ошибка при создании шаблонных скриптов: {fallback_error}")
-                bot.send_message(
+                tg_sender.send_message(
                     message.chat.id,
                     "❌ Возникла критическая ошибка. Пожалуйста, попробуйте позже."
                 )
@@ -2233,21 +3145,21 @@ def process_photo(message):
         if result:
             if isinstance(result, str):
                 # Если результат - строка, значит произошла ошибка
-                bot.send_message(message.chat.id, result)
+                tg_sender.send_message(message.chat.id, result)
                 user_states[message.chat.id] = "main_menu"
             else:
                 # Если результат - словарь с файлами, отправляем пользователю
                 try:
                     # Обновляем сообщение о статусе
                     try:
-                        bot.edit_message_text(
+                        tg_sender.edit_message_text(
                             "✅ Скрипты оптимизации успешно созданы! Подготавливаю файлы для отправки...",
                             message.chat.id,
                             processing_msg.message_id
                         )
                     except Exception as edit_error:
                         logger.warning(f"Не удалось отредактировать сообщение: {edit_error}")
-                        bot.send_message(
+                        tg_sender.send_message(
                             message.chat.id,
                             "✅ Скрипты оптимизации успешно созданы! Подготавливаю файлы для отправки..."
                         )
@@ -2264,11 +3176,13 @@ def process_photo(message):
                     script_gen_count += 1
                     
                     # Валидируем скрипты и собираем статистику ошибок
+                    # (шаблонные наборы проверены при сборке)
                     try:
-                        validation_results = validate_and_fix_scripts(result)
-                        if validation_results.get("errors", 0) > 0:
-                            # Обновляем статистику ошибок
-                            optimization_bot.update_error_stats(validation_results)
+                        if template_bundles.find(result) is None:
+                            validation_results = validate_and_fix_scripts(result)
+                            if validation_results.get("errors", 0) > 0:
+                                # Обновляем статистику ошибок
+                                optimization_bot.update_error_stats(validation_results)
                     except Exception as val_err:
                         logger.error(f"Ошибка при валидации скриптов: {val_err}")
                     
@@ -2281,7 +3195,7 @@ def process_photo(message):
                     btn2 = types.KeyboardButton("🔨 Исправить ошибки в скрипте")
                     markup.add(btn1, btn2)
                     
-                    bot.send_message(
+                    tg_sender.send_message(
                         message.chat.id,
                         "✅ Скрипты готовы! Что вы хотите сделать дальше?",
                         reply_markup=markup
@@ -2289,13 +3203,13 @@ def process_photo(message):
                     
                 except Exception as e:
                     logger.error(f"Ошибка при отправке файлов: {e}")
-                    bot.send_message(
+                    tg_sender.send_message(
                         message.chat.id,
                         "❌ Произошла ошибка при подготовке файлов. Пожалуйста, попробуйте снова."
                     )
                     user_states[message.chat.id] = "main_menu"
         else:
-            bot.send_message(
+            tg_sender.send_message(
                 message.chat.id,
                 "❌ Не удалось создать скрипты оптимизации. Пожалуйста, попробуйте снова с другим скриншотом."
             )
@@ -2303,7 +3217,7 @@ def process_photo(message):
         
     except Exception as e:
         logger.error(f"Ошибка при обработке скриншота: {e}")
-        bot.send_message(
+        tg_sender.send_message(
             message.chat.id,
             "❌ Произошла ошибка при обработке скриншота. Пожалуйста, попробуйте снова."
         )
@@ -2321,34 +3235,34 @@ def handle_text_in_photo_states(message):
         state = user_states.get(message.chat.id)
         
         if state == "waiting_for_screenshot":
-            bot.send_message(
+            tg_sender.send_message(
                 message.chat.id,
                 "📸 Отправьте скриншот с информацией о вашей системе.\n\n"
                 "Ваше описание сохранено и будет использовано при генерации скрипта."
             )
         elif state == "waiting_for_error_screenshot":
-            bot.send_message(
+            tg_sender.send_message(
                 message.chat.id,
                 "📸 Отправьте скриншот с ошибкой, которую нужно исправить.\n\n"
                 "Ваше описание сохранено и будет использовано при исправлении скрипта."
             )
     except Exception as e:
         logger.error(f"Ошибка в обработчике текстовых сообщений: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте снова.")
+        tg_sender.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте снова.")
 
 # Обработчик команды /stats
 @bot.message_handler(commands=['stats'])
 def cmd_stats(message):
     """Отображает статистику по генерации скриптов"""
     try:
-        metrics = ScriptMetrics()
+        metrics = script_metrics
         stats = metrics.get_summary()
         common_errors = metrics.get_common_errors()
         
         # Формируем сообщение со статистикой
         stats_message = f"📊 *Статистика оптимизации*\n\n"
-        stats_message += f"📝 Сгенерировано скриптов: {stats['scripts_generated']}\n"
-        stats_message += f"🔧 Исправлено скриптов: {stats['scripts_fixed']}\n"
+        stats_message += f"📝 Сгенерировано скриптов: {stats['total_scripts']}\n"
+        stats_message += f"🔧 Исправлено ошибок: {stats['total_fixed']}\n"
         stats_message += f"⚠️ Всего найдено ошибок: {stats['total_errors']}\n\n"
         
         # Добавляем информацию о типах ошибок
@@ -2373,35 +3287,50 @@ def cmd_stats(message):
         else:
             stats_message += "  Пока нет данных о распространенных ошибках\n"
         
-        # Добавляем статистику по типам скриптов
-        stats_message += f"\n📑 *Ошибки по типам скриптов:*\n"
-        stats_message += f"  • PowerShell (.ps1): {stats['ps1_errors']}\n"
-        stats_message += f"  • Batch (.bat): {stats['bat_errors']}\n"
+        # Добавляем расход токенов и задержки по моделям
+        llm_usage = metrics.get_llm_usage()
+        if llm_usage["by_model"]:
+            stats_message += f"\n🤖 *Запросы к моделям:*\n"
+            for model_name, usage in llm_usage["by_model"].items():
+                stats_message += (
+                    f"  • {model_name}: {usage['calls']} запросов, ошибок {usage['errors']}, "
+                    f"токенов {usage['input_tokens'] + usage['cache_read_input_tokens']}/{usage['output_tokens']}, "
+                    f"из кеша {usage['cache_read_share']:.0%}, "
+                    f"TTFB {usage['avg_ttfb_ms'] / 1000:.1f} с, всего {usage['avg_total_ms'] / 1000:.1f} с\n"
+                )
+        
+        # И расход самого пользователя
+        user_usage = metrics.get_user_llm_usage(message.chat.id)
+        if user_usage:
+            stats_message += (
+                f"\n👤 *Ваши запросы:* {user_usage['calls']}, "
+                f"токенов {user_usage['input_tokens'] + user_usage['cache_read_input_tokens'] + user_usage['output_tokens']}\n"
+            )
         
-        bot.send_message(message.chat.id, stats_message, parse_mode='Markdown')
+        tg_sender.send_message(message.chat.id, stats_message, parse_mode='Markdown')
     
     except Exception as e:
         logger.error(f"Ошибка при получении статистики: {e}")
-        bot.send_message(message.chat.id, "❌ Не удалось загрузить статистику. Попробуйте позже.")
+        tg_sender.send_message(message.chat.id, "❌ Не удалось загрузить статистику. Попробуйте позже.")
 
 # Обработчик команды для принудительного обновления промптов
 @bot.message_handler(commands=['update_prompts'])
 def cmd_update_prompts(message):
     """Обновляет промпты на основе статистики ошибок"""
     try:
-        metrics = ScriptMetrics()
+        metrics = script_metrics
         optimizer = PromptOptimizer(metrics=metrics)
         
         success = optimizer.update_prompts_based_on_metrics()
         
         if success:
-            bot.send_message(message.chat.id, "✅ Промпты успешно обновлены на основе статистики ошибок")
+            tg_sender.send_message(message.chat.id, "✅ Промпты успешно обновлены на основе статистики ошибок")
         else:
-            bot.send_message(message.chat.id, "ℹ️ Недостаточно данных для оптимизации промптов или произошла ошибка")
+            tg_sender.send_message(message.chat.id, "ℹ️ Недостаточно данных для оптимизации промптов или произошла ошибка")
     
     except Exception as e:
         logger.error(f"Ошибка при обновлении промптов: {e}")
-        bot.send_message(message.chat.id, "❌ Не удалось обновить промпты. Попробуйте позже.")
+        tg_sender.send_message(message.chat.id, "❌ Не удалось обновить промпты. Попробуйте позже.")
 
 # Новый обработчик для команды /subscription
 @bot.message_handler(commands=['subscription'])
@@ -2409,7 +3338,7 @@ def cmd_subscription(message):
     """Показывает информацию о подписке пользователя"""
     try:
         if not has_subscription_check:
-            bot.send_message(
+            tg_sender.send_message(
                 message.chat.id, 
                 "⚠️ Функционал подписок временно недоступен. Обратитесь к администратору бота."
             )
@@ -2450,7 +3379,7 @@ def cmd_subscription(message):
                 gen_text = "Нет доступных скриптов"
             
             # Отправляем краткую информацию с кнопкой
-            bot.send_message(
+            tg_sender.send_message(
                 message.chat.id, 
                 f"✅ *{plan_name}* (осталось дней: {days_left})\n\n"
                 f"📊 {gen_text}\n\n"
@@ -2460,7 +3389,7 @@ def cmd_subscription(message):
             )
         else:
             # Отправляем только кнопку для оформления подписки
-            bot.send_message(
+            tg_sender.send_message(
                 message.chat.id,
                 "Для оформления подписки нажмите кнопку ниже:",
                 reply_markup=markup
@@ -2469,11 +3398,75 @@ def cmd_subscription(message):
         logger.info(f"Пользователь {message.chat.id} запросил информацию о подписке")
     except Exception as e:
         logger.error(f"Ошибка в обработчике команды /subscription: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка при получении информации о подписке. Пожалуйста, попробуйте снова.")
+        tg_sender.send_message(message.chat.id, "Произошла ошибка при получении информации о подписке. Пожалуйста, попробуйте снова.")
+
+def setup_webhook_mode():
+    """
+    Монтирует эндпоинт обновлений Telegram в Flask-приложение
+
+    Обработчики выполняются в потоках WebhookDispatcher, поэтому собственный
+    пул потоков telebot отключается (threaded = False).
+    """
+    global webhook_dispatcher
+    if webhook_dispatcher is not None:
+        return webhook_dispatcher
+
+    from telegram_webhook import WebhookDispatcher, register_webhook_route
+
+    bot.threaded = False
+    webhook_dispatcher = WebhookDispatcher(
+        lambda update: bot.process_new_updates([update]),
+        workers=WEBHOOK_WORKERS
+    )
+    register_webhook_route(app, webhook_dispatcher, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN or None)
+
+    # Healthcheck-сервер не запускается в режиме webhook (тот же порт), поэтому
+    # отдаем /health из основного приложения
+    if has_healthcheck:
+        app.add_url_rule('/health', endpoint='health', view_func=healthcheck.health)
+        app.add_url_rule('/stats', endpoint='stats', view_func=healthcheck.stats)
+
+    logger.info(f"Webhook эндпоинт {WEBHOOK_PATH} подключен, рабочих потоков: {WEBHOOK_WORKERS}")
+    return webhook_dispatcher
+
+def run_webhook():
+    """Регистрирует webhook в Telegram и обслуживает обновления через веб-сервер"""
+    if not WEBHOOK_URL:
+        raise ValueError("Для режима webhook необходимо задать переменную окружения WEBHOOK_URL")
+
+    setup_webhook_mode()
+
+    bot.remove_webhook()
+    bot.set_webhook(
+        url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET_TOKEN or None,
+        max_connections=WEBHOOK_WORKERS * 5
+    )
+    logger.info(f"Webhook зарегистрирован: {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+    if has_healthcheck:
+        healthcheck.update_bot_status({"status": "running", "mode": "webhook"})
+
+    if web_server_started:
+        # Веб-сервер уже обслуживает запросы в отдельном потоке
+        while True:
+            time.sleep(3600)
+    else:
+        start_web_server()
 
 def main():
     """Основная функция бота"""
     try:
+        # Собираем наборы шаблонов заранее, не задерживая запуск
+        threading.Thread(target=template_bundles.warm_up, name="template-warm-up", daemon=True).start()
+
+        if BOT_MODE == 'webhook':
+            # Telegram сам распределяет обновления, проверка единственного
+            # экземпляра и polling не нужны
+            logger.info("Запуск бота в режиме webhook...")
+            run_webhook()
+            return
+
         # Проверяем, не запущен ли уже бот
         if not ensure_single_instance():
             logger.error("Завершаем работу из-за уже запущенного экземпляра")
@@ -2753,7 +3746,7 @@ def activate_subscription():
                                 limit = gen_info.get("generations_limit", 0)
                                 gen_text = f"{limit} скриптов"
                             
-                            bot.send_message(
+                            tg_sender.send_message(
                                 user_id,
                                 f"✅ Пакет '{plan_name}' успешно активирован!\n\n"
                                 f"📦 Доступно: {gen_text}\n"
@@ -2837,10 +3830,17 @@ def start_web_server():
 
 def start_web_server_thread():
     """Запуск веб-сервера в отдельном потоке"""
+    global web_server_started
+    web_server_started = True
     web_thread = threading.Thread(target=start_web_server, daemon=True)
     web_thread.start()
     logger.info("Веб-сервер запущен в отдельном потоке")
 
+# В режиме webhook эндпоинт монтируется при импорте, чтобы его видел
+# и WSGI-сервер (например, gunicorn optimization_bot:app)
+if BOT_MODE == 'webhook':
+    setup_webhook_mode()
+
 # Для тестирования
 if __name__ == "__main__":
     # Запускаем веб-сервер в отдельном потоке
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Дисковый кеш результатов генерации скриптов по перцептивному хешу скриншота.
+
+Пользователи часто отправляют тот же самый или почти тот же скриншот
+(повторы, двойные нажатия, /cancel и повторная отправка). Кеш хранит уже
+извлеченный и проверенный набор файлов под ключом:
+- владелец (ID чата): скриншоты с одинаковой разметкой, но разными
+  сведениями о системе различаются всего несколькими битами хеша, поэтому
+  результат одного пользователя никогда не отдается другому;
+- перцептивный хеш изображения (dHash), сравниваемый по расстоянию Хэмминга;
+- нормализованный текст запроса пользователя;
+- версия промпта (хеш его текста);
+- модель.
+
+Записи удаляются по TTL, а при превышении лимита размера вытесняются
+наименее используемые.
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import uuid
+import hashlib
+import logging
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Размер стороны dHash: 16 -> 256 бит, чтобы различались скриншоты с одинаковой разметкой
+HASH_SIZE = 16
+INDEX_FILE = "index.json"
+
+
+def perceptual_hash(image_data, hash_size=HASH_SIZE):
+    """
+    Вычисляет разностный перцептивный хеш (dHash) изображения
+
+    Args:
+        image_data (bytes): Изображение
+        hash_size (int): Размер стороны хеша
+
+    Returns:
+        int: Хеш из hash_size * hash_size бит
+    """
+    with Image.open(BytesIO(image_data)) as image:
+        small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+        pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(first, second):
+    """Количество различающихся бит"""
+    return bin(first ^ second).count("1")
+
+
+def normalize_text(text):
+    """Приводит текст запроса к каноническому виду"""
+    text = re.sub(r"[^\w\s]", " ", (text or "").lower())
+    return " ".join(text.split())
+
+
+def prompt_version(prompt):
+    """Короткий идентификатор версии промпта"""
+    return hashlib.sha256((prompt or "").encode("utf-8")).hexdigest()[:12]
+
+
+class ResultCache:
+    """Кеш наборов файлов пользователя по скриншоту, тексту запроса, промпту и модели"""
+
+    def __init__(self, cache_dir, ttl=7 * 24 * 3600, max_bytes=100 * 1024 * 1024, max_distance=8):
+        """
+        Инициализация кеша
+
+        Args:
+            cache_dir (str): Каталог кеша
+            ttl (float): Время жизни записи в секундах
+            max_bytes (int): Максимальный суммарный размер записей
+            max_distance (int): Максимальное расстояние Хэмминга для совпадения
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        # Счетчики для метрик
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, INDEX_FILE)
+
+    def _entry_path(self, entry_id):
+        return os.path.join(self.cache_dir, f"{entry_id}.zlib")
+
+    def _load_index(self):
+        """Загружает индекс кеша с диска"""
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            self._entries = {
+                entry_id: entry for entry_id, entry in entries.items()
+                if os.path.exists(self._entry_path(entry_id))
+            }
+        except FileNotFoundError:
+            self._entries = {}
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить индекс кеша результатов: {e}")
+            self._entries = {}
+
+    def _save_index(self):
+        """Атомарно сохраняет индекс кеша"""
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self._index_path())
+
+    def _remove(self, entry_id):
+        self._entries.pop(entry_id, None)
+        try:
+            os.remove(self._entry_path(entry_id))
+        except OSError:
+            pass
+
+    def _evict(self, now):
+        """Удаляет просроченные записи и вытесняет старые сверх лимита"""
+        for entry_id, entry in list(self._entries.items()):
+            if now - entry["created"] > self.ttl:
+                self._remove(entry_id)
+                self.evictions += 1
+        total = sum(entry["size"] for entry in self._entries.values())
+        for entry_id, entry in sorted(self._entries.items(), key=lambda item: item[1]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            total -= entry["size"]
+            self._remove(entry_id)
+            self.evictions += 1
+
+    def lookup(self, owner, image_hash, text, prompt_ver, model):
+        """
+        Ищет результат для скриншота и запроса
+
+        Args:
+            owner: Владелец записи (ID чата)
+            image_hash (int): Перцептивный хеш скриншота
+            text (str): Текст запроса пользователя
+            prompt_ver (str): Версия промпта
+            model (str): Модель
+
+        Returns:
+            dict: Набор файлов или None
+        """
+        owner_key = str(owner)
+        text_key = normalize_text(text)
+        now = time.time()
+        with self._lock:
+            best_id, best_distance = None, None
+            for entry_id, entry in self._entries.items():
+                if (entry.get("owner") != owner_key or entry["text"] != text_key or entry["prompt_version"] != prompt_ver
+                        or entry["model"] != model or now - entry["created"] > self.ttl):
+                    continue
+                distance = hamming_distance(image_hash, int(entry["image_hash"], 16))
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best_id, best_distance = entry_id, distance
+                    if distance == 0:
+                        break
+
+            if best_id is None:
+                self.misses += 1
+                return None
+
+            try:
+                with open(self._entry_path(best_id), "rb") as f:
+                    files = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+            except Exception as e:
+                logger.warning(f"Поврежденная запись кеша результатов {best_id}: {e}")
+                self._remove(best_id)
+                self.misses += 1
+                return None
+
+            self._entries[best_id]["last_access"] = now
+            self._entries[best_id]["hits"] = self._entries[best_id].get("hits", 0) + 1
+            if best_distance == 0:
+                self.hits += 1
+            else:
+                self.near_hits += 1
+            logger.info(f"Результат найден в кеше (расстояние {best_distance})")
+            return files
+
+    def store(self, owner, image_hash, text, prompt_ver, model, files):
+        """
+        Сохраняет проверенный набор файлов
+
+        Args:
+            owner: Владелец записи (ID чата)
+            image_hash (int): Перцептивный хеш скриншота
+            text (str): Текст запроса пользователя
+            prompt_ver (str): Версия промпта
+            model (str): Модель
+            files (dict): Набор файлов (имя -> содержимое)
+        """
+        data = zlib.compress(json.dumps(files, ensure_ascii=False).encode("utf-8"), 6)
+        entry_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            try:
+                with open(self._entry_path(entry_id), "wb") as f:
+                    f.write(data)
+                self._entries[entry_id] = {
+                    "owner": str(owner),
+                    "image_hash": format(image_hash, "x"),
+                    "text": normalize_text(text),
+                    "prompt_version": prompt_ver,
+                    "model": model,
+                    "created": now,
+                    "last_access": now,
+                    "size": len(data),
+                    "hits": 0,
+                }
+                self.stores += 1
+                self._evict(now)
+                self._save_index()
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить результат в кеш: {e}")
+                self._remove(entry_id)
+
+    def get_stats(self):
+        """
+        Возвращает статистику кеша
+
+        Returns:
+            dict: Количество записей, размер и счетчики попаданий
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": sum(entry["size"] for entry in self._entries.values()),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,596 @@
+#!/usr/bin/env python
+"""
+Сборка скрипта оптимизации из проверенных модулей по профилю системы.
+
+Генерация в два этапа:
+1. Быстрая модель по скриншоту возвращает короткий JSON-профиль системы
+   (версия и редакция Windows, процессор, объем памяти, тип диска);
+   parse_profile разбирает его в SystemProfile.
+2. ScriptAssembler выбирает модули оптимизации по признакам профиля
+   (ssd, hdd, low_ram, laptop, windows11, ...) и собирает из них
+   WindowsOptimizer.ps1 без обращения к модели. Bat-файл и README
+   строятся по готовому скрипту (artifact_generator).
+
+Каждый модуль проверяется ScriptValidator один раз при создании
+сборщика (в составе каркаса скрипта); модули с замечаниями не
+используются.
+
+Пример использования:
+```python
+assembler = ScriptAssembler()
+profile = parse_profile(response_text)
+files = assembler.assemble(profile)
+```
+"""
+
+import re
+import json
+import time
+import logging
+import threading
+
+from artifact_generator import SCRIPT_NAME, generate_artifacts
+from code_blocks import iter_fenced_blocks
+from script_validator import ScriptValidator
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Порог объема памяти для признака low_ram (ГБ)
+LOW_RAM_GB = 8
+# Порог числа ядер для признака few_cores
+FEW_CORES = 4
+
+
+class ProfileError(Exception):
+    """Ответ модели не содержит пригодного профиля системы"""
+
+
+class SystemProfile:
+    """Профиль системы, определенный по скриншоту"""
+
+    FIELDS = ("windows_version", "windows_edition", "cpu", "cpu_cores", "ram_gb", "disk_type", "laptop")
+
+    def __init__(self, windows_version=None, windows_edition=None, cpu=None, cpu_cores=None,
+                 ram_gb=None, disk_type=None, laptop=None):
+        self.windows_version = windows_version
+        self.windows_edition = windows_edition
+        self.cpu = cpu
+        self.cpu_cores = cpu_cores
+        self.ram_gb = ram_gb
+        self.disk_type = disk_type
+        self.laptop = laptop
+
+    @classmethod
+    def from_dict(cls, data):
+        """Профиль из JSON модели; значения приводятся к единому виду"""
+        return cls(
+            windows_version=_windows_version(data.get("windows_version")),
+            windows_edition=_text(data.get("windows_edition")),
+            cpu=_text(data.get("cpu")),
+            cpu_cores=_number(data.get("cpu_cores"), integer=True),
+            ram_gb=_ram_gb(data.get("ram_gb")),
+            disk_type=_disk_type(data.get("disk_type")),
+            laptop=_flag(data.get("laptop")),
+        )
+
+    def is_empty(self):
+        return all(getattr(self, field) is None for field in self.FIELDS)
+
+    def features(self):
+        """Признаки профиля, по которым выбираются модули"""
+        features = set()
+        if self.disk_type:
+            features.add(self.disk_type)
+        if self.ram_gb is not None and self.ram_gb < LOW_RAM_GB:
+            features.add("low_ram")
+        if self.cpu_cores is not None and self.cpu_cores <= FEW_CORES:
+            features.add("few_cores")
+        if self.laptop is not None:
+            features.add("laptop" if self.laptop else "desktop")
+        if self.windows_version:
+            features.add(f"windows{self.windows_version}")
+        if self.windows_edition and "home" in self.windows_edition.lower():
+            features.add("home_edition")
+        return features
+
+    def summary(self):
+        """Краткое описание для комментария в скрипте (без символов, влияющих на синтаксис)"""
+        parts = []
+        if self.windows_version or self.windows_edition:
+            parts.append(" ".join(filter(None, ("Windows", self.windows_version, self.windows_edition))))
+        if self.cpu:
+            parts.append(self.cpu + (f", {self.cpu_cores} cores" if self.cpu_cores else ""))
+        if self.ram_gb is not None:
+            parts.append(f"{self.ram_gb:g} GB RAM")
+        if self.disk_type:
+            parts.append(self.disk_type.upper())
+        if self.laptop is not None:
+            parts.append("laptop" if self.laptop else "desktop")
+        return re.sub(r"[^\w .,+@/-]", "", "; ".join(parts) or "unknown")
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return f"SystemProfile({self.summary()})"
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value if value and value.lower() not in ("unknown", "null", "none", "n/a") else None
+
+
+def _number(value, integer=False):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number = value
+    else:
+        match = re.search(r"\d+(?:[.,]\d+)?", str(value or ""))
+        if match is None:
+            return None
+        number = float(match.group(0).replace(",", "."))
+    return int(number) if integer else float(number)
+
+
+def _ram_gb(value):
+    number = _number(value)
+    if number is None:
+        return None
+    # "16384 MB" или просто число мегабайт
+    if re.search(r"\bmb\b|мб", str(value), re.IGNORECASE) or number > 1024:
+        number = number / 1024
+    return round(number, 1)
+
+
+def _disk_type(value):
+    value = (_text(value) or "").lower()
+    if any(marker in value for marker in ("ssd", "nvme", "solid")):
+        return "ssd"
+    if any(marker in value for marker in ("hdd", "hard", "rotational")):
+        return "hdd"
+    return None
+
+
+def _windows_version(value):
+    match = re.search(r"\b(10|11)\b", str(value or ""))
+    return match.group(1) if match else None
+
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    value = (_text(value) or "").lower()
+    if value in ("true", "yes", "laptop", "да"):
+        return True
+    if value in ("false", "no", "desktop", "нет"):
+        return False
+    return None
+
+
+def parse_profile(response_text):
+    """
+    Разбирает профиль системы из ответа модели
+
+    JSON берется из блока ```json или из первого объекта {...} в тексте.
+
+    Returns:
+        SystemProfile: Профиль системы
+
+    Raises:
+        ProfileError: JSON не найден, некорректен или не содержит известных полей
+    """
+    candidates = [block.content for block in iter_fenced_blocks(response_text)]
+    start = response_text.find("{")
+    if start != -1:
+        candidates.append(response_text[start:])
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        try:
+            data, _ = decoder.raw_decode(candidate.strip())
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            profile = SystemProfile.from_dict(data)
+            if profile.is_empty():
+                raise ProfileError("Профиль не содержит известных полей")
+            return profile
+    raise ProfileError("В ответе нет JSON-профиля системы")
+
+
+class TweakModule:
+    """Модуль оптимизации: функция PowerShell и признаки профиля, при которых она применяется"""
+
+    def __init__(self, name, description, title, code, when=(), unless=()):
+        """
+        Args:
+            name (str): Имя функции PowerShell
+            description (str): Описание для комментария над функцией и README
+            title (str): Строка меню (английский текст, как весь вывод скрипта)
+            code (str): Определение функции
+            when (iterable): Признаки, любой из которых включает модуль (пусто - всегда)
+            unless (iterable): Признаки, любой из которых исключает модуль
+        """
+        self.name = name
+        self.description = description
+        self.title = title
+        self.code = code.strip("\n")
+        self.when = frozenset(when)
+        self.unless = frozenset(unless)
+
+    def applies_to(self, features):
+        return (not self.when or bool(self.when & features)) and not self.unless & features
+
+    def __repr__(self):
+        return f"TweakModule({self.name})"
+
+
+SCRIPT_HEADER = r"""# Encoding: UTF-8
+$OutputEncoding = [System.Text.Encoding]::UTF8
+
+# Set system to use English language for output
+[System.Threading.Thread]::CurrentThread.CurrentUICulture = 'en-US'
+[System.Threading.Thread]::CurrentThread.CurrentCulture = 'en-US'
+
+# Скрипт собран из проверенных модулей по профилю системы
+# Профиль: {profile}
+
+# Проверка прав администратора
+function Test-Administrator {
+    $user = [Security.Principal.WindowsIdentity]::GetCurrent()
+    $principal = New-Object Security.Principal.WindowsPrincipal($user)
+    return $principal.IsInRole([Security.Principal.WindowsBuiltInRole]::Administrator)
+}
+
+if (-not (Test-Administrator)) {
+    Write-Warning "This script requires administrator privileges."
+    Write-Warning "Please run the script as administrator."
+    pause
+    exit
+}
+
+# Настройка логирования и резервных копий
+$LogPath = "$env:TEMP\WindowsOptimizer_Log.txt"
+$BackupDir = "$env:USERPROFILE\WindowsOptimizer_Backups"
+Start-Transcript -Path $LogPath -Append -Force | Out-Null
+
+# Функция для создания резервных копий настроек
+function Backup-Settings {
+    param (
+        [string]$SettingName,
+        [string]$Data
+    )
+
+    try {
+        if (-not (Test-Path -Path $BackupDir)) {
+            New-Item -Path $BackupDir -ItemType Directory -Force | Out-Null
+        }
+        $Timestamp = Get-Date -Format "yyyyMMdd_HHmmss"
+        $BackupFile = Join-Path $BackupDir "${SettingName}_$Timestamp.bak"
+        $Data | Out-File -FilePath $BackupFile -Encoding UTF8 -Force
+    }
+    catch {
+        Write-Warning "Failed to create backup of ${SettingName}: ${_}"
+    }
+}
+
+# Изменение типа запуска службы с резервной копией прежнего значения
+function Set-ServiceStartup {
+    param (
+        [string]$Name,
+        [string]$StartupType
+    )
+
+    try {
+        $service = Get-Service -Name $Name -ErrorAction SilentlyContinue
+        if (-not $service) {
+            Write-Host "Service $Name not found, skipped" -ForegroundColor Yellow
+            return
+        }
+        Backup-Settings -SettingName "Service_$Name" -Data "$($service.StartType)"
+        if ($StartupType -eq "Disabled" -and $service.Status -eq "Running") {
+            Stop-Service -Name $Name -Force -ErrorAction SilentlyContinue
+        }
+        Set-Service -Name $Name -StartupType $StartupType -ErrorAction SilentlyContinue
+        Write-Host "Service $Name set to $StartupType" -ForegroundColor Green
+    }
+    catch {
+        Write-Warning "Failed to configure service ${Name}: ${_}"
+    }
+}
+
+# Запись параметра реестра с резервной копией прежнего значения
+function Set-RegistryValue {
+    param (
+        [string]$Path,
+        [string]$Name,
+        $Value,
+        [string]$Type = "DWord"
+    )
+
+    try {
+        if (Test-Path -Path $Path) {
+            $current = Get-ItemProperty -Path $Path -Name $Name -ErrorAction SilentlyContinue
+            if ($current) {
+                Backup-Settings -SettingName "Registry_$Name" -Data "${Path}\${Name}=$($current.$Name)"
+            }
+        }
+        else {
+            New-Item -Path $Path -Force | Out-Null
+        }
+        Set-ItemProperty -Path $Path -Name $Name -Value $Value -Type $Type -Force -ErrorAction Stop
+        Write-Host "Registry value $Name set to $Value" -ForegroundColor Green
+    }
+    catch {
+        Write-Warning "Failed to set registry value ${Name}: ${_}"
+    }
+}
+"""
+
+SCRIPT_MENU = r"""
+# Список оптимизаций и подтверждение запуска
+function Show-Menu {
+    Write-Host "Windows Optimizer" -ForegroundColor Cyan
+    Write-Host "The following optimizations will be applied:" -ForegroundColor Cyan
+{items}
+    $answer = Read-Host "Continue? (Y/N)"
+    return ($answer -match "^[Yy]")
+}
+
+if (-not (Show-Menu)) {
+    Write-Host "Optimization cancelled" -ForegroundColor Yellow
+    Stop-Transcript | Out-Null
+    exit
+}
+
+$Steps = @({steps})
+$Step = 0
+foreach ($StepName in $Steps) {
+    $Step++
+    Write-Progress -Activity "Optimization" -Status $StepName -PercentComplete ([int]($Step * 100 / $Steps.Count))
+    try {
+        & $StepName
+    }
+    catch {
+        Write-Warning "Step ${StepName} failed: ${_}"
+    }
+}
+
+Stop-Transcript | Out-Null
+Write-Host "Optimization completed. Log saved to file: $LogPath" -ForegroundColor Green
+pause
+"""
+
+DEFAULT_MODULES = (
+    TweakModule("Disable-Telemetry", "Отключение телеметрии и службы сбора диагностических данных",
+                "Disable telemetry", r"""
+function Disable-Telemetry {
+    Write-Host "Disabling telemetry..." -ForegroundColor Cyan
+    Set-ServiceStartup -Name "DiagTrack" -StartupType Disabled
+    Set-ServiceStartup -Name "dmwappushservice" -StartupType Disabled
+    Set-RegistryValue -Path "HKLM:\SOFTWARE\Policies\Microsoft\Windows\DataCollection" -Name "AllowTelemetry" -Value 0
+}
+"""),
+    TweakModule("Clear-TempFiles", "Очистка временных файлов и корзины",
+                "Clean temporary files", r"""
+function Clear-TempFiles {
+    Write-Host "Cleaning temporary files..." -ForegroundColor Cyan
+    foreach ($folder in @("$env:TEMP", "$env:SystemRoot\Temp")) {
+        try {
+            if (Test-Path -Path $folder) {
+                Get-ChildItem -Path $folder -Force -ErrorAction SilentlyContinue | Remove-Item -Recurse -Force -ErrorAction SilentlyContinue
+                Write-Host "Cleaned: $folder" -ForegroundColor Green
+            }
+        }
+        catch {
+            Write-Warning "Failed to clean ${folder}: ${_}"
+        }
+    }
+    try {
+        Clear-RecycleBin -Force -ErrorAction SilentlyContinue
+        Write-Host "Recycle Bin emptied" -ForegroundColor Green
+    }
+    catch {
+        Write-Warning "Failed to empty Recycle Bin: ${_}"
+    }
+}
+"""),
+    TweakModule("Optimize-VisualEffects", "Визуальные эффекты в режиме производительности",
+                "Set visual effects for performance", r"""
+function Optimize-VisualEffects {
+    Write-Host "Configuring visual effects..." -ForegroundColor Cyan
+    Set-RegistryValue -Path "HKCU:\Software\Microsoft\Windows\CurrentVersion\Explorer\VisualEffects" -Name "VisualFXSetting" -Value 2
+    Set-RegistryValue -Path "HKCU:\Control Panel\Desktop" -Name "MenuShowDelay" -Value "0" -Type String
+}
+""", when=("low_ram",)),
+    TweakModule("Disable-BackgroundApps", "Запрет фоновой работы приложений из Microsoft Store",
+                "Disable background apps", r"""
+function Disable-BackgroundApps {
+    Write-Host "Disabling background apps..." -ForegroundColor Cyan
+    Set-RegistryValue -Path "HKCU:\Software\Microsoft\Windows\CurrentVersion\BackgroundAccessApplications" -Name "GlobalUserDisabled" -Value 1
+}
+""", when=("low_ram", "few_cores")),
+    TweakModule("Disable-GameDvr", "Отключение фоновой записи игр (Game DVR)",
+                "Disable Game DVR", r"""
+function Disable-GameDvr {
+    Write-Host "Disabling Game DVR..." -ForegroundColor Cyan
+    Set-RegistryValue -Path "HKCU:\System\GameConfigStore" -Name "GameDVR_Enabled" -Value 0
+    Set-RegistryValue -Path "HKLM:\SOFTWARE\Policies\Microsoft\Windows\GameDVR" -Name "AllowGameDVR" -Value 0
+}
+""", when=("low_ram", "few_cores")),
+    TweakModule("Disable-SysMain", "Отключение службы SysMain (предзагрузка не нужна на SSD)",
+                "Disable SysMain on SSD", r"""
+function Disable-SysMain {
+    Write-Host "Disabling SysMain..." -ForegroundColor Cyan
+    Set-ServiceStartup -Name "SysMain" -StartupType Disabled
+}
+""", when=("ssd",)),
+    TweakModule("Optimize-SsdTrim", "Включение TRIM и оптимизация SSD",
+                "Run TRIM on SSD volumes", r"""
+function Optimize-SsdTrim {
+    Write-Host "Optimizing SSD..." -ForegroundColor Cyan
+    try {
+        fsutil behavior set DisableDeleteNotify 0 | Out-Null
+        $volumes = Get-Volume -ErrorAction SilentlyContinue | Where-Object { $_.DriveType -eq "Fixed" -and $_.DriveLetter }
+        foreach ($volume in $volumes) {
+            Optimize-Volume -DriveLetter $volume.DriveLetter -ReTrim -ErrorAction SilentlyContinue
+            Write-Host "TRIM completed for drive $($volume.DriveLetter)" -ForegroundColor Green
+        }
+    }
+    catch {
+        Write-Warning "Failed to optimize SSD: ${_}"
+    }
+}
+""", when=("ssd",), unless=("hdd",)),
+    TweakModule("Optimize-HddDefrag", "Дефрагментация системного жесткого диска",
+                "Defragment system HDD", r"""
+function Optimize-HddDefrag {
+    Write-Host "Defragmenting system drive..." -ForegroundColor Cyan
+    try {
+        $drive = $env:SystemDrive.Substring(0, 1)
+        Optimize-Volume -DriveLetter $drive -Defrag -ErrorAction Stop
+        Write-Host "Defragmentation of drive $drive completed" -ForegroundColor Green
+    }
+    catch {
+        Write-Warning "Failed to defragment drive: ${_}"
+    }
+}
+""", when=("hdd",)),
+    TweakModule("Disable-SearchIndexing", "Отключение индексирования поиска Windows",
+                "Disable search indexing", r"""
+function Disable-SearchIndexing {
+    Write-Host "Disabling search indexing..." -ForegroundColor Cyan
+    Set-ServiceStartup -Name "WSearch" -StartupType Disabled
+}
+""", when=("hdd", "low_ram")),
+    TweakModule("Set-HighPerformancePower", "План электропитания \"Высокая производительность\"",
+                "Activate High performance power plan", r"""
+function Set-HighPerformancePower {
+    Write-Host "Configuring power plan..." -ForegroundColor Cyan
+    try {
+        powercfg /setactive SCHEME_MIN
+        Write-Host "High performance power plan activated" -ForegroundColor Green
+    }
+    catch {
+        Write-Warning "Failed to configure power plan: ${_}"
+    }
+}
+""", when=("desktop",)),
+    TweakModule("Set-BalancedPower", "Сбалансированный план электропитания и отключение гибернации",
+                "Activate Balanced power plan", r"""
+function Set-BalancedPower {
+    Write-Host "Configuring power plan..." -ForegroundColor Cyan
+    try {
+        powercfg /setactive SCHEME_BALANCED
+        powercfg /hibernate off
+        Write-Host "Balanced power plan activated, hibernation file removed" -ForegroundColor Green
+    }
+    catch {
+        Write-Warning "Failed to configure power plan: ${_}"
+    }
+}
+""", when=("laptop",)),
+    TweakModule("Disable-Widgets", "Отключение виджетов на панели задач Windows 11",
+                "Disable taskbar widgets", r"""
+function Disable-Widgets {
+    Write-Host "Disabling widgets..." -ForegroundColor Cyan
+    Set-RegistryValue -Path "HKCU:\Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced" -Name "TaskbarDa" -Value 0
+}
+""", when=("windows11",)),
+)
+
+
+class ScriptAssembler:
+    """Сборка WindowsOptimizer.ps1 из модулей, проверенных при создании"""
+
+    def __init__(self, modules=DEFAULT_MODULES, validator=None):
+        """
+        Инициализация сборщика: каждый модуль проверяется в составе каркаса
+
+        Args:
+            modules (iterable): Модули оптимизации в порядке выполнения
+            validator (ScriptValidator, optional): Валидатор скриптов
+        """
+        validator = validator or ScriptValidator()
+        self._lock = threading.Lock()
+        self.modules = []
+        self.rejected = {}
+        started = time.perf_counter()
+        for module in modules:
+            issues = validator.validate_powershell_script(self.render([module]))
+            if issues:
+                self.rejected[module.name] = issues
+                logger.error(f"Модуль {module.name} не прошел проверку и не будет использоваться: {issues}")
+            else:
+                self.modules.append(module)
+        logger.info(f"Проверено модулей оптимизации: {len(self.modules)} из {len(self.modules) + len(self.rejected)} "
+                    f"за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+        # Счетчики для метрик
+        self.stats = {
+            "assemblies": 0,
+            "total_ms": 0.0,
+            "module_usage": {module.name: 0 for module in self.modules},
+        }
+
+    def select(self, profile):
+        """Модули, подходящие профилю, в порядке библиотеки"""
+        features = profile.features()
+        return [module for module in self.modules if module.applies_to(features)]
+
+    @staticmethod
+    def render(modules, profile=None):
+        """
+        Текст скрипта из каркаса и модулей
+
+        Returns:
+            str: Содержимое WindowsOptimizer.ps1
+        """
+        parts = [SCRIPT_HEADER.replace("{profile}", profile.summary() if profile else "unknown")]
+        for module in modules:
+            parts.append(f"# {module.description}\n{module.code}\n")
+        items = "\n".join(f'    Write-Host " - {module.title}"' for module in modules)
+        steps = ", ".join(f'"{module.name}"' for module in modules)
+        parts.append(SCRIPT_MENU.replace("{items}", items).replace("{steps}", steps))
+        return "\n".join(parts)
+
+    def assemble(self, profile):
+        """
+        Собирает набор файлов для профиля
+
+        Args:
+            profile (SystemProfile): Профиль системы
+
+        Returns:
+            dict: WindowsOptimizer.ps1, Start-Optimizer.bat и README.md
+        """
+        started = time.perf_counter()
+        modules = self.select(profile)
+        files = {SCRIPT_NAME: self.render(modules, profile)}
+        files.update(generate_artifacts(files[SCRIPT_NAME]))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.stats["assemblies"] += 1
+            self.stats["total_ms"] += elapsed_ms
+            for module in modules:
+                self.stats["module_usage"][module.name] += 1
+        logger.info(f"Скрипт собран для профиля {profile.summary()}: "
+                    f"{', '.join(module.name for module in modules)} ({elapsed_ms:.1f} мс)")
+        return files
+
+    def get_stats(self):
+        """Статистика сборки: модули, количество сборок и время"""
+        with self._lock:
+            stats = dict(self.stats, module_usage=dict(self.stats["module_usage"]))
+        stats["modules"] = len(self.modules)
+        stats["rejected"] = sorted(self.rejected)
+        stats["avg_ms"] = round(stats["total_ms"] / stats["assemblies"], 3) if stats["assemblies"] else None
+        stats["total_ms"] = round(stats["total_ms"], 1)
+        return stats
@@ -1,6 +1,7 @@
 import json
 import os
 import time
+import threading
 from datetime import datetime
 from collections import defaultdict, Counter
 import logging
@@ -12,16 +13,31 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Счетчики токенов в поле usage ответа API
+LLM_TOKEN_FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+# Не чаще чем раз в столько секунд метрики записываются в файл
+SAVE_INTERVAL = float(os.getenv("METRICS_SAVE_INTERVAL", "30"))
+
 class ScriptMetrics:
-    """Класс для сбора и сохранения метрик качества скриптов"""
+    """Класс для сбора и сохранения метрик качества скриптов
+    
+    Один экземпляр используется всеми запросами: изменения выполняются под
+    блокировкой в памяти, а в файл попадают пакетно (не чаще save_interval)
+    атомарной заменой. Перед завершением процесса нужно вызвать flush().
+    """
     
-    def __init__(self, metrics_file="script_metrics.json"):
+    def __init__(self, metrics_file="script_metrics.json", save_interval=SAVE_INTERVAL):
         """Инициализация класса метрик
         
         Args:
             metrics_file (str): Путь к файлу для сохранения метрик
+            save_interval (float): Минимальный интервал между записями файла в секундах
         """
         self.metrics_file = metrics_file
+        self.save_interval = save_interval
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._last_save = time.monotonic()
         self.metrics = self._load_metrics()
     
     def _load_metrics(self):
@@ -30,7 +46,14 @@ class ScriptMetrics:
             try:
                 with open(self.metrics_file, 'r', encoding='utf-8') as f:
                     return json.load(f)
-            except json.JSONDecodeError:
+            except json.JSONDecodeError as e:
+                # Поврежденный файл сохраняется для разбора, а не перезаписывается молча
+                corrupt_file = f"{self.metrics_file}.corrupt"
+                logger.error(f"Файл метрик {self.metrics_file} поврежден ({e}), сохранен как {corrupt_file}")
+                try:
+                    os.replace(self.metrics_file, corrupt_file)
+                except OSError:
+                    pass
                 return self._create_initial_metrics()
         else:
             return self._create_initial_metrics()
@@ -48,11 +71,29 @@ class ScriptMetrics:
         }
     
     def _save_metrics(self):
-        """Сохранение метрик в файл"""
-        self.metrics["last_updated"] = datetime.now().isoformat()
-        
-        with open(self.metrics_file, 'w', encoding='utf-8') as f:
-            json.dump(self.metrics, f, indent=4, ensure_ascii=False)
+        """Отмечает изменения; файл записывается, если с прошлой записи прошло save_interval"""
+        with self._lock:
+            self.metrics["last_updated"] = datetime.now().isoformat()
+            self._dirty = True
+            if time.monotonic() - self._last_save >= self.save_interval:
+                self.flush()
+    
+    def flush(self):
+        """Атомарно записывает накопленные изменения в файл"""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = f"{self.metrics_file}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.metrics, f, indent=4, ensure_ascii=False)
+                os.replace(tmp_path, self.metrics_file)
+                self._dirty = False
+            except OSError as e:
+                logger.error(f"Не удалось сохранить метрики в {self.metrics_file}: {e}")
+            finally:
+                # При ошибке записи следующая попытка тоже выполняется не раньше save_interval
+                self._last_save = time.monotonic()
     
     def record_script_generation(self, data=None):
         """Записывает информацию о генерации скрипта
@@ -60,32 +101,33 @@ class ScriptMetrics:
         Args:
             data (dict, optional): Данные о генерации. Если None, то просто увеличивает счетчик.
         """
-        try:
-            # Увеличиваем счетчик сгенерированных скриптов
-            self.metrics["total_scripts_generated"] += 1
+        with self._lock:
+            try:
+                # Увеличиваем счетчик сгенерированных скриптов
+                self.metrics["total_scripts_generated"] += 1
             
-            # Если переданы данные для записи
-            if isinstance(data, dict):
-                # Проверяем наличие поля errors или validation_results
-                if "errors" in data or "validation_results" in data:
-                    # Сохраняем данные об ошибках, если они есть
-                    validation_results = data.get("validation_results") or data.get("errors") or {}
+                # Если переданы данные для записи
+                if isinstance(data, dict):
+                    # Проверяем наличие поля errors или validation_results
+                    if "errors" in data or "validation_results" in data:
+                        # Сохраняем данные об ошибках, если они есть
+                        validation_results = data.get("validation_results") or data.get("errors") or {}
                     
-                    # Записываем результаты валидации
-                    self.record_validation_results(validation_results)
+                        # Записываем результаты валидации
+                        self.record_validation_results(validation_results, data.get("model", "unknown"))
                     
-                    # Если переданы данные о количестве исправленных ошибок
-                    if "fixed_count" in data:
-                        self.metrics["total_errors_fixed"] += data["fixed_count"]
-                        self.record_script_fix()
+                        # Если переданы данные о количестве исправленных ошибок
+                        if "fixed_count" in data:
+                            self.metrics["total_errors_fixed"] += data["fixed_count"]
+                            self.record_script_fix()
             
-            # Сохраняем изменения
-            self._save_metrics()
+                # Сохраняем изменения
+                self._save_metrics()
             
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка при записи информации о генерации скрипта: {e}")
-            return False
+                return True
+            except Exception as e:
+                logger.error(f"Ошибка при записи информации о генерации скрипта: {e}")
+                return False
     
     def record_validation_results(self, validation_results, model_name="unknown", fixed_count=0):
         """Запись результатов валидации скрипта
@@ -95,43 +137,64 @@ class ScriptMetrics:
             model_name (str, optional): Название модели
             fixed_count (int, optional): Количество исправленных ошибок
         """
-        # Подсчет ошибок
-        error_count = 0
-        error_types = Counter()
+        with self._lock:
+            # Подсчет ошибок
+            error_count = 0
+            error_types = Counter()
         
-        for filename, issues in validation_results.items():
-            error_count += len(issues)
+            for filename, issues in validation_results.items():
+                error_count += len(issues)
             
-            # Группировка ошибок по типу
-            for issue in issues:
-                # Извлекаем тип ошибки из сообщения (например, "ps_syntax", "bat_syntax", и т.д.)
-                if "(" in issue and ")" in issue:
-                    error_type = issue.split("(")[1].split(")")[0]
-                    error_types[error_type] += 1
+                # Группировка ошибок по типу
+                for issue in issues:
+                    # Извлекаем тип ошибки из сообщения (например, "ps_syntax", "bat_syntax", и т.д.)
+                    if "(" in issue and ")" in issue:
+                        error_type = issue.split("(")[1].split(")")[0]
+                        error_types[error_type] += 1
+                    else:
+                        error_types["other"] += 1
+        
+            # Обновляем общее количество найденных ошибок
+            self.metrics["total_errors_found"] += error_count
+        
+            # Обновляем типы ошибок
+            for error_type, count in error_types.items():
+                if error_type in self.metrics["error_types"]:
+                    self.metrics["error_types"][error_type] += count
                 else:
-                    error_types["other"] += 1
+                    self.metrics["error_types"][error_type] = count
         
-        # Обновляем общее количество найденных ошибок
-        self.metrics["total_errors_found"] += error_count
+            # Добавляем запись в тренды
+            trend_entry = {
+                "timestamp": datetime.now().isoformat(),
+                "model": model_name,
+                "errors_found": error_count,
+                "errors_fixed": fixed_count,
+                "error_types": dict(error_types)
+            }
+            self.metrics["error_trends"].append(trend_entry)
         
-        # Обновляем типы ошибок
-        for error_type, count in error_types.items():
-            if error_type in self.metrics["error_types"]:
-                self.metrics["error_types"][error_type] += count
-            else:
-                self.metrics["error_types"][error_type] = count
-        
-        # Добавляем запись в тренды
-        trend_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "model": model_name,
-            "errors_found": error_count,
-            "errors_fixed": fixed_count,
-            "error_types": dict(error_types)
-        }
-        self.metrics["error_trends"].append(trend_entry)
+            # Обновляем статистику по модели
+            model_stats = self._model_entry(model_name)
+            model_stats["total_scripts"] += 1
+            model_stats["total_errors"] += error_count
+            model_stats["total_fixed"] += fixed_count
+            model_stats["average_errors_per_script"] = (
+                model_stats["total_errors"] / model_stats["total_scripts"]
+            )
         
-        # Обновляем статистику по модели
+            # Сохраняем обновленные метрики
+            self._save_metrics()
+        
+            return {
+                "total_errors": error_count,
+                "fixed_errors": fixed_count,
+                "improvement_percentage": 
+                    (fixed_count / error_count * 100) if error_count > 0 else 0
+            }
+    
+    def _model_entry(self, model_name):
+        """Возвращает (создавая при необходимости) статистику модели"""
         if model_name not in self.metrics["model_performance"]:
             self.metrics["model_performance"][model_name] = {
                 "total_scripts": 0,
@@ -139,24 +202,219 @@ class ScriptMetrics:
                 "total_fixed": 0,
                 "average_errors_per_script": 0
             }
-        
         model_stats = self.metrics["model_performance"][model_name]
-        model_stats["total_scripts"] += 1
-        model_stats["total_errors"] += error_count
-        model_stats["total_fixed"] += fixed_count
-        model_stats["average_errors_per_script"] = (
-            model_stats["total_errors"] / model_stats["total_scripts"]
-        )
+        for key, default in (("calls", 0), ("failures", 0), ("escalations", 0),
+                             ("recent_latencies_ms", []), ("recent_outcomes", [])):
+            model_stats.setdefault(key, default)
+        return model_stats
+    
+    def record_model_call(self, model_name, latency_ms, success=True, window=50):
+        """Запись результата обращения к модели
+        
+        Args:
+            model_name (str): Название модели
+            latency_ms (float): Длительность запроса в миллисекундах
+            success (bool): Успешен ли запрос
+            window (int): Сколько последних запросов хранить для оценки
+        """
+        with self._lock:
+            try:
+                model_stats = self._model_entry(model_name)
+                model_stats["calls"] += 1
+                if not success:
+                    model_stats["failures"] += 1
+                model_stats["recent_latencies_ms"] = (model_stats["recent_latencies_ms"] + [round(latency_ms)])[-window:]
+                model_stats["recent_outcomes"] = (model_stats["recent_outcomes"] + [1 if success else 0])[-window:]
+                self._save_metrics()
+            except Exception as e:
+                logger.error(f"Ошибка при записи обращения к модели {model_name}: {e}")
+    
+    def record_escalation(self, model_name):
+        """Запись переключения с модели на более качественную"""
+        with self._lock:
+            try:
+                self._model_entry(model_name)["escalations"] += 1
+                self._save_metrics()
+            except Exception as e:
+                logger.error(f"Ошибка при записи эскалации модели {model_name}: {e}")
+    
+    def record_llm_call(self, model_name, usage=None, ttfb_ms=None, total_ms=None, outcome="success",
+                        user_id=None, prompt_version=None, recent_limit=200, max_users=1000):
+        """Запись обращения к модели: токены, задержка и результат
         
-        # Сохраняем обновленные метрики
-        self._save_metrics()
+        Данные суммируются по модели, пользователю и версии промпта, последние
+        обращения хранятся целиком для поиска самых долгих и дорогих запросов.
         
-        return {
-            "total_errors": error_count,
-            "fixed_errors": fixed_count,
-            "improvement_percentage": 
-                (fixed_count / error_count * 100) if error_count > 0 else 0
-        }
+        Args:
+            model_name (str): Название модели
+            usage (dict, optional): Поле usage ответа API
+            ttfb_ms (float, optional): Время до первого фрагмента ответа
+            total_ms (float, optional): Полное время запроса
+            outcome (str): "success", "cancelled" или "error:<тип ошибки>"
+            user_id (optional): ID пользователя
+            prompt_version (str, optional): Версия промпта
+            recent_limit (int): Сколько последних обращений хранить
+            max_users (int): Сколько пользователей хранить (давно не обращавшиеся удаляются)
+        """
+        with self._lock:
+            try:
+                usage = usage or {}
+                tokens = {key: usage.get(key) or 0 for key in LLM_TOKEN_FIELDS}
+                llm_usage = self.metrics.setdefault("llm_usage", {
+                    "by_model": {},
+                    "by_user": {},
+                    "by_prompt": {},
+                    "recent_calls": []
+                })
+                now = datetime.now().isoformat()
+            
+                groups = [("by_model", model_name)]
+                if user_id is not None:
+                    groups.append(("by_user", str(user_id)))
+                if prompt_version:
+                    groups.append(("by_prompt", prompt_version))
+                for group, key in groups:
+                    bucket = llm_usage[group].setdefault(key, {
+                        "calls": 0, "errors": 0, "total_ms": 0, "ttfb_ms": 0, "max_total_ms": 0,
+                        **{field: 0 for field in LLM_TOKEN_FIELDS}
+                    })
+                    bucket["calls"] += 1
+                    # Отмененный при хеджировании запрос - не ошибка и не успех
+                    if outcome == "cancelled":
+                        bucket["cancelled"] = bucket.get("cancelled", 0) + 1
+                    elif outcome != "success":
+                        bucket["errors"] += 1
+                    for field, value in tokens.items():
+                        bucket[field] += value
+                    bucket["total_ms"] += round(total_ms or 0)
+                    bucket["ttfb_ms"] += round(ttfb_ms or 0)
+                    bucket["max_total_ms"] = max(bucket["max_total_ms"], round(total_ms or 0))
+                    bucket["last_call"] = now
+            
+                by_user = llm_usage["by_user"]
+                if len(by_user) > max_users:
+                    for stale_user in sorted(by_user, key=lambda key: by_user[key]["last_call"])[:len(by_user) - max_users]:
+                        del by_user[stale_user]
+            
+                llm_usage["recent_calls"] = (llm_usage["recent_calls"] + [{
+                    "timestamp": now,
+                    "model": model_name,
+                    "user_id": str(user_id) if user_id is not None else None,
+                    "prompt_version": prompt_version,
+                    "ttfb_ms": round(ttfb_ms) if ttfb_ms is not None else None,
+                    "total_ms": round(total_ms) if total_ms is not None else None,
+                    "outcome": outcome,
+                    **tokens
+                }])[-recent_limit:]
+                self._save_metrics()
+            except Exception as e:
+                logger.error(f"Ошибка при записи обращения к модели {model_name}: {e}")
+    
+    def get_llm_usage(self, top=5, include_users=False):
+        """Сводка расхода токенов и задержек
+        
+        Args:
+            top (int): Сколько самых долгих и дорогих запросов вернуть
+            include_users (bool): Включать ли данные по пользователям
+        
+        Returns:
+            dict: Агрегаты по моделям и промптам (со средними значениями),
+                самые долгие и самые дорогие из последних запросов
+        """
+        with self._lock:
+            llm_usage = self.metrics.get("llm_usage", {})
+        
+            def with_averages(buckets):
+                result = {}
+                for key, bucket in buckets.items():
+                    calls = bucket.get("calls", 0)
+                    input_total = sum(bucket.get(field, 0) for field in LLM_TOKEN_FIELDS if field != "output_tokens")
+                    result[key] = dict(
+                        bucket,
+                        avg_ttfb_ms=round(bucket.get("ttfb_ms", 0) / calls) if calls else 0,
+                        avg_total_ms=round(bucket.get("total_ms", 0) / calls) if calls else 0,
+                        cache_read_share=bucket.get("cache_read_input_tokens", 0) / input_total if input_total else 0.0
+                    )
+                return result
+        
+            def call_tokens(call):
+                return sum(call.get(field, 0) for field in LLM_TOKEN_FIELDS)
+        
+            recent = llm_usage.get("recent_calls", [])
+            summary = {
+                "by_model": with_averages(llm_usage.get("by_model", {})),
+                "by_prompt": with_averages(llm_usage.get("by_prompt", {})),
+                "slowest_calls": sorted(recent, key=lambda call: call.get("total_ms") or 0, reverse=True)[:top],
+                "most_expensive_calls": sorted(recent, key=call_tokens, reverse=True)[:top],
+            }
+            if include_users:
+                by_user = with_averages(llm_usage.get("by_user", {}))
+                summary["top_users_by_tokens"] = sorted(
+                    ({"user_id": user_id, **bucket} for user_id, bucket in by_user.items()),
+                    key=call_tokens, reverse=True
+                )[:top]
+            else:
+                for group in ("slowest_calls", "most_expensive_calls"):
+                    summary[group] = [dict(call, user_id=None) for call in summary[group]]
+            return summary
+    
+    def get_user_llm_usage(self, user_id):
+        """Расход токенов и задержки одного пользователя или None"""
+        with self._lock:
+            return self.metrics.get("llm_usage", {}).get("by_user", {}).get(str(user_id))
+    
+    def record_hedged_request(self, model_name, hedged, hedge_won, latency_ms, saved_ms=0, cancelled=0, window=200):
+        """Запись запроса, выполненного с хеджированием
+        
+        Args:
+            model_name (str): Модель основного запроса
+            hedged (bool): Отправлялся ли второй запрос
+            hedge_won (bool): Завершился ли второй запрос первым
+            latency_ms (float): Задержка, которую увидел пользователь
+            saved_ms (float): Оценка выигрыша от второго запроса
+            cancelled (int): Сколько проигравших запросов отменено
+            window (int): Сколько последних задержек хранить
+        """
+        with self._lock:
+            try:
+                hedging = self.metrics.setdefault("hedging", {
+                    "requests": 0,
+                    "hedged": 0,
+                    "hedge_wins": 0,
+                    "cancelled": 0,
+                    "estimated_saved_ms": 0,
+                    "recent_latencies_ms": []
+                })
+                hedging["requests"] += 1
+                hedging["hedged"] += int(hedged)
+                hedging["hedge_wins"] += int(hedge_won)
+                hedging["estimated_saved_ms"] += round(saved_ms)
+                hedging["cancelled"] = hedging.get("cancelled", 0) + cancelled
+                hedging["recent_latencies_ms"] = (hedging["recent_latencies_ms"] + [round(latency_ms)])[-window:]
+                self._save_metrics()
+            except Exception as e:
+                logger.error(f"Ошибка при записи хеджированного запроса к модели {model_name}: {e}")
+    
+    def get_model_health(self, model_name):
+        """Оценка состояния модели по последним запросам
+        
+        Args:
+            model_name (str): Название модели
+        
+        Returns:
+            dict: samples, error_rate, median_latency_ms, escalation_rate
+        """
+        with self._lock:
+            model_stats = self.metrics["model_performance"].get(model_name, {})
+            outcomes = model_stats.get("recent_outcomes", [])
+            latencies = sorted(model_stats.get("recent_latencies_ms", []))
+            calls = model_stats.get("calls", 0)
+            return {
+                "samples": len(outcomes),
+                "error_rate": (1 - sum(outcomes) / len(outcomes)) if outcomes else 0.0,
+                "median_latency_ms": latencies[len(latencies) // 2] if latencies else None,
+                "escalation_rate": model_stats.get("escalations", 0) / calls if calls else 0.0
+            }
     
     def get_model_stats(self, model_name=None):
         """Получение статистики по модели
@@ -167,13 +425,14 @@ class ScriptMetrics:
         Returns:
             dict: Статистика по модели или всем моделям
         """
-        if model_name:
-            if model_name in self.metrics["model_performance"]:
-                return self.metrics["model_performance"][model_name]
+        with self._lock:
+            if model_name:
+                if model_name in self.metrics["model_performance"]:
+                    return self.metrics["model_performance"][model_name]
+                else:
+                    return None
             else:
-                return None
-        else:
-            return self.metrics["model_performance"]
+                return self.metrics["model_performance"]
     
     def get_error_trends(self, days=30):
         """Получение трендов ошибок за указанный период
@@ -184,25 +443,26 @@ class ScriptMetrics:
         Returns:
             dict: Тренды ошибок по дням
         """
-        now = datetime.now()
-        cutoff = now.timestamp() - (days * 24 * 60 * 60)
+        with self._lock:
+            now = datetime.now()
+            cutoff = now.timestamp() - (days * 24 * 60 * 60)
         
-        # Фильтруем данные за указанный период
-        recent_trends = [
-            trend for trend in self.metrics["error_trends"]
-            if datetime.fromisoformat(trend["timestamp"]).timestamp() > cutoff
-        ]
+            # Фильтруем данные за указанный период
+            recent_trends = [
+                trend for trend in self.metrics["error_trends"]
+                if datetime.fromisoformat(trend["timestamp"]).timestamp() > cutoff
+            ]
         
-        # Группируем данные по дням
-        daily_trends = defaultdict(lambda: {"errors_found": 0, "errors_fixed": 0, "scripts": 0})
+            # Группируем данные по дням
+            daily_trends = defaultdict(lambda: {"errors_found": 0, "errors_fixed": 0, "scripts": 0})
         
-        for trend in recent_trends:
-            day = trend["timestamp"][:10]  # Получаем только дату (YYYY-MM-DD)
-            daily_trends[day]["errors_found"] += trend["errors_found"]
-            daily_trends[day]["errors_fixed"] += trend["errors_fixed"]
-            daily_trends[day]["scripts"] += 1
+            for trend in recent_trends:
+                day = trend["timestamp"][:10]  # Получаем только дату (YYYY-MM-DD)
+                daily_trends[day]["errors_found"] += trend["errors_found"]
+                daily_trends[day]["errors_fixed"] += trend["errors_fixed"]
+                daily_trends[day]["scripts"] += 1
         
-        return dict(daily_trends)
+            return dict(daily_trends)
     
     def get_common_errors(self, limit=5):
         """Получение наиболее распространенных типов ошибок
@@ -213,18 +473,19 @@ class ScriptMetrics:
         Returns:
             list: Список кортежей (тип_ошибки, количество)
         """
-        try:
-            # Берем словарь с типами ошибок
-            error_types = self.metrics.get("error_types", {})
+        with self._lock:
+            try:
+                # Берем словарь с типами ошибок
+                error_types = self.metrics.get("error_types", {})
             
-            # Создаем счетчик
-            counter = Counter(error_types)
+                # Создаем счетчик
+                counter = Counter(error_types)
             
-            # Возвращаем наиболее распространенные ошибки
-            return counter.most_common(limit)
-        except Exception as e:
-            logger.error(f"Ошибка при получении распространенных ошибок: {e}")
-            return []
+                # Возвращаем наиболее распространенные ошибки
+                return counter.most_common(limit)
+            except Exception as e:
+                logger.error(f"Ошибка при получении распространенных ошибок: {e}")
+                return []
     
     def get_summary(self):
         """Получение общей сводки метрик
@@ -232,20 +493,21 @@ class ScriptMetrics:
         Returns:
             dict: Сводка метрик
         """
-        total_errors = self.metrics["total_errors_found"]
-        total_fixed = self.metrics["total_errors_fixed"]
+        with self._lock:
+            total_errors = self.metrics["total_errors_found"]
+            total_fixed = self.metrics["total_errors_fixed"]
         
-        return {
-            "total_scripts": self.metrics["total_scripts_generated"],
-            "total_errors": total_errors,
-            "total_fixed": total_fixed,
-            "fix_rate": (total_fixed / total_errors * 100) if total_errors > 0 else 0,
-            "avg_errors_per_script": 
-                total_errors / self.metrics["total_scripts_generated"] 
-                if self.metrics["total_scripts_generated"] > 0 else 0,
-            "common_errors": self.get_common_errors(5),
-            "last_updated": self.metrics["last_updated"]
-        }
+            return {
+                "total_scripts": self.metrics["total_scripts_generated"],
+                "total_errors": total_errors,
+                "total_fixed": total_fixed,
+                "fix_rate": (total_fixed / total_errors * 100) if total_errors > 0 else 0,
+                "avg_errors_per_script": 
+                    total_errors / self.metrics["total_scripts_generated"] 
+                    if self.metrics["total_scripts_generated"] > 0 else 0,
+                "common_errors": self.get_common_errors(5),
+                "last_updated": self.metrics["last_updated"]
+            }
 
 # Пример использования:
 # metrics = ScriptMetrics()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""
+Точечное исправление ранее сгенерированных скриптов.
+
+Вместо повторной генерации всего набора модель получает текущие скрипты
+и скриншот ошибки и возвращает только изменения:
+- unified diff в блоке ```diff (заголовки --- a/файл и +++ b/файл);
+- замену функции целиком: блок ```powershell file=WindowsOptimizer.ps1 function=Clear-TempFiles;
+- замену небольшого файла целиком: блок ```batch file=Start-Optimizer.bat.
+
+ScriptPatcher применяет изменения к копии набора. Если хотя бы одно
+изменение не применяется (контекст не найден, функции нет в файле),
+поднимается PatchError, и вызывающий код переходит к полной генерации.
+
+Пример использования:
+```python
+patcher = ScriptPatcher()
+try:
+    result = patcher.apply(previous_files, response_text)
+    files = result.files
+except PatchError as e:
+    files = regenerate()
+```
+"""
+
+import re
+import logging
+import threading
+
+from code_blocks import iter_fenced_blocks
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Файлы, которые передаются модели для исправления
+SCRIPT_EXTENSIONS = (".ps1", ".bat", ".cmd", ".sh", ".command")
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_INFO_OPTION = re.compile(r"(\w+)=(\S+)")
+
+
+class PatchError(Exception):
+    """Изменения из ответа модели не удалось применить"""
+
+
+class PatchResult:
+    """Набор файлов после применения изменений"""
+
+    def __init__(self, files, changed, operations):
+        self.files = files
+        self.changed = changed
+        self.operations = operations
+
+    def __repr__(self):
+        return f"PatchResult(changed={self.changed}, operations={self.operations})"
+
+
+def render_scripts_for_prompt(files):
+    """
+    Текущие скрипты для запроса на исправление
+
+    Args:
+        files (dict): Имя файла -> содержимое
+
+    Returns:
+        str: Скрипты в блоках кода с именами файлов
+    """
+    sections = []
+    for filename, content in files.items():
+        if filename.lower().endswith(SCRIPT_EXTENSIONS):
+            sections.append(f"### {filename}\n```\n{content.rstrip()}\n```")
+    return "\n\n".join(sections)
+
+
+def _resolve_name(files, name):
+    """Имя файла набора без учета регистра и префиксов a/ и b/"""
+    name = name.strip().strip('"')
+    if name[:2] in ("a/", "b/"):
+        name = name[2:]
+    for filename in files:
+        if filename.lower() == name.lower():
+            return filename
+    raise PatchError(f"Файл {name} отсутствует в наборе")
+
+
+def parse_unified_diff(text):
+    """
+    Разбирает unified diff
+
+    Returns:
+        list: [(имя файла, [(строка начала, старые строки, новые строки), ...]), ...]
+    """
+    patches = []
+    hunks = None
+    old_lines = new_lines = None
+    for line in text.split("\n"):
+        if line.startswith("--- "):
+            continue
+        if line.startswith("+++ "):
+            hunks = []
+            patches.append((line[4:].split("\t")[0].strip(), hunks))
+            old_lines = None
+            continue
+        header = _HUNK_HEADER.match(line)
+        if header:
+            if hunks is None:
+                raise PatchError("Фрагмент diff без заголовка файла")
+            old_lines, new_lines = [], []
+            hunks.append((int(header.group(1)), old_lines, new_lines))
+            continue
+        if old_lines is None or line.startswith("\\"):
+            continue
+        marker, body = line[:1], line[1:]
+        if marker == "-":
+            old_lines.append(body)
+        elif marker == "+":
+            new_lines.append(body)
+        else:
+            # Контекст (пустая строка - контекст с обрезанным пробелом)
+            old_lines.append(body)
+            new_lines.append(body)
+    # Пустые строки в конце блока - не контекст, а конец ответа
+    for _, file_hunks in patches:
+        for _, old, new in file_hunks:
+            while old and new and old[-1] == "" and new[-1] == "":
+                old.pop()
+                new.pop()
+    if not patches:
+        raise PatchError("В diff нет ни одного файла")
+    return patches
+
+
+def _find_hunk(lines, old, hint, cursor):
+    """Позиция фрагмента: точное совпадение, затем без учета пробелов в конце строк"""
+    if not old:
+        return min(max(hint, cursor), len(lines))
+    for normalize in (lambda value: value, lambda value: value.rstrip()):
+        target = [normalize(line) for line in old]
+        candidates = [
+            start for start in range(cursor, len(lines) - len(old) + 1)
+            if normalize(lines[start]) == target[0]
+            and [normalize(line) for line in lines[start:start + len(old)]] == target
+        ]
+        if candidates:
+            # Ближайшее к номеру строки из заголовка фрагмента
+            return min(candidates, key=lambda start: abs(start - hint))
+    return None
+
+
+def apply_hunks(content, hunks):
+    """
+    Применяет фрагменты unified diff к тексту
+
+    Raises:
+        PatchError: контекст фрагмента не найден
+    """
+    lines = content.split("\n")
+    cursor = 0
+    offset = 0
+    for start, old, new in hunks:
+        position = _find_hunk(lines, old, max(start - 1 + offset, 0), cursor)
+        if position is None:
+            preview = old[0].strip() if old else ""
+            raise PatchError(f"Контекст фрагмента @@ -{start} не найден: {preview[:60]!r}")
+        lines[position:position + len(old)] = new
+        cursor = position + len(new)
+        offset += len(new) - len(old)
+    return "\n".join(lines)
+
+
+def _block_end(content, open_brace):
+    """Позиция после закрывающей скобки PowerShell-блока (строки и комментарии пропускаются)"""
+    depth = 0
+    index = open_brace
+    length = len(content)
+    while index < length:
+        char = content[index]
+        if content.startswith("<#", index):
+            end = content.find("#>", index + 2)
+            index = length if end == -1 else end + 2
+            continue
+        if char == "#":
+            end = content.find("\n", index)
+            index = length if end == -1 else end
+            continue
+        if content.startswith('@"', index) or content.startswith("@'", index):
+            terminator = "\n" + content[index + 1] + "@"
+            end = content.find(terminator, index + 2)
+            index = length if end == -1 else end + len(terminator)
+            continue
+        if char in "\"'":
+            index += 1
+            while index < length and content[index] != char:
+                if char == '"' and content[index] == "`":
+                    index += 1
+                index += 1
+            index += 1
+            continue
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+        index += 1
+    return None
+
+
+def replace_function(content, name, code):
+    """
+    Заменяет определение функции PowerShell целиком
+
+    Raises:
+        PatchError: функция не найдена или ее тело не закрыто
+    """
+    match = re.search(rf"^[ \t]*function\s+{re.escape(name)}\b", content, re.IGNORECASE | re.MULTILINE)
+    if match is None:
+        raise PatchError(f"Функция {name} не найдена")
+    open_brace = content.find("{", match.end())
+    end = _block_end(content, open_brace) if open_brace != -1 else None
+    if end is None:
+        raise PatchError(f"Не удалось найти конец функции {name}")
+    return content[:match.start()] + code.strip("\n") + content[end:]
+
+
+class ScriptPatcher:
+    """Применение изменений из ответа модели к набору скриптов"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # Счетчики для метрик
+        self.stats = {
+            "attempts": 0,
+            "applied": 0,
+            "failed": 0,
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def apply(self, files, response_text):
+        """
+        Применяет изменения из ответа модели
+
+        Args:
+            files (dict): Текущий набор файлов
+            response_text (str): Ответ модели с diff или заменами
+
+        Returns:
+            PatchResult: Новый набор (исходный словарь не изменяется)
+
+        Raises:
+            PatchError: изменений нет или хотя бы одно из них не применяется
+        """
+        self._count("attempts")
+        try:
+            result = self._apply(files, response_text)
+        except PatchError as e:
+            self._count("failed")
+            logger.info(f"Изменения не применены: {e}")
+            raise
+        self._count("applied")
+        logger.info(f"Применены изменения: {', '.join(result.operations)}")
+        return result
+
+    def _apply(self, files, response_text):
+        patched = dict(files)
+        changed = []
+        operations = []
+        for block in iter_fenced_blocks(response_text):
+            options = dict(_INFO_OPTION.findall(block.language or ""))
+            language = (block.language or "").split(" ")[0]
+            if language in ("diff", "patch") or (not options and block.content.startswith("--- ")):
+                for name, hunks in parse_unified_diff(block.content):
+                    filename = _resolve_name(patched, name)
+                    patched[filename] = apply_hunks(patched[filename], hunks)
+                    changed.append(filename)
+                    operations.append(f"diff {filename} ({len(hunks)} фрагм.)")
+            elif "file" in options:
+                filename = _resolve_name(patched, options["file"])
+                if "function" in options:
+                    patched[filename] = replace_function(patched[filename], options["function"], block.content)
+                    operations.append(f"функция {options['function']} в {filename}")
+                else:
+                    patched[filename] = block.content
+                    operations.append(f"файл {filename}")
+                changed.append(filename)
+        if not changed:
+            raise PatchError("В ответе нет изменений")
+        return PatchResult(patched, list(dict.fromkeys(changed)), operations)
+
+    def get_stats(self):
+        """Статистика применения изменений"""
+        with self._lock:
+            return dict(self.stats)
@@ -391,19 +391,33 @@ pause
         
         return enhanced_files
 
+    # Признаки критических ошибок, которые нельзя исправить автоматически
+    CRITICAL_MARKERS = ("несбалансированные", "синтаксис", "отсутствует")
+
+    def count_critical_issues(self, issues):
+        """Количество критических ошибок в списке замечаний одного файла"""
+        return sum(1 for issue in issues
+                   if any(critical in issue.lower() for critical in self.CRITICAL_MARKERS))
+
     def should_regenerate_script(self, validation_results):
         """Определяет, требуется ли полная регенерация скрипта"""
-        critical_issues_count = 0
-        
-        for filename, issues in validation_results.items():
-            for issue in issues:
-                # Подсчет критических ошибок, которые нельзя исправить автоматически
-                if any(critical in issue.lower() for critical in ["несбалансированные", "синтаксис", "отсутствует"]):
-                    critical_issues_count += 1
+        critical_issues_count = sum(self.count_critical_issues(issues) for issues in validation_results.values())
         
         # Если больше 3 критических ошибок, рекомендуем регенерацию
         return critical_issues_count > 3
 
+    def failing_files(self, validation_results):
+        """Файлы с критическими ошибками, начиная с файла с наибольшим их числом
+        
+        Args:
+            validation_results: результаты валидации (имя файла -> список замечаний)
+            
+        Returns:
+            list: Имена файлов, которые стоит сгенерировать заново
+        """
+        counts = {filename: self.count_critical_issues(issues) for filename, issues in validation_results.items()}
+        return sorted((filename for filename, count in counts.items() if count), key=lambda name: -counts[name])
+
     def fix_variables_in_strings(self, content):
         """Исправляет формат переменных в строках с двоеточием
         
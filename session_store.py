@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+"""
+Ограниченное по памяти хранилище сессий пользователей бота.
+
+Заменяет глобальные словари user_states, user_files и user_messages:
+- сессии упорядочены по последнему обращению (LRU) и удаляются по TTL;
+- наборы скриптов хранятся сжатыми (zlib), а при превышении лимита памяти
+  самые старые наборы выгружаются на диск в закрытый каталог, в файлы со
+  случайными именами (доступ только у владельца); сессии живут только в
+  памяти, поэтому оставшиеся от прошлого запуска файлы удаляются при старте;
+- при превышении лимита количества сессий или памяти вытесняются
+  наименее используемые сессии.
+
+Для совместимости хранилище предоставляет словареподобные представления
+полей (store.field("state")), поддерживающие get, [], in, pop и del.
+"""
+
+import os
+import json
+import time
+import zlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Поля, которые хранятся как сжатые наборы файлов
+BLOB_FIELDS = ("files",)
+# Имена файлов выгруженных наборов: SPILL_PREFIX + случайная часть + SPILL_SUFFIX
+SPILL_PREFIX = "session_"
+SPILL_SUFFIX = ".zlib"
+
+
+class ChatSession:
+    """Данные одного чата"""
+
+    __slots__ = ("chat_id", "values", "blobs", "spilled", "last_access")
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.values = {}    # Простые значения (состояние, текст запроса)
+        self.blobs = {}     # Сжатые наборы файлов в памяти
+        self.spilled = {}   # Наборы файлов, выгруженные на диск: поле -> путь
+        self.last_access = time.monotonic()
+
+    def resident_bytes(self):
+        """Оценка занимаемой памяти"""
+        size = sum(len(str(value)) for value in self.values.values())
+        return size + sum(len(blob) for blob in self.blobs.values())
+
+
+class SessionStore:
+    """Хранилище сессий с TTL, LRU и лимитом памяти"""
+
+    def __init__(self, max_sessions=10000, ttl=24 * 3600, max_bytes=64 * 1024 * 1024,
+                 spill_dir=None, sweep_interval=60):
+        """
+        Инициализация хранилища
+
+        Args:
+            max_sessions (int): Максимальное количество сессий
+            ttl (float): Время жизни неактивной сессии в секундах
+            max_bytes (int): Лимит памяти под данные сессий
+            spill_dir (str, optional): Закрытый каталог для выгрузки наборов файлов на диск
+                (например, созданный tempfile.mkdtemp)
+            sweep_interval (float): Минимальный интервал между очистками по TTL
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.sweep_interval = sweep_interval
+
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+        self._resident_bytes = 0
+        self._last_sweep = time.monotonic()
+
+        # Счетчики для метрик
+        self.stats = {
+            "expired": 0,
+            "evicted": 0,
+            "spilled": 0,
+            "loaded_from_disk": 0,
+            "stale_spills_removed": 0,
+        }
+
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, mode=0o700, exist_ok=True)
+            self._remove_stale_spills()
+
+    def field(self, name):
+        """Возвращает словареподобное представление поля сессий"""
+        return SessionField(self, name)
+
+    def _touch(self, chat_id, create=False):
+        """Возвращает сессию и переносит ее в конец LRU-очереди"""
+        session = self._sessions.get(chat_id)
+        now = time.monotonic()
+        if session is not None and now - session.last_access > self.ttl:
+            self._drop(chat_id, "expired")
+            session = None
+        if session is None:
+            if not create:
+                return None
+            session = ChatSession(chat_id)
+            self._sessions[chat_id] = session
+        else:
+            self._sessions.move_to_end(chat_id)
+        session.last_access = now
+        return session
+
+    def _drop(self, chat_id, reason):
+        """Удаляет сессию вместе с выгруженными на диск файлами"""
+        session = self._sessions.pop(chat_id, None)
+        if session is None:
+            return
+        self._resident_bytes -= session.resident_bytes()
+        for path in session.spilled.values():
+            self._remove_file(path)
+        self.stats[reason] += 1
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _remove_stale_spills(self):
+        """Удаляет выгруженные наборы, оставшиеся от прошлого запуска"""
+        try:
+            names = os.listdir(self.spill_dir)
+        except OSError as e:
+            logger.warning(f"Не удалось проверить каталог выгрузки сессий {self.spill_dir}: {e}")
+            return
+        for name in names:
+            if name.startswith(SPILL_PREFIX) and name.endswith(SPILL_SUFFIX):
+                self._remove_file(os.path.join(self.spill_dir, name))
+                self.stats["stale_spills_removed"] += 1
+        if self.stats["stale_spills_removed"]:
+            logger.info(f"Удалено оставшихся от прошлого запуска файлов сессий: {self.stats['stale_spills_removed']}")
+
+    def _spill(self, session):
+        """Выгружает наборы файлов сессии на диск"""
+        for name, blob in list(session.blobs.items()):
+            path = None
+            try:
+                # mkstemp создает файл с непредсказуемым именем и правами 0600
+                fd, path = tempfile.mkstemp(prefix=SPILL_PREFIX, suffix=SPILL_SUFFIX, dir=self.spill_dir)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(blob)
+            except OSError as e:
+                if path is not None:
+                    self._remove_file(path)
+                logger.warning(f"Не удалось выгрузить сессию {session.chat_id} на диск: {e}")
+                return False
+            del session.blobs[name]
+            session.spilled[name] = path
+            self._resident_bytes -= len(blob)
+            self.stats["spilled"] += 1
+        return True
+
+    def _enforce_limits(self):
+        """Очищает просроченные сессии и вытесняет лишние"""
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            expired = [chat_id for chat_id, session in self._sessions.items() if now - session.last_access > self.ttl]
+            for chat_id in expired:
+                self._drop(chat_id, "expired")
+
+        while len(self._sessions) > self.max_sessions:
+            self._drop(next(iter(self._sessions)), "evicted")
+
+        if self._resident_bytes <= self.max_bytes:
+            return
+
+        # Сначала выгружаем файлы самых старых сессий на диск, затем вытесняем сессии
+        if self.spill_dir:
+            for session in list(self._sessions.values()):
+                if self._resident_bytes <= self.max_bytes:
+                    return
+                if session.blobs and not self._spill(session):
+                    break
+        while self._resident_bytes > self.max_bytes and len(self._sessions) > 1:
+            self._drop(next(iter(self._sessions)), "evicted")
+
+    def get_value(self, chat_id, name, default=None):
+        """Возвращает значение поля сессии"""
+        with self._lock:
+            session = self._touch(chat_id)
+            if session is None:
+                return default
+            if name in BLOB_FIELDS:
+                return self._load_blob(session, name, default)
+            return session.values.get(name, default)
+
+    def has_value(self, chat_id, name):
+        """Проверяет наличие значения поля в сессии"""
+        with self._lock:
+            session = self._touch(chat_id)
+            if session is None:
+                return False
+            return name in session.values or name in session.blobs or name in session.spilled
+
+    def set_value(self, chat_id, name, value):
+        """Сохраняет значение поля сессии"""
+        with self._lock:
+            session = self._touch(chat_id, create=True)
+            self._discard(session, name)
+            if name in BLOB_FIELDS:
+                blob = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"), 6)
+                session.blobs[name] = blob
+                self._resident_bytes += len(blob)
+            else:
+                session.values[name] = value
+                self._resident_bytes += len(str(value))
+            self._enforce_limits()
+
+    def pop_value(self, chat_id, name, default=None):
+        """Удаляет значение поля и возвращает его"""
+        with self._lock:
+            session = self._touch(chat_id)
+            if session is None:
+                return default
+            if name in BLOB_FIELDS:
+                value = self._load_blob(session, name, default)
+            else:
+                value = session.values.get(name, default)
+            self._discard(session, name)
+            if not session.values and not session.blobs and not session.spilled:
+                del self._sessions[chat_id]
+            return value
+
+    def _discard(self, session, name):
+        """Удаляет значение поля из сессии"""
+        if name in session.values:
+            self._resident_bytes -= len(str(session.values.pop(name)))
+        if name in session.blobs:
+            self._resident_bytes -= len(session.blobs.pop(name))
+        if name in session.spilled:
+            self._remove_file(session.spilled.pop(name))
+
+    def _load_blob(self, session, name, default):
+        """Распаковывает набор файлов из памяти или с диска"""
+        blob = session.blobs.get(name)
+        if blob is None and name in session.spilled:
+            try:
+                with open(session.spilled[name], "rb") as f:
+                    blob = f.read()
+                self.stats["loaded_from_disk"] += 1
+            except OSError as e:
+                logger.warning(f"Не удалось прочитать выгруженную сессию {session.chat_id}: {e}")
+                session.spilled.pop(name)
+                return default
+        if blob is None:
+            return default
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def chat_ids(self, name):
+        """Список чатов, у которых задано поле"""
+        with self._lock:
+            return [
+                chat_id for chat_id, session in self._sessions.items()
+                if name in session.values or name in session.blobs or name in session.spilled
+            ]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def get_stats(self):
+        """
+        Возвращает статистику хранилища
+
+        Returns:
+            dict: Количество сессий, занимаемая память и счетчики вытеснений
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["sessions"] = len(self._sessions)
+            stats["resident_bytes"] = self._resident_bytes
+            stats["max_bytes"] = self.max_bytes
+            stats["spilled_sessions"] = sum(1 for session in self._sessions.values() if session.spilled)
+            return stats
+
+
+class SessionField:
+    """Словареподобное представление одного поля всех сессий"""
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def get(self, chat_id, default=None):
+        return self.store.get_value(chat_id, self.name, default)
+
+    def pop(self, chat_id, default=None):
+        return self.store.pop_value(chat_id, self.name, default)
+
+    def __getitem__(self, chat_id):
+        if not self.store.has_value(chat_id, self.name):
+            raise KeyError(chat_id)
+        return self.store.get_value(chat_id, self.name)
+
+    def __setitem__(self, chat_id, value):
+        self.store.set_value(chat_id, self.name, value)
+
+    def __delitem__(self, chat_id):
+        if not self.store.has_value(chat_id, self.name):
+            raise KeyError(chat_id)
+        self.store.pop_value(chat_id, self.name)
+
+    def __contains__(self, chat_id):
+        return self.store.has_value(chat_id, self.name)
+
+    def __iter__(self):
+        return iter(self.store.chat_ids(self.name))
+
+    def __len__(self):
+        return len(self.store.chat_ids(self.name))
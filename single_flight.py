@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Объединение одновременных одинаковых запросов (single-flight).
+
+Если пользователь дважды нажал кнопку или повторно отправил тот же
+скриншот, пока первый запрос еще выполняется, второй вызов не запускает
+генерацию заново, а присоединяется к уже выполняющейся и получает тот же
+результат. Ведущий вызов определяется по ключу (чат + хеш содержимого).
+"""
+
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+class CoalescedCallError(Exception):
+    """Ведущий вызов, к которому присоединился запрос, завершился ошибкой"""
+
+    def __init__(self, key, error):
+        self.key = key
+        self.error = error
+        super().__init__(f"Объединенный запрос {key} завершился ошибкой: {error}")
+
+
+class SingleFlight:
+    """Выполняет не более одного вызова на ключ одновременно"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+        # Счетчики для метрик
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args, timeout=None, **kwargs):
+        """
+        Выполняет func или присоединяется к уже выполняющемуся вызову с тем же ключом
+
+        Args:
+            key: Ключ запроса
+            func (callable): Функция, выполняемая ведущим вызовом
+            timeout (float, optional): Максимальное ожидание результата ведомым вызовом
+
+        Returns:
+            tuple: (результат, True для ведущего вызова / False для присоединившегося)
+
+        Raises:
+            CoalescedCallError: ведущий вызов завершился ошибкой (для присоединившихся)
+            TimeoutError: результат не получен за timeout
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._flights[key] = future
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            logger.info(f"Запрос {key} уже выполняется, ожидаем его результат")
+            try:
+                return future.result(timeout=timeout), False
+            except FutureTimeoutError:
+                raise TimeoutError(f"Не дождались результата запроса {key}")
+            except Exception as e:
+                raise CoalescedCallError(key, e) from e
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, True
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+
+    def in_flight(self):
+        """Количество выполняющихся вызовов"""
+        with self._lock:
+            return len(self._flights)
+
+    def get_stats(self):
+        """
+        Возвращает статистику объединения запросов
+
+        Returns:
+            dict: Количество ведущих, объединенных и выполняющихся вызовов
+        """
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights),
+            }
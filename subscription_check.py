@@ -7,11 +7,12 @@
 import os
 import json
 import logging
-import requests
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from monetization_client import MonetizationClient, MonetizationUnavailable
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -27,6 +28,9 @@ SUBSCRIPTIONS_FILE = Path(os.path.dirname(os.path.abspath(__file__))) / "subscri
 default_payment_url = "https://paymentsysatem-production.up.railway.app"
 MONETIZATION_SERVER_URL = os.getenv("PAYMENT_SYSTEM_URL", default_payment_url)
 
+# Общий клиент сервера монетизации (пул соединений, таймауты, кеш статусов)
+monetization_client = MonetizationClient(MONETIZATION_SERVER_URL)
+
 class SubscriptionManager:
     """
     Класс для управления подписками пользователей
@@ -129,21 +133,22 @@ class SubscriptionManager:
             
             # Проверяем статус платежа через API сервера монетизации
             if payment_id and not payment_id.startswith('test_'):
-                payment_status_url = f"{MONETIZATION_SERVER_URL}/api/payment-status/{payment_id}"
-                logger.info(f"[DEBUG] Checking payment status at {payment_status_url}")
+                logger.info(f"[DEBUG] Checking payment status for {payment_id}")
                 
                 try:
-                    response = requests.get(payment_status_url)
-                    if response.status_code == 200:
-                        payment_data = response.json()
+                    status_code, payment_data = monetization_client.fetch_payment_status(payment_id)
+                    if status_code == 200:
                         logger.info(f"[DEBUG] Payment status response: {payment_data}")
                         
                         if payment_data.get('status') != 'succeeded':
                             logger.error(f"[DEBUG] Payment {payment_id} not succeeded: {payment_data.get('status')}")
                             return False
                     else:
-                        logger.error(f"[DEBUG] Failed to check payment status: {response.status_code}")
+                        logger.error(f"[DEBUG] Failed to check payment status: {status_code}")
                         return False
+                except MonetizationUnavailable as e:
+                    logger.error(f"[DEBUG] Monetization server unavailable: {e}")
+                    return False
                 except Exception as e:
                     logger.error(f"[DEBUG] Error checking payment status: {e}")
                     return False
@@ -273,15 +278,11 @@ class SubscriptionManager:
             return True
             
         try:
-            # Формируем URL для запроса статуса платежа
-            url = f"{MONETIZATION_SERVER_URL}/api/payment-status/{payment_id}"
-            
-            # Отправляем запрос
-            response = requests.get(url, timeout=10)
+            # Запрашиваем статус через общий клиент (конечные статусы берутся из кеша)
+            status_code, payment_data = monetization_client.fetch_payment_status(payment_id)
             
             # Проверяем ответ
-            if response.status_code == 200:
-                payment_data = response.json()
+            if status_code == 200:
                 logger.info(f"Получен статус платежа {payment_id}: {payment_data}")
                 
                 # Проверяем статус платежа
@@ -291,7 +292,7 @@ class SubscriptionManager:
                 elif payment_data.get("status") == "test_succeeded" or payment_data.get("test") == True:
                     logger.info(f"Обнаружен успешный тестовый платеж {payment_id}")
                     return True
-            elif response.status_code == 404:
+            elif status_code == 404:
                 # Если платеж не найден, но URL содержит 'test', считаем его тестовым
                 if 'test' in payment_id.lower():
                     logger.info(f"Платеж {payment_id} не найден, но похож на тестовый - подтверждаем")
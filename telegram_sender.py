@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+"""
+Единый слой исходящих вызовов Telegram Bot API.
+
+Все отправки (send_message, edit_message_text, send_document) проходят через
+TelegramSender, который:
+- ограничивает скорость глобальным (~30 сообщений/с) и поканальным (~1 сообщение/с)
+  token bucket;
+- пропускает вперед более приоритетные вызовы (редактирование сообщений о
+  прогрессе раньше отправки документов);
+- автоматически повторяет вызов при ответе 429, выдерживая retry_after, а также
+  при ошибках соединения и ошибках 5xx; после таймаута чтения ответа
+  повторяется только редактирование: сообщение или документ могли быть уже
+  доставлены, и повтор прислал бы пользователю дубликат;
+- повторно отправляет одинаковые документы по file_id (FileIdIndex), не
+  загружая содержимое заново.
+"""
+
+import time
+import heapq
+import logging
+import itertools
+import threading
+from io import BytesIO
+
+import requests
+from telebot.apihelper import ApiTelegramException
+
+from file_id_index import document_key
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Приоритеты вызовов: меньше - важнее
+PRIORITY_EDIT = 0      # Редактирование сообщений о прогрессе
+PRIORITY_MESSAGE = 1   # Обычные текстовые сообщения
+PRIORITY_DOCUMENT = 2  # Отправка документов (архивов со скриптами)
+
+# Методы, повтор которых после таймаута чтения не создает дубликатов
+IDEMPOTENT_METHODS = {"edit_message_text"}
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не более capacity накоплено"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def try_acquire(self, now=None):
+        """
+        Пытается забрать один токен
+
+        Returns:
+            float: 0, если токен получен, иначе время ожидания следующего токена
+        """
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now=None):
+        """Bucket полностью восстановлен (можно удалить без потери состояния)"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class TelegramSender:
+    """Ограничитель скорости и повторов для исходящих вызовов бота"""
+
+    def __init__(self, bot, global_rate=30, global_burst=30, chat_rate=1, chat_burst=3,
+                 max_retries=5, max_retry_after=60, file_ids=None):
+        """
+        Инициализация слоя отправки
+
+        Args:
+            bot (telebot.TeleBot): Экземпляр бота
+            global_rate (float): Глобальный лимит вызовов в секунду
+            global_burst (int): Допустимый глобальный всплеск
+            chat_rate (float): Лимит вызовов в секунду для одного чата
+            chat_burst (int): Допустимый всплеск для одного чата
+            max_retries (int): Максимальное количество повторов одного вызова
+            max_retry_after (float): Максимальная пауза по retry_after в секундах
+            file_ids (FileIdIndex, optional): Индекс file_id загруженных документов
+        """
+        self.bot = bot
+        self.file_ids = file_ids
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+
+        self._lock = threading.Condition()
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._chat_buckets = {}
+        self._paused_until = 0.0  # Глобальная пауза после 429
+        self._waiters = []  # Куча (приоритет, порядковый номер)
+        self._sequence = itertools.count()
+
+        # Счетчики для метрик
+        self.stats = {
+            "sent": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failed": 0,
+            "throttled_seconds": 0.0,
+            "documents_uploaded": 0,
+            "documents_reused": 0,
+        }
+
+    def _chat_bucket(self, chat_id, now):
+        """Возвращает bucket чата, удаляя давно неиспользуемые"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                idle = [key for key, value in self._chat_buckets.items() if value.is_full(now)]
+                for key in idle:
+                    del self._chat_buckets[key]
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _acquire(self, chat_id, priority):
+        """Блокирует поток до получения разрешения на вызов"""
+        started = time.monotonic()
+        ticket = (priority, next(self._sequence))
+
+        with self._lock:
+            # Сначала ждем токен своего чата - это не задерживает другие чаты
+            while True:
+                now = time.monotonic()
+                wait = self._chat_bucket(chat_id, now).try_acquire(now) if chat_id is not None else 0.0
+                if wait <= 0:
+                    break
+                self._lock.wait(wait)
+
+            # Затем глобальная очередь: первым обслуживается самый приоритетный вызов
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._waiters[0] == ticket:
+                        if now < self._paused_until:
+                            wait = self._paused_until - now
+                        else:
+                            wait = self._global_bucket.try_acquire(now)
+                            if wait <= 0:
+                                break
+                        self._lock.wait(wait)
+                    else:
+                        # Очередь сдвигается только при выходе вызова из нее (notify_all ниже)
+                        self._lock.wait()
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._lock.notify_all()
+
+            self.stats["throttled_seconds"] += time.monotonic() - started
+
+    def _count(self, key, value=1):
+        """Потокобезопасно увеличивает счетчик"""
+        with self._lock:
+            self.stats[key] += value
+
+    def _pause(self, seconds):
+        """Глобальная пауза после ответа 429"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._lock.notify_all()
+
+    @staticmethod
+    def _retry_after(error):
+        """Извлекает retry_after из ошибки 429"""
+        try:
+            return float(error.result_json.get("parameters", {}).get("retry_after", 1))
+        except Exception:
+            return 1.0
+
+    def call(self, method, target_chat, priority, *args, **kwargs):
+        """
+        Выполняет метод бота с ограничением скорости и повторами
+
+        Args:
+            method (str): Имя метода telebot.TeleBot
+            target_chat: ID чата (для поканального лимита)
+            priority (int): Приоритет вызова (PRIORITY_*)
+            *args, **kwargs: Аргументы метода бота
+
+        Returns:
+            Результат метода бота
+
+        Raises:
+            ApiTelegramException: неповторяемая ошибка или исчерпаны повторы
+        """
+        document = kwargs.get("document")
+        attempt = 0
+        while True:
+            self._acquire(target_chat, priority)
+            if hasattr(document, "seek"):
+                # Поток документа мог быть прочитан предыдущей попыткой
+                document.seek(0)
+            try:
+                result = getattr(self.bot, method)(*args, **kwargs)
+                self._count("sent")
+                return result
+            except ApiTelegramException as e:
+                if e.error_code == 429 and attempt < self.max_retries:
+                    retry_after = min(self._retry_after(e), self.max_retry_after)
+                    self._count("rate_limited")
+                    logger.warning(f"Telegram 429 для {method} (чат {target_chat}), повтор через {retry_after} с")
+                    self._pause(retry_after)
+                elif e.error_code >= 500 and attempt < self.max_retries:
+                    delay = min(2 ** attempt, 30)
+                    logger.warning(f"Telegram {e.error_code} для {method}, повтор через {delay} с")
+                    time.sleep(delay)
+                else:
+                    self._count("failed")
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # Таймаут после установки соединения: Telegram мог уже выполнить вызов
+                delivered_maybe = (isinstance(e, requests.exceptions.Timeout)
+                                   and not isinstance(e, requests.exceptions.ConnectTimeout))
+                if attempt >= self.max_retries or (delivered_maybe and method not in IDEMPOTENT_METHODS):
+                    self._count("failed")
+                    raise
+                delay = min(2 ** attempt, 30)
+                logger.warning(f"Сетевая ошибка при {method}: {e}, повтор через {delay} с")
+                time.sleep(delay)
+            attempt += 1
+            self._count("retries")
+
+    def send_message(self, chat_id, text, **kwargs):
+        """Отправляет текстовое сообщение (аналог bot.send_message)"""
+        return self.call("send_message", chat_id, PRIORITY_MESSAGE, chat_id, text, **kwargs)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        """Редактирует сообщение (аналог bot.edit_message_text), приоритетная очередь"""
+        return self.call("edit_message_text", chat_id, PRIORITY_EDIT,
+                         text, chat_id=chat_id, message_id=message_id, **kwargs)
+
+    def send_document(self, chat_id, document, **kwargs):
+        """Отправляет документ (аналог bot.send_document), низкий приоритет"""
+        return self.call("send_document", chat_id, PRIORITY_DOCUMENT, chat_id=chat_id, document=document, **kwargs)
+
+    def send_document_bytes(self, chat_id, content, file_name, **kwargs):
+        """
+        Отправляет документ из байтов, повторно используя file_id одинаковых документов
+
+        Если документ с тем же именем и содержимым уже загружался, он отправляется
+        по file_id без передачи содержимого. Устаревший file_id (ошибка 400)
+        удаляется из индекса, и документ загружается заново.
+
+        Args:
+            chat_id: ID чата
+            content (bytes): Содержимое документа
+            file_name (str): Имя файла, видимое пользователю
+            **kwargs: Остальные аргументы bot.send_document (caption и т.д.)
+
+        Returns:
+            Отправленное сообщение
+        """
+        key = document_key(content, file_name) if self.file_ids is not None else None
+        file_id = self.file_ids.get(key) if key is not None else None
+        if file_id is not None:
+            try:
+                message = self.send_document(chat_id, file_id, **kwargs)
+                self._count("documents_reused")
+                return message
+            except ApiTelegramException as e:
+                if e.error_code != 400:
+                    raise
+                logger.warning(f"file_id для {file_name} больше не принимается, загружаю документ заново: {e}")
+                self.file_ids.invalidate(key)
+
+        message = self.send_document(chat_id, BytesIO(content), visible_file_name=file_name, **kwargs)
+        self._count("documents_uploaded")
+        document = getattr(message, "document", None)
+        if key is not None and document is not None:
+            self.file_ids.put(key, document.file_id, len(content))
+        return message
+
+    def get_stats(self):
+        """
+        Возвращает статистику отправки
+
+        Returns:
+            dict: Счетчики отправок, повторов и ожидания
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["queued"] = len(self._waiters)
+            stats["tracked_chats"] = len(self._chat_buckets)
+            return stats
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Режим доставки обновлений Telegram через webhook.
+
+Эндпоинт обновлений монтируется в существующее Flask-приложение,
+а обработка выполняется пулом рабочих потоков. Обновления одного чата
+всегда попадают в один и тот же поток, поэтому порядок сообщений
+пользователя (кнопка меню -> скриншот) сохраняется, а разные чаты
+обрабатываются параллельно.
+"""
+
+import hmac
+import queue
+import logging
+import threading
+
+from flask import request, jsonify
+from telebot import types
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передает secret_token из setWebhook
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def get_update_chat_id(update):
+    """
+    Определяет ID чата, к которому относится обновление
+
+    Args:
+        update (types.Update): Обновление Telegram
+
+    Returns:
+        int: ID чата или update_id, если чат определить нельзя
+    """
+    for attr in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        message = getattr(update, attr, None)
+        if message is not None:
+            return message.chat.id
+    callback_query = getattr(update, "callback_query", None)
+    if callback_query is not None and callback_query.message is not None:
+        return callback_query.message.chat.id
+    for attr in ("inline_query", "chosen_inline_result", "pre_checkout_query", "shipping_query"):
+        event = getattr(update, attr, None)
+        if event is not None:
+            return event.from_user.id
+    return update.update_id
+
+
+class WebhookDispatcher:
+    """Пул рабочих потоков для обработки обновлений из webhook"""
+
+    def __init__(self, process_update, workers=4, max_queue_size=1000):
+        """
+        Инициализация диспетчера
+
+        Args:
+            process_update (callable): Функция обработки одного обновления
+            workers (int): Количество рабочих потоков
+            max_queue_size (int): Максимальная длина очереди одного потока
+        """
+        self.process_update = process_update
+        self.workers = max(1, workers)
+        self._queues = [queue.Queue(maxsize=max_queue_size) for _ in range(self.workers)]
+        self._threads = []
+        self._stats_lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+
+        for index, update_queue in enumerate(self._queues):
+            thread = threading.Thread(
+                target=self._worker, args=(update_queue,),
+                name=f"webhook-worker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self, update_queue):
+        """Цикл рабочего потока"""
+        while True:
+            update = update_queue.get()
+            if update is None:
+                update_queue.task_done()
+                return
+            try:
+                self.process_update(update)
+                with self._stats_lock:
+                    self.processed += 1
+            except Exception as e:
+                logger.error(f"Ошибка при обработке обновления {update.update_id}: {e}", exc_info=True)
+                with self._stats_lock:
+                    self.failed += 1
+            finally:
+                update_queue.task_done()
+
+    def submit(self, update):
+        """
+        Ставит обновление в очередь потока, закрепленного за чатом
+
+        Returns:
+            bool: False, если очередь переполнена
+        """
+        shard = hash(get_update_chat_id(update)) % self.workers
+        try:
+            self._queues[shard].put_nowait(update)
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            return False
+        with self._stats_lock:
+            self.accepted += 1
+        return True
+
+    def join(self):
+        """Ожидает обработки всех поставленных в очередь обновлений"""
+        for update_queue in self._queues:
+            update_queue.join()
+
+    def shutdown(self):
+        """Останавливает рабочие потоки после обработки очереди"""
+        for update_queue in self._queues:
+            update_queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+    def get_stats(self):
+        """
+        Возвращает статистику диспетчера
+
+        Returns:
+            dict: Счетчики и текущая длина очередей
+        """
+        with self._stats_lock:
+            return {
+                "workers": self.workers,
+                "queued": sum(update_queue.qsize() for update_queue in self._queues),
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "processed": self.processed,
+                "failed": self.failed,
+            }
+
+
+def register_webhook_route(app, dispatcher, path, secret_token=None):
+    """
+    Монтирует эндпоинт обновлений Telegram в Flask-приложение
+
+    Args:
+        app (Flask): Flask-приложение
+        dispatcher (WebhookDispatcher): Диспетчер обновлений
+        path (str): Путь эндпоинта
+        secret_token (str, optional): Ожидаемое значение заголовка secret_token
+    """
+    def telegram_webhook():
+        """Прием обновления от Telegram"""
+        if secret_token:
+            received = request.headers.get(SECRET_TOKEN_HEADER, "")
+            if not hmac.compare_digest(received, secret_token):
+                logger.warning("Отклонен webhook-запрос с неверным secret_token")
+                return jsonify({"ok": False}), 403
+
+        try:
+            update = types.Update.de_json(request.get_data(as_text=True))
+        except Exception as e:
+            logger.error(f"Некорректное обновление в webhook: {e}")
+            return jsonify({"ok": False}), 400
+
+        if update is None:
+            return jsonify({"ok": False}), 400
+
+        if not dispatcher.submit(update):
+            # Telegram повторит доставку позже
+            logger.warning(f"Очередь обновлений переполнена, обновление {update.update_id} отклонено")
+            return jsonify({"ok": False}), 503
+
+        return jsonify({"ok": True})
+
+    app.add_url_rule(path, endpoint="telegram_webhook", view_func=telegram_webhook, methods=["POST"])
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Заранее подготовленные наборы шаблонных скриптов.
+
+Шаблонные скрипты (запасной вариант при недоступности API) одинаковы для
+всех пользователей, поэтому проверка, исправление, улучшение и упаковка в
+ZIP выполняются один раз на ОС. Готовый набор хранит исходные файлы,
+проверенные файлы, результаты валидации и байты архива; выдача шаблонов
+сводится к чтению из памяти.
+
+Архивы собираются детерминированно (фиксированная дата файлов), поэтому
+одинаковое содержимое всегда дает одинаковые байты архива.
+
+Пример использования:
+```python
+bundles = TemplateBundleCache(build_bundle)
+bundles.warm_up(("windows", "macos"))
+files = bundles.get("windows").copy_files()
+bundle = bundles.find(files)  # набор, если файлы совпадают с шаблонными
+```
+"""
+
+import hashlib
+import logging
+import threading
+import time
+
+from zip_packager import ZIP_DATE_TIME, ZipPackager
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def build_zip(files, date_time=ZIP_DATE_TIME):
+    """
+    Упаковывает файлы в ZIP-архив
+
+    Args:
+        files (dict): Имя файла -> содержимое (str или bytes)
+        date_time (tuple): Дата и время файлов в архиве
+
+    Returns:
+        bytes: Содержимое архива
+    """
+    return ZipPackager(date_time=date_time, cache_size=0).package(files)
+
+
+class TemplateBundle:
+    """Проверенный набор шаблонных файлов с готовым архивом"""
+
+    def __init__(self, os_type, raw_files, files, validation_results, errors_corrected, archive):
+        self.os_type = os_type
+        self.raw_files = dict(raw_files)
+        self.files = dict(files)
+        self.validation_results = validation_results
+        self.errors_corrected = errors_corrected
+        self.archive = archive
+        self.digest = hashlib.sha256(archive).hexdigest()
+
+    @property
+    def error_count(self):
+        """Количество проблем, оставшихся после исправления"""
+        return sum(len(issues) for issues in self.validation_results.values())
+
+    def copy_files(self):
+        """Копия проверенных файлов (изменения копии не затрагивают набор)"""
+        return dict(self.files)
+
+    def matches(self, files):
+        """Совпадают ли файлы с проверенными файлами набора"""
+        return files is self.files or files == self.files
+
+
+class TemplateBundleCache:
+    """Собирает наборы шаблонов один раз на ОС и хранит их в памяти"""
+
+    def __init__(self, builder):
+        """
+        Args:
+            builder (callable): os_type -> TemplateBundle
+        """
+        self._builder = builder
+        self._lock = threading.Lock()
+        self._bundles = {}
+
+        # Счетчики для метрик
+        self.builds = 0
+        self.build_seconds = 0.0
+        self.hits = 0
+        self.matches = 0
+
+    def get(self, os_type="windows"):
+        """
+        Набор для ОС (собирается при первом обращении)
+
+        Returns:
+            TemplateBundle: Готовый набор
+        """
+        bundle = self._bundles.get(os_type)
+        if bundle is not None:
+            self.hits += 1
+            return bundle
+
+        with self._lock:
+            bundle = self._bundles.get(os_type)
+            if bundle is None:
+                started = time.monotonic()
+                bundle = self._builder(os_type)
+                elapsed = time.monotonic() - started
+                self._bundles[os_type] = bundle
+                self.builds += 1
+                self.build_seconds += elapsed
+                logger.info(f"Собран набор шаблонов {os_type}: {len(bundle.files)} файлов, "
+                            f"архив {len(bundle.archive)} байт за {elapsed * 1000:.0f} мс")
+            else:
+                self.hits += 1
+        return bundle
+
+    def warm_up(self, os_types=("windows", "macos")):
+        """Собирает наборы заранее, чтобы первый запрос не ждал сборки"""
+        for os_type in os_types:
+            try:
+                self.get(os_type)
+            except Exception as e:
+                logger.error(f"Не удалось собрать набор шаблонов {os_type}: {e}")
+
+    def find(self, files):
+        """
+        Набор, проверенные файлы которого совпадают с переданными
+
+        Сравниваются только уже собранные наборы; сборка не запускается.
+
+        Returns:
+            TemplateBundle или None
+        """
+        for bundle in list(self._bundles.values()):
+            if bundle.matches(files):
+                self.matches += 1
+                return bundle
+        return None
+
+    def get_stats(self):
+        """Статистика для метрик"""
+        return {
+            "bundles": {os_type: {"files": len(bundle.files), "archive_bytes": len(bundle.archive),
+                                  "digest": bundle.digest[:12]}
+                        for os_type, bundle in list(self._bundles.items())},
+            "builds": self.builds,
+            "build_ms": round(self.build_seconds * 1000, 1),
+            "hits": self.hits,
+            "matches": self.matches,
+        }
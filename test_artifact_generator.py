@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Тесты локальной генерации вспомогательных файлов: разбор основного
+скрипта, запускающий bat-файл и README по списку функций.
+"""
+
+from artifact_generator import ARTIFACT_FILES, build_launcher, extract_script_metadata, generate_artifacts
+from script_validator import ScriptValidator
+
+SCRIPT = """$OutputEncoding = [System.Text.Encoding]::UTF8
+$LogPath = "$env:TEMP\\WindowsOptimizer.log"
+$BackupDir = "$env:USERPROFILE\\OptimizerBackup"
+
+function Write-Log {
+    param([string]$Message)
+    Add-Content -Path $LogPath -Value $Message
+}
+
+# Отключение телеметрии Windows
+function Disable-Telemetry {
+    Stop-Service -Name DiagTrack -Force
+    Set-Service -Name DiagTrack -StartupType Disabled
+    Set-ItemProperty -Path "HKLM:\\SOFTWARE\\Policies\\Microsoft\\Windows\\DataCollection" -Name AllowTelemetry -Value 0
+}
+
+function Clear-TempFiles {
+    <#
+    .SYNOPSIS
+        Очистка временных файлов
+    #>
+    Remove-Item "$env:TEMP\\*" -Recurse -Force -ErrorAction SilentlyContinue
+}
+
+function Optimize-Search {
+    Set-Service WSearch -StartupType Manual
+}
+
+Checkpoint-Computer -Description "Optimizer" -RestorePointType MODIFY_SETTINGS
+Disable-Telemetry
+Clear-TempFiles
+Optimize-Search
+"""
+
+
+def test_metadata_from_script():
+    """Функции с описаниями, службы, реестр, журнал и резервные копии"""
+    metadata = extract_script_metadata(SCRIPT)
+    assert metadata.functions == [
+        ("Disable-Telemetry", "Отключение телеметрии Windows"),
+        ("Clear-TempFiles", "Очистка временных файлов"),
+        ("Optimize-Search", ""),
+    ]
+    assert metadata.services == ["DiagTrack", "WSearch"]
+    assert metadata.registry_changes == 1
+    assert metadata.log_path == "$env:TEMP\\WindowsOptimizer.log"
+    assert metadata.backup_dir == "$env:USERPROFILE\\OptimizerBackup"
+    assert metadata.restore_point
+
+
+def test_launcher_passes_validation():
+    """Запускающий файл проходит проверку и содержит только ASCII"""
+    launcher = build_launcher()
+    assert ScriptValidator().validate_batch_script(launcher) == []
+    assert launcher.isascii()
+    assert '-ExecutionPolicy Bypass -NoProfile -File "%~dp0WindowsOptimizer.ps1"' in launcher
+
+
+def test_readme_lists_functions():
+    """README описывает функции скрипта; скрипт без функций дает общую инструкцию"""
+    artifacts = generate_artifacts(SCRIPT)
+    assert tuple(artifacts) == ARTIFACT_FILES
+    readme = artifacts["README.md"]
+    assert "## Использование" in readme
+    assert "- **Disable-Telemetry** - Отключение телеметрии Windows" in readme
+    assert "- **Optimize-Search**\n" in readme
+    assert "Write-Log" not in readme
+    assert "`DiagTrack`, `WSearch`" in readme and "точку восстановления" in readme
+
+    readme = generate_artifacts("Write-Host 'Оптимизация'")["README.md"]
+    assert "## Что делает скрипт" not in readme and "## Изменения в системе" not in readme
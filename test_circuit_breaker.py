@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Тесты порогов Circuit Breaker: доля ошибок, доля медленных вызовов,
+пробный запрос в half_open и классификация исключений.
+"""
+
+import time
+
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from concurrency_limiter import AdaptiveConcurrencyLimiter, ConcurrencyLimitExceeded
+
+
+def test_failure_rate_opens_circuit():
+    """Цепь размыкается по доле ошибок, даже если ошибки идут не подряд"""
+    breaker = CircuitBreaker("test", failure_threshold=100, failure_rate_threshold=0.5,
+                             window_size=10, min_calls=4)
+    for _ in range(2):
+        breaker.record_success()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_slow_calls_open_circuit_and_slow_probe_reopens():
+    """Медленные успешные вызовы размыкают цепь, медленный пробный вызов не замыкает ее"""
+    changes = []
+    breaker = CircuitBreaker("test", recovery_timeout=0.0, slow_call_threshold=1.0,
+                             slow_call_rate_threshold=0.75, min_calls=4,
+                             on_state_change=lambda name, old, new: changes.append(new))
+    breaker.record_success(0.1)
+    for _ in range(3):
+        breaker.record_success(5.0)
+    assert changes == [CircuitBreaker.OPEN]
+
+    assert breaker.allow_request()  # half_open, пробный запрос
+    breaker.record_success(5.0)
+    assert changes[-1] == CircuitBreaker.OPEN
+
+    assert breaker.allow_request()
+    breaker.record_success(0.1)
+    assert changes[-1] == CircuitBreaker.CLOSED
+    assert breaker.get_status()["total_slow"] == 4
+
+
+def test_is_failure_ignores_request_errors():
+    """Исключения, которые is_failure не считает сбоем сервиса, не размыкают цепь"""
+    breaker = CircuitBreaker("test", failure_threshold=1, is_failure=lambda e: not isinstance(e, ValueError))
+
+    def bad_request():
+        raise ValueError("bad request")
+
+    def unavailable():
+        raise ConnectionError("down")
+
+    with pytest.raises(ValueError):
+        breaker.call(bad_request)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    with pytest.raises(ConnectionError):
+        breaker.call(unavailable)
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "ok")
+
+
+def test_limiter_rejections_leave_circuit_closed():
+    """Отказы локальной очереди не размыкают цепь и не расходуют пробный запрос"""
+    limiter = AdaptiveConcurrencyLimiter("test", initial_limit=1, min_limit=1, max_limit=1)
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout=0.05,
+                             is_ignored=lambda e: isinstance(e, ConcurrencyLimitExceeded))
+
+    def limited_call():
+        permit = limiter.acquire(timeout=0.01)
+        permit.release()
+        return "ok"
+
+    held = limiter.acquire(timeout=1)
+    for _ in range(5):
+        with pytest.raises(ConcurrencyLimitExceeded):
+            breaker.call(limited_call)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.get_status()["total_calls"] == 0
+
+    def unavailable():
+        raise ConnectionError("down")
+
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            breaker.call(unavailable)
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    # Пробный запрос отклонен очередью - цепь остается полуоткрытой и пропускает следующий
+    with pytest.raises(ConcurrencyLimitExceeded):
+        breaker.call(limited_call)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    held.release()
+    assert breaker.call(limited_call) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
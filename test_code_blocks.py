@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Тесты разбора блоков кода: позиции блоков в ответе и определение типа
+блока по тегу языка и содержимому.
+"""
+
+from code_blocks import MACOS_KINDS, FencedBlock, classify_block, iter_fenced_blocks
+
+RESPONSE = (
+    "Вот скрипты:\n"
+    "```ps1\n$OutputEncoding = [System.Text.Encoding]::UTF8\nGet-Service -Name WSearch\n```\n"
+    "Запуск:\n"
+    "```\n@echo off\nchcp 65001 >nul\npowershell -ExecutionPolicy Bypass -File \"%~dp0Run.ps1\"\n```\n"
+    "```\n# Инструкция\n\n1. Запустите **Start-Optimizer.bat**\n```"
+)
+
+
+def test_spans_point_to_blocks_in_response():
+    """Позиции блока охватывают ограды, содержимое совпадает с текстом между ними"""
+    blocks = list(iter_fenced_blocks(RESPONSE))
+    assert [block.index for block in blocks] == [0, 1, 2]
+    for block in blocks:
+        start, end = block.span
+        fenced = RESPONSE[start:end]
+        assert fenced.startswith("```") and fenced.endswith("```")
+        assert block.content in fenced
+    # Последний блок закрыт строкой без перевода строки
+    assert blocks[-1].end == len(RESPONSE)
+
+
+def test_blocks_classified_by_tag_and_content():
+    """Синоним тега и блоки без тега распознаются по признакам содержимого"""
+    kinds = [classify_block(block)[0] for block in iter_fenced_blocks(RESPONSE)]
+    assert kinds == ["powershell", "batch", "markdown"]
+
+    # Тег побеждает признаки содержимого
+    assert classify_block(FencedBlock("markdown", "# Запуск\npowershell -File x.ps1\n", 0))[0] == "markdown"
+    # Обычный текст не относится ни к одному типу
+    assert classify_block(FencedBlock("", "просто текст\n", 0)) == (None, 0)
+
+
+def test_macos_kinds():
+    """Для macOS блоки Windows-скриптов не принимаются за shell-скрипты"""
+    shell = FencedBlock("", "#!/bin/bash\nsudo purge\n", 0)
+    powershell = FencedBlock("powershell", "Get-Service -Name WSearch\n", 1)
+    assert classify_block(shell, MACOS_KINDS)[0] == "shell"
+    assert classify_block(powershell, MACOS_KINDS)[0] is None
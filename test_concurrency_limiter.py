@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Тесты адаптивного ограничителя одновременных запросов: очередь со сроком
+ожидания, мультипликативное снижение и аддитивный рост лимита.
+"""
+
+import threading
+import time
+
+import pytest
+
+from concurrency_limiter import AdaptiveConcurrencyLimiter, ConcurrencyLimitExceeded
+
+
+def test_waiters_queue_in_order_and_time_out():
+    """Сверх лимита запросы ждут по очереди, а по истечении срока получают ошибку"""
+    limiter = AdaptiveConcurrencyLimiter("test", initial_limit=1)
+    first = limiter.acquire()
+    order = []
+
+    def waiter(name, delay):
+        time.sleep(delay)
+        with limiter.acquire(timeout=2):
+            order.append(name)
+
+    threads = [threading.Thread(target=waiter, args=(name, delay)) for name, delay in (("a", 0), ("b", 0.05))]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    assert limiter.get_stats()["queued"] == 2
+
+    with pytest.raises(ConcurrencyLimitExceeded):
+        limiter.acquire(timeout=0.05)
+
+    first.release()
+    for thread in threads:
+        thread.join()
+    assert order == ["a", "b"]
+    assert limiter.get_stats()["timeouts"] == 1
+
+
+def test_overload_burst_decreases_limit_once():
+    """Ответы 429 от запросов одной волны снижают лимит один раз"""
+    limiter = AdaptiveConcurrencyLimiter("test", initial_limit=8)
+    permits = [limiter.acquire() for _ in range(4)]
+    for permit in permits:
+        permit.overload()
+        permit.release()
+    assert limiter.limit == 4
+    assert limiter.get_stats()["decreases"] == 1
+
+    # Новый запрос после снижения снова может его вызвать
+    permit = limiter.acquire()
+    permit.overload()
+    permit.release()
+    assert limiter.limit == 2
+
+
+def test_limit_grows_only_when_saturated():
+    """Лимит растет при успешных ответах, только когда он исчерпан"""
+    limiter = AdaptiveConcurrencyLimiter("test", initial_limit=2, max_limit=3)
+    permit = limiter.acquire()
+    permit.success(0.1)
+    permit.release()
+    assert limiter.limit == 2
+
+    for _ in range(4):
+        permits = [limiter.acquire() for _ in range(limiter.limit)]
+        for permit in permits:
+            permit.success(0.1)
+            permit.release()
+    assert limiter.limit == 3
+
+
+def test_latency_inflation_decreases_limit():
+    """Задержка намного выше базовой считается признаком перегрузки"""
+    limiter = AdaptiveConcurrencyLimiter("test", initial_limit=4, min_latency_samples=5)
+    for _ in range(5):
+        with limiter.acquire() as permit:
+            permit.success(1.0)
+    with limiter.acquire() as permit:
+        permit.success(5.0)
+    assert limiter.limit == 2
+    assert limiter.get_stats()["baseline_latency_ms"] == 1000
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Тесты имитации Anthropic Messages API: потоковые ответы из корпуса,
+внедрение ошибок и таймаутов, адрес API из ANTHROPIC_BASE_URL.
+"""
+
+import random
+import time
+
+import pytest
+
+import fallback_anthropic
+from fake_anthropic_server import FakeAnthropicServer, LatencyDistribution
+
+
+@pytest.fixture
+def fake_api():
+    server = FakeAnthropicServer(tokens_per_second=0, hang_seconds=5, seed=1).start()
+    yield server
+    server.stop()
+
+
+def _client(**kwargs):
+    client = fallback_anthropic.Anthropic(api_key="test-key", **kwargs)
+    client.retry_policy.base_delay = 0.01
+    return client
+
+
+def _create(client, **kwargs):
+    return client.messages.create(model="claude-3-haiku-20240307", max_tokens=4000,
+                                  messages=[{"role": "user", "content": "Оптимизируй систему"}], **kwargs)
+
+
+def test_stream_from_corpus_with_cached_system(fake_api, monkeypatch):
+    """Поток собирается в ответ с блоками кода, повторный системный промпт читается из кеша"""
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", fake_api.base_url)
+    client = _client()
+    assert client.base_url == fake_api.base_url
+
+    system = fallback_anthropic.cached_system_prompt("Инструкции " * 100)
+    first = _create(client, stream=True, system=system).get_final_message()
+    text = first.content[0].text
+    assert "```powershell" in text and "```batch" in text and "```markdown" in text
+    assert first.stop_reason == "end_turn"
+    assert first.usage.cache_creation_input_tokens > 0
+
+    second = _create(client, stream=True, system=system).get_final_message()
+    assert second.usage.cache_read_input_tokens == first.usage.cache_creation_input_tokens
+    assert fake_api.get_stats()["outcomes"] == {"ok": 2}
+
+
+def test_injected_errors_are_retried(fake_api):
+    """429 и 529 повторяются клиентом, обрыв потока поднимает OverloadedError"""
+    fake_api.retry_after = 0
+    fake_api.fail_next("429")
+    fake_api.fail_next("529")
+    client = _client(base_url=fake_api.base_url)
+    assert "```powershell" in _create(client).content[0].text
+    assert client.stats["retries"] == 2
+
+    fake_api.fail_next("stream_error")
+    with pytest.raises(fallback_anthropic.OverloadedError):
+        _create(client, stream=True).get_final_message()
+    assert fake_api.get_stats()["outcomes"] == {"429": 1, "529": 1, "ok": 1, "stream_error": 1}
+
+
+def test_timeout_fault_exceeds_client_timeout(fake_api):
+    """Запрос без ответа завершается таймаутом клиента"""
+    fake_api.fail_next("timeout")
+    client = _client(base_url=fake_api.base_url, max_retries=0)
+    started = time.monotonic()
+    with pytest.raises(fallback_anthropic.APITimeoutError):
+        _create(client, timeout=0.5)
+    assert time.monotonic() - started < 2
+
+
+def test_latency_distributions():
+    """Распределения задержки задаются строкой и дают значения в ожидаемых пределах"""
+    rng = random.Random(7)
+    assert LatencyDistribution.parse("fixed:0.25").sample(rng) == 0.25
+    samples = [LatencyDistribution.parse("uniform:0.1:0.3").sample(rng) for _ in range(100)]
+    assert all(0.1 <= value <= 0.3 for value in samples)
+    lognormal = sorted(LatencyDistribution.parse("lognormal:1.0:0.5").sample(rng) for _ in range(1001))
+    assert 0.8 < lognormal[500] < 1.25
+    with pytest.raises(ValueError):
+        LatencyDistribution.parse("pareto:1")
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Тесты повторов запросов в fallback_anthropic: retry-after, перегрузка (529),
+неповторяемые ошибки и общий срок вызова; кешируемый системный промпт.
+"""
+
+import json
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fallback_anthropic
+
+OK_BODY = {"id": "msg_1", "type": "message", "content": [{"type": "text", "text": "ok"}],
+           "usage": {"input_tokens": 3, "output_tokens": 1}}
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """Отвечает по очереди ответами из server.script: (код, заголовки, тело)"""
+
+    def do_POST(self):
+        self.server.bodies.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+        self.server.calls.append(time.monotonic())
+        script = self.server.script
+        status, headers, body = script.pop(0) if len(script) > 1 else script[0]
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _error(error_type, message):
+    return {"type": "error", "error": {"type": error_type, "message": message}}
+
+
+@pytest.fixture
+def api_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedHandler)
+    server.calls = []
+    server.bodies = []
+    server.script = [(200, {}, OK_BODY)]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _client(server, **kwargs):
+    client = fallback_anthropic.Anthropic(api_key="test-key", base_url=server.url, **kwargs)
+    client.retry_policy.base_delay = 0.01
+    return client
+
+
+def _create(client, **kwargs):
+    return client.messages.create(model="m", max_tokens=10, messages=[{"role": "user", "content": "hi"}], **kwargs)
+
+
+def test_rate_limit_waits_retry_after(api_server):
+    """429 повторяется после паузы из retry-after-ms"""
+    api_server.script = [(429, {"retry-after-ms": "300"}, _error("rate_limit_error", "slow down")),
+                         (200, {}, OK_BODY)]
+    client = _client(api_server)
+    response = _create(client)
+    assert response.content[0].text == "ok"
+    assert len(api_server.calls) == 2
+    assert api_server.calls[1] - api_server.calls[0] >= 0.25
+    assert client.stats == {"requests": 2, "retries": 1, "failures": 0}
+
+
+def test_overloaded_retried_until_exhausted(api_server):
+    """529 повторяется max_retries раз, затем поднимается OverloadedError"""
+    api_server.script = [(529, {}, _error("overloaded_error", "Overloaded"))]
+    client = _client(api_server, max_retries=2)
+    with pytest.raises(fallback_anthropic.OverloadedError) as error:
+        _create(client)
+    assert error.value.status_code == 529
+    assert len(api_server.calls) == 3
+    # Вызывающий код видит, что ошибка уже повторялась, и не отправляет запрос снова
+    assert error.value.attempts == 3
+
+
+def test_bad_request_not_retried(api_server):
+    """400 не повторяется, тип и текст ошибки попадают в сообщение"""
+    api_server.script = [(400, {}, _error("invalid_request_error", "Your credit balance is too low"))]
+    client = _client(api_server)
+    with pytest.raises(fallback_anthropic.BadRequestError) as error:
+        _create(client)
+    assert "invalid_request_error" in str(error.value)
+    assert "credit balance is too low" in str(error.value)
+    assert len(api_server.calls) == 1
+    assert error.value.attempts == 1
+
+
+def test_deadline_limits_retries(api_server):
+    """Повтор не выполняется, если пауза retry-after выходит за общий срок вызова"""
+    api_server.script = [(429, {"retry-after": "30"}, _error("rate_limit_error", "slow down"))]
+    client = _client(api_server)
+    started = time.monotonic()
+    with pytest.raises(fallback_anthropic.RateLimitError):
+        _create(client, timeout=2)
+    assert time.monotonic() - started < 2
+    assert len(api_server.calls) == 1
+
+
+def test_parse_retry_after_formats():
+    """retry-after поддерживает секунды и HTTP-дату, retry-after-ms имеет приоритет"""
+    assert fallback_anthropic.parse_retry_after({"retry-after": "5"}) == 5.0
+    assert fallback_anthropic.parse_retry_after({"retry-after-ms": "1500", "retry-after": "5"}) == 1.5
+    delay = fallback_anthropic.parse_retry_after({"retry-after": formatdate(time.time() + 10, usegmt=True)})
+    assert 8 <= delay <= 10
+    assert fallback_anthropic.parse_retry_after({}) is None
+
+
+def test_cached_system_prompt_and_usage(api_server):
+    """Системный промпт уходит блоком с cache_control, usage и время доступны в ответе"""
+    usage = {"input_tokens": 20, "output_tokens": 5,
+             "cache_creation_input_tokens": 0, "cache_read_input_tokens": 1800}
+    api_server.script = [(200, {}, dict(OK_BODY, usage=usage))]
+    client = _client(api_server)
+    response = _create(client, system=fallback_anthropic.cached_system_prompt("Инструкции"))
+    assert api_server.bodies[0]["system"] == [
+        {"type": "text", "text": "Инструкции", "cache_control": {"type": "ephemeral"}}]
+
+    assert response.usage.cache_read_input_tokens == 1800
+    assert response.usage.total_input_tokens == 1820
+    assert response.timing.attempts == 1
+    assert 0 <= response.timing.ttfb_ms <= response.timing.total_ms
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Тесты индекса file_id: сохранение на диск, повторная отправка одинаковых
+архивов по file_id и повторная загрузка при устаревшем file_id.
+"""
+
+import pytest
+import telebot
+
+from fake_telegram_server import FakeTelegramServer
+from file_id_index import FileIdIndex, document_key
+from telegram_sender import TelegramSender
+
+TOKEN = "123456:TEST_TOKEN"
+
+
+@pytest.fixture
+def telegram():
+    server = FakeTelegramServer().start()
+    saved_url = telebot.apihelper.API_URL
+    telebot.apihelper.API_URL = server.api_url
+    yield server
+    telebot.apihelper.API_URL = saved_url
+    server.stop()
+
+
+def test_index_persists_per_bot(tmp_path):
+    """Записи переживают перезапуск, но не переносятся на другого бота"""
+    path = str(tmp_path / "file_ids.json")
+    key = document_key(b"zip-bytes", "WindowsOptimizer.zip")
+    assert key != document_key(b"zip-bytes", "MacOptimizer.zip")
+
+    index = FileIdIndex(path, bot_id="1")
+    index.put(key, "doc_1", size=9)
+    index.flush()
+    restored = FileIdIndex(path, bot_id="1")
+    assert restored.get(key) == "doc_1"
+    assert restored.get_stats()["saved_bytes"] == 9
+    assert FileIdIndex(path, bot_id="2").get(key) is None
+
+
+def test_saves_are_batched(tmp_path):
+    """Файл индекса записывается не на каждую запись, а пакетно и атомарно"""
+    path = tmp_path / "file_ids.json"
+    index = FileIdIndex(str(path), bot_id="1", save_interval=3600)
+    for number in range(50):
+        index.put(document_key(str(number).encode(), "WindowsOptimizer.zip"), f"doc_{number}")
+    assert not path.exists()
+
+    index.flush()
+    assert len(FileIdIndex(str(path), bot_id="1")) == 50
+    assert [item.name for item in tmp_path.iterdir()] == ["file_ids.json"]
+
+    index = FileIdIndex(str(path), bot_id="1", save_interval=0)
+    index.invalidate(document_key(b"0", "WindowsOptimizer.zip"))
+    assert len(FileIdIndex(str(path), bot_id="1")) == 49
+
+
+def test_identical_archive_sent_by_file_id(telegram, tmp_path):
+    """Повторная отправка того же архива не загружает содержимое"""
+    index = FileIdIndex(str(tmp_path / "file_ids.json"))
+    sender = TelegramSender(telebot.TeleBot(TOKEN, threaded=False), file_ids=index)
+
+    first = sender.send_document_bytes(1, b"zip-bytes", "WindowsOptimizer.zip", caption="Готово")
+    second = sender.send_document_bytes(2, b"zip-bytes", "WindowsOptimizer.zip", caption="Готово")
+    assert second.document.file_id == first.document.file_id
+    assert second.document.file_name == "WindowsOptimizer.zip"
+
+    uploads = [files for method, params, files, _ in telegram.calls if method == "sendDocument"]
+    assert "document" in uploads[0] and uploads[1] == {}
+    stats = sender.get_stats()
+    assert stats["documents_uploaded"] == 1 and stats["documents_reused"] == 1
+
+
+def test_stale_file_id_is_reuploaded(telegram, tmp_path):
+    """file_id, который Telegram не принимает, удаляется и документ загружается заново"""
+    index = FileIdIndex(str(tmp_path / "file_ids.json"))
+    key = document_key(b"zip-bytes", "WindowsOptimizer.zip")
+    index.put(key, "doc_from_old_bot")
+    sender = TelegramSender(telebot.TeleBot(TOKEN, threaded=False), file_ids=index)
+
+    message = sender.send_document_bytes(1, b"zip-bytes", "WindowsOptimizer.zip")
+    assert message.document.file_id != "doc_from_old_bot"
+    assert index.get(key) == message.document.file_id
+    assert index.get_stats()["invalidations"] == 1
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Тесты хеджирования запросов: второй запрос после перцентиля задержки,
+отмена проигравшего и ограничение доли хеджированных запросов.
+"""
+
+import threading
+import time
+
+from hedging import RequestHedger
+from script_metrics import ScriptMetrics
+
+
+def _warm_up(hedger, model, latency, count):
+    for _ in range(count):
+        hedger.run(model, lambda m, token, is_hedge: time.sleep(latency) or m)
+
+
+def _slow_primary(cancelled):
+    def attempt(model, token, is_hedge):
+        if is_hedge:
+            return "hedge"
+        stop = threading.Event()
+        token.on_cancel(stop.set)
+        token.on_cancel(lambda: cancelled.append(model))
+        stop.wait(5)
+        return "primary"
+    return attempt
+
+
+def test_hedge_wins_and_primary_is_cancelled(tmp_path):
+    """Запрос дольше p90 хеджируется, побеждает второй запрос, основной отменяется"""
+    hedger = RequestHedger(min_samples=5, min_delay=0.05, max_fraction=0.5)
+    _warm_up(hedger, "slow-model", 0.01, 5)
+    metrics = ScriptMetrics(str(tmp_path / "metrics.json"), save_interval=3600)
+
+    cancelled = []
+    started = time.monotonic()
+    assert hedger.run("slow-model", _slow_primary(cancelled), hedge_model="fast-model", metrics=metrics) == "hedge"
+    assert time.monotonic() - started < 1
+    assert cancelled == ["slow-model"]
+
+    stats = hedger.get_stats()
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1 and stats["cancelled"] == 1
+    assert stats["requests"] == 6
+    assert metrics.metrics["hedging"]["cancelled"] == 1
+    # Запись метрик хеджирования не переписывает файл на каждый запрос
+    assert not (tmp_path / "metrics.json").exists()
+
+
+def test_no_hedge_without_enough_samples():
+    """Пока нет min_samples наблюдений, второй запрос не отправляется"""
+    hedger = RequestHedger(min_samples=5, min_delay=0.01, max_fraction=1.0)
+    calls = []
+
+    def attempt(model, token, is_hedge):
+        calls.append(is_hedge)
+        time.sleep(0.1)
+        return "ok"
+
+    assert hedger.run("model", attempt) == "ok"
+    assert calls == [False]
+    assert hedger.get_stats()["hedged"] == 0
+
+
+def test_hedge_fraction_is_capped():
+    """Доля хеджированных запросов не превышает max_fraction"""
+    hedger = RequestHedger(min_samples=20, min_delay=0.02, max_fraction=0.1)
+    _warm_up(hedger, "model", 0.001, 20)
+    for _ in range(10):
+        hedger.run("model", lambda m, token, is_hedge: time.sleep(0 if is_hedge else 0.1) or m)
+    stats = hedger.get_stats()
+    assert 1 <= stats["hedged"] <= 0.1 * stats["requests"]
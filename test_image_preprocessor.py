@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Тесты предобработки скриншотов.
+"""
+
+from io import BytesIO
+
+from PIL import Image
+
+from bench_image_preprocessing import make_synthetic_screenshot
+from image_preprocessor import estimate_image_tokens, preprocess_screenshot, to_content_block
+
+
+def test_large_screenshot_is_downscaled_and_smaller():
+    """Крупный скриншот уменьшается по длинной стороне и в байтах"""
+    data = make_synthetic_screenshot(2560, 1440, "PNG")
+    result = preprocess_screenshot(data, max_long_edge=1280)
+    assert max(result.width, result.height) <= 1280
+    assert result.size < len(data)
+    assert result.estimated_tokens < result.original_tokens
+
+    decoded = Image.open(BytesIO(result.data))
+    assert decoded.size == (result.width, result.height)
+    assert decoded.mode in ("L", "P")
+
+
+def test_borders_are_cropped():
+    """Однотонные поля вокруг окна обрезаются"""
+    image = Image.new("RGB", (400, 300), (255, 255, 255))
+    image.paste((0, 0, 0), (100, 50, 300, 250))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    result = preprocess_screenshot(buffer.getvalue())
+    assert (result.width, result.height) == (200, 200)
+
+
+def test_invalid_image_falls_back_to_original():
+    """Нераспознанные данные отправляются как есть"""
+    result = preprocess_screenshot(b"not an image")
+    assert result.data == b"not an image"
+
+
+def test_content_block_and_token_estimate():
+    """Блок изображения совместим с Messages API, оценка учитывает уменьшение API"""
+    result = preprocess_screenshot(make_synthetic_screenshot(800, 600, "JPEG"))
+    block = to_content_block(result)
+    assert block["type"] == "image"
+    assert block["source"]["media_type"] == result.media_type
+    assert estimate_image_tokens(1000, 750) == 1000
+    assert 1500 <= estimate_image_tokens(4000, 3000) <= 1540
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Тесты инструментов нагрузочного теста: long polling и файлы в имитации
+Telegram Bot API, сводка перцентилей и сравнение отчетов.
+"""
+
+import threading
+import time
+
+import pytest
+import telebot
+
+from fake_telegram_server import FakeTelegramServer
+from load_test import compare_reports, make_user_screenshot, summarize
+from result_cache import hamming_distance, perceptual_hash
+
+TOKEN = "123456:TEST_TOKEN"
+
+
+@pytest.fixture
+def telegram():
+    server = FakeTelegramServer().start()
+    saved_urls = telebot.apihelper.API_URL, telebot.apihelper.FILE_URL
+    telebot.apihelper.API_URL = server.api_url
+    telebot.apihelper.FILE_URL = server.file_url
+    yield server
+    telebot.apihelper.API_URL, telebot.apihelper.FILE_URL = saved_urls
+    server.stop()
+
+
+def test_get_updates_long_polling_and_file_download(telegram):
+    """getUpdates ждет новое обновление, подтвержденные по offset не повторяются, фото скачивается"""
+    bot = telebot.TeleBot(TOKEN, threaded=False)
+    file_id = telegram.add_file(b"jpeg-bytes")
+    threading.Timer(0.2, lambda: telegram.enqueue_update(telegram.make_photo_update(42, file_id))).start()
+
+    started = time.monotonic()
+    updates = bot.get_updates(long_polling_timeout=5)
+    assert 0.1 < time.monotonic() - started < 3
+    assert len(updates) == 1
+    photo = updates[0].message.photo[-1]
+    assert bot.download_file(bot.get_file(photo.file_id).file_path) == b"jpeg-bytes"
+
+    assert bot.get_updates(offset=updates[0].update_id + 1, long_polling_timeout=1) == []
+
+
+def test_summarize_and_compare_reports():
+    """Перцентили считаются в миллисекундах, сравнение показывает изменение p95"""
+    summary = summarize([0.1 * i for i in range(1, 21)], errors=2)
+    assert summary["count"] == 20 and summary["errors"] == 2
+    assert summary["p50_ms"] == 1000 and summary["p95_ms"] == 1900 and summary["max_ms"] == 2000
+    assert summarize([])["p95_ms"] is None
+
+    baseline = {"commit": "abc1234", "stages": {"flow": {"p95_ms": 2000}}, "throughput_per_min": 10}
+    report = {"stages": {"flow": {"p95_ms": 1500}}, "throughput_per_min": 12}
+    lines = compare_reports(report, baseline)
+    assert "abc1234" in lines[0]
+    assert "-25%" in lines[1]
+
+
+def test_user_screenshots_are_not_near_duplicates():
+    """Скриншоты разных пользователей не совпадают в кеше результатов"""
+    hashes = [perceptual_hash(make_user_screenshot(index)) for index in range(5)]
+    for i in range(len(hashes)):
+        for j in range(i + 1, len(hashes)):
+            assert hamming_distance(hashes[i], hashes[j]) > 8
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Тесты маршрутизации между быстрой и качественной моделями.
+"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import optimization_bot
+from artifact_generator import generate_artifacts
+from model_router import ModelRouter
+from script_metrics import ScriptMetrics
+from script_validator import ScriptValidator
+
+MODELS = {"default": "fast", "high_quality": "quality"}
+CRITICAL = {"WindowsOptimizer.ps1": [f"Несбалансированные скобки {index}" for index in range(4)]}
+
+
+@pytest.fixture
+def metrics(tmp_path):
+    return ScriptMetrics(str(tmp_path / "metrics.json"))
+
+
+def test_fast_model_first_then_escalation(metrics):
+    """По умолчанию сначала быстрая модель, эскалация только при непригодном результате"""
+    router = ModelRouter(MODELS, metrics)
+    route = router.route()
+    assert route == ["fast", "quality"]
+
+    validator = ScriptValidator()
+    assert router.escalation_model("fast", route, {"WindowsOptimizer.ps1": []}, validator) is None
+    assert router.escalation_model("fast", route, CRITICAL, validator) == "quality"
+    assert router.escalation_model("quality", route, CRITICAL, validator) is None
+    assert metrics.get_model_stats("fast")["escalations"] == 1
+
+
+def test_failing_fast_model_is_skipped(metrics):
+    """Быстрая модель с частыми ошибками пропускается"""
+    router = ModelRouter(MODELS, metrics, min_samples=3)
+    for _ in range(3):
+        router.record("fast", 500, False)
+    assert router.route() == ["quality"]
+
+
+def test_slow_fast_model_is_skipped(metrics):
+    """Если быстрая модель по медиане не быстрее качественной, она не используется"""
+    router = ModelRouter(MODELS, metrics, min_samples=3)
+    for _ in range(3):
+        router.record("fast", 9000, True)
+        router.record("quality", 4000, True)
+    assert router.route() == ["quality"]
+    health = metrics.get_model_health("fast")
+    assert health["median_latency_ms"] == 9000 and health["error_rate"] == 0
+
+
+def test_no_escalation_to_failing_quality_model(metrics):
+    """Эскалация к модели, которая отвечает ошибками, не планируется"""
+    router = ModelRouter(MODELS, metrics, min_samples=3)
+    for _ in range(3):
+        router.record("fast", 1000, True)
+        router.record("quality", 4000, False)
+    assert router.route() == ["fast"]
+
+
+def test_statistics_persist_between_instances(metrics):
+    """Статистика моделей сохраняется в файл метрик"""
+    ModelRouter(MODELS, metrics).record("fast", 1200, True)
+    metrics.flush()
+    reloaded = ScriptMetrics(metrics.metrics_file)
+    assert reloaded.get_model_health("fast")["samples"] == 1
+
+
+def test_concurrent_requests_share_model_windows(tmp_path):
+    """Маршрутизаторы одновременных запросов не теряют чужие наблюдения и не пишут файл на каждый вызов"""
+    metrics = ScriptMetrics(str(tmp_path / "metrics.json"), save_interval=3600)
+
+    def request(success):
+        router = ModelRouter(MODELS, metrics)
+        for _ in range(100):
+            router.record("fast", 1000, success)
+
+    threads = [threading.Thread(target=request, args=(index % 2 == 0,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert metrics.get_model_stats("fast")["calls"] == 400
+    assert metrics.get_model_stats("fast")["failures"] == 200
+    assert metrics.get_model_health("fast")["samples"] == 50
+    assert not (tmp_path / "metrics.json").exists()
+
+
+def test_failing_files_for_targeted_regeneration():
+    """При эскалации заново генерируются только файлы с критическими ошибками"""
+    validator = ScriptValidator()
+    results = dict(CRITICAL, **{
+        "Start-Optimizer.bat": ["Отсутствует обязательный блок кода: chcp 65001"],
+        "README.md": ["Удаление файлов без перенаправления вывода в nul"],
+    })
+    assert validator.should_regenerate_script(results)
+    assert validator.failing_files(results) == ["WindowsOptimizer.ps1", "Start-Optimizer.bat"]
+    assert validator.failing_files({"README.md": []}) == []
+
+
+def test_single_generated_script_regenerated_with_local_artifacts(metrics, monkeypatch):
+    """Если модель пишет только основной скрипт, он запрашивается заново коротким промптом,
+    а bat-файл и README строятся по новой версии"""
+    monkeypatch.setattr(optimization_bot, "LOCAL_ARTIFACTS", True)
+    script = "$OutputEncoding = [System.Text.Encoding]::UTF8\nfunction Clear-TempFiles {\n"
+    files = dict({"WindowsOptimizer.ps1": script}, **generate_artifacts(script))
+    requests = []
+
+    def stream_completion(model, messages, max_tokens=4000, **kwargs):
+        requests.append((messages[0]["content"], max_tokens))
+        return ("```powershell\n$OutputEncoding = [System.Text.Encoding]::UTF8\n"
+                "# Отключение телеметрии\nfunction Disable-Telemetry {\n"
+                "    Set-Service -Name DiagTrack -StartupType Disabled -ErrorAction SilentlyContinue\n}\n```")
+
+    bot = SimpleNamespace(validator=ScriptValidator(), prompts={}, router=ModelRouter(MODELS, metrics),
+                          _stream_completion=stream_completion)
+    merged_files, merged_results, _ = asyncio.run(optimization_bot.OptimizationBot._regenerate_failing_files(
+        bot, "fast", files, dict(CRITICAL, **{"Start-Optimizer.bat": [], "README.md": []})
+    ))
+    assert len(requests) == 1
+    assert requests[0][0].startswith("Файл: WindowsOptimizer.ps1")
+    assert requests[0][1] == optimization_bot.FILE_REGENERATION_MAX_TOKENS["WindowsOptimizer.ps1"]
+    assert "Disable-Telemetry" in merged_files["WindowsOptimizer.ps1"]
+    assert "- **Disable-Telemetry** - Отключение телеметрии" in merged_files["README.md"]
+    assert merged_results["Start-Optimizer.bat"] == [] and merged_results["README.md"] == []
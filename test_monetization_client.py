@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Тесты клиента сервера монетизации: кеш конечных статусов,
+строгие таймауты и Circuit Breaker.
+"""
+
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from monetization_client import MonetizationClient, MonetizationUnavailable
+
+
+class FakePaymentHandler(BaseHTTPRequestHandler):
+    """Обработчик, имитирующий /api/payment-status/<id>"""
+
+    def do_GET(self):
+        self.server.requests_count += 1
+        payment_id = self.path.rsplit("/", 1)[-1]
+        if payment_id.startswith("slow"):
+            time.sleep(1.0)
+        if payment_id.startswith("broken"):
+            status_code, payload = 500, {"error": "internal"}
+        else:
+            status_code, payload = 200, {"orderId": payment_id, "status": self.server.statuses.get(payment_id, "pending")}
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def payment_server():
+    """Запускает локальный сервер статусов платежей"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakePaymentHandler)
+    server.requests_count = 0
+    server.statuses = {"paid": "succeeded", "waiting": "pending"}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _client(server, **kwargs):
+    return MonetizationClient(f"http://127.0.0.1:{server.server_address[1]}", **kwargs)
+
+
+def test_terminal_status_is_cached(payment_server):
+    """Повторная проверка успешного платежа не обращается к сети"""
+    client = _client(payment_server)
+    assert client.fetch_payment_status("paid") == (200, {"orderId": "paid", "status": "succeeded"})
+    assert client.fetch_payment_status("paid")[1]["status"] == "succeeded"
+    assert payment_server.requests_count == 1
+    assert client.cache_hits == 1
+
+
+def test_pending_status_is_not_cached(payment_server):
+    """Промежуточные статусы всегда запрашиваются заново"""
+    client = _client(payment_server)
+    client.fetch_payment_status("waiting")
+    payment_server.statuses["waiting"] = "succeeded"
+    assert client.fetch_payment_status("waiting")[1]["status"] == "succeeded"
+    assert payment_server.requests_count == 2
+
+
+def test_read_timeout_is_enforced(payment_server):
+    """Зависший сервер не блокирует поток дольше таймаута чтения"""
+    client = _client(payment_server, read_timeout=0.2)
+    started = time.monotonic()
+    with pytest.raises(MonetizationUnavailable):
+        client.fetch_payment_status("slow_payment")
+    assert time.monotonic() - started < 0.9
+
+
+def test_circuit_opens_after_server_errors(payment_server):
+    """После серии ошибок 5xx запросы отклоняются без обращения к сети"""
+    client = _client(payment_server)
+    for _ in range(client.breaker.failure_threshold):
+        assert client.fetch_payment_status("broken")[0] == 500
+    with pytest.raises(MonetizationUnavailable):
+        client.fetch_payment_status("paid")
+    assert payment_server.requests_count == client.breaker.failure_threshold
+    assert client.get_stats()["circuit"]["state"] == "open"
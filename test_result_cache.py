@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Тесты кеша результатов по перцептивному хешу скриншота.
+"""
+
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from bench_image_preprocessing import make_synthetic_screenshot
+from result_cache import ResultCache, hamming_distance, perceptual_hash, prompt_version
+
+FILES = {"WinOptimizer.ps1": "Write-Host 'ok'", "README.md": "readme"}
+CHAT_ID = 1001
+
+
+def _reencode(data, size, quality):
+    """Тот же скриншот с другим разрешением и сжатием"""
+    image = Image.open(BytesIO(data)).convert("RGB").resize(size)
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def _system_info(values):
+    """Окно сведений о системе: одинаковая разметка, разные значения"""
+    image = Image.new("RGB", (1280, 720), (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, 0, 1280, 28], fill=(0, 95, 184))
+    labels = ("OS Name", "Processor", "Installed RAM", "System Type", "Disk")
+    for row, (label, value) in enumerate(zip(labels, values)):
+        draw.text((40, 60 + row * 24), label, fill=(20, 20, 20))
+        draw.text((300, 60 + row * 24), value, fill=(20, 20, 20))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_near_duplicate_screenshot_hits(tmp_path):
+    """Пересжатый и уменьшенный скриншот находит сохраненный результат"""
+    cache = ResultCache(str(tmp_path))
+    original = make_synthetic_screenshot(1280, 720, "PNG", seed=1)
+    version = prompt_version("prompt")
+    cache.store(CHAT_ID, perceptual_hash(original), "Создай скрипт!", version, "model", FILES)
+
+    resent = _reencode(original, (1024, 576), 60)
+    assert cache.lookup(CHAT_ID, perceptual_hash(resent), "  создай   скрипт ", version, "model") == FILES
+    assert cache.get_stats()["hits"] + cache.get_stats()["near_hits"] == 1
+
+
+def test_different_screenshot_text_or_prompt_miss(tmp_path):
+    """Другой скриншот, текст запроса или версия промпта не совпадают"""
+    cache = ResultCache(str(tmp_path))
+    first = make_synthetic_screenshot(1280, 720, "PNG", seed=1)
+    second = make_synthetic_screenshot(1280, 720, "PNG", seed=2)
+    assert hamming_distance(perceptual_hash(first), perceptual_hash(second)) > cache.max_distance
+
+    image_hash = perceptual_hash(first)
+    cache.store(CHAT_ID, image_hash, "text", "v1", "model", FILES)
+    assert cache.lookup(CHAT_ID, perceptual_hash(second), "text", "v1", "model") is None
+    assert cache.lookup(CHAT_ID, image_hash, "other text", "v1", "model") is None
+    assert cache.lookup(CHAT_ID, image_hash, "text", "v2", "model") is None
+    assert cache.lookup(CHAT_ID, image_hash, "text", "v1", "other-model") is None
+
+
+def test_index_survives_restart_and_expires(tmp_path):
+    """Записи сохраняются между перезапусками и удаляются по TTL"""
+    ResultCache(str(tmp_path)).store(CHAT_ID, 1, "text", "v1", "model", FILES)
+    assert ResultCache(str(tmp_path)).lookup(CHAT_ID, 1, "text", "v1", "model") == FILES
+
+    cache = ResultCache(str(tmp_path), ttl=0.05)
+    time.sleep(0.1)
+    assert cache.lookup(CHAT_ID, 1, "text", "v1", "model") is None
+
+
+def test_size_limit_evicts_least_recently_used(tmp_path):
+    """При превышении размера вытесняются давно неиспользованные записи"""
+    cache = ResultCache(str(tmp_path), max_bytes=1)
+    cache.store(CHAT_ID, 1, "a", "v1", "model", FILES)
+    cache.store(CHAT_ID, 2 ** 200, "a", "v1", "model", FILES)
+    stats = cache.get_stats()
+    assert stats["entries"] <= 1
+    assert stats["evictions"] >= 1
+
+
+def test_same_layout_of_another_user_misses(tmp_path):
+    """Скриншот с той же разметкой, но другой системой, не получает чужой результат"""
+    cache = ResultCache(str(tmp_path))
+    weak = _system_info(("Windows 10 Home", "Intel Core i3-6100", "4.00 GB", "x64-based PC", "HDD 500 GB"))
+    strong = _system_info(("Windows 11 Pro", "AMD Ryzen 9 7950X", "64.0 GB", "x64-based PC", "NVMe SSD 2 TB"))
+    assert hamming_distance(perceptual_hash(weak), perceptual_hash(strong)) <= cache.max_distance
+
+    cache.store(CHAT_ID, perceptual_hash(weak), "text", "v1", "model", FILES)
+    assert cache.lookup(CHAT_ID + 1, perceptual_hash(strong), "text", "v1", "model") is None
+    assert cache.lookup(CHAT_ID + 1, perceptual_hash(weak), "text", "v1", "model") is None
+    assert cache.lookup(CHAT_ID, perceptual_hash(weak), "text", "v1", "model") == FILES
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Тесты двухэтапной генерации: разбор профиля системы из ответа модели,
+выбор модулей по признакам профиля и проверка модулей при загрузке.
+"""
+
+import pytest
+
+from script_assembler import (DEFAULT_MODULES, ProfileError, ScriptAssembler, SystemProfile, TweakModule,
+                              parse_profile)
+from script_validator import ScriptValidator
+
+
+def test_parse_profile_normalizes_values():
+    """JSON из блока или текста, значения приводятся к единому виду"""
+    profile = parse_profile(
+        "Профиль системы:\n```json\n"
+        '{"windows_version": "Windows 11 Pro 23H2", "windows_edition": "Home", "cpu": "Intel(R) Core(TM) i3",'
+        ' "cpu_cores": "2 ядра", "ram_gb": "4096 MB", "disk_type": "NVMe SSD", "laptop": "yes"}\n```'
+    )
+    assert profile.windows_version == "11" and profile.ram_gb == 4.0 and profile.cpu_cores == 2
+    assert profile.features() == {"windows11", "home_edition", "few_cores", "low_ram", "ssd", "laptop"}
+    assert "(" not in profile.summary()
+
+    profile = parse_profile('Ответ: {"ram_gb": 16, "disk_type": "HDD", "laptop": false, "cpu": null}')
+    assert profile.features() == {"hdd", "desktop"}
+
+    for response in ("Не удалось прочитать скриншот", '```json\n{"cpu": "unknown"}\n```', "{битый json"):
+        with pytest.raises(ProfileError):
+            parse_profile(response)
+
+
+def test_modules_selected_by_features():
+    """Модули выбираются по признакам профиля, порядок библиотеки сохраняется"""
+    assembler = ScriptAssembler()
+    names = lambda data: [module.name for module in assembler.select(SystemProfile.from_dict(data))]
+
+    assert names({}) == ["Disable-Telemetry", "Clear-TempFiles"]
+    assert names({"disk_type": "ssd", "ram_gb": 32, "laptop": False}) == [
+        "Disable-Telemetry", "Clear-TempFiles", "Disable-SysMain", "Optimize-SsdTrim", "Set-HighPerformancePower"]
+    hdd = names({"disk_type": "hdd", "ram_gb": 4, "laptop": True})
+    assert "Optimize-HddDefrag" in hdd and "Disable-SearchIndexing" in hdd and "Set-BalancedPower" in hdd
+    assert "Optimize-SsdTrim" not in hdd and "Set-HighPerformancePower" not in hdd
+
+
+def test_modules_validated_once_and_assembly():
+    """Модули проверяются при загрузке, собранный скрипт проходит проверку"""
+    broken = TweakModule("Broken-Module", "Модуль с ошибкой", "Broken", "function Broken-Module {\n    Write-Host \"x\"\n")
+    assembler = ScriptAssembler(DEFAULT_MODULES + (broken,))
+    assert assembler.rejected.keys() == {"Broken-Module"}
+    assert len(assembler.modules) == len(DEFAULT_MODULES)
+
+    profile = SystemProfile.from_dict({"windows_version": "11", "ram_gb": 4, "disk_type": "hdd", "laptop": True})
+    files = assembler.assemble(profile)
+    assert set(files) == {"WindowsOptimizer.ps1", "Start-Optimizer.bat", "README.md"}
+    assert ScriptValidator().validate_powershell_script(files["WindowsOptimizer.ps1"]) == []
+    assert "- **Disable-Widgets** - Отключение виджетов на панели задач Windows 11" in files["README.md"]
+    assert '" - Disable taskbar widgets"' in files["WindowsOptimizer.ps1"]
+
+    stats = assembler.get_stats()
+    assert stats["assemblies"] == 1 and stats["rejected"] == ["Broken-Module"]
+    assert stats["module_usage"]["Disable-Widgets"] == 1 and stats["module_usage"]["Optimize-SsdTrim"] == 0
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Тесты учета обращений к модели в ScriptMetrics: агрегаты по модели,
+пользователю и промпту, самые долгие запросы и ограничение числа пользователей,
+пакетная атомарная запись файла.
+"""
+
+import json
+
+from script_metrics import ScriptMetrics
+
+
+def _usage(input_tokens, output_tokens, cache_read=0):
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+            "cache_creation_input_tokens": 0, "cache_read_input_tokens": cache_read}
+
+
+def test_llm_calls_are_aggregated(tmp_path):
+    """Токены и задержки суммируются по модели, пользователю и версии промпта"""
+    metrics = ScriptMetrics(str(tmp_path / "metrics.json"))
+    metrics.record_llm_call("haiku", _usage(100, 50, cache_read=900), ttfb_ms=400, total_ms=2000,
+                            user_id=1, prompt_version="v1")
+    metrics.record_llm_call("haiku", _usage(100, 10), ttfb_ms=600, total_ms=9000,
+                            user_id=2, prompt_version="v1")
+    metrics.record_llm_call("opus", None, total_ms=30000, outcome="error:APITimeoutError",
+                            user_id=1, prompt_version="v1")
+    metrics.record_llm_call("haiku", _usage(100, 5), total_ms=500, outcome="cancelled")
+    metrics.flush()
+
+    summary = ScriptMetrics(str(tmp_path / "metrics.json")).get_llm_usage(top=2, include_users=True)
+    haiku = summary["by_model"]["haiku"]
+    assert haiku["calls"] == 3 and haiku["errors"] == 0 and haiku["cancelled"] == 1
+    assert haiku["avg_ttfb_ms"] == 333 and haiku["max_total_ms"] == 9000
+    assert haiku["cache_read_share"] == 900 / 1200
+    assert summary["by_model"]["opus"]["errors"] == 1
+    assert summary["by_prompt"]["v1"]["calls"] == 3
+    assert [call["total_ms"] for call in summary["slowest_calls"]] == [30000, 9000]
+    assert summary["top_users_by_tokens"][0]["user_id"] == "1"
+    assert metrics.get_user_llm_usage(2)["output_tokens"] == 10
+
+
+def test_user_data_is_private_and_bounded(tmp_path):
+    """Без include_users данные пользователей скрыты, число пользователей ограничено"""
+    metrics = ScriptMetrics(str(tmp_path / "metrics.json"))
+    for user_id in range(5):
+        metrics.record_llm_call("haiku", _usage(10, 1), total_ms=100, user_id=user_id, max_users=3)
+
+    assert len(metrics.metrics["llm_usage"]["by_user"]) == 3
+    assert metrics.get_user_llm_usage(0) is None
+    summary = metrics.get_llm_usage()
+    assert "top_users_by_tokens" not in summary
+    assert all(call["user_id"] is None for call in summary["slowest_calls"])
+
+
+def test_saves_are_batched_and_atomic(tmp_path):
+    """Файл записывается не на каждое обращение, поврежденный файл не обнуляется молча"""
+    path = tmp_path / "metrics.json"
+    metrics = ScriptMetrics(str(path), save_interval=3600)
+    for _ in range(10):
+        metrics.record_llm_call("haiku", _usage(10, 1), total_ms=100, user_id=1)
+    assert not path.exists()
+
+    metrics.flush()
+    assert json.loads(path.read_text(encoding="utf-8"))["llm_usage"]["by_model"]["haiku"]["calls"] == 10
+    assert [item.name for item in tmp_path.iterdir()] == ["metrics.json"]
+
+    path.write_text('{"total_scripts_generated": 3', encoding="utf-8")
+    assert ScriptMetrics(str(path)).metrics["total_scripts_generated"] == 0
+    assert (tmp_path / "metrics.json.corrupt").read_text(encoding="utf-8") == '{"total_scripts_generated": 3'
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Тесты точечного исправления скриптов: применение unified diff, замена
+функций PowerShell и отказ при несовпадающем контексте.
+"""
+
+import pytest
+
+from script_patcher import PatchError, ScriptPatcher, render_scripts_for_prompt
+
+SCRIPT = """$OutputEncoding = [System.Text.Encoding]::UTF8
+
+function Clear-TempFiles {
+    # Скобка в комментарии }
+    $message = "Очистка {temp}"
+    Remove-Item "$env:TEMP\\*" -Recurse
+    Write-Host $message
+}
+
+function Disable-Telemetry {
+    Set-Service -Name DiagTrack -StartupType Disabled
+}
+
+Clear-TempFiles
+Disable-Telemetry
+"""
+
+FILES = {
+    "WindowsOptimizer.ps1": SCRIPT,
+    "Start-Optimizer.bat": "@echo off\npowershell -File WindowsOptimizer.ps1\n",
+    "README.md": "# Инструкция\n",
+}
+
+
+def test_unified_diff_with_shifted_lines():
+    """Фрагмент находится по контексту, даже если номера строк сдвинуты"""
+    response = (
+        "Исправил удаление временных файлов:\n"
+        "```diff\n"
+        "--- a/WindowsOptimizer.ps1\n"
+        "+++ b/WindowsOptimizer.ps1\n"
+        "@@ -40,3 +40,3 @@\n"
+        "     $message = \"Очистка {temp}\"   \n"
+        "-    Remove-Item \"$env:TEMP\\*\" -Recurse\n"
+        "+    Remove-Item \"$env:TEMP\\*\" -Recurse -Force -ErrorAction SilentlyContinue\n"
+        "     Write-Host $message\n"
+        "```\n"
+    )
+    result = ScriptPatcher().apply(FILES, response)
+    assert result.changed == ["WindowsOptimizer.ps1"]
+    assert "-Recurse -Force -ErrorAction SilentlyContinue" in result.files["WindowsOptimizer.ps1"]
+    assert result.files["WindowsOptimizer.ps1"].count("Remove-Item") == 1
+    assert FILES["WindowsOptimizer.ps1"] == SCRIPT
+
+
+def test_function_and_file_replacement():
+    """Функция заменяется целиком, скобки в строках и комментариях не мешают"""
+    response = (
+        "```powershell file=windowsoptimizer.ps1 function=Clear-TempFiles\n"
+        "function Clear-TempFiles {\n"
+        "    Get-ChildItem $env:TEMP | Remove-Item -Recurse -Force -ErrorAction SilentlyContinue\n"
+        "}\n"
+        "```\n"
+        "```batch file=Start-Optimizer.bat\n"
+        "@echo off\nchcp 65001 >nul\npowershell -ExecutionPolicy Bypass -File WindowsOptimizer.ps1\n"
+        "```\n"
+    )
+    result = ScriptPatcher().apply(FILES, response)
+    script = result.files["WindowsOptimizer.ps1"]
+    assert "Очистка {temp}" not in script
+    assert "Get-ChildItem $env:TEMP" in script
+    assert "function Disable-Telemetry {" in script and script.endswith("Disable-Telemetry\n")
+    assert "chcp 65001" in result.files["Start-Optimizer.bat"]
+    assert result.changed == ["WindowsOptimizer.ps1", "Start-Optimizer.bat"]
+    assert result.files["README.md"] == FILES["README.md"]
+
+
+def test_unapplicable_patch_raises():
+    """Несовпадающий контекст, неизвестная функция или ответ без изменений - PatchError"""
+    patcher = ScriptPatcher()
+    stale = ("```diff\n--- a/WindowsOptimizer.ps1\n+++ b/WindowsOptimizer.ps1\n"
+             "@@ -1,1 +1,1 @@\n-Stop-Service -Name WSearch\n+Stop-Service -Name WSearch -Force\n```")
+    missing = "```powershell file=WindowsOptimizer.ps1 function=Optimize-Network\nfunction Optimize-Network {}\n```"
+    for response in (stale, missing, "```powershell\nWrite-Host 'весь скрипт'\n```"):
+        with pytest.raises(PatchError):
+            patcher.apply(FILES, response)
+    assert patcher.get_stats() == {"attempts": 3, "applied": 0, "failed": 3}
+
+    prompt = render_scripts_for_prompt(FILES)
+    assert "### Start-Optimizer.bat" in prompt and "README.md" not in prompt
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Тесты хранилища сессий: совместимость со словарями, TTL, LRU и лимит памяти.
+"""
+
+import os
+import time
+
+from session_store import SessionStore
+
+
+def _bundle(size):
+    return {"Optimize.ps1": os.urandom(size).hex(), "README.md": "readme"}
+
+
+def test_fields_behave_like_dicts():
+    """Представления полей поддерживают привычный API словаря"""
+    store = SessionStore()
+    states = store.field("state")
+    files = store.field("files")
+
+    states[1] = "main_menu"
+    files[1] = {"Run.bat": "echo"}
+    assert states.get(1) == "main_menu"
+    assert 1 in states and 2 not in states
+    assert states.get(2, "none") == "none"
+    assert files[1] == {"Run.bat": "echo"}
+    assert states.pop(1) == "main_menu"
+    assert 1 not in states
+    assert list(files) == [1]
+
+
+def test_sessions_expire_by_ttl():
+    """Неактивные сессии удаляются по истечении TTL"""
+    store = SessionStore(ttl=0.1, sweep_interval=0)
+    states = store.field("state")
+    states[1] = "main_menu"
+    time.sleep(0.15)
+    states[2] = "main_menu"
+    assert 1 not in states
+    assert store.get_stats()["expired"] == 1
+
+
+def test_least_recently_used_is_evicted():
+    """При превышении количества сессий вытесняется самая старая"""
+    store = SessionStore(max_sessions=2)
+    states = store.field("state")
+    states[1] = "a"
+    states[2] = "b"
+    states.get(1)  # Сессия 1 становится самой свежей
+    states[3] = "c"
+    assert 2 not in states
+    assert 1 in states and 3 in states
+
+
+def test_memory_cap_spills_bundles_to_disk(tmp_path):
+    """Сверх лимита памяти наборы файлов выгружаются на диск и читаются обратно"""
+    store = SessionStore(max_bytes=50 * 1024, spill_dir=str(tmp_path))
+    files = store.field("files")
+    bundles = {chat_id: _bundle(10 * 1024) for chat_id in range(10)}
+    for chat_id, bundle in bundles.items():
+        files[chat_id] = bundle
+
+    stats = store.get_stats()
+    assert stats["resident_bytes"] <= 50 * 1024
+    assert stats["spilled"] > 0
+    assert files[0] == bundles[0]
+    assert store.get_stats()["loaded_from_disk"] == 1
+
+
+def test_spill_files_are_private_and_stale_ones_removed(tmp_path):
+    """Файлы выгрузки не раскрывают ID чата, доступны только владельцу и не переживают перезапуск"""
+    spill_dir = tmp_path / "sessions"
+    store = SessionStore(max_bytes=20 * 1024, spill_dir=str(spill_dir))
+    files = store.field("files")
+    for chat_id in range(5):
+        files[chat_id] = _bundle(10 * 1024)
+
+    spilled = list(spill_dir.iterdir())
+    assert spilled and store.get_stats()["spilled"] == len(spilled)
+    assert all(not item.name.startswith("session_0_") for item in spilled)
+    if os.name == "posix":
+        assert all(item.stat().st_mode & 0o077 == 0 for item in spilled)
+
+    (spill_dir / "unrelated.txt").write_text("keep")
+    restarted = SessionStore(spill_dir=str(spill_dir))
+    assert sorted(item.name for item in spill_dir.iterdir()) == ["unrelated.txt"]
+    assert restarted.get_stats()["stale_spills_removed"] == len(spilled)
+
+
+def test_memory_cap_without_disk_evicts_sessions():
+    """Без каталога выгрузки лишние сессии вытесняются"""
+    store = SessionStore(max_bytes=50 * 1024)
+    files = store.field("files")
+    for chat_id in range(10):
+        files[chat_id] = _bundle(10 * 1024)
+    stats = store.get_stats()
+    assert stats["resident_bytes"] <= 50 * 1024
+    assert stats["evicted"] > 0
+    assert 9 in files
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Тесты объединения одновременных одинаковых запросов.
+"""
+
+import time
+import threading
+
+import pytest
+
+from single_flight import CoalescedCallError, SingleFlight
+
+
+def _run_concurrently(flights, key, func, count):
+    results = [None] * count
+    errors = [None] * count
+
+    def worker(index):
+        try:
+            results[index] = flights.do(key, func)
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join(timeout=5)
+    return results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    """Одновременные вызовы с одним ключом выполняют функцию один раз"""
+    flights = SingleFlight()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"Optimize.ps1": "..."}
+
+    results, errors = _run_concurrently(flights, "chat:hash", generate, 3)
+    assert errors == [None] * 3
+    assert len(calls) == 1
+    assert [is_leader for _, is_leader in results].count(True) == 1
+    assert all(result == {"Optimize.ps1": "..."} for result, _ in results)
+    assert flights.get_stats() == {"leaders": 1, "coalesced": 2, "in_flight": 0}
+
+
+def test_different_keys_run_independently():
+    """Разные ключи не объединяются"""
+    flights = SingleFlight()
+    assert flights.do("a", lambda: 1) == (1, True)
+    assert flights.do("b", lambda: 2) == (2, True)
+    assert flights.do("a", lambda: 3) == (3, True)
+
+
+def test_leader_error_is_reported_to_followers():
+    """Ошибка ведущего вызова доходит до присоединившихся как CoalescedCallError"""
+    flights = SingleFlight()
+
+    def fail():
+        time.sleep(0.2)
+        raise ValueError("api down")
+
+    results, errors = _run_concurrently(flights, "key", fail, 2)
+    assert isinstance(errors[0], ValueError)
+    assert isinstance(errors[1], CoalescedCallError)
+    assert isinstance(errors[1].error, ValueError)
+
+
+def test_follower_timeout():
+    """Присоединившийся вызов не ждет дольше timeout"""
+    flights = SingleFlight()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        time.sleep(0.5)
+        return 1
+
+    leader = threading.Thread(target=flights.do, args=("key", slow))
+    leader.start()
+    started.wait(1)
+    with pytest.raises(TimeoutError):
+        flights.do("key", slow, timeout=0.05)
+    leader.join()
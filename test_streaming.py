@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Тесты потокового режима: разбор SSE в клиенте и инкрементальное
+извлечение блоков кода.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fallback_anthropic
+from code_blocks import IncrementalFenceParser
+
+RESPONSE_TEXT = (
+    "Вот скрипты:\n\n"
+    "```powershell\nWrite-Host 'ok'\n$a = 1\n```\n\n"
+    "```batch\n@echo off\nchcp 65001 >nul\n```\n\n"
+    "```markdown\n# README\n```"
+)
+
+
+def _sse(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+class FakeStreamHandler(BaseHTTPRequestHandler):
+    """Отдает ответ Messages API в формате SSE по 7 символов"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(body)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        self.wfile.write(_sse("message_start", {"type": "message_start", "message": {
+            "id": "msg_1", "model": body["model"], "usage": {"input_tokens": 10, "output_tokens": 1}}}))
+        self.wfile.write(b": ping\n\n")
+        for start in range(0, len(RESPONSE_TEXT), 7):
+            chunk = RESPONSE_TEXT[start:start + 7]
+            self.wfile.write(_sse("content_block_delta", {
+                "type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": chunk}}))
+        self.wfile.write(_sse("message_delta", {
+            "type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": 42}}))
+        self.wfile.write(_sse("message_stop", {"type": "message_stop"}))
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stream_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeStreamHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.delenv("ANTHROPIC_BASE_URL", raising=False)
+    monkeypatch.setattr(fallback_anthropic, "API_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_parser_handles_any_chunking():
+    """Блоки извлекаются одинаково при любом разбиении текста"""
+    for size in (1, 2, 5, 64, len(RESPONSE_TEXT)):
+        parser = IncrementalFenceParser()
+        blocks = []
+        for start in range(0, len(RESPONSE_TEXT), size):
+            blocks.extend(parser.feed(RESPONSE_TEXT[start:start + size]))
+        blocks.extend(parser.close())
+        assert [block.language for block in blocks] == ["powershell", "batch", "markdown"]
+        assert blocks[0].content == "Write-Host 'ok'\n$a = 1\n"
+        assert blocks[2].content == "# README\n"
+
+
+def test_block_is_returned_at_closing_fence():
+    """Блок отдается сразу после закрывающей ограды, до конца ответа"""
+    parser = IncrementalFenceParser()
+    assert parser.feed("```powershell\nWrite-Host 1\n") == []
+    assert parser.in_block and parser.current_language == "powershell"
+    blocks = parser.feed("```\nтекст после")
+    assert len(blocks) == 1 and blocks[0].content == "Write-Host 1\n"
+
+
+def test_client_streams_text_and_final_message(stream_server):
+    """Клиент разбирает SSE и собирает итоговое сообщение"""
+    client = fallback_anthropic.Anthropic(api_key="test-key")
+    stream = client.messages.create(
+        model="claude-3-haiku-20240307", max_tokens=100,
+        messages=[{"role": "user", "content": "hi"}], stream=True
+    )
+    chunks = list(stream.text_stream)
+    assert len(chunks) > 1
+    assert "".join(chunks) == RESPONSE_TEXT
+
+    final = stream.get_final_message()
+    assert final.content[0].text == RESPONSE_TEXT
+    assert final.stop_reason == "end_turn"
+    assert final.usage == {"input_tokens": 10, "output_tokens": 42}
+    assert final.usage.output_tokens == 42 and final.usage.cache_read_input_tokens == 0
+    assert final.timing.ttfb_ms is not None and final.timing.ttfb_ms <= final.timing.total_ms
+    assert stream_server.requests[0]["stream"] is True
+
+
+def test_stream_connection_error_raises(monkeypatch):
+    """Сетевая ошибка в потоковом режиме поднимается до получения потока"""
+    monkeypatch.delenv("ANTHROPIC_BASE_URL", raising=False)
+    monkeypatch.setattr(fallback_anthropic, "API_URL", "http://127.0.0.1:9")
+    client = fallback_anthropic.Anthropic(api_key="test-key", max_retries=0)
+    with pytest.raises(fallback_anthropic.APIConnectionError):
+        client.messages.create(model="m", max_tokens=10, messages=[], stream=True)
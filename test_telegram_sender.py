@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Тесты слоя отправки в Telegram: повторы после 429, приоритеты и лимиты.
+"""
+
+import time
+import threading
+
+import pytest
+import requests
+from telebot.apihelper import ApiTelegramException
+
+from telegram_sender import TelegramSender, TokenBucket
+
+
+def _api_error(error_code, retry_after=None):
+    result_json = {"ok": False, "error_code": error_code, "description": "error"}
+    if retry_after is not None:
+        result_json["parameters"] = {"retry_after": retry_after}
+    return ApiTelegramException("sendMessage", None, result_json)
+
+
+class FakeBot:
+    """Бот, записывающий вызовы и возвращающий заранее заданные ошибки"""
+
+    def __init__(self, errors=None):
+        self.errors = list(errors or [])
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _record(self, name, *args, **kwargs):
+        with self.lock:
+            self.calls.append((name, args, kwargs, time.monotonic()))
+            if self.errors:
+                raise self.errors.pop(0)
+        return name
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._record("send_message", chat_id, text, **kwargs)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        return self._record("edit_message_text", text, chat_id=chat_id, message_id=message_id)
+
+    def send_document(self, chat_id=None, document=None, **kwargs):
+        return self._record("send_document", chat_id=chat_id, document=document)
+
+
+def test_retry_after_is_honored():
+    """После 429 вызов повторяется не раньше retry_after"""
+    bot = FakeBot(errors=[_api_error(429, retry_after=0.3)])
+    sender = TelegramSender(bot)
+    assert sender.send_message(1, "hello") == "send_message"
+    assert len(bot.calls) == 2
+    assert bot.calls[1][3] - bot.calls[0][3] >= 0.3
+    stats = sender.get_stats()
+    assert stats["rate_limited"] == 1
+    assert stats["sent"] == 1
+
+
+def test_non_retryable_error_is_raised():
+    """Ошибки клиента (например, 400) не повторяются"""
+    bot = FakeBot(errors=[_api_error(400)])
+    sender = TelegramSender(bot)
+    with pytest.raises(ApiTelegramException):
+        sender.send_message(1, "hello")
+    assert len(bot.calls) == 1
+    assert sender.get_stats()["failed"] == 1
+
+
+def test_read_timeout_is_not_resent():
+    """После таймаута чтения сообщение и документ не отправляются повторно, редактирование повторяется"""
+    bot = FakeBot(errors=[requests.exceptions.ReadTimeout("read timed out")] * 2)
+    sender = TelegramSender(bot)
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        sender.send_message(1, "hello")
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        sender.send_document(1, b"zip")
+    assert [call[0] for call in bot.calls] == ["send_message", "send_document"]
+    assert sender.get_stats()["failed"] == 2
+
+    bot = FakeBot(errors=[requests.exceptions.ReadTimeout("read timed out")])
+    sender = TelegramSender(bot)
+    assert sender.edit_message_text("progress", chat_id=1, message_id=7) == "edit_message_text"
+    assert len(bot.calls) == 2
+
+
+def test_connection_error_is_retried():
+    """Ошибка соединения повторяется: вызов не дошел до Telegram"""
+    bot = FakeBot(errors=[requests.exceptions.ConnectionError("connection refused")])
+    sender = TelegramSender(bot)
+    assert sender.send_message(1, "hello") == "send_message"
+    assert len(bot.calls) == 2
+    assert sender.get_stats()["retries"] == 1
+
+
+def test_chat_rate_limit():
+    """Сообщения одного чата сверх всплеска выдерживают лимит чата"""
+    bot = FakeBot()
+    sender = TelegramSender(bot, chat_rate=10, chat_burst=1)
+    started = time.monotonic()
+    for index in range(3):
+        sender.send_message(1, f"msg {index}")
+    assert time.monotonic() - started >= 0.18
+    # Другой чат не ждет
+    started = time.monotonic()
+    sender.send_message(2, "other")
+    assert time.monotonic() - started < 0.05
+
+
+def test_edits_go_before_documents():
+    """При исчерпании глобального лимита редактирование обслуживается раньше документов"""
+    bot = FakeBot()
+    sender = TelegramSender(bot, global_rate=5, global_burst=1)
+    sender.send_message(0, "drain")  # Забираем единственный токен
+
+    threads = [threading.Thread(target=sender.send_document, args=(chat_id, b"zip")) for chat_id in (1, 2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    edit = threading.Thread(target=sender.edit_message_text, args=("progress",), kwargs={"chat_id": 3, "message_id": 7})
+    edit.start()
+    for thread in threads + [edit]:
+        thread.join(timeout=5)
+
+    order = [call[0] for call in bot.calls[1:]]
+    assert order[0] == "edit_message_text"
+    assert order.count("send_document") == 2
+
+
+def test_token_bucket_wait_time():
+    """Пустой bucket сообщает время до следующего токена"""
+    bucket = TokenBucket(rate=2, capacity=1)
+    now = time.monotonic()
+    assert bucket.try_acquire(now) == 0.0
+    assert bucket.try_acquire(now) == pytest.approx(0.5)
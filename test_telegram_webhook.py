@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Интеграционные тесты режима webhook с локальной имитацией Telegram Bot API.
+"""
+
+import threading
+
+import pytest
+import telebot
+from flask import Flask
+from werkzeug.serving import make_server
+
+from fake_telegram_server import FakeTelegramServer
+from telegram_webhook import WebhookDispatcher, register_webhook_route
+
+TOKEN = "123456:TEST_TOKEN"
+SECRET = "webhook-secret"
+
+
+@pytest.fixture
+def telegram():
+    """Имитация Telegram Bot API, подключенная к telebot"""
+    server = FakeTelegramServer().start()
+    saved_api_url = telebot.apihelper.API_URL
+    telebot.apihelper.API_URL = server.api_url
+    yield server
+    telebot.apihelper.API_URL = saved_api_url
+    server.stop()
+
+
+@pytest.fixture
+def webhook_app(telegram):
+    """Flask-приложение с эндпоинтом webhook и ботом-эхо"""
+    bot = telebot.TeleBot(TOKEN, threaded=False)
+
+    @bot.message_handler(func=lambda message: True)
+    def echo(message):
+        bot.send_message(message.chat.id, f"echo: {message.text}")
+
+    dispatcher = WebhookDispatcher(lambda update: bot.process_new_updates([update]), workers=4)
+    app = Flask(__name__)
+    register_webhook_route(app, dispatcher, "/telegram/webhook", SECRET)
+
+    http_server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    bot.set_webhook(url=f"http://127.0.0.1:{http_server.server_port}/telegram/webhook", secret_token=SECRET)
+    yield dispatcher
+    http_server.shutdown()
+    dispatcher.shutdown()
+
+
+def test_updates_are_processed_by_worker_pool(telegram, webhook_app):
+    """Обновления из webhook обрабатываются и ответы уходят в Bot API"""
+    for chat_id in (101, 102, 103):
+        assert telegram.deliver_update(telegram.make_text_update(chat_id, "/start")) == 200
+
+    for chat_id in (101, 102, 103):
+        calls = telegram.wait_for_call("sendMessage", chat_id=chat_id)
+        assert calls[0][1]["text"] == "echo: /start"
+    webhook_app.join()
+    assert webhook_app.get_stats()["processed"] == 3
+
+
+def test_updates_of_one_chat_keep_order(telegram, webhook_app):
+    """Сообщения одного чата обрабатываются строго по порядку"""
+    texts = [f"msg {index}" for index in range(10)]
+    for text in texts:
+        telegram.deliver_update(telegram.make_text_update(200, text))
+
+    calls = telegram.wait_for_call("sendMessage", chat_id=200, count=len(texts))
+    assert [call[1]["text"] for call in calls] == [f"echo: {text}" for text in texts]
+
+
+def test_wrong_secret_token_is_rejected(telegram, webhook_app):
+    """Запросы без правильного secret_token не принимаются"""
+    telegram.webhook["secret_token"] = "wrong"
+    assert telegram.deliver_update(telegram.make_text_update(300, "hi")) == 403
+    assert webhook_app.get_stats()["accepted"] == 0
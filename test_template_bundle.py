@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Тесты наборов шаблонных скриптов: детерминированный архив, однократная
+сборка набора и поиск набора по файлам.
+"""
+
+import io
+import threading
+import time
+import zipfile
+
+from template_bundle import TemplateBundle, TemplateBundleCache, build_zip
+
+FILES = {
+    "WindowsOptimizer.ps1": "# Encoding: UTF-8\n$OutputEncoding = [System.Text.Encoding]::UTF8\nWrite-Host 'Готово'\n",
+    "README.md": "# Оптимизация Windows\n",
+}
+
+
+def _builder(calls):
+    def build(os_type):
+        calls.append(os_type)
+        time.sleep(0.05)
+        files = {name: content + "# проверено\n" for name, content in FILES.items()}
+        return TemplateBundle(os_type, FILES, files, {"WindowsOptimizer.ps1": []}, 0, build_zip(files))
+    return build
+
+
+def test_build_zip_is_deterministic():
+    """Одинаковые файлы дают одинаковые байты архива, содержимое читается обратно"""
+    first = build_zip(FILES)
+    time.sleep(1.1)
+    assert build_zip(FILES) == first
+    with zipfile.ZipFile(io.BytesIO(first)) as archive:
+        assert archive.namelist() == list(FILES)
+        assert archive.read("README.md").decode("utf-8") == FILES["README.md"]
+
+
+def test_bundle_built_once_for_concurrent_requests():
+    """Одновременные обращения собирают набор один раз, копии файлов независимы"""
+    calls = []
+    cache = TemplateBundleCache(_builder(calls))
+    bundles = []
+    threads = [threading.Thread(target=lambda: bundles.append(cache.get("windows"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["windows"]
+    assert all(bundle is bundles[0] for bundle in bundles)
+    files = bundles[0].copy_files()
+    files["README.md"] = "изменено"
+    assert cache.get("windows").files["README.md"].endswith("# проверено\n")
+    assert cache.get_stats()["builds"] == 1
+
+
+def test_find_matches_only_built_bundles():
+    """Поиск находит набор по совпадающим файлам и не запускает сборку"""
+    calls = []
+    cache = TemplateBundleCache(_builder(calls))
+    assert cache.find(dict(FILES)) is None
+    assert calls == []
+
+    bundle = cache.get("windows")
+    assert cache.find(bundle.copy_files()) is bundle
+    assert cache.find(bundle.raw_files) is None
+    assert cache.get_stats()["matches"] == 1
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Тесты упаковщика архивов: совместимость с zipfile, политика уровней
+сжатия и вставка заранее сжатых элементов.
+"""
+
+import io
+import os
+import zipfile
+
+import pytest
+
+from zip_packager import METHOD_DEFLATED, METHOD_STORED, ZipPackager, parse_level_policy
+
+FILES = {
+    "WindowsOptimizer.ps1": "$OutputEncoding = [System.Text.Encoding]::UTF8\n" + "Write-Host 'Очистка'\n" * 200,
+    "README.md": "# Оптимизация\n",
+}
+
+
+class WriteOnlyStream:
+    """Поток без seek и tell"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+
+
+def test_archive_readable_and_deterministic():
+    """Архив читается zipfile, запись в поток без seek дает те же байты"""
+    packager = ZipPackager()
+    usage = packager.precompress("КАК_ИСПОЛЬЗОВАТЬ.txt", "Запустите Start-Optimizer.bat")
+    archive = packager.package(FILES, members=[usage])
+    assert ZipPackager().package(FILES, members=[usage]) == archive
+
+    with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.namelist() == ["WindowsOptimizer.ps1", "README.md", "КАК_ИСПОЛЬЗОВАТЬ.txt"]
+        assert zip_file.read("КАК_ИСПОЛЬЗОВАТЬ.txt").decode("utf-8") == "Запустите Start-Optimizer.bat"
+        assert zip_file.read("WindowsOptimizer.ps1").decode("utf-8") == FILES["WindowsOptimizer.ps1"]
+
+    stream = WriteOnlyStream()
+    assert packager.write_to(stream, FILES, members=[usage]) == len(archive)
+    assert b"".join(stream.chunks) == archive
+
+
+def test_level_policy_by_member_size():
+    """Мелкие и несжимаемые файлы хранятся без сжатия, уровень выбирается по размеру"""
+    policy = parse_level_policy("*:1,100:0,4096:9")
+    assert policy == ((100, 0), (4096, 9), (None, 1))
+    assert parse_level_policy("100:0,4096:9")[-1] == (None, 9)
+    with pytest.raises(ValueError):
+        parse_level_policy("100:12")
+
+    packager = ZipPackager(policy)
+    assert [packager.level_for(size) for size in (10, 1000, 10000)] == [0, 9, 1]
+    assert packager.precompress("README.md", FILES["README.md"]).method == METHOD_STORED
+    assert packager.precompress("WindowsOptimizer.ps1", FILES["WindowsOptimizer.ps1"]).method == METHOD_DEFLATED
+    assert packager.precompress("random.bin", os.urandom(2000)).method == METHOD_STORED
+
+
+def test_repeated_members_are_not_recompressed():
+    """Повторяющиеся файлы берутся из кеша, статистика учитывает время и размеры"""
+    packager = ZipPackager()
+    usage = packager.precompress("КАК_ИСПОЛЬЗОВАТЬ.txt", "Инструкция")
+    first = packager.package(FILES, members=[usage])
+    second = packager.package(FILES, members=[usage])
+    assert first == second
+
+    stats = packager.get_stats()
+    assert stats["packages"] == 2 and stats["members"] == 6
+    assert stats["compressed"] == 2 and stats["reused"] == 4
+    assert stats["bytes_out"] == 2 * len(first) and stats["ratio"] < 1
+    assert stats["avg_ms"] is not None
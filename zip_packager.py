@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""
+Упаковка наборов скриптов в ZIP-архив.
+
+ZipPackager пишет архив сам (локальные заголовки, данные, центральный
+каталог), поэтому заранее сжатые элементы вставляются в архив без
+повторного сжатия:
+- статические файлы (инструкции) сжимаются один раз при создании
+  элемента (precompress) и добавляются в каждый архив как есть;
+- недавно сжатые файлы с тем же содержимым берутся из небольшого кеша
+  (результаты из кеша генерации, повторные отправки);
+- уровень сжатия выбирается по размеру файла (политика уровней): мелкие
+  файлы хранятся без сжатия, текстовые скрипты сжимаются сильнее,
+  большие файлы - быстрее.
+
+Архив записывается в поток по мере сжатия элементов (write_to) или
+собирается в байты (package). Дата файлов фиксирована, поэтому одинаковые
+файлы всегда дают одинаковые байты архива.
+
+Пример использования:
+```python
+packager = ZipPackager(parse_level_policy("256:0,262144:9,*:6"))
+usage = packager.precompress("КАК_ИСПОЛЬЗОВАТЬ.txt", instructions)
+archive = packager.package(files, members=[usage])
+print(packager.get_stats()["avg_ms"])
+```
+"""
+
+import struct
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from collections import OrderedDict
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Дата файлов в архиве: без нее байты архива зависели бы от времени сборки
+ZIP_DATE_TIME = (2024, 1, 1, 0, 0, 0)
+
+# Политика уровней по умолчанию: (максимальный размер файла или None, уровень);
+# уровень 0 - хранение без сжатия
+DEFAULT_LEVEL_POLICY = ((256, 0), (256 * 1024, 9), (4 * 1024 * 1024, 6), (None, 1))
+
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_OF_CENTRAL_DIR = struct.Struct("<IHHHHIIH")
+_VERSION = 20
+_MADE_BY_UNIX = 3 << 8
+_UTF8_FLAG = 0x800
+_FILE_MODE = 0o644 << 16
+
+
+def parse_level_policy(spec):
+    """
+    Разбирает политику уровней сжатия из строки "256:0,262144:9,*:6"
+
+    Каждый элемент - максимальный размер файла в байтах и уровень (0-9);
+    "*" означает файлы любого размера.
+
+    Returns:
+        tuple: ((максимальный размер или None, уровень), ...) по возрастанию размера
+    """
+    policy = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        size, _, level = item.partition(":")
+        level = int(level)
+        if not 0 <= level <= 9:
+            raise ValueError(f"Уровень сжатия должен быть от 0 до 9: {item}")
+        policy.append((None if size.strip() == "*" else int(size), level))
+    if not policy:
+        raise ValueError("Пустая политика уровней сжатия")
+    policy.sort(key=lambda rule: float("inf") if rule[0] is None else rule[0])
+    if policy[-1][0] is not None:
+        # Файлы больше последнего порога сжимаются последним уровнем
+        policy.append((None, policy[-1][1]))
+    return tuple(policy)
+
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return ((hour << 11) | (minute << 5) | (second // 2),
+            ((year - 1980) << 9) | (month << 5) | day)
+
+
+class CompressedMember:
+    """Элемент архива, сжатый заранее"""
+
+    __slots__ = ("name", "name_bytes", "flags", "method", "crc", "size", "data")
+
+    def __init__(self, name, method, crc, size, data):
+        self.name = name
+        try:
+            self.name_bytes, self.flags = name.encode("ascii"), 0
+        except UnicodeEncodeError:
+            self.name_bytes, self.flags = name.encode("utf-8"), _UTF8_FLAG
+        self.method = method
+        self.crc = crc
+        self.size = size
+        self.data = data
+
+    @property
+    def compressed_size(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return (f"CompressedMember(name={self.name!r}, method={self.method}, "
+                f"size={self.size}, compressed_size={self.compressed_size})")
+
+
+class ZipPackager:
+    """Сборка ZIP-архивов с заранее сжатыми элементами"""
+
+    def __init__(self, level_policy=DEFAULT_LEVEL_POLICY, date_time=ZIP_DATE_TIME, cache_size=256):
+        """
+        Инициализация упаковщика
+
+        Args:
+            level_policy (tuple): Политика уровней (см. parse_level_policy)
+            date_time (tuple): Дата и время файлов в архиве
+            cache_size (int): Количество недавно сжатых файлов в кеше (0 - без кеша)
+        """
+        self.level_policy = tuple(level_policy)
+        self.date_time = date_time
+        self.cache_size = cache_size
+        self._dos_time, self._dos_date = _dos_date_time(date_time)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+        # Счетчики для метрик
+        self.stats = {
+            "packages": 0,
+            "members": 0,
+            "compressed": 0,
+            "reused": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "total_ms": 0.0,
+            "max_ms": 0.0,
+        }
+
+    def level_for(self, size):
+        """Уровень сжатия для файла заданного размера"""
+        for max_size, level in self.level_policy:
+            if max_size is None or size <= max_size:
+                return level
+        return self.level_policy[-1][1]
+
+    def precompress(self, name, content):
+        """
+        Сжимает элемент архива
+
+        Args:
+            name (str): Имя файла в архиве
+            content (str | bytes): Содержимое (строки кодируются в UTF-8)
+
+        Returns:
+            CompressedMember: Элемент, который можно добавлять в архивы без повторного сжатия
+        """
+        data = content.encode("utf-8") if isinstance(content, str) else bytes(content)
+        crc = zlib.crc32(data) & 0xFFFFFFFF
+        level = self.level_for(len(data))
+        if level > 0:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            compressed = compressor.compress(data) + compressor.flush()
+            if len(compressed) < len(data):
+                return CompressedMember(name, METHOD_DEFLATED, crc, len(data), compressed)
+        # Сжатие не уменьшило файл - храним как есть
+        return CompressedMember(name, METHOD_STORED, crc, len(data), data)
+
+    def _member(self, name, content):
+        """Сжатый элемент из кеша или новый"""
+        if not self.cache_size:
+            self._count("compressed")
+            return self.precompress(name, content)
+        data = content.encode("utf-8") if isinstance(content, str) else bytes(content)
+        key = (name, hashlib.sha1(data).digest())
+        with self._lock:
+            member = self._cache.get(key)
+            if member is not None:
+                self._cache.move_to_end(key)
+                self.stats["reused"] += 1
+                return member
+        member = self.precompress(name, data)
+        with self._lock:
+            self.stats["compressed"] += 1
+            self._cache[key] = member
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return member
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def write_to(self, stream, files, members=()):
+        """
+        Записывает архив в поток
+
+        Элементы сжимаются и записываются по одному; поток может не
+        поддерживать seek.
+
+        Args:
+            stream: Поток с методом write
+            files (dict): Имя файла -> содержимое
+            members (iterable): Заранее сжатые элементы (CompressedMember), добавляются после files
+
+        Returns:
+            int: Количество записанных байт
+        """
+        started = time.perf_counter()
+        members = list(members)
+        offset = 0
+        written = []
+        bytes_in = 0
+        reused = 0
+        # Одноименный заранее сжатый элемент заменяет файл из files
+        static_names = {member.name for member in members}
+        entries = [(name, content) for name, content in files.items() if name not in static_names]
+        entries += [(member.name, member) for member in members]
+        for name, content in entries:
+            if isinstance(content, CompressedMember):
+                member = content
+                reused += 1
+            else:
+                member = self._member(name, content)
+            header = _LOCAL_HEADER.pack(
+                0x04034b50, _VERSION, member.flags, member.method, self._dos_time, self._dos_date,
+                member.crc, member.compressed_size, member.size, len(member.name_bytes), 0)
+            stream.write(header)
+            stream.write(member.name_bytes)
+            stream.write(member.data)
+            written.append((member, offset))
+            offset += len(header) + len(member.name_bytes) + member.compressed_size
+            bytes_in += member.size
+
+        directory_offset = offset
+        for member, local_offset in written:
+            header = _CENTRAL_HEADER.pack(
+                0x02014b50, _MADE_BY_UNIX | _VERSION, _VERSION, member.flags, member.method,
+                self._dos_time, self._dos_date, member.crc, member.compressed_size, member.size,
+                len(member.name_bytes), 0, 0, 0, 0, _FILE_MODE, local_offset)
+            stream.write(header)
+            stream.write(member.name_bytes)
+            offset += len(header) + len(member.name_bytes)
+        stream.write(_END_OF_CENTRAL_DIR.pack(
+            0x06054b50, 0, 0, len(written), len(written), offset - directory_offset, directory_offset, 0))
+        offset += _END_OF_CENTRAL_DIR.size
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.stats["packages"] += 1
+            self.stats["members"] += len(written)
+            self.stats["reused"] += reused
+            self.stats["bytes_in"] += bytes_in
+            self.stats["bytes_out"] += offset
+            self.stats["total_ms"] += elapsed_ms
+            self.stats["max_ms"] = max(self.stats["max_ms"], elapsed_ms)
+        logger.debug(f"Архив из {len(written)} файлов: {bytes_in} -> {offset} байт за {elapsed_ms:.2f} мс")
+        return offset
+
+    def package(self, files, members=()):
+        """
+        Собирает архив в памяти
+
+        Returns:
+            bytes: Содержимое архива
+        """
+        buffer = BytesIO()
+        self.write_to(buffer, files, members)
+        return buffer.getvalue()
+
+    def get_stats(self):
+        """Статистика упаковки: количество, размеры и время"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["avg_ms"] = round(stats["total_ms"] / stats["packages"], 3) if stats["packages"] else None
+        stats["total_ms"] = round(stats["total_ms"], 1)
+        stats["max_ms"] = round(stats["max_ms"], 3)
+        stats["ratio"] = round(stats["bytes_out"] / stats["bytes_in"], 3) if stats["bytes_in"] else None
+        stats["cached_members"] = len(self._cache)
+        return stats